@@ -0,0 +1,238 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.13"
+# dependencies = [
+#     "typer",
+#     "rich",
+# ]
+# ///
+"""
+Run benchmarks and append the results to the benchmark history.
+"""
+
+# Imports
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+# Config
+app = typer.Typer(add_completion=False, help="Run dkdc benchmarks")
+console = Console()
+
+ROOT = Path(__file__).resolve().parent.parent
+RS_DIR = ROOT / "rs"
+CRITERION_DIR = RS_DIR / "target" / "criterion"
+DKDC_BIN = RS_DIR / "target" / "release" / "dkdc"
+HISTORY_FILE = ROOT / "benchmarks" / "history.jsonl"
+
+BENCH_PACKAGES = ["dkdc-lake", "dkdc-archive"]
+EXPORT_SECRET_COUNT = 100
+
+# Functions
+
+
+def run(cmd: list[str], **kwargs) -> subprocess.CompletedProcess:
+    return subprocess.run(cmd, check=True, **kwargs)
+
+
+def git_info() -> dict:
+    def git(*args: str) -> str:
+        result = subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=False
+        )
+        return result.stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def run_criterion(filter: str | None) -> None:
+    cmd = ["cargo", "bench"]
+    for package in BENCH_PACKAGES:
+        cmd += ["-p", package]
+    cmd += ["--", "--noplot"]
+    if filter:
+        cmd.append(filter)
+    run(cmd, cwd=RS_DIR)
+
+
+def collect_criterion(since: float) -> dict[str, dict]:
+    """Read the estimates criterion wrote for benchmarks run after `since`."""
+    results = {}
+    for benchmark_file in sorted(CRITERION_DIR.glob("**/new/benchmark.json")):
+        estimates_file = benchmark_file.with_name("estimates.json")
+        if not estimates_file.exists() or estimates_file.stat().st_mtime < since:
+            continue
+
+        benchmark = json.loads(benchmark_file.read_text())
+        estimates = json.loads(estimates_file.read_text())
+        results[benchmark["full_id"]] = {
+            "mean_ns": estimates["mean"]["point_estimate"],
+            "stddev_ns": estimates["std_dev"]["point_estimate"],
+        }
+    return results
+
+
+def time_command(cmd: list[str], runs: int, env: dict | None = None) -> dict:
+    """Wall-clock a command `runs` times, after one warmup run."""
+    run(cmd, env=env, capture_output=True)
+
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter_ns()
+        run(cmd, env=env, capture_output=True)
+        samples.append(time.perf_counter_ns() - start)
+
+    return {
+        "mean_ns": statistics.mean(samples),
+        "stddev_ns": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def bench_cli(runs: int) -> dict[str, dict]:
+    """Process-level timings for the `dkdc` binary."""
+    run(["cargo", "build", "--release", "-p", "dkdc-cli"], cwd=RS_DIR)
+    dkdc = str(DKDC_BIN)
+
+    results = {"cli/version": time_command([dkdc, "--version"], runs)}
+
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, "DKDC_HOME": home}
+        env.pop("DKDC_LAKE", None)
+
+        for i in range(EXPORT_SECRET_COUNT):
+            run(
+                [dkdc, "secrets", "set", f"BENCH_{i}", "--value", "value"],
+                env=env,
+                capture_output=True,
+            )
+
+        results[f"cli/secrets_export/{EXPORT_SECRET_COUNT}"] = time_command(
+            [dkdc, "secrets", "export", "--format", "json"], runs, env=env
+        )
+
+    return results
+
+
+def load_history() -> list[dict]:
+    if not HISTORY_FILE.exists():
+        return []
+    return [json.loads(line) for line in HISTORY_FILE.read_text().splitlines() if line]
+
+
+def previous_run(history: list[dict], host: str) -> dict | None:
+    """Most recent run on the same machine, since timings don't compare across hosts."""
+    for entry in reversed(history):
+        if entry.get("host") == host:
+            return entry
+    return None
+
+
+def report(
+    results: dict[str, dict], previous: dict | None, threshold: float
+) -> list[str]:
+    """Print a results table and return the names of regressed benchmarks."""
+    baseline = previous["results"] if previous else {}
+    regressions = []
+
+    table = Table(title="Benchmarks")
+    table.add_column("benchmark")
+    table.add_column("mean", justify="right")
+    table.add_column("change", justify="right")
+
+    for name, result in sorted(results.items()):
+        mean = result["mean_ns"]
+        change = ""
+        if name in baseline:
+            delta = (mean - baseline[name]["mean_ns"]) / baseline[name]["mean_ns"]
+            style = (
+                "red" if delta > threshold else "green" if delta < -threshold else ""
+            )
+            change = f"[{style}]{delta:+.1%}[/{style}]" if style else f"{delta:+.1%}"
+            if delta > threshold:
+                regressions.append(name)
+        table.add_row(name, format_ns(mean), change)
+
+    console.print(table)
+    if previous:
+        console.print(
+            f"Compared against {previous['commit']} ({previous['timestamp']})"
+        )
+    return regressions
+
+
+def format_ns(ns: float) -> str:
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("µs", 1e3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f} {unit}"
+    return f"{ns:.0f} ns"
+
+
+@app.command()
+def main(
+    filter: str = typer.Argument(
+        None, help="Only run criterion benchmarks matching this"
+    ),
+    runs: int = typer.Option(20, "--runs", help="Runs per CLI timing"),
+    skip_rust: bool = typer.Option(False, "--skip-rust", help="Skip criterion benches"),
+    skip_cli: bool = typer.Option(False, "--skip-cli", help="Skip CLI timings"),
+    threshold: float = typer.Option(
+        0.10, "--threshold", help="Relative slowdown reported as a regression"
+    ),
+    no_save: bool = typer.Option(
+        False, "--no-save", help="Don't append to the history"
+    ),
+    fail_on_regression: bool = typer.Option(
+        False, "--fail-on-regression", help="Exit non-zero if anything regressed"
+    ),
+) -> None:
+    """Run benchmarks and append the results to benchmarks/history.jsonl."""
+    results: dict[str, dict] = {}
+
+    if not skip_rust:
+        started = time.time()
+        run_criterion(filter)
+        results.update(collect_criterion(started))
+
+    if not skip_cli:
+        results.update(bench_cli(runs))
+
+    host = platform.node()
+    history = load_history()
+    regressions = report(results, previous_run(history, host), threshold)
+
+    if not no_save:
+        entry = {
+            "timestamp": datetime.now(UTC).isoformat(timespec="seconds"),
+            **git_info(),
+            "host": host,
+            "platform": platform.platform(),
+            "results": results,
+        }
+        HISTORY_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(HISTORY_FILE, "a") as f:
+            f.write(json.dumps(entry, sort_keys=True) + "\n")
+        console.print(f"Appended results to {HISTORY_FILE.relative_to(ROOT)}")
+
+    if regressions:
+        console.print(f"[red]Regressed by more than {threshold:.0%}:[/red]")
+        for name in regressions:
+            console.print(f"  {name}")
+        if fail_on_regression:
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -11,3 +11,16 @@ except importlib.metadata.PackageNotFoundError:
             __version__ = f.read().strip()
     except FileNotFoundError:
         __version__ = "0.0.0+dev"
+
+try:
+    from dkdc._dkdc import Lake as Lake
+    from dkdc._dkdc import MappedFile as MappedFile
+    from dkdc._dkdc import SecretCache as SecretCache
+    from dkdc._dkdc import disable_tracing as disable_tracing
+    from dkdc._dkdc import enable_tracing as enable_tracing
+    from dkdc._dkdc import secrets_env as secrets_env
+    from dkdc._dkdc import trace_summary as trace_summary
+    from dkdc._dkdc import write_trace as write_trace
+except ImportError:
+    # Rust extension not built yet (see `uv run maturin develop`)
+    pass
@@ -0,0 +1,207 @@
+"""fsspec filesystem over the dkdc virtual filesystem.
+
+Paths look like ``dkdc://files/notes/todo.md``: every component but the last
+is the lake's ``filepath`` (``./files/notes``) and the last is the
+``filename``. Listings and ``info`` come from file metadata and the directory
+index only, reads fetch byte ranges (only the chunks they touch, for large
+files) through fsspec's read-ahead or block caches, and files opened for
+writing are stored as one new version when closed. ``mv`` and ``rm`` change
+names only, so moving a large tree never copies it.
+
+Requires the ``fsspec`` extra (``pip install dkdc[fsspec]``)::
+
+    import fsspec
+
+    fs = fsspec.filesystem("dkdc")
+    with fs.open("dkdc://files/data.csv", cache_type="blockcache") as f:
+        header = f.readline()
+"""
+
+import posixpath
+
+from fsspec.spec import AbstractBufferedFile, AbstractFileSystem
+
+from dkdc import Lake
+
+
+class DkdcFileSystem(AbstractFileSystem):
+    """Files in a dkdc lake as an fsspec filesystem."""
+
+    protocol = "dkdc"
+    root_marker = ""
+
+    def __init__(self, path=None, profile=None, lake=None, **storage_options):
+        super().__init__(**storage_options)
+        self.lake = lake if lake is not None else Lake(path=path, profile=profile)
+
+    @classmethod
+    def _strip_protocol(cls, path):
+        if isinstance(path, list):
+            return [cls._strip_protocol(p) for p in path]
+        path = posixpath.normpath(super()._strip_protocol(path) or ".")
+        path = path.removeprefix("./").lstrip("/")
+        return "" if path == "." else path
+
+    @staticmethod
+    def _split(path):
+        """Split a stripped path into the lake's (filepath, filename)."""
+        directory, name = posixpath.split(path)
+        if not name or not directory:
+            raise IsADirectoryError(path)
+        return f"./{directory}", name
+
+    @staticmethod
+    def _lake_path(path):
+        """The lake path (``./files/...``) of a stripped path."""
+        return f"./{path}" if path else "."
+
+    def _entries(self, path):
+        """Metadata of a file at or below a directory, if there is any."""
+        return self.lake.ls(path=self._lake_path(path), recursive=True, limit=1)
+
+    def ls(self, path, detail=True, **kwargs):
+        path = self._strip_protocol(path)
+        directory = self._lake_path(path)
+        listing = [
+            {
+                "name": posixpath.join(path, entry["filename"]),
+                "size": entry["filesize"],
+                "type": "file",
+                "mtime": entry["fileupdated"],
+                "versions": entry["versions"],
+                "sha256": entry["filehash"],
+            }
+            for entry in self.lake.ls(path=directory)
+        ]
+        listing += [
+            {"name": subdir.removeprefix("./"), "size": 0, "type": "directory"}
+            for subdir in self.lake.dirs(path=directory)
+        ]
+
+        if not listing and path:
+            # `path` may itself be a file
+            info = self.info(path)
+            return [info] if detail else [info["name"]]
+
+        entries = sorted(listing, key=lambda entry: entry["name"])
+        return entries if detail else [entry["name"] for entry in entries]
+
+    def info(self, path, **kwargs):
+        path = self._strip_protocol(path)
+        if not path:
+            return {"name": "", "size": 0, "type": "directory"}
+
+        directory, name = posixpath.split(path)
+        entry = self.lake.entry(name, path=self._lake_path(directory))
+        if entry is not None:
+            return {
+                "name": path,
+                "size": entry["filesize"],
+                "type": "file",
+                "mtime": entry["fileupdated"],
+                "versions": entry["versions"],
+                "sha256": entry["filehash"],
+            }
+
+        if self._entries(path):
+            return {"name": path, "size": 0, "type": "directory"}
+        raise FileNotFoundError(path)
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        path = self._strip_protocol(path)
+        filepath, filename = self._split(path)
+        if start is None and end is None:
+            data = self.lake.get_file(filename, path=filepath)
+        else:
+            size = self.size(path)
+            start, end = _resolve_range(start, end, size)
+            data = self.lake.read_range(filename, start, end, path=filepath)
+        if data is None:
+            raise FileNotFoundError(path)
+        return data
+
+    def pipe_file(self, path, value, **kwargs):
+        filepath, filename = self._split(self._strip_protocol(path))
+        self.lake.write_file(filename, bytes(value), path=filepath)
+
+    def _open(
+        self,
+        path,
+        mode="rb",
+        block_size=None,
+        autocommit=True,
+        cache_options=None,
+        cache_type="readahead",
+        **kwargs,
+    ):
+        return DkdcFile(
+            self,
+            path,
+            mode=mode,
+            block_size=block_size or self.blocksize,
+            autocommit=autocommit,
+            cache_options=cache_options,
+            cache_type=cache_type,
+            **kwargs,
+        )
+
+    def mv(self, path1, path2, recursive=False, maxdepth=None, **kwargs):
+        # Renames only; the lake moves whole directories itself
+        source = self._lake_path(self._strip_protocol(path1))
+        self.lake.mv(source, self._lake_path(self._strip_protocol(path2)))
+
+    def rm(self, path, recursive=False, maxdepth=None):
+        paths = path if isinstance(path, list) else [path]
+        for p in paths:
+            self.lake.rm(self._lake_path(self._strip_protocol(p)), recursive=recursive)
+
+    def rm_file(self, path):
+        self.lake.rm(self._lake_path(self._strip_protocol(path)))
+
+    def mkdir(self, path, create_parents=True, **kwargs):
+        # Directories only exist through the files in them
+        pass
+
+    def makedirs(self, path, exist_ok=False):
+        pass
+
+
+class DkdcFile(AbstractBufferedFile):
+    """A file in the lake, read by byte range and written on close.
+
+    Writes are buffered in memory and committed as a single new version, so
+    readers never see a partially written file.
+    """
+
+    def __init__(self, fs, path, mode="rb", **kwargs):
+        path = fs._strip_protocol(path)
+        self.filepath, self.filename = fs._split(path)
+        super().__init__(fs, path, mode=mode, **kwargs)
+
+    def _fetch_range(self, start, end):
+        data = self.fs.lake.read_range(self.filename, start, end, path=self.filepath)
+        if data is None:
+            raise FileNotFoundError(self.path)
+        return data
+
+    def _initiate_upload(self):
+        self._parts = []
+
+    def _upload_chunk(self, final=False):
+        self._parts.append(self.buffer.getvalue())
+        if final:
+            data = b"".join(self._parts)
+            self.fs.lake.write_file(self.filename, data, path=self.filepath)
+            self._parts = []
+        return True
+
+
+def _resolve_range(start, end, size):
+    """Absolute (start, end) offsets for fsspec's possibly negative ones."""
+    start = 0 if start is None else start
+    end = size if end is None else end
+    if start < 0:
+        start = max(size + start, 0)
+    if end < 0:
+        end = max(size + end, 0)
+    return start, min(end, size)
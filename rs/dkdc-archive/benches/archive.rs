@@ -0,0 +1,61 @@
+//! Zipping synthetic directory trees
+//!
+//! Run with `cargo bench -p dkdc-archive`.
+
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use std::fs;
+use std::hint::black_box;
+use std::path::Path;
+use tempfile::TempDir;
+
+/// (directories, files per directory, bytes per file)
+const TREES: &[(usize, usize, usize)] = &[(1, 10, 1024), (10, 100, 1024), (10, 10, 1 << 20)];
+
+fn synthetic_tree(root: &Path, dirs: usize, files: usize, size: usize) {
+    let data: Vec<u8> = (0..size).map(|i| (i % 251) as u8).collect();
+    for d in 0..dirs {
+        let dir = root.join(format!("dir-{}", d));
+        fs::create_dir_all(&dir).expect("create dir");
+        for f in 0..files {
+            fs::write(dir.join(format!("file-{}.txt", f)), &data).expect("write file");
+        }
+    }
+    fs::write(root.join(".gitignore"), "dir-0/file-0.txt\n").expect("write .gitignore");
+}
+
+fn bench_zip(c: &mut Criterion) {
+    let mut group = c.benchmark_group("zip_directory");
+    group.sample_size(10);
+
+    for &(dirs, files, size) in TREES {
+        let root = TempDir::new().expect("tempdir");
+        synthetic_tree(root.path(), dirs, files, size);
+
+        group.throughput(Throughput::Bytes((dirs * files * size) as u64));
+        group.bench_function(
+            BenchmarkId::from_parameter(format!("{}x{}x{}", dirs, files, size)),
+            |b| b.iter(|| black_box(dkdc_archive::zip_directory(root.path()).expect("zip"))),
+        );
+    }
+
+    group.finish();
+}
+
+fn bench_archive(c: &mut Criterion) {
+    let home = TempDir::new().expect("tempdir");
+    std::env::set_var(dkdc_config::DKDC_HOME_ENV, home.path());
+
+    let root = TempDir::new().expect("tempdir");
+    synthetic_tree(root.path(), 10, 100, 1024);
+    let path = root.path().to_str().expect("utf-8 tempdir");
+
+    let mut group = c.benchmark_group("archive_directory");
+    group.sample_size(10);
+    group.bench_function("10x100x1024", |b| {
+        b.iter(|| dkdc_archive::archive_directory(path, Some("bench.zip")).expect("archive"))
+    });
+    group.finish();
+}
+
+criterion_group!(benches, bench_zip, bench_archive);
+criterion_main!(benches);
@@ -1,5 +1,5 @@
 use anyhow::Result;
-use dkdc_common::gitignore;
+use dkdc_common::{gitignore, trace};
 use dkdc_lake::Lake;
 use std::fs;
 use std::io::{Cursor, Write};
@@ -8,26 +8,9 @@ use walkdir::WalkDir;
 use zip::write::{FileOptions, ZipWriter};
 use zip::CompressionMethod;
 
-pub fn archive_directory(path: &str, name: Option<&str>) -> Result<()> {
-    let dir_path = Path::new(path);
-    if !dir_path.exists() {
-        anyhow::bail!("'{}' does not exist", path);
-    }
-
-    if !dir_path.is_dir() {
-        anyhow::bail!("'{}' is not a directory", path);
-    }
-
-    // Create archive name
-    let archive_name = if let Some(n) = name {
-        n.to_string()
-    } else {
-        let dir_name = dir_path
-            .file_name()
-            .and_then(|n| n.to_str())
-            .unwrap_or("archive");
-        format!("{}.zip", dir_name)
-    };
+/// Zip a directory in memory, skipping gitignored paths
+pub fn zip_directory(dir_path: &Path) -> Result<Vec<u8>> {
+    let _span = trace::span_with("archive.zip", || dir_path.display().to_string());
 
     // Create zip in memory
     let mut buffer = Cursor::new(Vec::new());
@@ -60,8 +43,31 @@ pub fn archive_directory(path: &str, name: Option<&str>) -> Result<()> {
         zip.finish()?;
     }
 
-    // Get the zip data
-    let zip_data = buffer.into_inner();
+    Ok(buffer.into_inner())
+}
+
+pub fn archive_directory(path: &str, name: Option<&str>) -> Result<()> {
+    let dir_path = Path::new(path);
+    if !dir_path.exists() {
+        anyhow::bail!("'{}' does not exist", path);
+    }
+
+    if !dir_path.is_dir() {
+        anyhow::bail!("'{}' is not a directory", path);
+    }
+
+    // Create archive name
+    let archive_name = if let Some(n) = name {
+        n.to_string()
+    } else {
+        let dir_name = dir_path
+            .file_name()
+            .and_then(|n| n.to_str())
+            .unwrap_or("archive");
+        format!("{}.zip", dir_name)
+    };
+
+    let zip_data = zip_directory(dir_path)?;
 
     // Store in lake
     let lake = Lake::new()?;
@@ -0,0 +1,520 @@
+//! Incremental, verifiable backups of the dkdc lake
+//!
+//! A backup directory holds a chain of backups, one subdirectory each:
+//!
+//! ```text
+//! <dir>/<id>/metadata.db     online copy of the SQLite catalog
+//! <dir>/<id>/data/...        data files added since the previous backup
+//! <dir>/<id>/manifest.json   every data file of the lake, with its checksum
+//!                            and the backup that holds it
+//! ```
+//!
+//! DuckLake data and delete files are immutable and record the snapshot that
+//! added them, so a backup copies the catalog and then only the files whose
+//! `begin_snapshot` is newer than the previous backup's snapshot; the rest
+//! are referenced from earlier backups in the manifest. Files are copied and
+//! hashed (SHA-256) in parallel, into a staging directory that is renamed
+//! into place once the manifest is written, so an interrupted backup never
+//! looks complete.
+//!
+//! The catalog holds the data files' encryption keys, so a backup is as
+//! sensitive as the lake itself.
+
+use anyhow::Result;
+use dkdc_common::trace;
+use dkdc_config::Config;
+use rusqlite::{Connection, DatabaseName, OpenFlags};
+use serde::{Deserialize, Serialize};
+use sha2::{Digest, Sha256};
+use std::collections::HashMap;
+use std::fs;
+use std::io::{Read, Write};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+use std::time::Duration;
+use walkdir::WalkDir;
+
+pub const MANIFEST_FILENAME: &str = "manifest.json";
+const CATALOG_FILENAME: &str = "metadata.db";
+const DATA_DIRNAME: &str = "data";
+const MANIFEST_VERSION: u32 = 1;
+
+/// How long to wait for writers holding the catalog
+const BUSY_TIMEOUT: Duration = Duration::from_secs(30);
+
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct Manifest {
+    pub version: u32,
+    pub id: String,
+    /// RFC 3339 creation time
+    pub created: String,
+    /// Latest DuckLake snapshot in the backed up catalog
+    pub snapshot: i64,
+    /// Previous backup in the chain, if incremental
+    pub parent: Option<String>,
+    pub catalog: Checksum,
+    pub files: Vec<DataFile>,
+}
+
+impl Manifest {
+    /// Data files copied by this backup rather than referenced
+    pub fn copied(&self) -> impl Iterator<Item = &DataFile> {
+        self.files.iter().filter(|file| file.backup == self.id)
+    }
+}
+
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct Checksum {
+    pub size: u64,
+    pub sha256: String,
+}
+
+#[derive(Debug, Clone, Serialize, Deserialize)]
+pub struct DataFile {
+    /// Path under the lake's data directory, `/`-separated
+    pub path: String,
+    /// Snapshot that added the file
+    pub snapshot: i64,
+    /// Backup whose `data/` holds the file
+    pub backup: String,
+    #[serde(flatten)]
+    pub checksum: Checksum,
+}
+
+/// Back up the lake into `dir`, copying only data files added since the
+/// latest backup there, or every file with `full`
+pub fn create_backup(config: &Config, dir: &Path, full: bool) -> Result<Manifest> {
+    let _span = trace::span_with("backup.create", || dir.display().to_string());
+    let metadata_path = config.metadata_path();
+    if !metadata_path.exists() {
+        anyhow::bail!("No lake at {}", config.lake_dir().display());
+    }
+
+    let parent = if full { None } else { latest_backup(dir)? };
+    let id = backup_id(dir)?;
+    let staging = dir.join(format!(".{}.tmp", id));
+    fs::create_dir_all(staging.join(DATA_DIRNAME))?;
+
+    let result = (|| {
+        let catalog_path = staging.join(CATALOG_FILENAME);
+        copy_catalog(&metadata_path, &catalog_path)?;
+        let (snapshot, referenced) = catalog_files(&catalog_path)?;
+
+        // Match the catalog's files to the data directory by name, which
+        // DuckLake makes unique
+        let data_path = config.data_path();
+        let mut files = Vec::new();
+        if data_path.exists() {
+            for entry in WalkDir::new(&data_path) {
+                let entry = entry?;
+                let name = entry.file_name().to_string_lossy();
+                if let Some(snapshot) = referenced.get(name.as_ref()) {
+                    if entry.file_type().is_file() {
+                        files.push((relative_path(&data_path, entry.path())?, *snapshot));
+                    }
+                }
+            }
+        }
+        if files.len() < referenced.len() {
+            anyhow::bail!(
+                "{} data files referenced by the catalog are missing from {}",
+                referenced.len() - files.len(),
+                data_path.display()
+            );
+        }
+
+        let previous: HashMap<&str, &DataFile> = parent
+            .iter()
+            .flat_map(|parent| &parent.files)
+            .map(|file| (file.path.as_str(), file))
+            .collect();
+        let parent_snapshot = parent.as_ref().map(|parent| parent.snapshot);
+
+        let mut copies = Vec::new();
+        let mut entries = Vec::new();
+        for (path, snapshot) in files {
+            match previous.get(path.as_str()) {
+                Some(file) if parent_snapshot.is_some_and(|parent| snapshot <= parent) => {
+                    entries.push((*file).clone())
+                }
+                _ => copies.push((path, snapshot)),
+            }
+        }
+
+        let copied = run_parallel(&copies, |(path, snapshot)| {
+            let checksum = copy_file(
+                &data_path.join(path),
+                &staging.join(DATA_DIRNAME).join(path),
+            )?;
+            Ok(DataFile {
+                path: path.clone(),
+                snapshot: *snapshot,
+                backup: id.clone(),
+                checksum,
+            })
+        })?;
+        entries.extend(copied);
+        entries.sort_by(|a, b| a.path.cmp(&b.path));
+
+        let manifest = Manifest {
+            version: MANIFEST_VERSION,
+            id: id.clone(),
+            created: chrono::Utc::now().to_rfc3339(),
+            snapshot,
+            parent: parent.as_ref().map(|parent| parent.id.clone()),
+            catalog: checksum(&catalog_path)?,
+            files: entries,
+        };
+        write_manifest(&staging, &manifest)?;
+        Ok(manifest)
+    })();
+
+    match result {
+        Ok(manifest) => {
+            fs::rename(&staging, dir.join(&id))?;
+            Ok(manifest)
+        }
+        Err(e) => {
+            let _ = fs::remove_dir_all(&staging);
+            Err(e)
+        }
+    }
+}
+
+/// Rebuild the lake from a backup (the latest in `dir` unless `id` is given)
+///
+/// Every file is checked against the manifest as it is copied. An existing
+/// lake is only replaced with `force`.
+pub fn restore_backup(
+    config: &Config,
+    dir: &Path,
+    id: Option<&str>,
+    force: bool,
+) -> Result<Manifest> {
+    let _span = trace::span_with("backup.restore", || dir.display().to_string());
+    let manifest = load_backup(dir, id)?;
+    let metadata_path = config.metadata_path();
+    if metadata_path.exists() && !force {
+        anyhow::bail!(
+            "A lake already exists at {} (use --force to replace it)",
+            config.lake_dir().display()
+        );
+    }
+    config.ensure_directories()?;
+
+    let data_path = config.data_path();
+    run_parallel(&manifest.files, |file| {
+        let source = dir.join(&file.backup).join(DATA_DIRNAME).join(&file.path);
+        let checksum = copy_file(&source, &data_path.join(&file.path))?;
+        check(&file.path, &checksum, &file.checksum)
+    })?;
+
+    // The catalog goes last, so a failed restore leaves no lake referencing
+    // missing files
+    let staged = metadata_path.with_extension("db.restore");
+    let checksum = copy_file(&dir.join(&manifest.id).join(CATALOG_FILENAME), &staged)?;
+    check(CATALOG_FILENAME, &checksum, &manifest.catalog)?;
+    set_data_path(&staged, &data_path)?;
+    for suffix in ["-wal", "-shm"] {
+        let _ = fs::remove_file(format!("{}{}", metadata_path.display(), suffix));
+    }
+    fs::rename(&staged, &metadata_path)?;
+
+    Ok(manifest)
+}
+
+/// Check the checksums of a backup and every file it references, returning
+/// its manifest
+pub fn verify_backup(dir: &Path, id: Option<&str>) -> Result<Manifest> {
+    let _span = trace::span_with("backup.verify", || dir.display().to_string());
+    let manifest = load_backup(dir, id)?;
+
+    let catalog = checksum(&dir.join(&manifest.id).join(CATALOG_FILENAME))?;
+    check(CATALOG_FILENAME, &catalog, &manifest.catalog)?;
+    run_parallel(&manifest.files, |file| {
+        let path = dir.join(&file.backup).join(DATA_DIRNAME).join(&file.path);
+        check(&file.path, &checksum(&path)?, &file.checksum)
+    })?;
+
+    Ok(manifest)
+}
+
+/// Complete backups in `dir`, oldest first
+pub fn list_backups(dir: &Path) -> Result<Vec<Manifest>> {
+    let mut backups = Vec::new();
+    if !dir.exists() {
+        return Ok(backups);
+    }
+
+    for entry in fs::read_dir(dir)? {
+        let path = entry?.path().join(MANIFEST_FILENAME);
+        if path.exists() {
+            backups.push(read_manifest(&path)?);
+        }
+    }
+
+    backups.sort_by(|a, b| a.id.cmp(&b.id));
+    Ok(backups)
+}
+
+/// Where `dkdc backup` keeps backups unless told otherwise
+pub fn default_backup_dir(config: &Config) -> PathBuf {
+    config.dkdc_dir().join("backups")
+}
+
+fn latest_backup(dir: &Path) -> Result<Option<Manifest>> {
+    Ok(list_backups(dir)?.pop())
+}
+
+fn load_backup(dir: &Path, id: Option<&str>) -> Result<Manifest> {
+    match id {
+        Some(id) => read_manifest(&dir.join(id).join(MANIFEST_FILENAME)),
+        None => {
+            latest_backup(dir)?.ok_or_else(|| anyhow::anyhow!("No backups in {}", dir.display()))
+        }
+    }
+}
+
+fn read_manifest(path: &Path) -> Result<Manifest> {
+    let manifest: Manifest = serde_json::from_slice(&fs::read(path)?)
+        .map_err(|e| anyhow::anyhow!("Invalid manifest {}: {}", path.display(), e))?;
+    if manifest.version > MANIFEST_VERSION {
+        anyhow::bail!(
+            "Backup {} has manifest version {}, newer than this dkdc supports",
+            manifest.id,
+            manifest.version
+        );
+    }
+    Ok(manifest)
+}
+
+fn write_manifest(dir: &Path, manifest: &Manifest) -> Result<()> {
+    let mut file = fs::File::create(dir.join(MANIFEST_FILENAME))?;
+    file.write_all(&serde_json::to_vec_pretty(manifest)?)?;
+    file.sync_all()?;
+    Ok(())
+}
+
+/// Sortable id from the current time, unique within `dir`
+fn backup_id(dir: &Path) -> Result<String> {
+    let id = chrono::Utc::now().format("%Y%m%dT%H%M%S%.3fZ").to_string();
+    if dir.join(&id).exists() {
+        anyhow::bail!("Backup {} already exists in {}", id, dir.display());
+    }
+    Ok(id)
+}
+
+/// Copy the catalog with SQLite's online backup, which sees one consistent
+/// state without blocking writers (the catalog is in WAL mode)
+fn copy_catalog(source: &Path, destination: &Path) -> Result<()> {
+    let _span = trace::span("backup.catalog");
+    let db = Connection::open_with_flags(source, OpenFlags::SQLITE_OPEN_READ_ONLY)?;
+    db.busy_timeout(BUSY_TIMEOUT)?;
+    db.backup(DatabaseName::Main, destination, None)?;
+    Ok(())
+}
+
+/// Latest snapshot of a catalog, and the snapshot that added each data and
+/// delete file, by file name
+fn catalog_files(catalog: &Path) -> Result<(i64, HashMap<String, i64>)> {
+    let db = Connection::open_with_flags(catalog, OpenFlags::SQLITE_OPEN_READ_ONLY)?;
+    let snapshot: Option<i64> = match db.query_row(
+        "SELECT max(snapshot_id) FROM ducklake_snapshot",
+        [],
+        |row| row.get(0),
+    ) {
+        Ok(snapshot) => snapshot,
+        // A catalog DuckLake never initialized
+        Err(e) if e.to_string().contains("no such table") => return Ok((0, HashMap::new())),
+        Err(e) => return Err(e.into()),
+    };
+
+    let mut stmt = db.prepare(
+        "SELECT path, begin_snapshot FROM ducklake_data_file
+         UNION ALL
+         SELECT path, begin_snapshot FROM ducklake_delete_file",
+    )?;
+    let rows = stmt.query_map([], |row| {
+        Ok((row.get::<_, String>(0)?, row.get::<_, i64>(1)?))
+    })?;
+
+    let mut files = HashMap::new();
+    for row in rows {
+        let (path, snapshot) = row?;
+        let name = path.rsplit(['/', '\\']).next().unwrap_or(&path).to_string();
+        files.insert(name, snapshot);
+    }
+    Ok((snapshot.unwrap_or(0), files))
+}
+
+/// Point a restored catalog at the lake's data directory
+fn set_data_path(catalog: &Path, data_path: &Path) -> Result<()> {
+    let db = Connection::open(catalog)?;
+    let value = format!("{}{}", data_path.display(), std::path::MAIN_SEPARATOR);
+    db.execute(
+        "UPDATE ducklake_metadata SET value = ?1 WHERE key = 'data_path'",
+        [value],
+    )?;
+    Ok(())
+}
+
+fn relative_path(base: &Path, path: &Path) -> Result<String> {
+    let relative = path.strip_prefix(base)?;
+    Ok(relative
+        .components()
+        .map(|c| c.as_os_str().to_string_lossy())
+        .collect::<Vec<_>>()
+        .join("/"))
+}
+
+/// Copy a file, hashing it on the way, and sync the copy
+fn copy_file(source: &Path, destination: &Path) -> Result<Checksum> {
+    let _span = trace::span_with("backup.copy", || source.display().to_string());
+    if let Some(parent) = destination.parent() {
+        fs::create_dir_all(parent)?;
+    }
+
+    let mut output = fs::File::create(destination)?;
+    let checksum = hash_reader(fs::File::open(source)?, |bytes| output.write_all(bytes))?;
+    output.sync_all()?;
+    Ok(checksum)
+}
+
+fn checksum(path: &Path) -> Result<Checksum> {
+    hash_reader(fs::File::open(path)?, |_| Ok(()))
+}
+
+fn hash_reader(
+    mut reader: impl Read,
+    mut sink: impl FnMut(&[u8]) -> std::io::Result<()>,
+) -> Result<Checksum> {
+    let mut hasher = Sha256::new();
+    let mut buffer = vec![0; 1024 * 1024];
+    let mut size = 0;
+
+    loop {
+        let n = reader.read(&mut buffer)?;
+        if n == 0 {
+            break;
+        }
+        hasher.update(&buffer[..n]);
+        sink(&buffer[..n])?;
+        size += n as u64;
+    }
+
+    let sha256 = hasher
+        .finalize()
+        .iter()
+        .map(|b| format!("{:02x}", b))
+        .collect();
+    Ok(Checksum { size, sha256 })
+}
+
+fn check(name: &str, actual: &Checksum, expected: &Checksum) -> Result<()> {
+    if actual.size != expected.size || actual.sha256 != expected.sha256 {
+        anyhow::bail!(
+            "Checksum mismatch for {}: expected {} ({} bytes), found {} ({} bytes)",
+            name,
+            expected.sha256,
+            expected.size,
+            actual.sha256,
+            actual.size
+        );
+    }
+    Ok(())
+}
+
+/// Run `f` over `items` on one thread per core, failing if any call fails
+fn run_parallel<T, R, F>(items: &[T], f: F) -> Result<Vec<R>>
+where
+    T: Sync,
+    R: Send,
+    F: Fn(&T) -> Result<R> + Sync,
+{
+    let jobs = std::thread::available_parallelism()
+        .map(|n| n.get())
+        .unwrap_or(4);
+    let next = AtomicUsize::new(0);
+    let slots: Mutex<Vec<Option<Result<R>>>> = Mutex::new(items.iter().map(|_| None).collect());
+
+    std::thread::scope(|s| {
+        for _ in 0..jobs.clamp(1, items.len().max(1)) {
+            s.spawn(|| loop {
+                let index = next.fetch_add(1, Ordering::Relaxed);
+                let Some(item) = items.get(index) else {
+                    break;
+                };
+                let result = f(item);
+                let failed = result.is_err();
+                slots.lock().unwrap()[index] = Some(result);
+                if failed {
+                    // Stop handing out work; other workers finish their item
+                    next.store(items.len(), Ordering::Relaxed);
+                }
+            });
+        }
+    });
+
+    slots.into_inner().unwrap().into_iter().flatten().collect()
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_incremental_backup_and_restore() {
+        let home = tempfile::tempdir().unwrap();
+        let config = Config::from_path(home.path().join("lake"));
+        config.ensure_directories().unwrap();
+        let dir = home.path().join("backups");
+
+        // A stand-in catalog with the DuckLake tables a backup reads
+        let db = Connection::open(config.metadata_path()).unwrap();
+        db.execute_batch(
+            "CREATE TABLE ducklake_snapshot (snapshot_id INTEGER);
+             CREATE TABLE ducklake_data_file (path TEXT, begin_snapshot INTEGER);
+             CREATE TABLE ducklake_delete_file (path TEXT, begin_snapshot INTEGER);
+             CREATE TABLE ducklake_metadata (key TEXT, value TEXT);
+             INSERT INTO ducklake_snapshot VALUES (1);
+             INSERT INTO ducklake_data_file VALUES ('main/t/a.parquet', 1);",
+        )
+        .unwrap();
+        let data = config.data_path().join("main").join("t");
+        fs::create_dir_all(&data).unwrap();
+        fs::write(data.join("a.parquet"), b"first").unwrap();
+
+        let first = create_backup(&config, &dir, false).unwrap();
+        assert_eq!(first.copied().count(), 1);
+
+        db.execute_batch(
+            "INSERT INTO ducklake_snapshot VALUES (2);
+             INSERT INTO ducklake_data_file VALUES ('main/t/b.parquet', 2);",
+        )
+        .unwrap();
+        fs::write(data.join("b.parquet"), b"second").unwrap();
+        std::thread::sleep(Duration::from_millis(2));
+
+        let second = create_backup(&config, &dir, false).unwrap();
+        assert_eq!(second.parent.as_deref(), Some(first.id.as_str()));
+        let copied: Vec<_> = second.copied().map(|f| f.path.as_str()).collect();
+        assert_eq!(copied, ["main/t/b.parquet"]);
+        verify_backup(&dir, None).unwrap();
+
+        let restored = Config::from_path(home.path().join("restored"));
+        restore_backup(&restored, &dir, None, false).unwrap();
+        let a = restored.data_path().join("main/t/a.parquet");
+        assert_eq!(fs::read(a).unwrap(), b"first");
+
+        // A corrupted file in an earlier backup fails verification
+        fs::write(
+            dir.join(&first.id)
+                .join(DATA_DIRNAME)
+                .join("main/t/a.parquet"),
+            b"flipped",
+        )
+        .unwrap();
+        assert!(verify_backup(&dir, None).is_err());
+    }
+}
@@ -1,8 +1,13 @@
 use anyhow::Result;
-use clap::{Parser, Subcommand};
-use dkdc_config::Config;
+use chrono::{DateTime, Utc};
+use clap::{Parser, Subcommand, ValueEnum};
+use dkdc_common::trace::{self, TraceFormat};
+use dkdc_config::{Config, DKDC_HOME_ENV};
 use dkdc_dev::{Dev, DevMode};
-use dkdc_lake::Lake;
+use dkdc_lake::files::{FileSort, ListOptions};
+use dkdc_lake::transfer::TransferOptions;
+use dkdc_lake::{AsOf, Lake};
+use std::path::PathBuf;
 use std::process::Command;
 
 #[derive(Parser)]
@@ -16,6 +21,14 @@ pub struct Cli {
     /// Open config file in editor
     #[arg(short, long)]
     pub config: bool,
+
+    /// Use a named lake from the [lakes] section of the config file
+    #[arg(long, global = true, value_name = "NAME")]
+    pub lake: Option<String>,
+
+    /// Record timing spans and write them to FILE (.json: Chrome trace, else JSON lines)
+    #[arg(long, global = true, value_name = "FILE")]
+    pub trace: Option<PathBuf>,
 }
 
 #[derive(Subcommand)]
@@ -54,8 +67,152 @@ pub enum Commands {
         command: SecretsCommands,
     },
 
-    /// Backup management (future)
-    Backup,
+    /// Inspect the lake's history
+    Lake {
+        #[command(subcommand)]
+        command: LakeCommands,
+    },
+
+    /// Back up and restore the lake
+    Backup {
+        #[command(subcommand)]
+        command: BackupCommands,
+    },
+
+    /// Serve the virtual filesystem over HTTP, read-only
+    Serve {
+        /// Address to listen on
+        #[arg(long, default_value = "127.0.0.1:8080")]
+        addr: String,
+
+        /// Number of worker threads (default: number of CPUs)
+        #[arg(long)]
+        workers: Option<usize>,
+    },
+}
+
+#[derive(Subcommand)]
+pub enum BackupCommands {
+    /// Back up the catalog and the data files added since the last backup
+    Create {
+        /// Backup directory (default: ~/.dkdc/backups)
+        dir: Option<PathBuf>,
+
+        /// Copy every data file instead of only new ones
+        #[arg(long)]
+        full: bool,
+    },
+
+    /// Rebuild the lake from a backup
+    Restore {
+        /// Backup directory (default: ~/.dkdc/backups)
+        dir: Option<PathBuf>,
+
+        /// Backup to restore (default: the latest)
+        #[arg(long)]
+        id: Option<String>,
+
+        /// Replace an existing lake
+        #[arg(long)]
+        force: bool,
+    },
+
+    /// Check a backup's checksums, including files held by earlier backups
+    Verify {
+        /// Backup directory (default: ~/.dkdc/backups)
+        dir: Option<PathBuf>,
+
+        /// Backup to verify (default: the latest)
+        #[arg(long)]
+        id: Option<String>,
+    },
+
+    /// List backups
+    List {
+        /// Backup directory (default: ~/.dkdc/backups)
+        dir: Option<PathBuf>,
+    },
+}
+
+#[derive(Subcommand)]
+pub enum LakeCommands {
+    /// List snapshots, for use with `--at`
+    Snapshots,
+
+    /// Export a table to partitioned Parquet (files include their chunks)
+    Export {
+        /// Table to export
+        #[arg(long, default_value = "files")]
+        table: String,
+
+        /// Directory to write `<table>/month=YYYY-MM/*.parquet` under
+        #[arg(long)]
+        to: PathBuf,
+
+        #[command(flatten)]
+        filter: TransferArgs,
+
+        /// Allow exporting secrets without --key-secret, as plaintext Parquet
+        #[arg(long)]
+        plaintext: bool,
+
+        /// Read as of a snapshot id or timestamp (e.g. 2025-01-31T12:00:00Z)
+        #[arg(long, default_value = "latest", value_name = "SNAPSHOT|TIME")]
+        at: AsOf,
+    },
+
+    /// Import a table exported with `lake export`, as one snapshot
+    Import {
+        /// Table to import
+        #[arg(long, default_value = "files")]
+        table: String,
+
+        /// Directory the export was written to
+        #[arg(long)]
+        from: PathBuf,
+
+        #[command(flatten)]
+        filter: TransferArgs,
+    },
+}
+
+#[derive(clap::Args)]
+pub struct TransferArgs {
+    /// Only rows whose path starts with this (e.g. ./files/projects)
+    #[arg(long)]
+    prefix: Option<String>,
+
+    /// Only rows updated at or after this time
+    #[arg(long, value_parser = dkdc_lake::snapshot::parse_time)]
+    since: Option<DateTime<Utc>>,
+
+    /// Only rows updated before this time
+    #[arg(long, value_parser = dkdc_lake::snapshot::parse_time)]
+    until: Option<DateTime<Utc>>,
+
+    /// Encrypt (or decrypt) the Parquet files with a key derived from this secret
+    #[arg(long, value_name = "SECRET")]
+    key_secret: Option<String>,
+}
+
+impl TransferArgs {
+    fn options(self, lake: &Lake) -> Result<TransferOptions> {
+        let key = match &self.key_secret {
+            Some(name) => Some(
+                lake.get_secret(name)?
+                    .ok_or_else(|| anyhow::anyhow!("Secret '{}' not found", name))?,
+            ),
+            None => None,
+        };
+
+        Ok(TransferOptions {
+            prefix: self.prefix,
+            since: self.since,
+            until: self.until,
+            key,
+            plaintext: false,
+        })
+    }
 }
 
 #[derive(Subcommand)]
@@ -65,12 +222,41 @@ pub enum FilesCommands {
         /// Directory path (default: ./files)
         #[arg(default_value = "./files")]
         path: String,
+
+        /// Show size, last update, version count and content hash
+        #[arg(short, long)]
+        long: bool,
+
+        /// Include files under sub-paths
+        #[arg(short = 'R', long)]
+        recursive: bool,
+
+        /// Sort by this column
+        #[arg(short, long, value_enum, default_value_t = SortBy::Name)]
+        sort: SortBy,
+
+        /// Reverse the sort order
+        #[arg(short, long)]
+        reverse: bool,
+
+        /// Show at most this many files
+        #[arg(long)]
+        limit: Option<usize>,
+
+        /// Skip this many files
+        #[arg(long, default_value_t = 0)]
+        offset: usize,
+
+        /// Read as of a snapshot id or timestamp (e.g. 2025-01-31T12:00:00Z)
+        #[arg(long, default_value = "latest", value_name = "SNAPSHOT|TIME")]
+        at: AsOf,
     },
 
-    /// Add a file
+    /// Add files (committed together as one snapshot)
     Add {
-        /// Local file path
-        file: String,
+        /// Local file paths
+        #[arg(required = true)]
+        files: Vec<String>,
 
         /// Virtual path in filesystem
         #[arg(short, long)]
@@ -92,6 +278,10 @@ pub enum FilesCommands {
         /// Local directory to dump to
         #[arg(default_value = ".")]
         output: String,
+
+        /// Read as of a snapshot id or timestamp (e.g. 2025-01-31T12:00:00Z)
+        #[arg(long, default_value = "latest", value_name = "SNAPSHOT|TIME")]
+        at: AsOf,
     },
 
     /// Restore files from local directory
@@ -99,6 +289,97 @@ pub enum FilesCommands {
         /// Local directory to restore from
         directory: String,
     },
+
+    /// Mount the latest files with FUSE (Linux), until unmounted
+    Mount {
+        /// Empty local directory to mount at
+        mountpoint: String,
+
+        /// Accept writes, each stored as one new version on close
+        #[arg(long)]
+        writable: bool,
+    },
+
+    /// Print lines of text files containing a pattern
+    Grep {
+        /// Text to find
+        pattern: String,
+
+        /// Match case-insensitively
+        #[arg(short, long)]
+        ignore_case: bool,
+
+        /// Only files under this path
+        #[arg(short, long)]
+        path: Option<String>,
+    },
+
+    /// Rank text files by relevance to a query
+    Search {
+        /// Words to search for
+        query: String,
+
+        /// Show at most this many files
+        #[arg(short = 'n', long, default_value_t = 10)]
+        limit: usize,
+
+        /// Only files under this path
+        #[arg(short, long)]
+        path: Option<String>,
+    },
+
+    /// Rebuild the search and directory indexes (e.g. after turning
+    /// `search_index` back on)
+    Reindex,
+
+    /// Delete chunks of large files no file uses any more (run while
+    /// nothing else is writing to the lake)
+    Gc,
+
+    /// Move or rename a file or directory (only names change, not contents)
+    Mv {
+        /// Path of a file or directory (e.g. ./files/notes.md)
+        source: String,
+
+        /// New path, or an existing directory to move into
+        destination: String,
+    },
+
+    /// Remove a file, or a directory with --recursive
+    Rm {
+        /// Path of a file or directory (e.g. ./files/notes.md)
+        path: String,
+
+        /// Remove a directory and everything below it
+        #[arg(short, long)]
+        recursive: bool,
+    },
+
+    /// Show directories and files as a tree
+    Tree {
+        /// Directory path
+        #[arg(default_value = "./files")]
+        path: String,
+    },
+}
+
+#[derive(Clone, Copy, ValueEnum)]
+pub enum SortBy {
+    Name,
+    Size,
+    Updated,
+    Versions,
+}
+
+impl From<SortBy> for FileSort {
+    fn from(sort: SortBy) -> Self {
+        match sort {
+            SortBy::Name => FileSort::Name,
+            SortBy::Size => FileSort::Size,
+            SortBy::Updated => FileSort::Updated,
+            SortBy::Versions => FileSort::Versions,
+        }
+    }
 }
 
 #[derive(Subcommand)]
@@ -129,10 +410,18 @@ pub enum SecretsCommands {
         /// Copy to clipboard
         #[arg(short, long)]
         clipboard: bool,
+
+        /// Read as of a snapshot id or timestamp (e.g. 2025-01-31T12:00:00Z)
+        #[arg(long, default_value = "latest", value_name = "SNAPSHOT|TIME")]
+        at: AsOf,
     },
 
     /// List all secrets
-    List,
+    List {
+        /// Read as of a snapshot id or timestamp (e.g. 2025-01-31T12:00:00Z)
+        #[arg(long, default_value = "latest", value_name = "SNAPSHOT|TIME")]
+        at: AsOf,
+    },
 
     /// Delete a secret
     Delete {
@@ -153,6 +442,21 @@ pub enum SecretsCommands {
         /// Only export secrets with this prefix
         #[arg(short, long)]
         prefix: Option<String>,
+
+        /// Read as of a snapshot id or timestamp (e.g. 2025-01-31T12:00:00Z)
+        #[arg(long, default_value = "latest", value_name = "SNAPSHOT|TIME")]
+        at: AsOf,
+    },
+
+    /// Run a command with secrets as environment variables
+    Exec {
+        /// Only pass secrets with this prefix
+        #[arg(short, long)]
+        prefix: Option<String>,
+
+        /// Command and its arguments (after `--`)
+        #[arg(required = true, trailing_var_arg = true, allow_hyphen_values = true)]
+        command: Vec<String>,
     },
 }
 
@@ -164,13 +468,33 @@ pub fn run_cli(args: Vec<String>) -> Result<()> {
         return handle_config_edit();
     }
 
+    // Select the lake for this process and anything it launches (e.g. `dev`)
+    if let Some(name) = &cli.lake {
+        let config = Config::for_profile(name)?;
+        std::env::set_var(DKDC_HOME_ENV, config.dkdc_dir());
+    }
+
     if cli.command.is_none() {
         use clap::CommandFactory;
         Cli::command().print_help()?;
         return Ok(());
     }
 
-    match cli.command {
+    if let Some(path) = &cli.trace {
+        trace::enable();
+        let result = run_command(cli.command);
+        // Write the trace even when the command failed; that's when it's needed
+        trace::write(path, TraceFormat::from_path(path))?;
+        return result;
+    }
+
+    run_command(cli.command)
+}
+
+fn run_command(command: Option<Commands>) -> Result<()> {
+    let _span = trace::span("cli.command");
+
+    match command {
         Some(Commands::Dev { sql, exit }) => {
             let dev = Dev::new()?;
             let mode = if sql { DevMode::Sql } else { DevMode::Python };
@@ -199,8 +523,18 @@ pub fn run_cli(args: Vec<String>) -> Result<()> {
             handle_secrets_command(command)?;
         }
 
-        Some(Commands::Backup) => {
-            println!("Backup command not yet implemented");
+        Some(Commands::Lake { command }) => {
+            handle_lake_command(command)?;
+        }
+
+        Some(Commands::Backup { command }) => {
+            handle_backup_command(command)?;
+        }
+
+        Some(Commands::Serve { addr, workers }) => {
+            let workers = workers
+                .unwrap_or_else(|| std::thread::available_parallelism().map_or(4, |n| n.get()));
+            dkdc_serve::serve(&addr, workers)?;
         }
 
         None => unreachable!("Clap should handle this case"),
@@ -209,13 +543,149 @@ pub fn run_cli(args: Vec<String>) -> Result<()> {
     Ok(())
 }
 
+fn handle_backup_command(command: BackupCommands) -> Result<()> {
+    let config = Config::new()?;
+    let backup_dir =
+        |dir: Option<PathBuf>| dir.unwrap_or_else(|| dkdc_backup::default_backup_dir(&config));
+
+    match command {
+        BackupCommands::Create { dir, full } => {
+            let manifest = dkdc_backup::create_backup(&config, &backup_dir(dir), full)?;
+            let (files, bytes) = manifest
+                .copied()
+                .fold((0, 0), |(n, size), file| (n + 1, size + file.checksum.size));
+            println!(
+                "{}  snapshot {}  copied {} of {} data files ({} bytes)",
+                manifest.id,
+                manifest.snapshot,
+                files,
+                manifest.files.len(),
+                bytes
+            );
+        }
+        BackupCommands::Restore { dir, id, force } => {
+            let manifest =
+                dkdc_backup::restore_backup(&config, &backup_dir(dir), id.as_deref(), force)?;
+            println!(
+                "Restored {} (snapshot {}) to {}",
+                manifest.id,
+                manifest.snapshot,
+                config.lake_dir().display()
+            );
+        }
+        BackupCommands::Verify { dir, id } => {
+            let manifest = dkdc_backup::verify_backup(&backup_dir(dir), id.as_deref())?;
+            println!("{}  ok  ({} data files)", manifest.id, manifest.files.len());
+        }
+        BackupCommands::List { dir } => {
+            for manifest in dkdc_backup::list_backups(&backup_dir(dir))? {
+                println!(
+                    "{}  snapshot {:>6}  {:>6} files  {}",
+                    manifest.id,
+                    manifest.snapshot,
+                    manifest.copied().count(),
+                    manifest.parent.as_deref().unwrap_or("full")
+                );
+            }
+        }
+    }
+
+    Ok(())
+}
+
 fn handle_files_command(command: FilesCommands) -> Result<()> {
     match command {
-        FilesCommands::List { path } => dkdc_files::list_files(&path),
-        FilesCommands::Add { file, path } => dkdc_files::add_file(&file, path.as_deref()),
+        FilesCommands::List {
+            path,
+            long,
+            recursive,
+            sort,
+            reverse,
+            limit,
+            offset,
+            at,
+        } => {
+            let options = ListOptions {
+                recursive,
+                sort: sort.into(),
+                reverse,
+                limit,
+                offset,
+            };
+            dkdc_files::list_files(&path, long, &options, at)
+        }
+        FilesCommands::Add { files, path } => {
+            let files: Vec<&str> = files.iter().map(String::as_str).collect();
+            dkdc_files::add_files(&files, path.as_deref())
+        }
         FilesCommands::Open { name, path } => dkdc_files::open_file(&name, &path),
-        FilesCommands::Dump { output } => dkdc_files::dump_files(&output),
+        FilesCommands::Dump { output, at } => dkdc_files::dump_files(&output, at),
         FilesCommands::Restore { directory } => dkdc_files::restore_files(&directory),
+        FilesCommands::Mount {
+            mountpoint,
+            writable,
+        } => dkdc_files::mount_files(&mountpoint, writable),
+        FilesCommands::Grep {
+            pattern,
+            ignore_case,
+            path,
+        } => dkdc_files::grep_files(&pattern, ignore_case, path.as_deref()),
+        FilesCommands::Search { query, limit, path } => {
+            dkdc_files::search_files(&query, limit, path.as_deref())
+        }
+        FilesCommands::Reindex => dkdc_files::reindex_files(),
+        FilesCommands::Gc => dkdc_files::gc_chunks(),
+        FilesCommands::Mv {
+            source,
+            destination,
+        } => dkdc_files::move_path(&source, &destination),
+        FilesCommands::Rm { path, recursive } => dkdc_files::remove_path(&path, recursive),
+        FilesCommands::Tree { path } => dkdc_files::print_tree(&path),
+    }
+}
+
+fn handle_lake_command(command: LakeCommands) -> Result<()> {
+    match command {
+        LakeCommands::Snapshots => {
+            let lake = Lake::read_only()?;
+            for snapshot in lake.snapshots()? {
+                println!(
+                    "{:>8}  {}",
+                    snapshot.id,
+                    snapshot.time.format("%Y-%m-%dT%H:%M:%SZ")
+                );
+            }
+            Ok(())
+        }
+        LakeCommands::Export {
+            table,
+            to,
+            filter,
+            plaintext,
+            at,
+        } => {
+            let lake = Lake::read_only()?.at(at)?;
+            let options = TransferOptions {
+                plaintext,
+                ..filter.options(&lake)?
+            };
+            for (table, rows) in lake.export_table(&table, &to, &options)? {
+                println!("{:>10}  {}", rows, to.join(table).display());
+            }
+            Ok(())
+        }
+        LakeCommands::Import {
+            table,
+            from,
+            filter,
+        } => {
+            let lake = Lake::new()?;
+            let options = filter.options(&lake)?;
+            for (table, rows) in lake.import_table(&table, &from, &options)? {
+                println!("{:>10}  {}", rows, table);
+            }
+            Ok(())
+        }
     }
 }
 
@@ -239,6 +709,35 @@ editor = "nano"
 [dev]
 # Additional Python packages to install in dev environment
 # packages = ["pandas", "matplotlib"]
+
+[lake]
+# How long (ms) writes retry while another process holds the catalog
+# busy_timeout_ms = 30000
+# Initial backoff (ms) between retries, doubled each attempt with jitter
+# retry_backoff_ms = 10
+# Compress blobs with zstd before they are encrypted (level 1-22)
+# compression = false
+# compression_level = 3
+# DuckDB scan settings (defaults: a thread per core, 80% of RAM)
+# threads = 8
+# memory_limit = "4GB"
+# temp_directory = "/tmp/dkdc"
+# object_cache = true
+# prefetch = false
+# Keep decrypted copies of opened files in a local cache (plaintext on disk)
+# file_cache = false
+# file_cache_dir = "~/.dkdc/cache/files"
+# file_cache_max_bytes = 10737418240
+# Full-text index of text files for `dkdc files search/grep`
+# search_index = true
+# Encrypt blobs client-side too, with per-blob keys sealed by a master key
+# file (back the key file up separately: sealed blobs are unreadable without it)
+# envelope_encryption = false
+# envelope_key_file = "~/.dkdc/keys/envelope.key"
+
+# Named lakes, used with `dkdc --lake NAME` or DKDC_LAKE=NAME
+# [lakes.scratch]
+# path = "~/.dkdc-scratch"
 "#;
         std::fs::write(&config_path, default_config)?;
     }
@@ -266,8 +765,8 @@ editor = "nano"
 
 fn handle_secrets_command(command: SecretsCommands) -> Result<()> {
     match command {
-        SecretsCommands::List => {
-            let lake = Lake::new()?;
+        SecretsCommands::List { at } => {
+            let lake = Lake::read_only()?.at(at)?;
             let secrets = lake.list_secrets()?;
             for secret in secrets {
                 println!("{}", secret);
@@ -328,8 +827,12 @@ fn handle_secrets_command(command: SecretsCommands) -> Result<()> {
             eprintln!("✓ Secret '{}' saved", name);
             Ok(())
         }
-        SecretsCommands::Get { name, clipboard } => {
-            let lake = Lake::new()?;
+        SecretsCommands::Get {
+            name,
+            clipboard,
+            at,
+        } => {
+            let lake = Lake::read_only()?.at(at)?;
 
             if let Some(secret_data) = lake.get_secret(&name)? {
                 let secret_value = String::from_utf8_lossy(&secret_data);
@@ -367,14 +870,11 @@ fn handle_secrets_command(command: SecretsCommands) -> Result<()> {
             output,
             format,
             prefix,
+            at,
         } => {
-            let lake = Lake::new()?;
-            let mut secrets = lake.list_secrets()?;
-
-            // Filter by prefix if provided
-            if let Some(p) = &prefix {
-                secrets.retain(|s| s.starts_with(p));
-            }
+            // One query for every value, at one snapshot
+            let lake = Lake::read_only()?.at(at)?;
+            let secrets = lake.secrets_with_prefix(prefix.as_deref())?;
 
             if secrets.is_empty() {
                 eprintln!(
@@ -388,13 +888,10 @@ fn handle_secrets_command(command: SecretsCommands) -> Result<()> {
                 return Ok(());
             }
 
-            // Collect secrets data
-            let mut secret_map = std::collections::HashMap::new();
-            for name in &secrets {
-                if let Some(data) = lake.get_secret(name)? {
-                    secret_map.insert(name.clone(), String::from_utf8_lossy(&data).to_string());
-                }
-            }
+            let secret_map: std::collections::HashMap<_, _> = secrets
+                .into_iter()
+                .map(|(name, data)| (name, String::from_utf8_lossy(&data).to_string()))
+                .collect();
 
             // Format output
             let formatted_output = match format.as_str() {
@@ -435,5 +932,48 @@ fn handle_secrets_command(command: SecretsCommands) -> Result<()> {
 
             Ok(())
         }
+        SecretsCommands::Exec { prefix, command } => {
+            let secrets = Lake::read_only()?.secrets_with_prefix(prefix.as_deref())?;
+            exec_with_secrets(&command, secrets)
+        }
+    }
+}
+
+/// Replace this process with `command`, with `secrets` added to its
+/// environment
+///
+/// Values are passed as bytes straight to the child, never through a shell.
+/// Where `exec` is unavailable the command runs as a child and its exit code
+/// is passed on.
+fn exec_with_secrets(command: &[String], secrets: Vec<(String, Vec<u8>)>) -> Result<()> {
+    let mut child = std::process::Command::new(&command[0]);
+    child.args(&command[1..]);
+
+    for (name, value) in secrets {
+        if name.is_empty() || name.contains(['=', '\0']) {
+            anyhow::bail!("Secret '{}' is not a valid environment variable name", name);
+        }
+        #[cfg(unix)]
+        let value = {
+            use std::os::unix::ffi::OsStringExt;
+            std::ffi::OsString::from_vec(value)
+        };
+        #[cfg(not(unix))]
+        let value = String::from_utf8_lossy(&value).to_string();
+        child.env(name, value);
+    }
+
+    #[cfg(unix)]
+    {
+        use std::os::unix::process::CommandExt;
+        // Only returns on failure
+        let err = child.exec();
+        anyhow::bail!("Failed to run '{}': {}", command[0], err)
+    }
+
+    #[cfg(not(unix))]
+    {
+        let status = child.status()?;
+        std::process::exit(status.code().unwrap_or(1))
     }
 }
@@ -1,4 +1,5 @@
 /// Common utilities for dkdc
+pub mod trace;
 pub mod version;
 
 use anyhow::Result;
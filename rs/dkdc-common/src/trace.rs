@@ -0,0 +1,303 @@
+//! Lightweight span tracing
+//!
+//! Tracing is off by default and a disabled span costs one atomic load.
+//! Once enabled, every [`Span`] records its name, optional detail, start
+//! time, duration and thread when dropped. Recorded spans can be written as
+//! JSON lines or in the Chrome trace event format (load the file in
+//! `chrome://tracing` or Perfetto) and summarized into per-name counters.
+//!
+//! Spans are kept in a ring buffer of [`DEFAULT_MAX_EVENTS`] (see
+//! [`set_max_events`]), so a long-running process that leaves tracing on
+//! keeps only its most recent spans instead of growing without bound.
+
+use anyhow::Result;
+use serde_json::json;
+use std::cell::Cell;
+use std::collections::{HashMap, VecDeque};
+use std::fs::File;
+use std::io::{BufWriter, Write};
+use std::path::Path;
+use std::sync::atomic::{AtomicBool, AtomicU64, AtomicUsize, Ordering};
+use std::sync::{Mutex, OnceLock};
+use std::time::Instant;
+
+static ENABLED: AtomicBool = AtomicBool::new(false);
+static EVENTS: Mutex<VecDeque<Event>> = Mutex::new(VecDeque::new());
+static MAX_EVENTS: AtomicUsize = AtomicUsize::new(DEFAULT_MAX_EVENTS);
+static DROPPED: AtomicU64 = AtomicU64::new(0);
+static EPOCH: OnceLock<Instant> = OnceLock::new();
+static NEXT_THREAD: AtomicU64 = AtomicU64::new(1);
+
+thread_local! {
+    static THREAD_ID: Cell<u64> = const { Cell::new(0) };
+}
+
+/// Longest detail string kept per span (SQL is truncated to this)
+const MAX_DETAIL: usize = 200;
+
+/// Spans kept by default; older ones are dropped first
+pub const DEFAULT_MAX_EVENTS: usize = 100_000;
+
+/// A finished span
+#[derive(Debug, Clone)]
+pub struct Event {
+    pub name: &'static str,
+    pub detail: Option<String>,
+    /// Microseconds since tracing was first enabled
+    pub start_us: u64,
+    pub duration_us: u64,
+    pub thread: u64,
+}
+
+/// Aggregated timings for all spans with the same name
+#[derive(Debug, Clone, PartialEq, Eq)]
+pub struct Counter {
+    pub name: &'static str,
+    pub count: u64,
+    pub total_us: u64,
+    pub max_us: u64,
+}
+
+/// Output format for [`write`]
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum TraceFormat {
+    /// One JSON object per span
+    JsonLines,
+    /// Chrome trace event format
+    Chrome,
+}
+
+impl TraceFormat {
+    /// Chrome format for `.json` files, JSON lines otherwise
+    pub fn from_path(path: &Path) -> Self {
+        match path.extension().and_then(|ext| ext.to_str()) {
+            Some("json") => Self::Chrome,
+            _ => Self::JsonLines,
+        }
+    }
+}
+
+pub fn enable() {
+    EPOCH.get_or_init(Instant::now);
+    ENABLED.store(true, Ordering::Release);
+}
+
+pub fn disable() {
+    ENABLED.store(false, Ordering::Release);
+}
+
+pub fn is_enabled() -> bool {
+    ENABLED.load(Ordering::Relaxed)
+}
+
+/// Keep at most `max` spans, dropping the oldest beyond that
+pub fn set_max_events(max: usize) {
+    MAX_EVENTS.store(max, Ordering::Relaxed);
+    if let Ok(mut events) = EVENTS.lock() {
+        trim(&mut events);
+    }
+}
+
+/// Number of spans dropped because the buffer was full
+pub fn dropped() -> u64 {
+    DROPPED.load(Ordering::Relaxed)
+}
+
+fn trim(events: &mut VecDeque<Event>) {
+    let max = MAX_EVENTS.load(Ordering::Relaxed);
+    while events.len() > max {
+        events.pop_front();
+        DROPPED.fetch_add(1, Ordering::Relaxed);
+    }
+}
+
+/// A timed region, recorded when dropped
+#[must_use = "a span records the time until it is dropped"]
+pub struct Span {
+    name: &'static str,
+    detail: Option<String>,
+    start: Option<Instant>,
+}
+
+/// Start a span
+pub fn span(name: &'static str) -> Span {
+    Span {
+        name,
+        detail: None,
+        start: is_enabled().then(Instant::now),
+    }
+}
+
+/// Start a span with a detail string, built only when tracing is enabled
+pub fn span_with<D: AsRef<str>>(name: &'static str, detail: impl FnOnce() -> D) -> Span {
+    if !is_enabled() {
+        return Span {
+            name,
+            detail: None,
+            start: None,
+        };
+    }
+
+    Span {
+        name,
+        detail: Some(compact(detail().as_ref())),
+        start: Some(Instant::now()),
+    }
+}
+
+impl Drop for Span {
+    fn drop(&mut self) {
+        let Some(start) = self.start else {
+            return;
+        };
+        let epoch = *EPOCH.get_or_init(Instant::now);
+
+        let event = Event {
+            name: self.name,
+            detail: self.detail.take(),
+            start_us: start.saturating_duration_since(epoch).as_micros() as u64,
+            duration_us: start.elapsed().as_micros() as u64,
+            thread: thread_id(),
+        };
+
+        if let Ok(mut events) = EVENTS.lock() {
+            events.push_back(event);
+            trim(&mut events);
+        }
+    }
+}
+
+fn thread_id() -> u64 {
+    THREAD_ID.with(|id| {
+        if id.get() == 0 {
+            id.set(NEXT_THREAD.fetch_add(1, Ordering::Relaxed));
+        }
+        id.get()
+    })
+}
+
+/// Collapse whitespace and truncate, so SQL fits on one line
+fn compact(detail: &str) -> String {
+    let mut compacted = detail.split_whitespace().collect::<Vec<_>>().join(" ");
+    if compacted.len() > MAX_DETAIL {
+        let mut end = MAX_DETAIL;
+        while !compacted.is_char_boundary(end) {
+            end -= 1;
+        }
+        compacted.truncate(end);
+        compacted.push('…');
+    }
+    compacted
+}
+
+/// Copy of the recorded spans still in the buffer, oldest first
+pub fn events() -> Vec<Event> {
+    EVENTS
+        .lock()
+        .map(|events| events.iter().cloned().collect())
+        .unwrap_or_default()
+}
+
+/// Drop all recorded spans
+pub fn clear() {
+    if let Ok(mut events) = EVENTS.lock() {
+        events.clear();
+    }
+    DROPPED.store(0, Ordering::Relaxed);
+}
+
+/// Count and total time per span name, slowest total first, over the spans
+/// still in the buffer
+pub fn counters() -> Vec<Counter> {
+    let mut counters: HashMap<&'static str, Counter> = HashMap::new();
+
+    for event in events() {
+        let counter = counters.entry(event.name).or_insert(Counter {
+            name: event.name,
+            count: 0,
+            total_us: 0,
+            max_us: 0,
+        });
+        counter.count += 1;
+        counter.total_us += event.duration_us;
+        counter.max_us = counter.max_us.max(event.duration_us);
+    }
+
+    let mut counters: Vec<Counter> = counters.into_values().collect();
+    counters.sort_by(|a, b| b.total_us.cmp(&a.total_us).then(a.name.cmp(b.name)));
+    counters
+}
+
+/// Write all recorded spans to `path`
+pub fn write(path: &Path, format: TraceFormat) -> Result<()> {
+    let events = events();
+    let mut out = BufWriter::new(File::create(path)?);
+
+    match format {
+        TraceFormat::JsonLines => {
+            for event in &events {
+                let line = json!({
+                    "name": event.name,
+                    "detail": event.detail,
+                    "start_us": event.start_us,
+                    "duration_us": event.duration_us,
+                    "thread": event.thread,
+                });
+                writeln!(out, "{}", line)?;
+            }
+        }
+        TraceFormat::Chrome => {
+            let pid = std::process::id();
+            let trace_events: Vec<_> = events
+                .iter()
+                .map(|event| {
+                    json!({
+                        "name": event.name,
+                        "cat": event.name.split('.').next().unwrap_or(event.name),
+                        "ph": "X",
+                        "ts": event.start_us,
+                        "dur": event.duration_us,
+                        "pid": pid,
+                        "tid": event.thread,
+                        "args": { "detail": event.detail },
+                    })
+                })
+                .collect();
+            serde_json::to_writer(&mut out, &json!({ "traceEvents": trace_events }))?;
+        }
+    }
+
+    out.flush()?;
+    Ok(())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_ring_buffer() {
+        let mut events: VecDeque<Event> = (0..5)
+            .map(|i| Event {
+                name: "test",
+                detail: None,
+                start_us: i,
+                duration_us: 1,
+                thread: 1,
+            })
+            .collect();
+        MAX_EVENTS.store(3, Ordering::Relaxed);
+        trim(&mut events);
+        MAX_EVENTS.store(DEFAULT_MAX_EVENTS, Ordering::Relaxed);
+
+        assert_eq!(events.len(), 3);
+        assert_eq!(events.front().unwrap().start_us, 2);
+        assert!(dropped() >= 2);
+    }
+
+    #[test]
+    fn test_compact() {
+        assert_eq!(compact("SELECT *\n   FROM files"), "SELECT * FROM files");
+        assert_eq!(compact(&"x".repeat(300)).chars().count(), MAX_DETAIL + 1);
+    }
+}
@@ -1,5 +1,6 @@
 use anyhow::Result;
 use serde::{Deserialize, Serialize};
+use std::collections::HashMap;
 use std::fs;
 use std::path::{Path, PathBuf};
 
@@ -10,6 +11,11 @@ pub struct ConfigFile {
     pub general: GeneralConfig,
     #[serde(default)]
     pub dev: DevConfig,
+    #[serde(default)]
+    pub lake: LakeConfig,
+    /// Named lakes, selectable with `DKDC_LAKE` or `dkdc --lake NAME`
+    #[serde(default)]
+    pub lakes: HashMap<String, LakeProfile>,
 }
 
 #[derive(Debug, Clone, Deserialize, Serialize)]
@@ -36,6 +42,108 @@ pub struct DevConfig {
     pub packages: Vec<String>,
 }
 
+/// Settings applied to every lake connection
+#[derive(Debug, Clone, Deserialize, Serialize)]
+pub struct LakeConfig {
+    /// How long (ms) a write keeps retrying while the catalog is locked
+    #[serde(default = "default_busy_timeout_ms")]
+    pub busy_timeout_ms: u64,
+    /// Initial backoff (ms) between write retries, doubled on each attempt
+    #[serde(default = "default_retry_backoff_ms")]
+    pub retry_backoff_ms: u64,
+    /// Compress blobs with zstd before they are encrypted and stored
+    #[serde(default)]
+    pub compression: bool,
+    /// zstd level used when compressing (1-22)
+    #[serde(default = "default_compression_level")]
+    pub compression_level: i32,
+    /// DuckDB worker threads for scans (default: one per core)
+    #[serde(default)]
+    pub threads: Option<usize>,
+    /// DuckDB memory limit, e.g. "4GB" (default: 80% of RAM)
+    #[serde(default)]
+    pub memory_limit: Option<String>,
+    /// Where DuckDB spills to when over the memory limit
+    #[serde(default)]
+    pub temp_directory: Option<String>,
+    /// Cache Parquet footers between queries; lake data files never change
+    #[serde(default = "default_object_cache")]
+    pub object_cache: bool,
+    /// Prefetch whole Parquet data files during scans (helps remote data paths)
+    #[serde(default)]
+    pub prefetch: bool,
+    /// Read files through the local cache of decrypted copies (plaintext on disk)
+    #[serde(default)]
+    pub file_cache: bool,
+    /// Directory of the file cache (default: `<dkdc home>/cache/files`)
+    #[serde(default)]
+    pub file_cache_dir: Option<String>,
+    /// Size the file cache is trimmed to, least recently used first
+    #[serde(default = "default_file_cache_max_bytes")]
+    pub file_cache_max_bytes: u64,
+    /// Keep a full-text index of text files up to date as they are added
+    #[serde(default = "default_search_index")]
+    pub search_index: bool,
+    /// Encrypt blobs with per-blob keys before DuckLake encrypts them again
+    #[serde(default)]
+    pub envelope_encryption: bool,
+    /// Master key of envelope encryption (default: `<dkdc home>/keys/envelope.key`)
+    #[serde(default)]
+    pub envelope_key_file: Option<String>,
+}
+
+impl Default for LakeConfig {
+    fn default() -> Self {
+        Self {
+            busy_timeout_ms: default_busy_timeout_ms(),
+            retry_backoff_ms: default_retry_backoff_ms(),
+            compression: false,
+            compression_level: default_compression_level(),
+            threads: None,
+            memory_limit: None,
+            temp_directory: None,
+            object_cache: default_object_cache(),
+            prefetch: false,
+            file_cache: false,
+            file_cache_dir: None,
+            file_cache_max_bytes: default_file_cache_max_bytes(),
+            search_index: default_search_index(),
+            envelope_encryption: false,
+            envelope_key_file: None,
+        }
+    }
+}
+
+fn default_busy_timeout_ms() -> u64 {
+    30_000
+}
+
+fn default_retry_backoff_ms() -> u64 {
+    10
+}
+
+fn default_compression_level() -> i32 {
+    3
+}
+
+fn default_object_cache() -> bool {
+    true
+}
+
+fn default_file_cache_max_bytes() -> u64 {
+    10 * 1024 * 1024 * 1024
+}
+
+fn default_search_index() -> bool {
+    true
+}
+
+#[derive(Debug, Clone, Deserialize, Serialize)]
+pub struct LakeProfile {
+    /// dkdc home directory for this lake (same meaning as `DKDC_HOME`)
+    pub path: String,
+}
+
 #[derive(Clone)]
 pub struct Config {
     dkdc_dir: PathBuf,
@@ -43,18 +151,34 @@ pub struct Config {
 }
 
 impl Config {
+    /// Resolve the dkdc home directory
+    ///
+    /// In order of precedence: `DKDC_HOME`, the profile named by `DKDC_LAKE`,
+    /// then `~/.dkdc`.
     pub fn new() -> Result<Self> {
-        let home = std::env::var("HOME").or_else(|_| std::env::var("USERPROFILE"))?;
-        let dkdc_dir = PathBuf::from(home).join(".dkdc");
-        let mut config = Self {
-            dkdc_dir,
-            config_file: None,
-        };
+        if let Some(dkdc_dir) = env_var(DKDC_HOME_ENV) {
+            return Ok(Self::from_path(expand_home(&dkdc_dir)));
+        }
 
-        // Try to load config file
-        config.reload_config_file();
+        if let Some(profile) = env_var(DKDC_LAKE_ENV) {
+            return Self::for_profile(&profile);
+        }
 
-        Ok(config)
+        Ok(Self::from_path(default_dkdc_dir()?))
+    }
+
+    /// Resolve a named lake profile from the `[lakes]` section of the config file
+    pub fn for_profile(name: &str) -> Result<Self> {
+        let base = Self::from_path(default_dkdc_dir()?);
+        let profile = base.file().lakes.get(name).cloned().ok_or_else(|| {
+            anyhow::anyhow!(
+                "Lake profile '{}' not found in {}",
+                name,
+                base.config_file_path().display()
+            )
+        })?;
+
+        Ok(Self::from_path(expand_home(&profile.path)))
     }
 
     pub fn from_path(dkdc_dir: PathBuf) -> Self {
@@ -85,6 +209,14 @@ impl Config {
         self.config_file.clone().unwrap_or_default()
     }
 
+    /// Override the `[lake]` settings from the config file
+    pub fn with_lake_settings(mut self, settings: LakeConfig) -> Self {
+        let mut file = self.file();
+        file.lake = settings;
+        self.config_file = Some(file);
+        self
+    }
+
     pub fn dkdc_dir(&self) -> &Path {
         &self.dkdc_dir
     }
@@ -101,6 +233,23 @@ impl Config {
         self.lake_dir().join("data")
     }
 
+    /// Local cache of decrypted files, unless `[lake] file_cache_dir` is set
+    pub fn file_cache_path(&self) -> PathBuf {
+        match self.file().lake.file_cache_dir {
+            Some(dir) => expand_home(&dir),
+            None => self.dkdc_dir.join("cache").join("files"),
+        }
+    }
+
+    /// Master key of envelope encryption, unless `[lake] envelope_key_file`
+    /// is set; kept outside the lake directory, so lake backups don't hold it
+    pub fn envelope_key_path(&self) -> PathBuf {
+        match self.file().lake.envelope_key_file {
+            Some(path) => expand_home(&path),
+            None => self.dkdc_dir.join("keys").join("envelope.key"),
+        }
+    }
+
     pub fn venv_path(&self) -> PathBuf {
         self.dkdc_dir.join("venv")
     }
@@ -141,9 +290,56 @@ impl Config {
     }
 }
 
+fn env_var(name: &str) -> Option<String> {
+    std::env::var(name).ok().filter(|value| !value.is_empty())
+}
+
+fn default_dkdc_dir() -> Result<PathBuf> {
+    let home = std::env::var("HOME").or_else(|_| std::env::var("USERPROFILE"))?;
+    Ok(PathBuf::from(home).join(".dkdc"))
+}
+
+/// Expand a leading `~` to the user's home directory
+pub fn expand_home(path: &str) -> PathBuf {
+    if path == "~" || path.starts_with("~/") {
+        if let Ok(home) = std::env::var("HOME").or_else(|_| std::env::var("USERPROFILE")) {
+            return PathBuf::from(home).join(path[1..].trim_start_matches('/'));
+        }
+    }
+    PathBuf::from(path)
+}
+
+/// Environment variable overriding the dkdc home directory (default `~/.dkdc`)
+pub const DKDC_HOME_ENV: &str = "DKDC_HOME";
+/// Environment variable selecting a lake profile from the config file
+pub const DKDC_LAKE_ENV: &str = "DKDC_LAKE";
+
 pub const SECRETS_TABLE_NAME: &str = "secrets";
 pub const FILES_TABLE_NAME: &str = "files";
 pub const ARCHIVES_TABLE_NAME: &str = "archives";
+/// Content-addressed chunks of large files, shared between versions
+pub const CHUNKS_TABLE_NAME: &str = "chunks";
+/// Full-text index: one row per indexed file (its latest version)
+pub const SEARCH_DOCS_TABLE_NAME: &str = "search_docs";
+/// Full-text index: one row per (term, file) with the term's frequency
+pub const SEARCH_TERMS_TABLE_NAME: &str = "search_terms";
+
+/// Directory index: one row per directory files were written to
+pub const DIRS_TABLE_NAME: &str = "dirs";
+/// Visible names of moved files, pointing at where their versions are stored
+pub const NAMES_TABLE_NAME: &str = "names";
+
+/// Tables that can be read directly (e.g. as Arrow from Python)
+pub const LAKE_TABLES: &[&str] = &[
+    FILES_TABLE_NAME,
+    SECRETS_TABLE_NAME,
+    ARCHIVES_TABLE_NAME,
+    CHUNKS_TABLE_NAME,
+    SEARCH_DOCS_TABLE_NAME,
+    SEARCH_TERMS_TABLE_NAME,
+    DIRS_TABLE_NAME,
+    NAMES_TABLE_NAME,
+];
 
 pub const DUCKLAKE_EXTENSION: &str = "ducklake";
 pub const SQLITE_EXTENSION: &str = "sqlite";
@@ -201,4 +397,26 @@ mod tests {
             "/home/test/.dkdc/dkdclake/metadata.db"
         );
     }
+
+    #[test]
+    fn test_lake_profiles() {
+        let config: ConfigFile = toml::from_str(
+            r#"
+[lakes.work]
+path = "/srv/lakes/work"
+
+[lakes.scratch]
+path = "~/scratch"
+"#,
+        )
+        .unwrap();
+
+        assert_eq!(config.lakes.len(), 2);
+        assert_eq!(config.lakes["work"].path, "/srv/lakes/work");
+        assert_eq!(
+            expand_home("/srv/lakes/work"),
+            PathBuf::from("/srv/lakes/work")
+        );
+        assert!(!expand_home("~/scratch").starts_with("~"));
+    }
 }
@@ -16,12 +16,17 @@ pub struct Dev {
 impl Dev {
     pub fn new() -> Result<Self> {
         let config = Config::new()?;
-        let lake = Lake::with_config(config.clone())?;
-        Ok(Self { config, lake })
+        Self::with_config(config)
     }
 
     pub fn with_config(config: Config) -> Result<Self> {
-        let lake = Lake::with_config(config.clone())?;
+        // The REPL attaches on its own, so an existing lake is only opened
+        // read-only here; a new one is created so the REPL has somewhere to write
+        let lake = if config.metadata_path().exists() {
+            Lake::open_read_only(config.clone())?
+        } else {
+            Lake::with_config(config.clone())?
+        };
         Ok(Self { config, lake })
     }
 
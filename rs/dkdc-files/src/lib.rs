@@ -1,43 +1,97 @@
 use anyhow::Result;
-use dkdc_lake::Lake;
+use dkdc_common::trace;
+use dkdc_lake::files::{FileEntry, ListOptions};
+use dkdc_lake::{AsOf, Lake};
+use std::collections::BTreeMap;
 use std::fs;
 use std::path::Path;
 
-pub fn list_files(path: &str) -> Result<()> {
-    let lake = Lake::new()?;
-    let files = lake.list_files(path)?;
-
-    for file in files {
-        println!("{}", file);
+#[cfg(all(target_os = "linux", feature = "mount"))]
+mod mount;
+
+/// List files under `path`; `long` adds size, update time, versions and hash
+///
+/// Reads metadata only, so listing is independent of file sizes. `at` lists
+/// the files as they were at an earlier snapshot or time.
+pub fn list_files(path: &str, long: bool, options: &ListOptions, at: AsOf) -> Result<()> {
+    let lake = Lake::read_only()?.at(at)?;
+    let entries = lake.list_file_entries(path, options)?;
+
+    for entry in &entries {
+        let name = display_name(path, entry);
+        if long {
+            let hash = entry.filehash.as_deref().unwrap_or("-");
+            println!(
+                "{:>12}  {}  {:>4}  {:<12}  {}",
+                entry.filesize,
+                entry.fileupdated.format("%Y-%m-%d %H:%M"),
+                entry.versions,
+                &hash[..hash.len().min(12)],
+                name
+            );
+        } else {
+            println!("{}", name);
+        }
     }
 
     Ok(())
 }
 
+/// Name relative to the listed path, e.g. `sub/notes.md` for recursive listings
+fn display_name(path: &str, entry: &FileEntry) -> String {
+    let base = path.trim_end_matches('/');
+    match entry.filepath.strip_prefix(base) {
+        Some(rest) if !rest.is_empty() => {
+            format!("{}/{}", rest.trim_start_matches('/'), entry.filename)
+        }
+        _ => entry.filename.clone(),
+    }
+}
+
 pub fn add_file(file: &str, path: Option<&str>) -> Result<()> {
-    let file_path = Path::new(file);
+    add_files(&[file], path)
+}
 
-    if !file_path.exists() {
-        anyhow::bail!("File not found: '{}'", file);
-    }
+/// Add several files, committed together as one snapshot
+pub fn add_files(files: &[&str], path: Option<&str>) -> Result<()> {
+    let mut entries = Vec::with_capacity(files.len());
 
-    if !file_path.is_file() {
-        anyhow::bail!("'{}' is not a file", file);
-    }
+    for file in files {
+        let file_path = Path::new(*file);
+
+        if !file_path.exists() {
+            anyhow::bail!("File not found: '{}'", file);
+        }
+
+        if !file_path.is_file() {
+            anyhow::bail!("'{}' is not a file", file);
+        }
 
-    let filename = file_path
-        .file_name()
-        .and_then(|n| n.to_str())
-        .ok_or_else(|| anyhow::anyhow!("Invalid filename"))?;
+        let filename = file_path
+            .file_name()
+            .and_then(|n| n.to_str())
+            .ok_or_else(|| anyhow::anyhow!("Invalid filename"))?;
+
+        let data = {
+            let _span = trace::span_with("io.read", || *file);
+            fs::read(file_path)?
+        };
+        entries.push((filename, data));
+    }
 
-    let data = fs::read(file_path)?;
     let lake = Lake::new()?;
     let filepath = path.unwrap_or("./files");
 
-    lake.add_file(filepath, filename, &data)?;
+    let batch: Vec<(&str, &str, &[u8])> = entries
+        .iter()
+        .map(|(filename, data)| (filepath, *filename, data.as_slice()))
+        .collect();
+    lake.add_files(&batch)?;
 
-    // Just output the filename that was added, Unix style
-    println!("{}", filename);
+    // Just output the filenames that were added, Unix style
+    for (filename, _) in &entries {
+        println!("{}", filename);
+    }
 
     Ok(())
 }
@@ -48,12 +102,23 @@ pub fn open_file(name: &str, path: &str) -> Result<()> {
     let editor = std::env::var("EDITOR").unwrap_or_else(|_| "vim".to_string());
     let lake = Lake::new()?;
 
-    // Get existing file content if it exists
-    let existing_content = lake.get_file(path, name)?;
-    let initial_content = existing_content
-        .as_ref()
-        .map(|f| f.filedata.as_slice())
-        .unwrap_or(b"");
+    // Get existing file content if it exists; with the file cache enabled
+    // it is mapped from the local copy instead of decrypted again
+    let use_cache = lake.config().file().lake.file_cache;
+    let mapped = if use_cache {
+        lake.get_file_mapped(path, name)?
+    } else {
+        None
+    };
+    let file = if use_cache {
+        None
+    } else {
+        lake.get_file(path, name)?
+    };
+    let existing_content = mapped
+        .as_deref()
+        .or(file.as_ref().map(|f| f.filedata.as_slice()));
+    let initial_content = existing_content.unwrap_or(b"");
 
     // Extract file extension from name
     let extension = Path::new(name)
@@ -102,16 +167,22 @@ pub fn open_file(name: &str, path: &str) -> Result<()> {
     Ok(())
 }
 
-pub fn dump_files(output: &str) -> Result<()> {
+/// Write every file to `output` as of one snapshot
+///
+/// The listing and every read are pinned to the same snapshot, so a dump is
+/// consistent even while other processes write. Passing an earlier `at`
+/// gives a point-in-time restore.
+pub fn dump_files(output: &str, at: AsOf) -> Result<()> {
     let output_path = Path::new(output);
     fs::create_dir_all(output_path)?;
 
-    let lake = Lake::new()?;
+    let lake = Lake::read_only()?.at(at)?;
     let files = lake.list_files("./files")?;
 
     for filename in &files {
         if let Some(file) = lake.get_file("./files", filename)? {
             let file_path = output_path.join(filename);
+            let _span = trace::span_with("io.write", || file_path.display().to_string());
             fs::write(&file_path, &file.filedata)?;
             // Output each file as it's dumped
             println!("{}", file_path.display());
@@ -121,6 +192,133 @@ pub fn dump_files(output: &str) -> Result<()> {
     Ok(())
 }
 
+/// Mount the latest files at `mountpoint` with FUSE until it is unmounted
+///
+/// Read-only unless `writable`, in which case each file written is stored as
+/// one new version when it is closed.
+pub fn mount_files(mountpoint: &str, writable: bool) -> Result<()> {
+    #[cfg(all(target_os = "linux", feature = "mount"))]
+    return mount::mount(mountpoint, writable);
+
+    #[cfg(not(all(target_os = "linux", feature = "mount")))]
+    {
+        let _ = (mountpoint, writable);
+        anyhow::bail!("Mounting requires Linux and the `mount` feature of dkdc-files")
+    }
+}
+
+/// Print lines of text files containing `pattern`, as `path/name:line:text`
+///
+/// Only files the search index lists with every term of the pattern are
+/// read, so most of the lake is never decrypted.
+pub fn grep_files(pattern: &str, ignore_case: bool, path: Option<&str>) -> Result<()> {
+    let lake = Lake::read_only()?;
+    for found in lake.grep(pattern, path, ignore_case)? {
+        println!(
+            "{}/{}:{}:{}",
+            found.filepath, found.filename, found.line_number, found.line
+        );
+    }
+    Ok(())
+}
+
+/// Print the files best matching `query`, most relevant first
+pub fn search_files(query: &str, limit: usize, path: Option<&str>) -> Result<()> {
+    let lake = Lake::read_only()?;
+    for hit in lake.search(query, path, limit)? {
+        println!("{:>8.3}  {}/{}", hit.score, hit.filepath, hit.filename);
+        if let Some(snippet) = &hit.snippet {
+            println!("          {}", snippet);
+        }
+    }
+    Ok(())
+}
+
+/// Rebuild the search index from the latest version of every file
+pub fn reindex_files() -> Result<()> {
+    let lake = Lake::new()?;
+    let indexed = lake.reindex_files()?;
+    println!("Indexed {} files", indexed);
+    Ok(())
+}
+
+/// Delete chunks no file references any more, e.g. after removing large files
+pub fn gc_chunks() -> Result<()> {
+    let lake = Lake::new()?;
+    let deleted = lake.gc_chunks()?;
+    println!("Deleted {} unreferenced chunks", deleted);
+    Ok(())
+}
+
+/// Move or rename a file or directory; only names change, never contents
+pub fn move_path(source: &str, destination: &str) -> Result<()> {
+    let lake = Lake::new()?;
+    let moved = lake.move_path(source, destination)?;
+    println!("Moved {} files", moved);
+    Ok(())
+}
+
+/// Remove a file, or with `recursive` a directory and everything below it
+pub fn remove_path(path: &str, recursive: bool) -> Result<()> {
+    let lake = Lake::new()?;
+    let removed = lake.remove_path(path, recursive)?;
+    println!("Removed {} files", removed);
+    Ok(())
+}
+
+/// Print the directories and files under `path` as a tree
+///
+/// Directories come from the directory index and files from metadata, so
+/// no contents are read.
+pub fn print_tree(path: &str) -> Result<()> {
+    let lake = Lake::read_only()?;
+    let base = path.trim_end_matches('/');
+    let dirs = lake.list_dirs(base, true)?;
+    let options = ListOptions {
+        recursive: true,
+        ..Default::default()
+    };
+    let files = lake.list_file_entries(base, &options)?;
+
+    // Entries per directory: display name, and the full path of directories
+    let mut children: BTreeMap<&str, Vec<(String, Option<&str>)>> = BTreeMap::new();
+    for dir in &dirs {
+        if let Some((parent, name)) = dir.rsplit_once('/') {
+            children
+                .entry(parent)
+                .or_default()
+                .push((format!("{}/", name), Some(dir.as_str())));
+        }
+    }
+    for file in &files {
+        children
+            .entry(file.filepath.as_str())
+            .or_default()
+            .push((file.filename.clone(), None));
+    }
+
+    println!("{}", base);
+    print_children(&children, base, "");
+    Ok(())
+}
+
+fn print_children(children: &BTreeMap<&str, Vec<(String, Option<&str>)>>, dir: &str, prefix: &str) {
+    let Some(entries) = children.get(dir) else {
+        return;
+    };
+    let mut entries: Vec<_> = entries.iter().collect();
+    entries.sort();
+
+    for (i, (name, subdir)) in entries.iter().enumerate() {
+        let last = i + 1 == entries.len();
+        println!("{}{}{}", prefix, if last { "└── " } else { "├── " }, name);
+        if let Some(subdir) = subdir {
+            let prefix = format!("{}{}", prefix, if last { "    " } else { "│   " });
+            print_children(children, subdir, &prefix);
+        }
+    }
+}
+
 pub fn restore_files(directory: &str) -> Result<()> {
     let restore_path = Path::new(directory);
 
@@ -134,18 +332,33 @@ pub fn restore_files(directory: &str) -> Result<()> {
 
     let lake = Lake::new()?;
 
-    for entry in fs::read_dir(restore_path)? {
-        let entry = entry?;
-        let path = entry.path();
-
-        if path.is_file() {
-            if let Some(filename) = path.file_name().and_then(|n| n.to_str()) {
-                let data = fs::read(&path)?;
-                lake.add_file("./files", filename, &data)?;
-                // Output each file as it's restored
-                println!("{}", filename);
+    // Restore everything as one snapshot; files are read inside the
+    // transaction so the whole directory is never held in memory
+    let restored = lake.transaction(|lake| {
+        let mut restored = Vec::new();
+
+        for entry in fs::read_dir(restore_path)? {
+            let entry = entry?;
+            let path = entry.path();
+
+            if path.is_file() {
+                if let Some(filename) = path.file_name().and_then(|n| n.to_str()) {
+                    let data = {
+                        let _span = trace::span_with("io.read", || path.display().to_string());
+                        fs::read(&path)?
+                    };
+                    lake.add_file("./files", filename, &data)?;
+                    restored.push(filename.to_string());
+                }
             }
         }
+
+        Ok(restored)
+    })?;
+
+    // Output each file that was restored
+    for filename in restored {
+        println!("{}", filename);
     }
 
     Ok(())
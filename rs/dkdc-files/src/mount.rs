@@ -0,0 +1,773 @@
+//! FUSE mount of the virtual filesystem (Linux)
+//!
+//! The mount mirrors the lake's `filepath`/`filename` tree: `./files/sub/x.md`
+//! appears as `MOUNTPOINT/files/sub/x.md`, at its latest version. The tree and
+//! all attributes come from `Lake::list_file_entries`, so `ls -l`, `find` and
+//! `stat` never read file contents; it is rebuilt at most once per [`TTL`].
+//!
+//! Reads go through `Lake::read_file_range`, which only fetches the chunks a
+//! range touches. Each open file reads the snapshot that was latest when it
+//! was opened, so versions written meanwhile never mix into it. It keeps a
+//! read-ahead window that doubles while reads stay sequential, and files
+//! whose hash is unchanged since their last open keep their kernel page
+//! cache.
+//!
+//! With `--writable`, files can be created, overwritten, truncated and
+//! deleted. Writes are buffered per open file and stored as a single version
+//! when it is closed; there are no directories of their own, renames or
+//! links.
+
+use anyhow::Result;
+use dkdc_lake::files::{FileEntry, ListOptions};
+use dkdc_lake::{AsOf, Lake};
+use fuser::{
+    FileAttr, FileType, Filesystem, KernelConfig, MountOption, ReplyAttr, ReplyCreate, ReplyData,
+    ReplyDirectory, ReplyEmpty, ReplyEntry, ReplyOpen, ReplyWrite, Request, TimeOrNow,
+};
+use libc::c_int;
+use std::collections::{BTreeMap, HashMap};
+use std::ffi::OsStr;
+use std::os::unix::fs::MetadataExt;
+use std::time::{Duration, Instant, SystemTime};
+
+/// How long the kernel (and the mount) may cache the tree and attributes
+const TTL: Duration = Duration::from_secs(1);
+
+const MIN_READ_AHEAD: u64 = 128 * 1024;
+const MAX_READ_AHEAD: u64 = 8 * 1024 * 1024;
+
+const ROOT: u64 = fuser::FUSE_ROOT_ID;
+
+/// Mount the latest files at `mountpoint`, serving until it is unmounted
+pub fn mount(mountpoint: &str, writable: bool) -> Result<()> {
+    let lake = if writable {
+        Lake::new()?
+    } else {
+        Lake::read_only()?
+    };
+    let owner = std::fs::metadata(mountpoint)?;
+
+    let mut options = vec![
+        MountOption::FSName("dkdc".to_string()),
+        MountOption::Subtype("dkdc".to_string()),
+        MountOption::DefaultPermissions,
+        MountOption::NoAtime,
+    ];
+    if !writable {
+        options.push(MountOption::RO);
+    }
+
+    let fs = LakeFs {
+        lake,
+        writable,
+        uid: owner.uid(),
+        gid: owner.gid(),
+        mounted: SystemTime::now(),
+        tree: Tree::default(),
+        refreshed: None,
+        handles: HashMap::new(),
+        next_handle: 1,
+        opened_hashes: HashMap::new(),
+    };
+
+    eprintln!(
+        "Mounted at {} (unmount with `fusermount -u {}`)",
+        mountpoint, mountpoint
+    );
+    fuser::mount2(fs, mountpoint, &options)?;
+    Ok(())
+}
+
+enum Node {
+    Dir {
+        children: BTreeMap<String, u64>,
+    },
+    File {
+        filepath: String,
+        filename: String,
+        size: u64,
+        modified: SystemTime,
+        filehash: Option<String>,
+    },
+}
+
+/// Inodes of the tree, stable across rebuilds for the same path
+#[derive(Default)]
+struct Tree {
+    nodes: HashMap<u64, Node>,
+    inodes: HashMap<String, u64>,
+}
+
+impl Tree {
+    /// Rebuild the nodes from a recursive listing of `.`
+    fn rebuild(&mut self, entries: Vec<FileEntry>) {
+        self.nodes.clear();
+        self.nodes.insert(
+            ROOT,
+            Node::Dir {
+                children: BTreeMap::new(),
+            },
+        );
+
+        for entry in entries {
+            let dir = entry.filepath.trim_start_matches("./").trim_matches('/');
+            let dir = if dir == "." { "" } else { dir };
+            let Some(parent) = self.ensure_dir(dir) else {
+                continue;
+            };
+            let node = Node::File {
+                filepath: entry.filepath.clone(),
+                filename: entry.filename.clone(),
+                size: entry.filesize.max(0) as u64,
+                modified: entry.fileupdated.into(),
+                filehash: entry.filehash,
+            };
+            self.add_child(parent, &join(dir, &entry.filename), node);
+        }
+    }
+
+    /// Inode of the directory at `path`, creating it and its parents; `None`
+    /// if a file is in the way
+    fn ensure_dir(&mut self, path: &str) -> Option<u64> {
+        let mut ino = ROOT;
+        let mut current = String::new();
+
+        for component in path.split('/').filter(|c| !c.is_empty()) {
+            current = join(&current, component);
+            let child = match self.child(ino, component) {
+                Some(child) => child,
+                None => self.add_child(
+                    ino,
+                    &current,
+                    Node::Dir {
+                        children: BTreeMap::new(),
+                    },
+                )?,
+            };
+            if !matches!(self.nodes.get(&child), Some(Node::Dir { .. })) {
+                return None;
+            }
+            ino = child;
+        }
+
+        Some(ino)
+    }
+
+    /// Add a node under `parent`; the first node added for a name wins
+    fn add_child(&mut self, parent: u64, path: &str, node: Node) -> Option<u64> {
+        let name = path.rsplit('/').next().unwrap_or(path).to_string();
+        if self.child(parent, &name).is_some() {
+            return None;
+        }
+
+        let next = self.inodes.len() as u64 + ROOT + 1;
+        let ino = *self.inodes.entry(path.to_string()).or_insert(next);
+        self.nodes.insert(ino, node);
+        if let Some(Node::Dir { children }) = self.nodes.get_mut(&parent) {
+            children.insert(name, ino);
+        }
+        Some(ino)
+    }
+
+    fn child(&self, parent: u64, name: &str) -> Option<u64> {
+        match self.nodes.get(&parent) {
+            Some(Node::Dir { children }) => children.get(name).copied(),
+            _ => None,
+        }
+    }
+
+    /// Path of a directory, relative to the root
+    fn dir_path(&self, ino: u64) -> Option<&str> {
+        if ino == ROOT {
+            return Some("");
+        }
+        self.inodes
+            .iter()
+            .find(|(_, i)| **i == ino)
+            .map(|(path, _)| path.as_str())
+    }
+}
+
+fn join(dir: &str, name: &str) -> String {
+    if dir.is_empty() {
+        name.to_string()
+    } else {
+        format!("{}/{}", dir, name)
+    }
+}
+
+/// Bytes of a file being read, plus where the next sequential read starts
+struct ReadHandle {
+    filepath: String,
+    filename: String,
+    /// Snapshot at open, which every window is read from
+    snapshot: Option<i64>,
+    start: u64,
+    buffer: Vec<u8>,
+    next: u64,
+    window: u64,
+}
+
+/// Contents of a file open for writing, stored as one version on close
+struct WriteHandle {
+    ino: u64,
+    filepath: String,
+    filename: String,
+    data: Vec<u8>,
+    dirty: bool,
+}
+
+enum Handle {
+    Read(ReadHandle),
+    Write(WriteHandle),
+}
+
+struct LakeFs {
+    lake: Lake,
+    writable: bool,
+    uid: u32,
+    gid: u32,
+    mounted: SystemTime,
+    tree: Tree,
+    refreshed: Option<Instant>,
+    handles: HashMap<u64, Handle>,
+    next_handle: u64,
+    /// Hash of each file when it was last opened, to keep unchanged pages
+    opened_hashes: HashMap<u64, Option<String>>,
+}
+
+impl LakeFs {
+    /// Rebuild the tree if it is older than [`TTL`]
+    fn refresh(&mut self) -> Result<()> {
+        if self.refreshed.is_some_and(|at| at.elapsed() < TTL) {
+            return Ok(());
+        }
+
+        let options = ListOptions {
+            recursive: true,
+            ..Default::default()
+        };
+        let entries = self.lake.list_file_entries(".", &options)?;
+        self.tree.rebuild(entries);
+
+        // Files being written show their pending contents
+        for handle in self.handles.values() {
+            if let Handle::Write(handle) = handle {
+                if let Some(Node::File { size, .. }) = self.tree.nodes.get_mut(&handle.ino) {
+                    *size = handle.data.len() as u64;
+                } else {
+                    let dir = handle.filepath.trim_start_matches("./").trim_matches('/');
+                    let dir = if dir == "." { "" } else { dir };
+                    if let Some(parent) = self.tree.ensure_dir(dir) {
+                        let node = pending_node(handle);
+                        self.tree
+                            .add_child(parent, &join(dir, &handle.filename), node);
+                    }
+                }
+            }
+        }
+
+        self.refreshed = Some(Instant::now());
+        Ok(())
+    }
+
+    fn attr(&self, ino: u64) -> Option<FileAttr> {
+        let (kind, size, modified, perm) = match self.tree.nodes.get(&ino)? {
+            Node::Dir { .. } => (FileType::Directory, 0, self.mounted, 0o555),
+            Node::File { size, modified, .. } => (FileType::RegularFile, *size, *modified, 0o444),
+        };
+        let perm = if self.writable { perm | 0o200 } else { perm };
+
+        Some(FileAttr {
+            ino,
+            size,
+            blocks: size.div_ceil(512),
+            atime: modified,
+            mtime: modified,
+            ctime: modified,
+            crtime: modified,
+            kind,
+            perm,
+            nlink: if kind == FileType::Directory { 2 } else { 1 },
+            uid: self.uid,
+            gid: self.gid,
+            rdev: 0,
+            blksize: 4096,
+            flags: 0,
+        })
+    }
+
+    fn add_handle(&mut self, handle: Handle) -> u64 {
+        let fh = self.next_handle;
+        self.next_handle += 1;
+        self.handles.insert(fh, handle);
+        fh
+    }
+
+    /// Store a write handle's contents as a new version if it changed
+    fn commit(&mut self, fh: u64) -> Result<()> {
+        let Some(Handle::Write(handle)) = self.handles.get_mut(&fh) else {
+            return Ok(());
+        };
+        if !handle.dirty {
+            return Ok(());
+        }
+
+        self.lake
+            .add_file(&handle.filepath, &handle.filename, &handle.data)?;
+        handle.dirty = false;
+        self.refreshed = None;
+        Ok(())
+    }
+
+    fn read_range(&mut self, fh: u64, offset: u64, size: u64) -> Result<Vec<u8>, c_int> {
+        let handle = match self.handles.get_mut(&fh) {
+            Some(Handle::Read(handle)) => handle,
+            Some(Handle::Write(handle)) => {
+                let start = (offset as usize).min(handle.data.len());
+                let end = (start + size as usize).min(handle.data.len());
+                return Ok(handle.data[start..end].to_vec());
+            }
+            None => return Err(libc::EBADF),
+        };
+
+        let end = offset + size;
+        let buffered = handle.start + handle.buffer.len() as u64;
+        if offset < handle.start || end > buffered {
+            // Grow the window while reads are sequential, reset it otherwise
+            handle.window = if offset == handle.next {
+                (handle.window * 2).clamp(MIN_READ_AHEAD, MAX_READ_AHEAD)
+            } else {
+                MIN_READ_AHEAD
+            };
+
+            let fetch_end = end.max(offset + handle.window);
+            handle.buffer = read_at(&mut self.lake, handle, offset, fetch_end)
+                .map_err(io_error)?
+                .ok_or(libc::ENOENT)?;
+            handle.start = offset;
+        }
+
+        let from = (offset - handle.start) as usize;
+        let to = ((end - handle.start) as usize).min(handle.buffer.len());
+        let data = handle.buffer[from.min(to)..to].to_vec();
+        handle.next = offset + data.len() as u64;
+        Ok(data)
+    }
+}
+
+/// Read bytes `start..end` of an open file as of its snapshot, leaving the
+/// lake unpinned for the tree and writes
+fn read_at(lake: &mut Lake, handle: &ReadHandle, start: u64, end: u64) -> Result<Option<Vec<u8>>> {
+    if let Some(snapshot) = handle.snapshot {
+        lake.pin(AsOf::Snapshot(snapshot))?;
+    }
+    let data = lake.read_file_range(&handle.filepath, &handle.filename, start, end);
+    lake.unpin();
+    data
+}
+
+fn pending_node(handle: &WriteHandle) -> Node {
+    Node::File {
+        filepath: handle.filepath.clone(),
+        filename: handle.filename.clone(),
+        size: handle.data.len() as u64,
+        modified: SystemTime::now(),
+        filehash: None,
+    }
+}
+
+fn io_error(e: anyhow::Error) -> c_int {
+    eprintln!("dkdc mount: {:#}", e);
+    libc::EIO
+}
+
+impl Filesystem for LakeFs {
+    fn init(&mut self, _req: &Request<'_>, config: &mut KernelConfig) -> Result<(), c_int> {
+        let _ = config.set_max_readahead(MAX_READ_AHEAD as u32);
+        self.refresh().map_err(io_error)
+    }
+
+    fn lookup(&mut self, _req: &Request<'_>, parent: u64, name: &OsStr, reply: ReplyEntry) {
+        if let Err(e) = self.refresh() {
+            return reply.error(io_error(e));
+        }
+        let attr = name
+            .to_str()
+            .and_then(|name| self.tree.child(parent, name))
+            .and_then(|ino| self.attr(ino));
+
+        match attr {
+            Some(attr) => reply.entry(&TTL, &attr, 0),
+            None => reply.error(libc::ENOENT),
+        }
+    }
+
+    fn getattr(&mut self, _req: &Request<'_>, ino: u64, reply: ReplyAttr) {
+        if let Err(e) = self.refresh() {
+            return reply.error(io_error(e));
+        }
+        match self.attr(ino) {
+            Some(attr) => reply.attr(&TTL, &attr),
+            None => reply.error(libc::ENOENT),
+        }
+    }
+
+    fn readdir(
+        &mut self,
+        _req: &Request<'_>,
+        ino: u64,
+        _fh: u64,
+        offset: i64,
+        mut reply: ReplyDirectory,
+    ) {
+        if let Err(e) = self.refresh() {
+            return reply.error(io_error(e));
+        }
+        let children = match self.tree.nodes.get(&ino) {
+            Some(Node::Dir { children }) => children,
+            Some(Node::File { .. }) => return reply.error(libc::ENOTDIR),
+            None => return reply.error(libc::ENOENT),
+        };
+
+        let mut entries = vec![
+            (ino, FileType::Directory, ".".to_string()),
+            (ino, FileType::Directory, "..".to_string()),
+        ];
+        for (name, child) in children {
+            let kind = match self.tree.nodes.get(child) {
+                Some(Node::Dir { .. }) => FileType::Directory,
+                _ => FileType::RegularFile,
+            };
+            entries.push((*child, kind, name.clone()));
+        }
+
+        for (i, (ino, kind, name)) in entries.into_iter().enumerate().skip(offset as usize) {
+            if reply.add(ino, (i + 1) as i64, kind, name) {
+                break;
+            }
+        }
+        reply.ok();
+    }
+
+    fn open(&mut self, _req: &Request<'_>, ino: u64, flags: i32, reply: ReplyOpen) {
+        let (filepath, filename, filehash) = match self.tree.nodes.get(&ino) {
+            Some(Node::File {
+                filepath,
+                filename,
+                filehash,
+                ..
+            }) => (filepath.clone(), filename.clone(), filehash.clone()),
+            Some(Node::Dir { .. }) => return reply.error(libc::EISDIR),
+            None => return reply.error(libc::ENOENT),
+        };
+
+        if flags & libc::O_ACCMODE == libc::O_RDONLY {
+            let snapshot = match self.lake.resolve_snapshot(AsOf::Latest) {
+                Ok(snapshot) => snapshot,
+                Err(e) => return reply.error(io_error(e)),
+            };
+            // Versions are immutable, so pages of an unchanged hash stay valid
+            let unchanged = filehash.is_some()
+                && self.opened_hashes.insert(ino, filehash.clone()) == Some(filehash);
+            let fh = self.add_handle(Handle::Read(ReadHandle {
+                filepath,
+                filename,
+                snapshot,
+                start: 0,
+                buffer: Vec::new(),
+                next: 0,
+                window: 0,
+            }));
+            let open_flags = if unchanged {
+                fuser::consts::FOPEN_KEEP_CACHE
+            } else {
+                0
+            };
+            return reply.opened(fh, open_flags);
+        }
+
+        if !self.writable {
+            return reply.error(libc::EROFS);
+        }
+        let truncate = flags & libc::O_TRUNC != 0;
+        let data = if truncate {
+            Vec::new()
+        } else {
+            match self.lake.get_file(&filepath, &filename) {
+                Ok(file) => file.map(|f| f.filedata).unwrap_or_default(),
+                Err(e) => return reply.error(io_error(e)),
+            }
+        };
+
+        self.opened_hashes.remove(&ino);
+        let fh = self.add_handle(Handle::Write(WriteHandle {
+            ino,
+            filepath,
+            filename,
+            data,
+            dirty: truncate,
+        }));
+        reply.opened(fh, 0);
+    }
+
+    fn create(
+        &mut self,
+        _req: &Request<'_>,
+        parent: u64,
+        name: &OsStr,
+        _mode: u32,
+        _umask: u32,
+        _flags: i32,
+        reply: ReplyCreate,
+    ) {
+        if !self.writable {
+            return reply.error(libc::EROFS);
+        }
+        let Some(name) = name.to_str() else {
+            return reply.error(libc::EINVAL);
+        };
+        let Some(dir) = self.tree.dir_path(parent).map(str::to_string) else {
+            return reply.error(libc::ENOENT);
+        };
+        if !matches!(self.tree.nodes.get(&parent), Some(Node::Dir { .. })) {
+            return reply.error(libc::ENOTDIR);
+        }
+        if self.tree.child(parent, name).is_some() {
+            return reply.error(libc::EEXIST);
+        }
+
+        let handle = WriteHandle {
+            ino: 0,
+            filepath: if dir.is_empty() {
+                ".".to_string()
+            } else {
+                format!("./{}", dir)
+            },
+            filename: name.to_string(),
+            data: Vec::new(),
+            dirty: true,
+        };
+        let Some(ino) = self
+            .tree
+            .add_child(parent, &join(&dir, name), pending_node(&handle))
+        else {
+            return reply.error(libc::EEXIST);
+        };
+        let fh = self.add_handle(Handle::Write(WriteHandle { ino, ..handle }));
+
+        match self.attr(ino) {
+            Some(attr) => reply.created(&TTL, &attr, 0, fh, 0),
+            None => reply.error(libc::EIO),
+        }
+    }
+
+    fn write(
+        &mut self,
+        _req: &Request<'_>,
+        _ino: u64,
+        fh: u64,
+        offset: i64,
+        data: &[u8],
+        _write_flags: u32,
+        _flags: i32,
+        _lock_owner: Option<u64>,
+        reply: ReplyWrite,
+    ) {
+        let Some(Handle::Write(handle)) = self.handles.get_mut(&fh) else {
+            return reply.error(libc::EBADF);
+        };
+
+        let start = offset as usize;
+        let end = start + data.len();
+        if handle.data.len() < end {
+            handle.data.resize(end, 0);
+        }
+        handle.data[start..end].copy_from_slice(data);
+        handle.dirty = true;
+
+        let (ino, size) = (handle.ino, handle.data.len() as u64);
+        if let Some(Node::File {
+            size: node_size, ..
+        }) = self.tree.nodes.get_mut(&ino)
+        {
+            *node_size = size;
+        }
+        reply.written(data.len() as u32);
+    }
+
+    fn setattr(
+        &mut self,
+        _req: &Request<'_>,
+        ino: u64,
+        _mode: Option<u32>,
+        _uid: Option<u32>,
+        _gid: Option<u32>,
+        size: Option<u64>,
+        _atime: Option<TimeOrNow>,
+        _mtime: Option<TimeOrNow>,
+        _ctime: Option<SystemTime>,
+        fh: Option<u64>,
+        _crtime: Option<SystemTime>,
+        _chgtime: Option<SystemTime>,
+        _bkuptime: Option<SystemTime>,
+        _flags: Option<u32>,
+        reply: ReplyAttr,
+    ) {
+        // Only truncation is meaningful; modes and times come from the lake
+        if let Some(size) = size {
+            if !self.writable {
+                return reply.error(libc::EROFS);
+            }
+
+            let open = fh.filter(|fh| matches!(self.handles.get(fh), Some(Handle::Write(_))));
+            let result = match open {
+                Some(fh) => {
+                    if let Some(Handle::Write(handle)) = self.handles.get_mut(&fh) {
+                        handle.data.resize(size as usize, 0);
+                        handle.dirty = true;
+                    }
+                    Ok(())
+                }
+                // `truncate(2)` on a path: store the new version right away
+                None => match self.tree.nodes.get(&ino) {
+                    Some(Node::File {
+                        filepath, filename, ..
+                    }) => {
+                        let (filepath, filename) = (filepath.clone(), filename.clone());
+                        self.lake.get_file(&filepath, &filename).and_then(|file| {
+                            let mut data = file.map(|f| f.filedata).unwrap_or_default();
+                            data.resize(size as usize, 0);
+                            self.refreshed = None;
+                            self.lake.add_file(&filepath, &filename, &data)
+                        })
+                    }
+                    _ => return reply.error(libc::EISDIR),
+                },
+            };
+            if let Err(e) = result {
+                return reply.error(io_error(e));
+            }
+            if let Some(Node::File {
+                size: node_size, ..
+            }) = self.tree.nodes.get_mut(&ino)
+            {
+                *node_size = size;
+            }
+        }
+
+        match self.attr(ino) {
+            Some(attr) => reply.attr(&TTL, &attr),
+            None => reply.error(libc::ENOENT),
+        }
+    }
+
+    fn read(
+        &mut self,
+        _req: &Request<'_>,
+        _ino: u64,
+        fh: u64,
+        offset: i64,
+        size: u32,
+        _flags: i32,
+        _lock_owner: Option<u64>,
+        reply: ReplyData,
+    ) {
+        match self.read_range(fh, offset.max(0) as u64, size as u64) {
+            Ok(data) => reply.data(&data),
+            Err(errno) => reply.error(errno),
+        }
+    }
+
+    fn flush(
+        &mut self,
+        _req: &Request<'_>,
+        _ino: u64,
+        fh: u64,
+        _lock_owner: u64,
+        reply: ReplyEmpty,
+    ) {
+        // close(2) waits for flush, so write errors reach the caller
+        match self.commit(fh) {
+            Ok(()) => reply.ok(),
+            Err(e) => reply.error(io_error(e)),
+        }
+    }
+
+    fn release(
+        &mut self,
+        _req: &Request<'_>,
+        _ino: u64,
+        fh: u64,
+        _flags: i32,
+        _lock_owner: Option<u64>,
+        _flush: bool,
+        reply: ReplyEmpty,
+    ) {
+        let result = self.commit(fh);
+        self.handles.remove(&fh);
+        match result {
+            Ok(()) => reply.ok(),
+            Err(e) => reply.error(io_error(e)),
+        }
+    }
+
+    fn unlink(&mut self, _req: &Request<'_>, parent: u64, name: &OsStr, reply: ReplyEmpty) {
+        if !self.writable {
+            return reply.error(libc::EROFS);
+        }
+        let Some(ino) = name.to_str().and_then(|name| self.tree.child(parent, name)) else {
+            return reply.error(libc::ENOENT);
+        };
+        let Some(Node::File {
+            filepath, filename, ..
+        }) = self.tree.nodes.get(&ino)
+        else {
+            return reply.error(libc::EISDIR);
+        };
+
+        if let Err(e) = self.lake.delete_file(filepath, filename) {
+            return reply.error(io_error(e));
+        }
+        self.refreshed = None;
+        reply.ok();
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use chrono::Utc;
+
+    #[test]
+    fn test_tree_from_entries() {
+        let entry = |filepath: &str, filename: &str| FileEntry {
+            filepath: filepath.to_string(),
+            filename: filename.to_string(),
+            filesize: 3,
+            fileupdated: Utc::now(),
+            versions: 1,
+            filehash: None,
+        };
+
+        let mut tree = Tree::default();
+        tree.rebuild(vec![
+            entry("./files", "a.md"),
+            entry("./files/sub", "b.md"),
+            entry("./files", "sub"), // shadowed by the directory
+        ]);
+        let files = tree.child(ROOT, "files").unwrap();
+        let sub = tree.child(files, "sub").unwrap();
+        assert!(matches!(tree.nodes[&sub], Node::Dir { .. }));
+        assert!(tree.child(sub, "b.md").is_some());
+
+        // Inodes survive a rebuild
+        let a = tree.child(files, "a.md").unwrap();
+        tree.rebuild(vec![entry("./files", "a.md")]);
+        assert_eq!(
+            tree.child(tree.child(ROOT, "files").unwrap(), "a.md"),
+            Some(a)
+        );
+        assert_eq!(tree.dir_path(sub), Some("files/sub"));
+    }
+}
@@ -0,0 +1,199 @@
+//! Lake hot paths: open, file round trips, listing, secret reads, and file
+//! round trips with and without envelope encryption
+//!
+//! Run with `cargo bench -p dkdc-lake` (or `bin/bench.sh` to record history).
+//! Every benchmark works in its own temporary dkdc home.
+
+use criterion::{criterion_group, criterion_main, BatchSize, BenchmarkId, Criterion, Throughput};
+use dkdc_config::{Config, LakeConfig};
+use dkdc_lake::Lake;
+use std::hint::black_box;
+use tempfile::TempDir;
+
+const FILE_SIZES: &[usize] = &[1 << 10, 1 << 20, 16 << 20];
+const HISTORY_DEPTHS: &[usize] = &[1, 10, 100];
+const SECRET_COUNTS: &[usize] = &[10, 100, 1000];
+/// One file stored whole and one stored as chunks
+const ENVELOPE_SIZES: &[usize] = &[1 << 20, 64 << 20];
+
+fn open_lake(home: &TempDir) -> Lake {
+    Lake::with_config(Config::from_path(home.path().to_path_buf())).expect("open lake")
+}
+
+fn payload(size: usize) -> Vec<u8> {
+    (0..size).map(|i| (i % 251) as u8).collect()
+}
+
+/// Bytes zstd can't shrink, different for each seed, so every write stores
+/// (and encrypts) all of its chunks
+fn noise(size: usize, seed: u64) -> Vec<u8> {
+    let mut state = seed.wrapping_mul(0x9e37_79b9_7f4a_7c15) | 1;
+    (0..size)
+        .map(|_| {
+            state ^= state << 13;
+            state ^= state >> 7;
+            state ^= state << 17;
+            (state >> 24) as u8
+        })
+        .collect()
+}
+
+fn bench_open(c: &mut Criterion) {
+    let mut group = c.benchmark_group("lake_open");
+    group.sample_size(10);
+
+    group.bench_function("cold", |b| {
+        b.iter_batched(
+            || TempDir::new().expect("tempdir"),
+            |home| black_box(open_lake(&home)),
+            BatchSize::PerIteration,
+        )
+    });
+
+    let home = TempDir::new().expect("tempdir");
+    drop(open_lake(&home));
+    group.bench_function("warm", |b| b.iter(|| black_box(open_lake(&home))));
+
+    group.finish();
+}
+
+fn bench_files(c: &mut Criterion) {
+    let home = TempDir::new().expect("tempdir");
+    let lake = open_lake(&home);
+
+    let mut group = c.benchmark_group("files");
+    group.sample_size(10);
+
+    for &size in FILE_SIZES {
+        let data = payload(size);
+        let name = format!("bench-{}.bin", size);
+        group.throughput(Throughput::Bytes(size as u64));
+
+        group.bench_with_input(BenchmarkId::new("add_file", size), &data, |b, data| {
+            b.iter(|| lake.add_file("./bench", &name, data).expect("add"))
+        });
+
+        group.bench_with_input(BenchmarkId::new("get_file", size), &name, |b, name| {
+            b.iter(|| black_box(lake.get_file("./bench", name).expect("get")))
+        });
+    }
+
+    group.finish();
+}
+
+fn bench_list(c: &mut Criterion) {
+    let mut group = c.benchmark_group("list_files");
+    group.sample_size(20);
+
+    for &depth in HISTORY_DEPTHS {
+        let home = TempDir::new().expect("tempdir");
+        let lake = open_lake(&home);
+
+        // 100 files, each written `depth` times
+        for version in 0..depth {
+            let files: Vec<(String, Vec<u8>)> = (0..100)
+                .map(|i| (format!("file-{}.txt", i), payload(1024 + version)))
+                .collect();
+            let batch: Vec<(&str, &str, &[u8])> = files
+                .iter()
+                .map(|(name, data)| ("./files", name.as_str(), data.as_slice()))
+                .collect();
+            lake.add_files(&batch).expect("seed");
+        }
+
+        group.bench_function(BenchmarkId::new("names", depth), |b| {
+            b.iter(|| black_box(lake.list_files("./files").expect("list")))
+        });
+
+        let options = dkdc_lake::files::ListOptions::default();
+        group.bench_function(BenchmarkId::new("entries", depth), |b| {
+            b.iter(|| black_box(lake.list_file_entries("./files", &options).expect("list")))
+        });
+    }
+
+    group.finish();
+}
+
+fn bench_secrets(c: &mut Criterion) {
+    let mut group = c.benchmark_group("secrets_export");
+    group.sample_size(10);
+
+    for &count in SECRET_COUNTS {
+        let home = TempDir::new().expect("tempdir");
+        let lake = open_lake(&home);
+        lake.transaction(|lake| {
+            for i in 0..count {
+                lake.set_secret(&format!("SECRET_{}", i), b"value")?;
+            }
+            Ok(())
+        })
+        .expect("seed");
+
+        // Same access pattern as `dkdc secrets export`
+        group.throughput(Throughput::Elements(count as u64));
+        group.bench_function(BenchmarkId::from_parameter(count), |b| {
+            b.iter(|| {
+                for name in lake.list_secrets().expect("list") {
+                    black_box(lake.get_secret(&name).expect("get"));
+                }
+            })
+        });
+    }
+
+    group.finish();
+}
+
+/// The existing path (DuckLake encryption only) against envelope encryption
+/// on top of it
+fn bench_envelope(c: &mut Criterion) {
+    let mut group = c.benchmark_group("envelope");
+    group.sample_size(10);
+
+    for envelope_encryption in [false, true] {
+        let home = TempDir::new().expect("tempdir");
+        let settings = LakeConfig {
+            envelope_encryption,
+            ..LakeConfig::default()
+        };
+        let config = Config::from_path(home.path().to_path_buf()).with_lake_settings(settings);
+        let lake = Lake::with_config(config).expect("open lake");
+        let mode = if envelope_encryption {
+            "envelope"
+        } else {
+            "ducklake"
+        };
+
+        for &size in ENVELOPE_SIZES {
+            let name = format!("bench-{}.bin", size);
+            group.throughput(Throughput::Bytes(size as u64));
+
+            let mut seed = 0;
+            group.bench_function(BenchmarkId::new(format!("add_file/{}", mode), size), |b| {
+                b.iter_batched(
+                    || {
+                        seed += 1;
+                        noise(size, seed)
+                    },
+                    |data| lake.add_file("./bench", &name, &data).expect("add"),
+                    BatchSize::PerIteration,
+                )
+            });
+
+            group.bench_function(BenchmarkId::new(format!("get_file/{}", mode), size), |b| {
+                b.iter(|| black_box(lake.get_file("./bench", &name).expect("get")))
+            });
+        }
+    }
+
+    group.finish();
+}
+
+criterion_group!(
+    benches,
+    bench_open,
+    bench_files,
+    bench_list,
+    bench_secrets,
+    bench_envelope
+);
+criterion_main!(benches);
@@ -1,81 +1,84 @@
+use crate::schema::{read_or_empty, with_optional_column, Area};
 use crate::Lake;
 use anyhow::Result;
+use dkdc_common::trace;
 use dkdc_config::ARCHIVES_TABLE_NAME;
 use duckdb::params;
 
 impl Lake {
-    pub fn create_archives_table(&self) -> Result<()> {
-        let sql = format!(
-            "CREATE TABLE IF NOT EXISTS {} (
-                filepath VARCHAR,
-                filename VARCHAR,
-                filedata BLOB,
-                filesize BIGINT,
-                fileupdated TIMESTAMP
-            )",
-            ARCHIVES_TABLE_NAME
-        );
-        self.execute(&sql)?;
-        Ok(())
-    }
-
     pub fn add_archive(&self, name: &str, data: &[u8]) -> Result<()> {
+        let _span = trace::span_with("archives.add", || name);
+        self.ensure_schema(Area::Archives)?;
         let sql = format!(
-            "INSERT INTO {} (filepath, filename, filedata, filesize, fileupdated)
-             VALUES (?, ?, ?, ?, ?)",
+            "INSERT INTO {} (filepath, filename, filedata, filesize, fileupdated, filecodec)
+             VALUES (?, ?, ?, ?, ?, ?)",
             ARCHIVES_TABLE_NAME
         );
 
-        let mut stmt = self.prepare(&sql)?;
         use chrono::Utc;
-        stmt.execute(params![
-            "./archives",
-            name,
-            data,
-            data.len() as i64,
-            Utc::now().to_rfc3339(),
-        ])?;
-
-        Ok(())
+        let (stored, codec) = self.encode_blob(name, data)?;
+        self.with_retry(|lake| {
+            let mut stmt = lake.prepare(&sql)?;
+            stmt.execute(params![
+                "./archives",
+                name,
+                stored.as_ref(),
+                data.len() as i64,
+                Utc::now().to_rfc3339(),
+                codec,
+            ])?;
+            Ok(())
+        })
     }
 
     pub fn get_archive(&self, name: &str) -> Result<Option<Vec<u8>>> {
-        let sql = format!(
-            "SELECT filedata
-             FROM {}
-             WHERE filepath = './archives' AND filename = ?
-             ORDER BY fileupdated DESC
-             LIMIT 1",
-            ARCHIVES_TABLE_NAME
-        );
+        let _span = trace::span_with("archives.get", || name);
+        let query = |codec_column: &str| -> Result<Option<Vec<u8>>> {
+            let sql = format!(
+                "SELECT filedata, filesize, {} AS filecodec
+                 FROM {}
+                 WHERE filepath = './archives' AND filename = ?
+                 ORDER BY rowid DESC
+                 LIMIT 1",
+                codec_column,
+                self.table_ref(ARCHIVES_TABLE_NAME)
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![name])?;
 
-        let mut stmt = self.prepare(&sql)?;
-        let mut rows = stmt.query(params![name])?;
+            if let Some(row) = rows.next()? {
+                let (data, size) = (row.get(0)?, row.get(1)?);
+                let codec: Option<String> = row.get(2)?;
+                Ok(Some(self.decode_blob(data, codec.as_deref(), size)?))
+            } else {
+                Ok(None)
+            }
+        };
 
-        if let Some(row) = rows.next()? {
-            Ok(Some(row.get(0)?))
-        } else {
-            Ok(None)
-        }
+        read_or_empty(|| with_optional_column("filecodec", "filecodec", query))
     }
 
     pub fn list_archives(&self) -> Result<Vec<String>> {
-        let sql = format!(
-            "SELECT DISTINCT filename
-             FROM {}
-             WHERE filepath = './archives'
-             ORDER BY filename",
-            ARCHIVES_TABLE_NAME
-        );
+        let _span = trace::span("archives.list");
+        read_or_empty(|| {
+            let sql = format!(
+                "SELECT DISTINCT filename
+                 FROM {}
+                 WHERE filepath = './archives'
+                 ORDER BY filename",
+                self.table_ref(ARCHIVES_TABLE_NAME)
+            );
 
-        let mut stmt = self.prepare(&sql)?;
-        let mut rows = stmt.query([])?;
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query([])?;
 
-        let mut archives = Vec::new();
-        while let Some(row) = rows.next()? {
-            archives.push(row.get(0)?);
-        }
+            let mut archives = Vec::new();
+            while let Some(row) = rows.next()? {
+                archives.push(row.get(0)?);
+            }
 
-        Ok(archives)
+            Ok(archives)
+        })
     }
 }
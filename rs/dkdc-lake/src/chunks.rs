@@ -0,0 +1,292 @@
+//! Content-defined chunking of large files
+//!
+//! Files of at least [`CHUNK_THRESHOLD`] bytes are split with FastCDC, a
+//! rolling gear hash that places chunk boundaries by content, so an edit
+//! only changes the chunks around it. Chunks are stored once in the
+//! `chunks` table, keyed by their SHA-256, and a file version records the
+//! ordered list of its chunk hashes in `filechunks` instead of `filedata`.
+//! A new version of a large file therefore only stores (and encrypts) the
+//! chunks that changed. Reads reassemble the chunks transparently.
+//!
+//! Chunks are compressed (and sealed, with envelope encryption) like any
+//! other blob, on a thread per core: the new chunks of a file are encoded in
+//! batches of `ENCODE_BATCH`, and the chunks of a read are decoded together.
+//! Chunks no longer referenced by any file stay until [`Lake::gc_chunks`]
+//! (`dkdc files gc`) deletes them; earlier snapshots keep them for time
+//! travel either way. Deleting files never does this itself: a writer that
+//! found a chunk already stored commits a reference to it without writing
+//! it again, so a collection running concurrently could delete it from
+//! under the writer.
+
+use crate::envelope;
+use crate::files::file_hash;
+use crate::{run_parallel, Lake};
+use anyhow::Result;
+use dkdc_common::trace;
+use dkdc_config::{CHUNKS_TABLE_NAME, FILES_TABLE_NAME};
+use duckdb::params;
+use std::collections::{HashMap, HashSet};
+
+/// Files smaller than this are stored whole
+pub const CHUNK_THRESHOLD: usize = 4 * 1024 * 1024;
+
+const MIN_CHUNK_SIZE: u32 = 512 * 1024;
+const AVG_CHUNK_SIZE: u32 = 1024 * 1024;
+const MAX_CHUNK_SIZE: u32 = 4 * 1024 * 1024;
+
+/// New chunks encoded at once, which bounds the encoded copies held in
+/// memory to about this many average chunks
+const ENCODE_BATCH: usize = 64;
+
+/// Separator between hashes in `filechunks`
+const SEPARATOR: char = ',';
+
+/// Split data into content-defined chunks
+pub fn split(data: &[u8]) -> Vec<&[u8]> {
+    fastcdc::v2020::FastCDC::new(data, MIN_CHUNK_SIZE, AVG_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        .map(|chunk| &data[chunk.offset..chunk.offset + chunk.length])
+        .collect()
+}
+
+impl Lake {
+    /// Store the chunks of `data` that aren't stored yet, returning the
+    /// `filechunks` value that reassembles it
+    ///
+    /// Must run inside a transaction, together with the file row.
+    pub(crate) fn store_chunks(&self, filename: &str, data: &[u8]) -> Result<String> {
+        let chunks = split(data);
+        let _span = trace::span_with("chunks.store", || format!("{} chunks", chunks.len()));
+        let hashes: Vec<String> = chunks.iter().map(|chunk| file_hash(chunk)).collect();
+
+        let mut stored = self.stored_chunks(&hashes)?;
+        let sql = format!(
+            "INSERT INTO {} (chunkhash, chunkdata, chunksize, chunkcodec) VALUES (?, ?, ?, ?)",
+            CHUNKS_TABLE_NAME
+        );
+        let mut stmt = self.prepare(&sql)?;
+
+        // `insert` also skips chunks repeated within this file
+        let new: Vec<(&String, &[u8])> = hashes
+            .iter()
+            .zip(chunks.iter().copied())
+            .filter(|(hash, _)| stored.insert((*hash).clone()))
+            .collect();
+
+        let (settings, master) = (&self.settings, self.sealing_key()?);
+        for batch in new.chunks(ENCODE_BATCH) {
+            let encoded = run_parallel(batch.to_vec(), |(_, chunk)| {
+                envelope::encode(filename, chunk, settings, master)
+            })?;
+            for ((hash, chunk), (bytes, codec)) in batch.iter().zip(encoded) {
+                stmt.execute(params![hash, bytes.as_ref(), chunk.len() as i64, codec])?;
+            }
+        }
+
+        Ok(hashes.join(&SEPARATOR.to_string()))
+    }
+
+    /// Reassemble a file from its `filechunks` value
+    pub(crate) fn read_chunks(&self, filechunks: &str, filesize: i64) -> Result<Vec<u8>> {
+        let hashes: Vec<&str> = filechunks.split(SEPARATOR).collect();
+        let _span = trace::span_with("chunks.read", || format!("{} chunks", hashes.len()));
+        let chunks = self.fetch_chunks(&hashes)?;
+
+        let mut data = Vec::with_capacity(filesize.max(0) as usize);
+        for hash in hashes {
+            data.extend_from_slice(chunk(&chunks, hash)?);
+        }
+
+        if data.len() as i64 != filesize {
+            anyhow::bail!(
+                "Reassembled {} bytes from chunks, expected {}",
+                data.len(),
+                filesize
+            );
+        }
+        Ok(data)
+    }
+
+    /// Read bytes `start..end` of a chunked file, fetching only the chunks
+    /// that overlap the range
+    pub(crate) fn read_chunk_range(
+        &self,
+        filechunks: &str,
+        start: u64,
+        end: u64,
+    ) -> Result<Vec<u8>> {
+        let hashes: Vec<&str> = filechunks.split(SEPARATOR).collect();
+        let _span = trace::span_with("chunks.read_range", || format!("{}..{}", start, end));
+
+        // Chunk sizes come from a metadata-only query
+        let sql = format!(
+            "SELECT DISTINCT chunkhash, chunksize FROM {} WHERE chunkhash IN ({})",
+            self.table_ref(CHUNKS_TABLE_NAME),
+            hash_list(&hashes)?
+        );
+        let mut stmt = self.prepare(&sql)?;
+        let mut rows = stmt.query([])?;
+        let mut sizes = HashMap::new();
+        while let Some(row) = rows.next()? {
+            sizes.insert(row.get::<_, String>(0)?, row.get::<_, i64>(1)? as u64);
+        }
+
+        // (hash, offset of the chunk in the file) for chunks overlapping the range
+        let mut overlapping = Vec::new();
+        let mut offset = 0;
+        for hash in &hashes {
+            let size = *chunk(&sizes, hash)?;
+            if offset < end && offset + size > start {
+                overlapping.push((*hash, offset));
+            }
+            offset += size;
+        }
+
+        let needed: Vec<&str> = overlapping.iter().map(|(hash, _)| *hash).collect();
+        let chunks = self.fetch_chunks(&needed)?;
+
+        let mut data = Vec::with_capacity(end.saturating_sub(start) as usize);
+        for (hash, offset) in overlapping {
+            let chunk = chunk(&chunks, hash)?;
+            let from = start.saturating_sub(offset) as usize;
+            let to = (end - offset).min(chunk.len() as u64) as usize;
+            data.extend_from_slice(&chunk[from..to]);
+        }
+        Ok(data)
+    }
+
+    /// Decoded contents of the given chunks, by hash
+    fn fetch_chunks(&self, hashes: &[&str]) -> Result<HashMap<String, Vec<u8>>> {
+        let mut chunks = HashMap::new();
+        if hashes.is_empty() {
+            return Ok(chunks);
+        }
+
+        let sql = format!(
+            "SELECT chunkhash, chunkdata, chunksize, chunkcodec
+             FROM {}
+             WHERE chunkhash IN ({})",
+            self.table_ref(CHUNKS_TABLE_NAME),
+            hash_list(hashes)?
+        );
+        let mut stmt = self.prepare(&sql)?;
+        let mut rows = stmt.query([])?;
+
+        let mut stored: Vec<(String, Vec<u8>, i64, Option<String>)> = Vec::new();
+        while let Some(row) = rows.next()? {
+            stored.push((row.get(0)?, row.get(1)?, row.get(2)?, row.get(3)?));
+        }
+
+        let sealed = stored
+            .iter()
+            .any(|(_, _, _, codec)| envelope::is_sealed(codec.as_deref()));
+        let master = self.opening_key(sealed)?;
+        let decoded = run_parallel(stored, |(hash, data, size, codec)| {
+            let data = envelope::decode(data, codec.as_deref(), size, master)?;
+            Ok((hash, data))
+        })?;
+        chunks.extend(decoded);
+        Ok(chunks)
+    }
+
+    /// Delete chunks no file references any more, returning how many
+    ///
+    /// Run this as maintenance, while nothing is writing to the lake: a
+    /// concurrent write can reference a chunk it saw stored, which this
+    /// would delete if it isn't referenced yet.
+    pub fn gc_chunks(&self) -> Result<usize> {
+        let _span = trace::span("chunks.gc");
+        let sql = format!(
+            "DELETE FROM {} WHERE chunkhash NOT IN (
+                SELECT unnest(string_split(filechunks, '{}'))
+                FROM {}
+                WHERE filechunks IS NOT NULL
+             )",
+            CHUNKS_TABLE_NAME, SEPARATOR, FILES_TABLE_NAME
+        );
+
+        self.with_retry(|lake| {
+            let mut stmt = lake.prepare(&sql)?;
+            Ok(stmt.execute([])?)
+        })
+    }
+
+    /// Which of `hashes` are already in the chunk store
+    fn stored_chunks(&self, hashes: &[String]) -> Result<HashSet<String>> {
+        let hashes: Vec<&str> = hashes.iter().map(String::as_str).collect();
+        let sql = format!(
+            "SELECT DISTINCT chunkhash FROM {} WHERE chunkhash IN ({})",
+            CHUNKS_TABLE_NAME,
+            hash_list(&hashes)?
+        );
+
+        let mut stmt = self.prepare(&sql)?;
+        let mut rows = stmt.query([])?;
+
+        let mut stored = HashSet::new();
+        while let Some(row) = rows.next()? {
+            stored.insert(row.get(0)?);
+        }
+        Ok(stored)
+    }
+}
+
+fn chunk<'a, T>(chunks: &'a HashMap<String, T>, hash: &str) -> Result<&'a T> {
+    chunks
+        .get(hash)
+        .ok_or_else(|| anyhow::anyhow!("Missing chunk {}", hash))
+}
+
+/// Hashes as a SQL list of literals; they are checked to be hex first
+fn hash_list(hashes: &[&str]) -> Result<String> {
+    if let Some(bad) = hashes
+        .iter()
+        .find(|hash| hash.is_empty() || !hash.bytes().all(|b| b.is_ascii_hexdigit()))
+    {
+        anyhow::bail!("Invalid chunk hash '{}'", bad);
+    }
+
+    let unique: HashSet<&str> = hashes.iter().copied().collect();
+    Ok(unique
+        .into_iter()
+        .map(|hash| format!("'{}'", hash))
+        .collect::<Vec<_>>()
+        .join(", "))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_edit_changes_few_chunks() {
+        // Deterministic pseudo-random data, so boundaries come from content
+        let mut state = 0x2545_f491_4f6c_dd1d_u64;
+        let original: Vec<u8> = (0..16 * 1024 * 1024)
+            .map(|_| {
+                state ^= state << 13;
+                state ^= state >> 7;
+                state ^= state << 17;
+                state as u8
+            })
+            .collect();
+
+        let mut edited = original.clone();
+        edited.splice(8_000_000..8_000_000, b"one inserted line\n".iter().copied());
+
+        let before: HashSet<String> = split(&original).iter().map(|c| file_hash(c)).collect();
+        let after = split(&edited);
+        assert_eq!(after.concat(), edited);
+
+        let changed = after
+            .iter()
+            .filter(|chunk| !before.contains(&file_hash(chunk)))
+            .count();
+        assert!(
+            changed <= 3,
+            "{} of {} chunks changed",
+            changed,
+            after.len()
+        );
+        assert!(hash_list(&["abc", "../x"]).is_err());
+    }
+}
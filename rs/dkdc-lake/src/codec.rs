@@ -0,0 +1,109 @@
+//! Optional, transparent compression of stored blobs
+//!
+//! With `[lake] compression` (off by default), blobs are compressed with zstd
+//! before DuckLake encrypts them, so storage and encryption cost scale with
+//! the compressed size. The codec is recorded per row in `filecodec` (`NULL`
+//! for raw bytes) and `filesize` stays the uncompressed size. Reads decode
+//! whatever codec a row has, whatever the setting. Small blobs and data that
+//! is already compressed (archives, images, media) are stored raw, as is
+//! anything zstd can't shrink by at least an eighth.
+
+use anyhow::Result;
+use dkdc_config::LakeConfig;
+use std::borrow::Cow;
+
+/// Codec name recorded for zstd-compressed rows
+pub const ZSTD: &str = "zstd";
+
+/// Below this, frame overhead eats most of the savings
+const MIN_COMPRESS_SIZE: usize = 256;
+
+/// Extensions of formats that are compressed already
+const COMPRESSED_EXTENSIONS: &[&str] = &[
+    "7z", "avif", "br", "bz2", "docx", "gif", "gz", "heic", "jpeg", "jpg", "lz4", "mkv", "mov",
+    "mp3", "mp4", "ogg", "parquet", "pdf", "png", "rar", "tgz", "webm", "webp", "woff2", "xlsx",
+    "xz", "zip", "zst",
+];
+
+/// Leading bytes of formats that are compressed already
+const COMPRESSED_MAGIC: &[&[u8]] = &[
+    b"PK\x03\x04",         // zip (and docx, xlsx, jar, ...)
+    b"\x1f\x8b",           // gzip
+    b"\x28\xb5\x2f\xfd",   // zstd
+    b"\xfd7zXZ\x00",       // xz
+    b"BZh",                // bzip2
+    b"7z\xbc\xaf\x27\x1c", // 7z
+    b"\x89PNG",            // png
+    b"\xff\xd8\xff",       // jpeg
+    b"GIF8",               // gif
+    b"PAR1",               // parquet
+];
+
+/// Encode a blob for storage, returning the stored bytes and their codec
+///
+/// `name` is only used to recognize already-compressed formats.
+pub fn encode<'a>(
+    name: &str,
+    data: &'a [u8],
+    settings: &LakeConfig,
+) -> Result<(Cow<'a, [u8]>, Option<&'static str>)> {
+    if !settings.compression || data.len() < MIN_COMPRESS_SIZE || is_compressed(name, data) {
+        return Ok((Cow::Borrowed(data), None));
+    }
+
+    let compressed = zstd::bulk::compress(data, settings.compression_level)?;
+    if compressed.len() > data.len() - data.len() / 8 {
+        return Ok((Cow::Borrowed(data), None));
+    }
+
+    Ok((Cow::Owned(compressed), Some(ZSTD)))
+}
+
+/// Decode stored bytes; `size` is the uncompressed size recorded with them
+pub fn decode(data: Vec<u8>, codec: Option<&str>, size: i64) -> Result<Vec<u8>> {
+    match codec {
+        None => Ok(data),
+        Some(ZSTD) => Ok(zstd::bulk::decompress(&data, size.max(0) as usize)?),
+        Some(other) => anyhow::bail!("Unknown codec '{}'", other),
+    }
+}
+
+fn is_compressed(name: &str, data: &[u8]) -> bool {
+    let extension = name
+        .rsplit_once('.')
+        .map(|(_, extension)| extension.to_ascii_lowercase());
+    if let Some(extension) = extension {
+        if COMPRESSED_EXTENSIONS.contains(&extension.as_str()) {
+            return true;
+        }
+    }
+
+    COMPRESSED_MAGIC.iter().any(|magic| data.starts_with(magic))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_codec_selection() {
+        let settings = LakeConfig {
+            compression: true,
+            ..LakeConfig::default()
+        };
+        let text = "key = \"value\"\n".repeat(100);
+
+        let (stored, codec) = encode("config.toml", text.as_bytes(), &settings).unwrap();
+        assert_eq!(codec, Some(ZSTD));
+        assert!(stored.len() < text.len());
+        let decoded = decode(stored.into_owned(), codec, text.len() as i64).unwrap();
+        assert_eq!(decoded, text.as_bytes());
+
+        let (_, codec) = encode("notes.zip", text.as_bytes(), &settings).unwrap();
+        assert_eq!(codec, None);
+        let (_, codec) = encode("short.txt", b"tiny", &settings).unwrap();
+        assert_eq!(codec, None);
+        let (_, codec) = encode("config.toml", text.as_bytes(), &LakeConfig::default()).unwrap();
+        assert_eq!(codec, None);
+    }
+}
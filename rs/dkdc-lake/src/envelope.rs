@@ -0,0 +1,422 @@
+//! Client-side envelope encryption of stored blobs
+//!
+//! With `[lake] envelope_encryption`, blobs are encrypted before they reach
+//! DuckLake, which then encrypts them again. Every blob gets a fresh random
+//! 256-bit data key, which is sealed with the master key and stored in the
+//! blob's header. The master key lives in a key file outside the lake
+//! directory (see `Config::envelope_key_path`), so the catalog, which holds
+//! DuckLake's keys, isn't enough to read the lake on its own.
+//!
+//! The payload is sealed with AES-256-GCM in segments of [`SEGMENT_SIZE`]
+//! bytes. A segment's nonce is its index plus a flag marking the last one,
+//! so segments can be sealed and opened independently, in parallel, and a
+//! blob that was reordered, truncated or extended fails to open. Blobs of
+//! at least [`PARALLEL_MIN_SIZE`] use a thread per core; smaller blobs
+//! (e.g. the chunks of large files) are sealed whole, and callers process
+//! several at once instead.
+//!
+//! Layout of a sealed blob:
+//!
+//! ```text
+//! b"dkdcenv1"                      magic
+//! nonce, data key, tag             12 + 32 + 16 bytes, sealed with the master key
+//! segment 0, tag                   SEGMENT_SIZE + 16 bytes
+//! ...
+//! last segment, tag                up to SEGMENT_SIZE + 16 bytes
+//! ```
+//!
+//! Blobs are compressed (see `codec`) before they are sealed; the row's
+//! `filecodec` records both steps, e.g. `zstd+envelope`.
+
+use crate::codec;
+use crate::Lake;
+use anyhow::Result;
+use dkdc_config::LakeConfig;
+use ring::aead::{Aad, LessSafeKey, Nonce, UnboundKey, AES_256_GCM, NONCE_LEN};
+use ring::rand::{SecureRandom, SystemRandom};
+use std::borrow::Cow;
+use std::fs;
+use std::io::Write;
+use std::path::Path;
+
+/// Codec of sealed blobs that weren't compressed
+pub const ENVELOPE: &str = "envelope";
+/// Codec of blobs compressed with zstd, then sealed
+pub const ZSTD_ENVELOPE: &str = "zstd+envelope";
+
+const MAGIC: &[u8; 8] = b"dkdcenv1";
+const KEY_LEN: usize = 32;
+const TAG_LEN: usize = 16;
+/// Magic, nonce, and the sealed data key with its tag
+const HEADER_LEN: usize = MAGIC.len() + NONCE_LEN + KEY_LEN + TAG_LEN;
+
+/// Plaintext bytes per sealed segment
+pub const SEGMENT_SIZE: usize = 256 * 1024;
+/// Blobs at least this large are sealed and opened on a thread per core
+pub const PARALLEL_MIN_SIZE: usize = 8 * 1024 * 1024;
+
+/// Key that seals the per-blob data keys
+pub struct MasterKey(LessSafeKey);
+
+impl MasterKey {
+    /// Read the key file at `path`, first creating it with a random key if
+    /// it doesn't exist and `create` is set
+    pub fn load(path: &Path, create: bool) -> Result<Self> {
+        if !path.exists() {
+            if !create {
+                anyhow::bail!(
+                    "Envelope encryption key not found at {}; blobs sealed with it can't be read",
+                    path.display()
+                );
+            }
+            create_key_file(path)?;
+        }
+
+        let bytes = fs::read(path)?;
+        let key: [u8; KEY_LEN] = bytes.as_slice().try_into().map_err(|_| {
+            anyhow::anyhow!(
+                "Envelope encryption key {} is not {} bytes",
+                path.display(),
+                KEY_LEN
+            )
+        })?;
+        Ok(Self(aead_key(&key)?))
+    }
+}
+
+/// Write a new random key to `path`, readable by the owner only
+///
+/// The key is written to a temporary file and hard-linked into place, which
+/// fails rather than replaces if another process created the key first, so
+/// no blob is ever sealed with a key that gets overwritten.
+fn create_key_file(path: &Path) -> Result<()> {
+    if let Some(parent) = path.parent() {
+        fs::create_dir_all(parent)?;
+    }
+    let mut key = [0u8; KEY_LEN];
+    random(&mut key)?;
+
+    let temp = path.with_extension(format!("tmp.{}", std::process::id()));
+    let mut options = fs::OpenOptions::new();
+    options.write(true).create(true).truncate(true);
+    #[cfg(unix)]
+    {
+        use std::os::unix::fs::OpenOptionsExt;
+        options.mode(0o600);
+    }
+    {
+        let mut file = options.open(&temp)?;
+        file.write_all(&key)?;
+        file.sync_all()?;
+    }
+
+    let linked = fs::hard_link(&temp, path);
+    fs::remove_file(&temp)?;
+    match linked {
+        Err(e) if e.kind() != std::io::ErrorKind::AlreadyExists => Err(e.into()),
+        _ => Ok(()),
+    }
+}
+
+/// Seal `data` under a fresh data key, itself sealed with `master`
+pub fn seal(master: &MasterKey, data: &[u8]) -> Result<Vec<u8>> {
+    let mut data_key = [0u8; KEY_LEN];
+    random(&mut data_key)?;
+    let mut nonce = [0u8; NONCE_LEN];
+    random(&mut nonce)?;
+
+    let segments = data.len().div_ceil(SEGMENT_SIZE).max(1);
+    let mut sealed = vec![0u8; HEADER_LEN + data.len() + segments * TAG_LEN];
+    let (header, body) = sealed.split_at_mut(HEADER_LEN);
+
+    header[..MAGIC.len()].copy_from_slice(MAGIC);
+    let (nonce_out, wrapped) = header[MAGIC.len()..].split_at_mut(NONCE_LEN);
+    nonce_out.copy_from_slice(&nonce);
+    let (key_out, tag_out) = wrapped.split_at_mut(KEY_LEN);
+    key_out.copy_from_slice(&data_key);
+    let tag = master
+        .0
+        .seal_in_place_separate_tag(
+            Nonce::assume_unique_for_key(nonce),
+            Aad::from(MAGIC),
+            key_out,
+        )
+        .map_err(|_| anyhow::anyhow!("Failed to seal data key"))?;
+    tag_out.copy_from_slice(tag.as_ref());
+
+    let key = aead_key(&data_key)?;
+    let header: &[u8] = header;
+    let seal_segment = |index: usize, segment: &mut [u8]| -> Result<()> {
+        let (text, tag_out) = segment.split_at_mut(segment.len() - TAG_LEN);
+        let start = index * SEGMENT_SIZE;
+        text.copy_from_slice(&data[start..start + text.len()]);
+        let tag = key
+            .seal_in_place_separate_tag(
+                segment_nonce(index, index + 1 == segments),
+                Aad::from(header),
+                text,
+            )
+            .map_err(|_| anyhow::anyhow!("Failed to seal segment {}", index))?;
+        tag_out.copy_from_slice(tag.as_ref());
+        Ok(())
+    };
+    for_each_segment(body, data.len() >= PARALLEL_MIN_SIZE, seal_segment)?;
+
+    Ok(sealed)
+}
+
+/// Open a blob sealed by [`seal`], verifying every segment
+pub fn open(master: &MasterKey, mut sealed: Vec<u8>) -> Result<Vec<u8>> {
+    if sealed.len() < HEADER_LEN + TAG_LEN || !sealed.starts_with(MAGIC) {
+        anyhow::bail!("Not an envelope-encrypted blob");
+    }
+
+    {
+        let (header, body) = sealed.split_at_mut(HEADER_LEN);
+        let nonce: [u8; NONCE_LEN] = header[MAGIC.len()..MAGIC.len() + NONCE_LEN].try_into()?;
+        let mut wrapped = header[MAGIC.len() + NONCE_LEN..].to_vec();
+        let data_key = master
+            .0
+            .open_in_place(
+                Nonce::assume_unique_for_key(nonce),
+                Aad::from(MAGIC),
+                &mut wrapped,
+            )
+            .map_err(|_| {
+                anyhow::anyhow!("Failed to open data key; was the blob sealed with another key?")
+            })?;
+        let key = aead_key(&<[u8; KEY_LEN]>::try_from(&*data_key)?)?;
+
+        let header: &[u8] = header;
+        let segments = body.len().div_ceil(SEGMENT_SIZE + TAG_LEN);
+        let open_segment = |index: usize, segment: &mut [u8]| -> Result<()> {
+            key.open_in_place(
+                segment_nonce(index, index + 1 == segments),
+                Aad::from(header),
+                segment,
+            )
+            .map_err(|_| {
+                anyhow::anyhow!("Envelope-encrypted blob is corrupt at segment {}", index)
+            })?;
+            Ok(())
+        };
+        let parallel = body.len() >= PARALLEL_MIN_SIZE;
+        for_each_segment(body, parallel, open_segment)?;
+    }
+
+    // Drop the header and tags, leaving the plaintext segments in order
+    let mut written = 0;
+    let mut read = HEADER_LEN;
+    while read < sealed.len() {
+        let end = (read + SEGMENT_SIZE + TAG_LEN).min(sealed.len());
+        let len = end - read - TAG_LEN;
+        sealed.copy_within(read..read + len, written);
+        written += len;
+        read = end;
+    }
+    sealed.truncate(written);
+
+    Ok(sealed)
+}
+
+/// Encode a blob for storage: compress it (see `codec`), then seal it if
+/// `master` is given
+pub fn encode<'a>(
+    name: &str,
+    data: &'a [u8],
+    settings: &LakeConfig,
+    master: Option<&MasterKey>,
+) -> Result<(Cow<'a, [u8]>, Option<&'static str>)> {
+    let (stored, codec) = codec::encode(name, data, settings)?;
+    let Some(master) = master else {
+        return Ok((stored, codec));
+    };
+
+    let codec = match codec {
+        Some(_) => ZSTD_ENVELOPE,
+        None => ENVELOPE,
+    };
+    Ok((Cow::Owned(seal(master, &stored)?), Some(codec)))
+}
+
+/// Decode a stored blob, opening it with `master` first if it is sealed
+pub fn decode(
+    data: Vec<u8>,
+    codec: Option<&str>,
+    size: i64,
+    master: Option<&MasterKey>,
+) -> Result<Vec<u8>> {
+    if !is_sealed(codec) {
+        return codec::decode(data, codec, size);
+    }
+
+    let master = master
+        .ok_or_else(|| anyhow::anyhow!("Blob is envelope-encrypted, but no key was given"))?;
+    let inner = codec.and_then(|codec| codec.strip_suffix("+envelope"));
+    codec::decode(open(master, data)?, inner, size)
+}
+
+/// Whether blobs stored with `codec` are sealed
+pub fn is_sealed(codec: Option<&str>) -> bool {
+    matches!(codec, Some(ENVELOPE | ZSTD_ENVELOPE))
+}
+
+impl Lake {
+    /// Encode a blob with this lake's settings, sealing it if envelope
+    /// encryption is on
+    pub(crate) fn encode_blob<'a>(
+        &self,
+        name: &str,
+        data: &'a [u8],
+    ) -> Result<(Cow<'a, [u8]>, Option<&'static str>)> {
+        encode(name, data, &self.settings, self.sealing_key()?)
+    }
+
+    /// Decode a stored blob, opening it if it is sealed
+    pub(crate) fn decode_blob(
+        &self,
+        data: Vec<u8>,
+        codec: Option<&str>,
+        size: i64,
+    ) -> Result<Vec<u8>> {
+        decode(data, codec, size, self.opening_key(is_sealed(codec))?)
+    }
+
+    /// Key to seal new blobs with, if `[lake] envelope_encryption` is on;
+    /// the key file is created on first use
+    pub(crate) fn sealing_key(&self) -> Result<Option<&MasterKey>> {
+        if !self.settings.envelope_encryption {
+            return Ok(None);
+        }
+        self.master_key(true).map(Some)
+    }
+
+    /// Key to open sealed blobs with, whether or not new blobs are sealed
+    pub(crate) fn opening_key(&self, sealed: bool) -> Result<Option<&MasterKey>> {
+        if !sealed {
+            return Ok(None);
+        }
+        self.master_key(false).map(Some)
+    }
+
+    /// The master key, read once per handle
+    fn master_key(&self, create: bool) -> Result<&MasterKey> {
+        if let Some(key) = self.master_key.get() {
+            return Ok(key);
+        }
+        let key = MasterKey::load(&self.config.envelope_key_path(), create)?;
+        Ok(self.master_key.get_or_init(|| key))
+    }
+}
+
+/// Run `op` on each `(index, segment)` of a sealed body, on a thread per
+/// core if `parallel`
+fn for_each_segment(
+    body: &mut [u8],
+    parallel: bool,
+    op: impl Fn(usize, &mut [u8]) -> Result<()> + Sync,
+) -> Result<()> {
+    let mut segments: Vec<(usize, &mut [u8])> = body
+        .chunks_mut(SEGMENT_SIZE + TAG_LEN)
+        .enumerate()
+        .collect();
+    let threads = if parallel {
+        std::thread::available_parallelism()
+            .map(|n| n.get())
+            .unwrap_or(4)
+    } else {
+        1
+    };
+    if threads == 1 || segments.len() < 2 {
+        return segments
+            .into_iter()
+            .try_for_each(|(index, segment)| op(index, segment));
+    }
+
+    let op = &op;
+    let per_thread = segments.len().div_ceil(threads);
+    std::thread::scope(|s| {
+        let workers: Vec<_> = segments
+            .chunks_mut(per_thread)
+            .map(|batch| {
+                s.spawn(move || {
+                    batch
+                        .iter_mut()
+                        .try_for_each(|(index, segment)| op(*index, segment))
+                })
+            })
+            .collect();
+        workers
+            .into_iter()
+            .map(|worker| worker.join().expect("segment worker panicked"))
+            .collect()
+    })
+}
+
+/// Segment nonces count up from zero, with the last byte marking the final
+/// segment, so a blob cut at a segment boundary fails to open
+fn segment_nonce(index: usize, last: bool) -> Nonce {
+    let mut nonce = [0u8; NONCE_LEN];
+    nonce[..8].copy_from_slice(&(index as u64).to_be_bytes());
+    nonce[NONCE_LEN - 1] = last as u8;
+    Nonce::assume_unique_for_key(nonce)
+}
+
+fn aead_key(key: &[u8; KEY_LEN]) -> Result<LessSafeKey> {
+    let key = UnboundKey::new(&AES_256_GCM, key)
+        .map_err(|_| anyhow::anyhow!("Invalid envelope encryption key"))?;
+    Ok(LessSafeKey::new(key))
+}
+
+pub(crate) fn random(buf: &mut [u8]) -> Result<()> {
+    SystemRandom::new()
+        .fill(buf)
+        .map_err(|_| anyhow::anyhow!("Failed to generate random bytes"))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_seal_and_open() {
+        let dir = tempfile::tempdir().unwrap();
+        let path = dir.path().join("keys").join("envelope.key");
+        assert!(MasterKey::load(&path, false).is_err());
+        let master = MasterKey::load(&path, true).unwrap();
+
+        for size in [0, 1, SEGMENT_SIZE, SEGMENT_SIZE + 1, PARALLEL_MIN_SIZE + 7] {
+            let data: Vec<u8> = (0..size).map(|i| (i % 251) as u8).collect();
+            let sealed = seal(&master, &data).unwrap();
+            if size > 0 {
+                assert_ne!(
+                    &sealed[HEADER_LEN..HEADER_LEN + size.min(64)],
+                    &data[..size.min(64)]
+                );
+            }
+            assert_eq!(open(&master, sealed).unwrap(), data);
+        }
+
+        // Tampering, truncation at a segment boundary and another key all fail
+        let data = vec![7u8; SEGMENT_SIZE * 2];
+        let mut sealed = seal(&master, &data).unwrap();
+        sealed[HEADER_LEN + 5] ^= 1;
+        assert!(open(&master, sealed).is_err());
+        let mut sealed = seal(&master, &data).unwrap();
+        sealed.truncate(HEADER_LEN + SEGMENT_SIZE + TAG_LEN);
+        assert!(open(&master, sealed).is_err());
+        let other = MasterKey::load(&dir.path().join("other.key"), true).unwrap();
+        assert!(open(&other, seal(&master, &data).unwrap()).is_err());
+
+        // The codec records both steps
+        let text = "key = \"value\"\n".repeat(100);
+        let settings = LakeConfig {
+            compression: true,
+            ..LakeConfig::default()
+        };
+        let (stored, codec) = encode("a.toml", text.as_bytes(), &settings, Some(&master)).unwrap();
+        assert_eq!(codec, Some(ZSTD_ENVELOPE));
+        let decoded = decode(stored.into_owned(), codec, text.len() as i64, Some(&master));
+        assert_eq!(decoded.unwrap(), text.as_bytes());
+    }
+}
@@ -0,0 +1,400 @@
+//! Local cache of decrypted files for memory-mapped reads
+//!
+//! Reading a file from the lake decrypts and copies it every time. Files read
+//! through [`Lake::get_file_mapped`] are instead written once to a local
+//! cache directory and returned as read-only memory maps, so repeated reads
+//! of a large file cost a metadata query and a `mmap`.
+//!
+//! Entries are content-addressed by `filehash`, so each version of a file is
+//! its own entry and a new version never invalidates an old one. Entries are
+//! written to a temporary file and renamed into place, never modified, so a
+//! mapping stays valid even if its entry is evicted while in use. Recency is
+//! tracked with mtime, and the cache is trimmed to `[lake]
+//! file_cache_max_bytes`, least recently used first.
+//!
+//! Versions written before hashing have no `filehash`. The hash computed on
+//! their first read is recorded under `versions/`, keyed by the stored row,
+//! so later reads of the same version hit the cache too.
+//!
+//! The cache holds plaintext, which is why it is opt-in; its directories are
+//! created owner-only.
+
+use crate::files::file_hash;
+use crate::schema::{read_or_empty, with_optional_column};
+use crate::Lake;
+use anyhow::Result;
+use dkdc_common::trace;
+use dkdc_config::{Config, FILES_TABLE_NAME};
+use duckdb::params;
+use memmap2::Mmap;
+use std::fs;
+use std::io::Write;
+use std::ops::Deref;
+use std::path::{Path, PathBuf};
+use std::time::SystemTime;
+
+/// A read-only memory map of a cached file version
+pub struct MappedFile {
+    pub filepath: String,
+    pub filename: String,
+    /// SHA-256 of the contents, which is also the cache key
+    pub filehash: String,
+    /// `None` for empty files, which can't be mapped
+    mmap: Option<Mmap>,
+}
+
+impl MappedFile {
+    pub fn as_bytes(&self) -> &[u8] {
+        self.mmap.as_deref().unwrap_or_default()
+    }
+}
+
+impl AsRef<[u8]> for MappedFile {
+    fn as_ref(&self) -> &[u8] {
+        self.as_bytes()
+    }
+}
+
+impl Deref for MappedFile {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        self.as_bytes()
+    }
+}
+
+/// Directory of content hashes recorded for versions written without one
+const VERSIONS_DIR: &str = "versions";
+
+/// A size-bounded directory of decrypted file versions
+pub struct FileCache {
+    dir: PathBuf,
+    max_bytes: u64,
+}
+
+impl FileCache {
+    pub fn new(dir: PathBuf, max_bytes: u64) -> Self {
+        Self { dir, max_bytes }
+    }
+
+    /// The file cache configured for a lake
+    pub fn for_config(config: &Config) -> Self {
+        Self::new(
+            config.file_cache_path(),
+            config.file().lake.file_cache_max_bytes,
+        )
+    }
+
+    pub fn dir(&self) -> &Path {
+        &self.dir
+    }
+
+    /// Map the entry for `hash`, marking it recently used
+    pub fn get(&self, hash: &str) -> Result<Option<Mmap>> {
+        let _span = trace::span("file_cache.get");
+        let path = self.entry_path(hash)?;
+        let file = match fs::File::open(&path) {
+            Ok(file) => file,
+            Err(e) if e.kind() == std::io::ErrorKind::NotFound => return Ok(None),
+            Err(e) => return Err(e.into()),
+        };
+
+        // Recency only steers eviction, so a failed touch isn't an error
+        let _ = fs::File::options()
+            .append(true)
+            .open(&path)
+            .and_then(|f| f.set_modified(SystemTime::now()));
+
+        Ok(Some(map(&file)?))
+    }
+
+    /// Whether an entry for `hash` exists
+    pub fn contains(&self, hash: &str) -> bool {
+        self.entry_path(hash).is_ok_and(|path| path.exists())
+    }
+
+    /// Store `data` under `hash` and map it, then trim the cache to its bound
+    ///
+    /// The entry is mapped before trimming, so the returned map is valid even
+    /// when `data` alone is larger than the cache. Empty data can't be mapped.
+    pub fn insert(&self, hash: &str, data: &[u8]) -> Result<Mmap> {
+        let _span = trace::span_with("file_cache.insert", || format!("{} bytes", data.len()));
+        anyhow::ensure!(!data.is_empty(), "Empty files can't be cached");
+        let path = self.entry_path(hash)?;
+        let parent = path.parent().expect("entries live in a shard directory");
+        create_private_dir(parent)?;
+
+        let temp = parent.join(format!(".{}.{}.tmp", hash, std::process::id()));
+        {
+            let mut file = create_private_file(&temp)?;
+            file.write_all(data)?;
+            file.sync_all()?;
+        }
+        fs::rename(&temp, &path)?;
+
+        let mmap = map(&fs::File::open(&path)?)?;
+        self.trim()?;
+        Ok(mmap)
+    }
+
+    /// Content hash recorded for a version without a `filehash`
+    pub fn version_hash(&self, version: &str) -> Option<String> {
+        let hash = fs::read_to_string(self.version_path(version).ok()?).ok()?;
+        self.entry_path(&hash).is_ok().then_some(hash)
+    }
+
+    /// Record the content hash of a version without a `filehash`
+    pub fn record_version(&self, version: &str, hash: &str) -> Result<()> {
+        let path = self.version_path(version)?;
+        let parent = path.parent().expect("versions live in their own directory");
+        create_private_dir(parent)?;
+
+        let temp = parent.join(format!(".{}.{}.tmp", version, std::process::id()));
+        create_private_file(&temp)?.write_all(hash.as_bytes())?;
+        fs::rename(&temp, &path)?;
+        Ok(())
+    }
+
+    /// Remove least recently used entries until the cache fits its bound,
+    /// returning the number of bytes freed
+    pub fn trim(&self) -> Result<u64> {
+        let mut entries = self.entries()?;
+        let mut total: u64 = entries.iter().map(|(_, size, _)| size).sum();
+        if total <= self.max_bytes {
+            return Ok(0);
+        }
+
+        let _span = trace::span("file_cache.trim");
+        entries.sort_by_key(|(modified, _, _)| *modified);
+
+        let mut freed = 0;
+        for (_, size, path) in entries {
+            if total <= self.max_bytes {
+                break;
+            }
+            // Another process may have evicted it already
+            if fs::remove_file(&path).is_ok() {
+                total -= size;
+                freed += size;
+            }
+        }
+
+        Ok(freed)
+    }
+
+    /// Total size of all entries in bytes
+    pub fn size(&self) -> Result<u64> {
+        Ok(self.entries()?.iter().map(|(_, size, _)| size).sum())
+    }
+
+    /// Every entry as (last used, size, path), recorded versions included
+    fn entries(&self) -> Result<Vec<(SystemTime, u64, PathBuf)>> {
+        let mut entries = Vec::new();
+        if !self.dir.exists() {
+            return Ok(entries);
+        }
+
+        for shard in fs::read_dir(&self.dir)? {
+            let shard = shard?;
+            if !shard.file_type()?.is_dir() {
+                continue;
+            }
+
+            for entry in fs::read_dir(shard.path())? {
+                let entry = entry?;
+                if entry.file_name().to_string_lossy().starts_with('.') {
+                    continue; // in-flight writes
+                }
+
+                let metadata = entry.metadata()?;
+                let modified = metadata.modified().unwrap_or(SystemTime::UNIX_EPOCH);
+                entries.push((modified, metadata.len(), entry.path()));
+            }
+        }
+
+        Ok(entries)
+    }
+
+    /// `<dir>/<first two hex digits>/<hash>`
+    fn entry_path(&self, hash: &str) -> Result<PathBuf> {
+        if !is_hash(hash) {
+            anyhow::bail!("Invalid file hash '{}'", hash);
+        }
+        Ok(self.dir.join(&hash[..2]).join(hash))
+    }
+
+    /// `<dir>/versions/<version>`
+    fn version_path(&self, version: &str) -> Result<PathBuf> {
+        if !is_hash(version) {
+            anyhow::bail!("Invalid file version '{}'", version);
+        }
+        Ok(self.dir.join(VERSIONS_DIR).join(version))
+    }
+}
+
+impl Lake {
+    /// Latest version of a file as a read-only memory map, via the file cache
+    ///
+    /// The first read of a version decrypts it into the cache; later reads
+    /// only look up its hash and map the cached copy, without copying it.
+    pub fn get_file_mapped(&self, filepath: &str, filename: &str) -> Result<Option<MappedFile>> {
+        let _span = trace::span_with("files.get_mapped", || format!("{}/{}", filepath, filename));
+        let cache = FileCache::for_config(&self.config);
+
+        let mapped = |filehash: String, mmap: Option<Mmap>| MappedFile {
+            filepath: filepath.to_string(),
+            filename: filename.to_string(),
+            filehash,
+            mmap,
+        };
+
+        let Some(latest) = self.latest_version(filepath, filename)? else {
+            return Ok(None);
+        };
+        let hash = latest
+            .filehash
+            .clone()
+            .or_else(|| cache.version_hash(&latest.version));
+        if let Some(hash) = hash {
+            if let Some(mmap) = cache.get(&hash)? {
+                return Ok(Some(mapped(hash, Some(mmap))));
+            }
+        }
+
+        // Miss: read through the lake once. The hash is recomputed so the
+        // entry matches the contents even if a writer raced the lookup.
+        let file = match self.get_file(filepath, filename)? {
+            None => return Ok(None),
+            Some(file) => file,
+        };
+        let hash = file_hash(&file.filedata);
+        if file.filedata.is_empty() {
+            return Ok(Some(mapped(hash, None)));
+        }
+
+        let mmap = cache.insert(&hash, &file.filedata)?;
+        // Only record the hash against the version it was read from: if the
+        // latest version is still the one looked up, that's what was read
+        if latest.filehash.is_none()
+            && self.latest_version(filepath, filename)?.as_ref() == Some(&latest)
+        {
+            cache.record_version(&latest.version, &hash)?;
+        }
+        Ok(Some(mapped(hash, Some(mmap))))
+    }
+
+    /// A file's latest version, `None` if the file doesn't exist
+    fn latest_version(&self, filepath: &str, filename: &str) -> Result<Option<LatestVersion>> {
+        let Some((storepath, storename)) = self.stored_name(filepath, filename)? else {
+            return Ok(None);
+        };
+        let query = |hash_column: &str| -> Result<Option<LatestVersion>> {
+            let sql = format!(
+                "SELECT rowid, {} AS filehash
+                 FROM {}
+                 WHERE filepath = ? AND filename = ?
+                 ORDER BY rowid DESC
+                 LIMIT 1",
+                hash_column,
+                self.table_ref(FILES_TABLE_NAME)
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![storepath, storename])?;
+
+            match rows.next()? {
+                Some(row) => {
+                    // Rows are never rewritten, so the stored name and rowid
+                    // identify a version
+                    let rowid: i64 = row.get(0)?;
+                    let version = format!("{}\0{}\0{}", storepath, storename, rowid);
+                    Ok(Some(LatestVersion {
+                        version: file_hash(version.as_bytes()),
+                        filehash: row.get(1)?,
+                    }))
+                }
+                None => Ok(None),
+            }
+        };
+
+        read_or_empty(|| with_optional_column("filehash", "filehash", query))
+    }
+}
+
+/// The latest version of a file, as stored
+#[derive(PartialEq)]
+struct LatestVersion {
+    /// Key for the version in the file cache
+    version: String,
+    /// `None` if it was written before hashing
+    filehash: Option<String>,
+}
+
+fn is_hash(hash: &str) -> bool {
+    hash.len() >= 2 && hash.bytes().all(|b| b.is_ascii_hexdigit())
+}
+
+fn map(file: &fs::File) -> Result<Mmap> {
+    // SAFETY: entries are never written after being renamed into place, and
+    // eviction only unlinks them, so the mapped bytes can't change.
+    Ok(unsafe { Mmap::map(file)? })
+}
+
+fn create_private_dir(path: &Path) -> Result<()> {
+    #[cfg(unix)]
+    {
+        use std::os::unix::fs::DirBuilderExt;
+        fs::DirBuilder::new()
+            .recursive(true)
+            .mode(0o700)
+            .create(path)?;
+    }
+    #[cfg(not(unix))]
+    fs::create_dir_all(path)?;
+
+    Ok(())
+}
+
+fn create_private_file(path: &Path) -> Result<fs::File> {
+    let mut options = fs::File::options();
+    options.write(true).create(true).truncate(true);
+    #[cfg(unix)]
+    {
+        use std::os::unix::fs::OpenOptionsExt;
+        options.mode(0o600);
+    }
+
+    Ok(options.open(path)?)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_file_cache_evicts_least_recently_used() {
+        let dir = tempfile::tempdir().unwrap();
+        let cache = FileCache::new(dir.path().to_path_buf(), 10);
+        let (old, new) = (file_hash(b"old"), file_hash(b"new"));
+
+        cache.insert(&old, b"012345").unwrap();
+        let old_entry = cache.entry_path(&old).unwrap();
+        fs::File::options()
+            .append(true)
+            .open(&old_entry)
+            .unwrap()
+            .set_modified(SystemTime::UNIX_EPOCH)
+            .unwrap();
+        cache.insert(&new, b"6789ab").unwrap();
+
+        assert!(!cache.contains(&old));
+        assert_eq!(&cache.get(&new).unwrap().unwrap()[..], b"6789ab");
+        assert!(cache.entry_path("../etc").is_err());
+
+        let version = file_hash(b"files\0old.txt\01");
+        assert_eq!(cache.version_hash(&version), None);
+        cache.record_version(&version, &new).unwrap();
+        assert_eq!(cache.version_hash(&version), Some(new));
+        assert!(cache.record_version("../etc", &old).is_err());
+    }
+}
@@ -1,8 +1,12 @@
+use crate::chunks::CHUNK_THRESHOLD;
+use crate::schema::{read_or_empty, with_optional_column, Area};
 use crate::Lake;
 use anyhow::Result;
 use chrono::{DateTime, Utc};
+use dkdc_common::trace;
 use dkdc_config::FILES_TABLE_NAME;
 use duckdb::params;
+use sha2::{Digest, Sha256};
 
 pub struct File {
     pub filepath: String,
@@ -12,102 +16,403 @@ pub struct File {
     pub fileupdated: DateTime<Utc>,
 }
 
-impl Lake {
-    pub fn create_files_table(&self) -> Result<()> {
-        let sql = format!(
-            "CREATE TABLE IF NOT EXISTS {} (
-                filepath VARCHAR,
-                filename VARCHAR,
-                filedata BLOB,
-                filesize BIGINT,
-                fileupdated TIMESTAMP
-            )",
-            FILES_TABLE_NAME
-        );
-        self.execute(&sql)?;
-        Ok(())
+/// Metadata for the latest version of a file, read without its contents
+#[derive(Debug, Clone)]
+pub struct FileEntry {
+    pub filepath: String,
+    pub filename: String,
+    pub filesize: i64,
+    pub fileupdated: DateTime<Utc>,
+    /// Number of stored versions of the file
+    pub versions: i64,
+    /// SHA-256 of the latest contents (missing for files written before hashing)
+    pub filehash: Option<String>,
+}
+
+/// Column a file listing is ordered by
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq)]
+pub enum FileSort {
+    #[default]
+    Name,
+    Size,
+    Updated,
+    Versions,
+}
+
+impl FileSort {
+    fn column(self) -> &'static str {
+        match self {
+            Self::Name => "filename",
+            Self::Size => "filesize",
+            Self::Updated => "fileupdated",
+            Self::Versions => "versions",
+        }
     }
+}
+
+/// Options for a metadata listing
+#[derive(Debug, Clone, Default)]
+pub struct ListOptions {
+    /// Include files under sub-paths of the listed path
+    pub recursive: bool,
+    pub sort: FileSort,
+    pub reverse: bool,
+    pub limit: Option<usize>,
+    pub offset: usize,
+}
 
+/// Hex-encoded SHA-256 of file contents
+pub fn file_hash(data: &[u8]) -> String {
+    format!("{:x}", Sha256::digest(data))
+}
+
+/// DuckDB returns timestamps as microseconds since epoch
+fn datetime_from_micros(micros: i64) -> DateTime<Utc> {
+    DateTime::from_timestamp_micros(micros).unwrap_or_else(Utc::now)
+}
+
+impl Lake {
     pub fn add_file(&self, filepath: &str, filename: &str, data: &[u8]) -> Result<()> {
+        self.ensure_schema(Area::Files)?;
+        self.ensure_schema(Area::Chunks)?;
+        self.ensure_schema(Area::Paths)?;
+        // A chunked file is its chunks plus the file row, written together
+        self.transaction(|lake| lake.insert_file(filepath, filename, data))
+    }
+
+    /// Add several files as a single snapshot
+    ///
+    /// Group small writes together this way instead of committing each one:
+    /// the catalog lock is taken once for the whole batch.
+    pub fn add_files(&self, files: &[(&str, &str, &[u8])]) -> Result<()> {
+        let _span = trace::span_with("files.add_files", || format!("{} files", files.len()));
+        self.ensure_schema(Area::Files)?;
+        self.ensure_schema(Area::Chunks)?;
+        self.ensure_schema(Area::Paths)?;
+        self.transaction(|lake| {
+            for (filepath, filename, data) in files {
+                lake.insert_file(filepath, filename, data)?;
+            }
+            Ok(())
+        })
+    }
+
+    /// Insert one file version; large files are stored as chunks (see
+    /// `chunks`), so this must run inside a transaction
+    fn insert_file(&self, filepath: &str, filename: &str, data: &[u8]) -> Result<()> {
+        let _span = trace::span_with("files.insert", || format!("{}/{}", filepath, filename));
+        // Moved files are stored under another name (see `paths`)
+        let (storepath, storename) = self.stored_name_for_write(filepath, filename)?;
         let sql = format!(
-            "INSERT INTO {} (filepath, filename, filedata, filesize, fileupdated)
-             VALUES (?, ?, ?, ?, ?)",
+            "INSERT INTO {} (filepath, filename, filedata, filesize, fileupdated, filehash, filecodec, filechunks)
+             VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             FILES_TABLE_NAME
         );
 
+        let (stored, codec, filechunks) = if data.len() >= CHUNK_THRESHOLD {
+            (None, None, Some(self.store_chunks(filename, data)?))
+        } else {
+            let (stored, codec) = self.encode_blob(filename, data)?;
+            (Some(stored), codec, None)
+        };
+
         let mut stmt = self.prepare(&sql)?;
         stmt.execute(params![
-            filepath,
-            filename,
-            data,
+            storepath,
+            storename,
+            stored.as_deref(),
             data.len() as i64,
             Utc::now().to_rfc3339(),
+            file_hash(data),
+            codec,
+            filechunks,
         ])?;
 
-        Ok(())
+        // Keep the directory and search indexes current, in the same snapshot
+        self.add_dir(filepath)?;
+        self.index_file(filepath, filename, data)
     }
 
     pub fn get_file(&self, filepath: &str, filename: &str) -> Result<Option<File>> {
-        let sql = format!(
-            "SELECT filepath, filename, filedata, filesize, fileupdated
-             FROM {}
-             WHERE filepath = ? AND filename = ?
-             ORDER BY fileupdated DESC
-             LIMIT 1",
-            FILES_TABLE_NAME
-        );
+        let _span = trace::span_with("files.get", || format!("{}/{}", filepath, filename));
+        let Some((storepath, storename)) = self.stored_name(filepath, filename)? else {
+            return Ok(None);
+        };
+        let query = |codec_column: &str, chunks_column: &str| -> Result<Option<File>> {
+            let sql = format!(
+                "SELECT filepath, filename, filedata, filesize, fileupdated,
+                        {} AS filecodec, {} AS filechunks
+                 FROM {}
+                 WHERE filepath = ? AND filename = ?
+                 ORDER BY rowid DESC
+                 LIMIT 1",
+                codec_column,
+                chunks_column,
+                self.table_ref(FILES_TABLE_NAME)
+            );
 
-        let mut stmt = self.prepare(&sql)?;
-        let mut rows = stmt.query(params![filepath, filename])?;
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![storepath, storename])?;
+
+            let Some(row) = rows.next()? else {
+                return Ok(None);
+            };
+            let filesize = row.get(3)?;
+            let codec: Option<String> = row.get(5)?;
+            let filechunks: Option<String> = row.get(6)?;
+            let filedata = match filechunks {
+                Some(filechunks) => self.read_chunks(&filechunks, filesize)?,
+                None => self.decode_blob(row.get(2)?, codec.as_deref(), filesize)?,
+            };
 
-        if let Some(row) = rows.next()? {
             Ok(Some(File {
-                filepath: row.get(0)?,
-                filename: row.get(1)?,
-                filedata: row.get(2)?,
-                filesize: row.get(3)?,
-                fileupdated: {
-                    // DuckDB returns timestamps as microseconds since epoch
-                    let micros: i64 = row.get(4)?;
-                    let secs = micros / 1_000_000;
-                    let nanos = ((micros % 1_000_000) * 1000) as u32;
-                    DateTime::from_timestamp(secs, nanos).unwrap_or_else(Utc::now)
-                },
+                filepath: filepath.to_string(),
+                filename: filename.to_string(),
+                filedata,
+                filesize,
+                fileupdated: datetime_from_micros(row.get(4)?),
             }))
-        } else {
-            Ok(None)
-        }
+        };
+
+        read_or_empty(|| {
+            with_optional_column("filechunks", "filechunks", |chunks_column| {
+                with_optional_column("filecodec", "filecodec", |codec_column| {
+                    query(codec_column, chunks_column)
+                })
+            })
+        })
+    }
+
+    /// Read bytes `start..end` of a file's latest version
+    ///
+    /// The range is clamped to the file's size. Chunked files only fetch the
+    /// chunks overlapping the range; smaller files are read whole and sliced.
+    pub fn read_file_range(
+        &self,
+        filepath: &str,
+        filename: &str,
+        start: u64,
+        end: u64,
+    ) -> Result<Option<Vec<u8>>> {
+        let _span = trace::span_with("files.read_range", || {
+            format!("{}/{} {}..{}", filepath, filename, start, end)
+        });
+        let Some((storepath, storename)) = self.stored_name(filepath, filename)? else {
+            return Ok(None);
+        };
+        let query = |codec_column: &str, chunks_column: &str| -> Result<Option<Vec<u8>>> {
+            let sql = format!(
+                "SELECT filedata, filesize, {} AS filecodec, {} AS filechunks
+                 FROM {}
+                 WHERE filepath = ? AND filename = ?
+                 ORDER BY rowid DESC
+                 LIMIT 1",
+                codec_column,
+                chunks_column,
+                self.table_ref(FILES_TABLE_NAME)
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![storepath, storename])?;
+
+            let Some(row) = rows.next()? else {
+                return Ok(None);
+            };
+            let filesize: i64 = row.get(1)?;
+            let end = end.min(filesize.max(0) as u64);
+            let start = start.min(end);
+
+            let codec: Option<String> = row.get(2)?;
+            let filechunks: Option<String> = row.get(3)?;
+            match filechunks {
+                Some(filechunks) => Ok(Some(self.read_chunk_range(&filechunks, start, end)?)),
+                None => {
+                    let data = self.decode_blob(row.get(0)?, codec.as_deref(), filesize)?;
+                    let end = (end as usize).min(data.len());
+                    Ok(Some(data[(start as usize).min(end)..end].to_vec()))
+                }
+            }
+        };
+
+        read_or_empty(|| {
+            with_optional_column("filechunks", "filechunks", |chunks_column| {
+                with_optional_column("filecodec", "filecodec", |codec_column| {
+                    query(codec_column, chunks_column)
+                })
+            })
+        })
     }
 
     pub fn list_files(&self, filepath: &str) -> Result<Vec<String>> {
-        let sql = format!(
-            "SELECT DISTINCT filename
-             FROM {}
-             WHERE filepath = ?
-             ORDER BY filename",
-            FILES_TABLE_NAME
-        );
+        let _span = trace::span_with("files.list", || filepath);
+        read_or_empty(|| {
+            self.with_visible_files(|files| {
+                let sql = format!(
+                    "SELECT DISTINCT filename
+                     FROM {}
+                     WHERE filepath = ?
+                     ORDER BY filename",
+                    files
+                );
 
-        let mut stmt = self.prepare(&sql)?;
-        let mut rows = stmt.query(params![filepath])?;
+                let mut stmt = self.prepare(&sql)?;
+                let mut rows = stmt.query(params![filepath])?;
 
-        let mut files = Vec::new();
-        while let Some(row) = rows.next()? {
-            files.push(row.get(0)?);
-        }
+                let mut files = Vec::new();
+                while let Some(row) = rows.next()? {
+                    files.push(row.get(0)?);
+                }
+
+                Ok(files)
+            })
+        })
+    }
+
+    /// List the latest version of each file with its metadata
+    ///
+    /// Only metadata columns are read, so the cost does not depend on file
+    /// sizes. With `recursive`, files under `filepath/...` are included too.
+    pub fn list_file_entries(
+        &self,
+        filepath: &str,
+        options: &ListOptions,
+    ) -> Result<Vec<FileEntry>> {
+        let _span = trace::span_with("files.list_entries", || filepath);
+        let filter = if options.recursive {
+            "filepath = $1 OR starts_with(filepath, $1 || '/')"
+        } else {
+            "filepath = $1"
+        };
+        let direction = if options.reverse { "DESC" } else { "ASC" };
+        let limit = options
+            .limit
+            .map(|limit| format!("LIMIT {}", limit))
+            .unwrap_or_default();
 
-        Ok(files)
+        let query = |files: &str, hash: &str| -> Result<Vec<FileEntry>> {
+            let sql = format!(
+                "SELECT filepath,
+                        filename,
+                        arg_max(filesize, rowid) AS filesize,
+                        epoch_us(arg_max(fileupdated, rowid)) AS fileupdated,
+                        count(*) AS versions,
+                        {} AS filehash
+                 FROM {}
+                 WHERE {}
+                 GROUP BY filepath, filename
+                 ORDER BY {} {}, filepath, filename
+                 {} OFFSET {}",
+                hash,
+                files,
+                filter,
+                options.sort.column(),
+                direction,
+                limit,
+                options.offset
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![filepath.trim_end_matches('/')])?;
+
+            let mut entries = Vec::new();
+            while let Some(row) = rows.next()? {
+                entries.push(FileEntry {
+                    filepath: row.get(0)?,
+                    filename: row.get(1)?,
+                    filesize: row.get(2)?,
+                    fileupdated: datetime_from_micros(row.get(3)?),
+                    versions: row.get(4)?,
+                    filehash: row.get(5)?,
+                });
+            }
+
+            Ok(entries)
+        };
+
+        // Lakes not written to since hashing was added lack the column
+        read_or_empty(|| {
+            self.with_visible_files(|files| {
+                with_optional_column("filehash", "arg_max(filehash, rowid)", |hash| {
+                    query(files, hash)
+                })
+            })
+        })
+    }
+
+    /// Metadata of a file's latest version, without reading its contents
+    pub fn file_entry(&self, filepath: &str, filename: &str) -> Result<Option<FileEntry>> {
+        let _span = trace::span_with("files.entry", || format!("{}/{}", filepath, filename));
+        let Some((storepath, storename)) = self.stored_name(filepath, filename)? else {
+            return Ok(None);
+        };
+        let query = |hash: &str| -> Result<Option<FileEntry>> {
+            let sql = format!(
+                "SELECT arg_max(filesize, rowid),
+                        epoch_us(arg_max(fileupdated, rowid)),
+                        count(*),
+                        {}
+                 FROM {}
+                 WHERE filepath = ? AND filename = ?
+                 HAVING count(*) > 0",
+                hash,
+                self.table_ref(FILES_TABLE_NAME)
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![storepath, storename])?;
+
+            let Some(row) = rows.next()? else {
+                return Ok(None);
+            };
+            Ok(Some(FileEntry {
+                filepath: filepath.to_string(),
+                filename: filename.to_string(),
+                filesize: row.get(0)?,
+                fileupdated: datetime_from_micros(row.get(1)?),
+                versions: row.get(2)?,
+                filehash: row.get(3)?,
+            }))
+        };
+
+        read_or_empty(|| with_optional_column("filehash", "arg_max(filehash, rowid)", query))
     }
 
     pub fn delete_file(&self, filepath: &str, filename: &str) -> Result<()> {
+        let _span = trace::span_with("files.delete", || format!("{}/{}", filepath, filename));
+        let Some((storepath, storename)) = self.stored_name(filepath, filename)? else {
+            return Ok(());
+        };
         let sql = format!(
             "DELETE FROM {} WHERE filepath = ? AND filename = ?",
             FILES_TABLE_NAME
         );
 
-        let mut stmt = self.prepare(&sql)?;
-        stmt.execute(params![filepath, filename])?;
-
+        read_or_empty(|| {
+            self.transaction(|lake| {
+                let mut stmt = lake.prepare(&sql)?;
+                stmt.execute(params![storepath, storename])?;
+                lake.forget_name(filepath, filename)?;
+                lake.unindex_file(filepath, filename)?;
+                // A directory left without files is gone, as in a listing
+                if lake.schema_version(Area::Paths) > 0 {
+                    lake.prune_dirs(filepath)?;
+                }
+                Ok(())
+            })
+        })?;
         Ok(())
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_file_hash() {
+        assert_eq!(
+            file_hash(b"abc"),
+            "ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad"
+        );
+    }
+}
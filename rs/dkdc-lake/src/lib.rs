@@ -11,17 +11,56 @@
 //! - Archive creation and extraction
 
 use anyhow::Result;
-use dkdc_config::{Config, DUCKLAKE_EXTENSION, SQLITE_EXTENSION};
+use dkdc_common::trace;
+use dkdc_config::{expand_home, Config, LakeConfig, DUCKLAKE_EXTENSION, SQLITE_EXTENSION};
 use duckdb::{Connection, Statement};
+use schema::Area;
+use std::cell::{Cell, OnceCell, RefCell};
+use std::collections::HashMap;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+use std::time::{Duration, Instant};
 
 pub mod archives;
+pub mod chunks;
+pub mod codec;
+pub mod envelope;
+pub mod file_cache;
 pub mod files;
+pub mod paths;
+pub mod query;
+pub mod schema;
+pub mod search;
 pub mod secrets;
+pub mod snapshot;
+pub mod transfer;
+
+pub use duckdb::arrow;
+pub use snapshot::{AsOf, Snapshot};
+
+/// Longest single sleep between write retries
+const MAX_RETRY_BACKOFF: Duration = Duration::from_secs(1);
+
+/// Error fragments that mean another writer holds the catalog
+const RETRYABLE_ERRORS: &[&str] = &["database is locked", "database is busy", "conflict"];
 
 /// Main interface to the DuckLake data storage
 pub struct Lake {
     connection: Connection,
     config: Config,
+    settings: LakeConfig,
+    read_only: bool,
+    /// Read-only handle on a lake that didn't exist yet when opened
+    empty: bool,
+    /// Snapshot all reads are pinned to (see `snapshot`)
+    snapshot: Option<i64>,
+    in_transaction: Cell<bool>,
+    /// Schema version of each area, as recorded in the catalog
+    schema: RefCell<HashMap<Area, usize>>,
+    /// Areas migrated inside the current transaction, recorded on commit
+    pending_schema: RefCell<Vec<Area>>,
+    /// Envelope encryption key, read on first use (see `envelope`)
+    master_key: OnceCell<envelope::MasterKey>,
 }
 
 impl Lake {
@@ -33,38 +72,113 @@ impl Lake {
 
     /// Create a new Lake instance with custom configuration
     pub fn with_config(config: Config) -> Result<Self> {
+        let _span = trace::span_with("lake.open", || config.dkdc_dir().display().to_string());
+
         config.ensure_metadata_db()?;
 
-        let connection = Connection::open_in_memory()?;
+        let settings = config.file().lake;
+        let versions = {
+            let _span = trace::span("lake.prepare_metadata");
+            let db = schema::open_catalog(
+                &config.metadata_path(),
+                Duration::from_millis(settings.busy_timeout_ms),
+            )?;
+            prepare_metadata_db(&db)?;
+            schema::load_versions(&db)?
+        };
 
-        connection.execute_batch(&format!("INSTALL {};", DUCKLAKE_EXTENSION))?;
-        connection.execute_batch(&format!("INSTALL {};", SQLITE_EXTENSION))?;
+        let connection = connect(&config, &settings, false)?;
 
-        let metadata_path = config.metadata_path();
-        let data_path = config.data_path();
+        // Tables are created on first write to each area (see `schema`)
+        Ok(Self {
+            connection,
+            config,
+            settings,
+            read_only: false,
+            empty: false,
+            snapshot: None,
+            in_transaction: Cell::new(false),
+            schema: RefCell::new(versions),
+            pending_schema: RefCell::new(Vec::new()),
+            master_key: OnceCell::new(),
+        })
+    }
 
-        connection.execute_batch(&format!(
-            "ATTACH 'ducklake:sqlite:{}' AS data (DATA_PATH '{}', ENCRYPTED);",
-            metadata_path.display(),
-            data_path.display()
-        ))?;
+    /// Open the default lake for reading only
+    pub fn read_only() -> Result<Self> {
+        let config = Config::new()?;
+        Self::open_read_only(config)
+    }
 
-        connection.execute_batch("USE data;")?;
+    /// Open a lake for reading only
+    ///
+    /// The catalog is attached `READ_ONLY`, so any number of readers can run
+    /// alongside a writer without taking write locks on `metadata.db`. No
+    /// directories are created and no DDL is issued; a lake that doesn't
+    /// exist yet opens as empty. Writes through this handle fail.
+    pub fn open_read_only(config: Config) -> Result<Self> {
+        let _span = trace::span_with("lake.open_read_only", || {
+            config.dkdc_dir().display().to_string()
+        });
 
-        let lake = Self { connection, config };
+        let settings = config.file().lake;
+        let empty = !config.metadata_path().exists();
+        // Reads that depend on an area's schema (e.g. moved files) need its
+        // version, read without taking a write lock
+        let versions = if empty {
+            HashMap::new()
+        } else {
+            schema::load_versions(&schema::open_catalog_read_only(
+                &config.metadata_path(),
+                Duration::from_millis(settings.busy_timeout_ms),
+            )?)?
+        };
+        let connection = if empty {
+            // Nothing written yet: an empty catalog reads as an empty lake
+            let connection = Connection::open_in_memory()?;
+            connection.execute_batch("ATTACH ':memory:' AS data; USE data;")?;
+            connection
+        } else {
+            connect(&config, &settings, true)?
+        };
 
-        // Bootstrap all required tables
-        lake.bootstrap_tables()?;
+        Ok(Self {
+            connection,
+            config,
+            settings,
+            read_only: true,
+            empty,
+            snapshot: None,
+            in_transaction: Cell::new(false),
+            schema: RefCell::new(versions),
+            pending_schema: RefCell::new(Vec::new()),
+            master_key: OnceCell::new(),
+        })
+    }
 
-        Ok(lake)
+    /// A second handle on this lake's database, for reads on another thread
+    ///
+    /// It shares the same DuckDB instance (and so sees the same catalog and
+    /// snapshot), but is read-only whatever this handle is.
+    pub(crate) fn clone_for_reads(&self) -> Result<Self> {
+        let connection = self.connection.try_clone()?;
+        connection.execute_batch("USE data;")?;
+        Ok(Self {
+            connection,
+            config: self.config.clone(),
+            settings: self.settings.clone(),
+            read_only: true,
+            empty: self.empty,
+            snapshot: self.snapshot,
+            in_transaction: Cell::new(false),
+            schema: RefCell::new(self.schema.borrow().clone()),
+            pending_schema: RefCell::new(Vec::new()),
+            master_key: OnceCell::new(),
+        })
     }
 
-    /// Bootstrap all required tables
-    fn bootstrap_tables(&self) -> Result<()> {
-        self.create_files_table()?;
-        self.create_secrets_table()?;
-        self.create_archives_table()?;
-        Ok(())
+    pub fn is_read_only(&self) -> bool {
+        self.read_only
     }
 
     pub fn connection(&self) -> &Connection {
@@ -76,25 +190,101 @@ impl Lake {
     }
 
     pub fn execute(&self, sql: &str) -> Result<()> {
+        let _span = trace::span_with("lake.execute", || sql);
         self.connection.execute_batch(sql)?;
         Ok(())
     }
 
     pub fn prepare(&self, sql: &str) -> Result<Statement> {
+        let _span = trace::span_with("lake.prepare", || sql);
         Ok(self.connection.prepare(sql)?)
     }
 
+    /// Run a write, retrying with jittered exponential backoff while another
+    /// process holds the catalog, for up to `busy_timeout_ms`
+    pub fn with_retry<T>(&self, mut op: impl FnMut(&Self) -> Result<T>) -> Result<T> {
+        if self.read_only {
+            anyhow::bail!(
+                "Lake at {} is open read-only",
+                self.config.dkdc_dir().display()
+            );
+        }
+        if let Some(snapshot) = self.snapshot {
+            anyhow::bail!(
+                "Lake is pinned to snapshot {} and can't be written",
+                snapshot
+            );
+        }
+
+        // Inside a transaction the whole transaction is retried instead
+        if self.in_transaction.get() {
+            return op(self);
+        }
+
+        retry_busy(&self.settings, || op(self))
+    }
+
+    /// Run several writes as one transaction, so they land in a single
+    /// DuckLake snapshot and take the catalog lock once
+    ///
+    /// The transaction is retried as a whole on conflicts, so `op` may run
+    /// more than once. Nested calls join the outer transaction.
+    pub fn transaction<T>(&self, mut op: impl FnMut(&Self) -> Result<T>) -> Result<T> {
+        if self.in_transaction.get() {
+            return op(self);
+        }
+
+        self.with_retry(|lake| {
+            let _span = trace::span("lake.transaction");
+            lake.execute("BEGIN TRANSACTION")?;
+            lake.in_transaction.set(true);
+            let result = op(lake);
+            lake.in_transaction.set(false);
+
+            match result.and_then(|value| lake.execute("COMMIT").map(|_| value)) {
+                Ok(value) => {
+                    lake.commit_schema();
+                    Ok(value)
+                }
+                Err(e) => {
+                    let _ = lake.execute("ROLLBACK");
+                    lake.rollback_schema();
+                    Err(e)
+                }
+            }
+        })
+    }
+
+    /// Id of the latest committed DuckLake snapshot
+    ///
+    /// Every write creates a new snapshot, so an unchanged id means nothing in
+    /// the lake has changed, including writes from other processes.
+    pub fn current_snapshot(&self) -> Result<i64> {
+        if self.empty {
+            return Ok(0);
+        }
+
+        let snapshot = self.connection.query_row(
+            "SELECT max(snapshot_id) FROM ducklake_snapshots('data')",
+            [],
+            |row| row.get::<_, Option<i64>>(0),
+        )?;
+        Ok(snapshot.unwrap_or(0))
+    }
+
     pub fn get_sql_commands(&self) -> String {
         let metadata_path = self.config.metadata_path();
         let data_path = self.config.data_path();
 
         format!(
-            r#"INSTALL {};
+            r#"{}
+INSTALL {};
 INSTALL {};
 
 ATTACH 'ducklake:sqlite:{}' AS data (DATA_PATH '{}', ENCRYPTED);
 
 USE data;"#,
+            settings_sql(&self.settings),
             DUCKLAKE_EXTENSION,
             SQLITE_EXTENSION,
             metadata_path.display(),
@@ -103,13 +293,210 @@ USE data;"#,
     }
 }
 
+/// Install the extensions and attach the lake as `data`
+fn connect(config: &Config, settings: &LakeConfig, read_only: bool) -> Result<Connection> {
+    let connection = Connection::open_in_memory()?;
+    connection.execute_batch(&settings_sql(settings))?;
+
+    {
+        let _span = trace::span("lake.install_extensions");
+        connection.execute_batch(&format!("INSTALL {};", DUCKLAKE_EXTENSION))?;
+        connection.execute_batch(&format!("INSTALL {};", SQLITE_EXTENSION))?;
+    }
+
+    let attach = format!(
+        "ATTACH 'ducklake:sqlite:{}' AS data (DATA_PATH '{}', ENCRYPTED{});",
+        config.metadata_path().display(),
+        config.data_path().display(),
+        if read_only { ", READ_ONLY" } else { "" }
+    );
+    {
+        let _span = trace::span("lake.attach");
+        retry_busy(settings, || Ok(connection.execute_batch(&attach)?))?;
+    }
+
+    connection.execute_batch("USE data;")?;
+    Ok(connection)
+}
+
+/// `SET` statements applying the `[lake]` DuckDB settings
+///
+/// Unset options keep DuckDB's defaults: a thread per core and 80% of RAM.
+fn settings_sql(settings: &LakeConfig) -> String {
+    let mut sql = vec![
+        format!("SET enable_object_cache = {};", settings.object_cache),
+        format!("SET prefetch_all_parquet_files = {};", settings.prefetch),
+    ];
+    if let Some(threads) = settings.threads {
+        sql.push(format!("SET threads = {};", threads.max(1)));
+    }
+    if let Some(limit) = &settings.memory_limit {
+        sql.push(format!("SET memory_limit = {};", quote_literal(limit)));
+    }
+    if let Some(dir) = &settings.temp_directory {
+        let dir = expand_home(dir).display().to_string();
+        sql.push(format!("SET temp_directory = {};", quote_literal(&dir)));
+    }
+    sql.join("\n")
+}
+
+/// Run `f` over `items` on one thread per core, keeping their order and
+/// failing if any call fails
+pub(crate) fn run_parallel<T, R, F>(items: Vec<T>, f: F) -> Result<Vec<R>>
+where
+    T: Send,
+    R: Send,
+    F: Fn(T) -> Result<R> + Sync,
+{
+    let jobs = std::thread::available_parallelism()
+        .map(|n| n.get())
+        .unwrap_or(4)
+        .clamp(1, items.len().max(1));
+    let count = items.len();
+    let next = AtomicUsize::new(0);
+    let items: Vec<Mutex<Option<T>>> = items
+        .into_iter()
+        .map(|item| Mutex::new(Some(item)))
+        .collect();
+    let slots: Mutex<Vec<Option<Result<R>>>> = Mutex::new((0..count).map(|_| None).collect());
+
+    std::thread::scope(|s| {
+        for _ in 0..jobs {
+            s.spawn(|| loop {
+                let index = next.fetch_add(1, Ordering::Relaxed);
+                let Some(item) = items
+                    .get(index)
+                    .and_then(|item| item.lock().unwrap().take())
+                else {
+                    break;
+                };
+                let result = f(item);
+                let failed = result.is_err();
+                slots.lock().unwrap()[index] = Some(result);
+                if failed {
+                    // Stop handing out work; other workers finish their item
+                    next.store(count, Ordering::Relaxed);
+                }
+            });
+        }
+    });
+
+    slots.into_inner().unwrap().into_iter().flatten().collect()
+}
+
+pub(crate) fn quote_literal(value: &str) -> String {
+    format!("'{}'", value.replace('\'', "''"))
+}
+
+/// Put the SQLite catalog in WAL mode so readers don't block the writer
+///
+/// WAL is persistent, so this only writes on the first open of a catalog.
+fn prepare_metadata_db(db: &rusqlite::Connection) -> Result<()> {
+    let mode: String = db.query_row("PRAGMA journal_mode", [], |row| row.get(0))?;
+    if !mode.eq_ignore_ascii_case("wal") {
+        db.query_row("PRAGMA journal_mode = WAL", [], |row| {
+            row.get::<_, String>(0)
+        })?;
+    }
+
+    Ok(())
+}
+
+/// Retry `op` with jittered exponential backoff while it fails because the
+/// catalog is busy, giving up after `busy_timeout_ms`
+fn retry_busy<T>(settings: &LakeConfig, mut op: impl FnMut() -> Result<T>) -> Result<T> {
+    let deadline = Instant::now() + Duration::from_millis(settings.busy_timeout_ms);
+    let mut backoff = Duration::from_millis(settings.retry_backoff_ms.max(1));
+
+    loop {
+        match op() {
+            Ok(value) => return Ok(value),
+            Err(e) if is_retryable(&e) && Instant::now() < deadline => {
+                let remaining = deadline.saturating_duration_since(Instant::now());
+                let _span = trace::span_with("lake.retry_wait", || e.to_string());
+                std::thread::sleep(jitter(backoff).min(remaining));
+                backoff = (backoff * 2).min(MAX_RETRY_BACKOFF);
+            }
+            Err(e) => return Err(e),
+        }
+    }
+}
+
+fn is_retryable(e: &anyhow::Error) -> bool {
+    let message = format!("{:#}", e).to_lowercase();
+    RETRYABLE_ERRORS
+        .iter()
+        .any(|fragment| message.contains(fragment))
+}
+
+/// Randomize a backoff to between half and all of it, so writers that
+/// collided don't retry in lockstep
+fn jitter(backoff: Duration) -> Duration {
+    use std::collections::hash_map::RandomState;
+    use std::hash::{BuildHasher, Hasher};
+
+    let mut hasher = RandomState::new().build_hasher();
+    hasher.write_u128(
+        std::time::SystemTime::now()
+            .duration_since(std::time::UNIX_EPOCH)
+            .map(|d| d.as_nanos())
+            .unwrap_or_default(),
+    );
+
+    let half = backoff / 2;
+    let spread = half.as_nanos() as u64 + 1;
+    half + Duration::from_nanos(hasher.finish() % spread)
+}
+
 #[cfg(test)]
 mod tests {
     use super::*;
+    use tempfile::TempDir;
+
+    /// A lake in its own temporary dkdc home, removed when the `TempDir` drops
+    pub(crate) fn temp_lake(settings: LakeConfig) -> (TempDir, Lake) {
+        let home = TempDir::new().unwrap();
+        let config = Config::from_path(home.path().to_path_buf()).with_lake_settings(settings);
+        let lake = Lake::with_config(config).unwrap();
+        (home, lake)
+    }
 
     #[test]
     fn test_lake_creation() {
         let lake = Lake::new();
         assert!(lake.is_ok());
     }
+
+    #[test]
+    fn test_retryable_errors() {
+        assert!(is_retryable(&anyhow::anyhow!(
+            "IO Error: database is locked"
+        )));
+        assert!(is_retryable(&anyhow::anyhow!(
+            "Transaction conflict: cannot add data to table"
+        )));
+        assert!(!is_retryable(&anyhow::anyhow!("Table does not exist")));
+    }
+
+    #[test]
+    fn test_settings_sql() {
+        let settings = LakeConfig {
+            threads: Some(8),
+            memory_limit: Some("4GB".to_string()),
+            ..LakeConfig::default()
+        };
+        let sql = settings_sql(&settings);
+        assert!(sql.contains("SET threads = 8;"));
+        assert!(sql.contains("SET memory_limit = '4GB';"));
+        assert!(!sql.contains("temp_directory"));
+    }
+
+    #[test]
+    fn test_jitter_bounds() {
+        let backoff = Duration::from_millis(100);
+        for _ in 0..100 {
+            let delay = jitter(backoff);
+            assert!(delay >= backoff / 2 && delay <= backoff);
+        }
+    }
 }
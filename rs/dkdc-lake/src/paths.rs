@@ -0,0 +1,627 @@
+//! Directories, and moving and removing files by path
+//!
+//! File versions are stored under the `(filepath, filename)` they were
+//! written with. Moving a file only records its new name: `names` maps the
+//! visible name of a moved file to the key its versions are stored under, so
+//! `move_path` never copies `filedata`. A stored key is visible under its own
+//! name unless a `names` row points at it. Writing to a name whose own key
+//! belongs to a moved file stores the new file under a fresh key in
+//! [`STORE_PATH`].
+//!
+//! `dirs` indexes the directories files are written to, so listing
+//! subdirectories reads that small table instead of every file row. Moving
+//! or removing a directory is a few set-based statements on `names`,
+//! `dirs` and the search index, however many files it holds.
+
+use crate::files::file_hash;
+use crate::schema::{is_missing_table, read_or_empty, Area};
+use crate::Lake;
+use anyhow::Result;
+use chrono::Utc;
+use dkdc_common::trace;
+use dkdc_config::{
+    DIRS_TABLE_NAME, FILES_TABLE_NAME, NAMES_TABLE_NAME, SEARCH_DOCS_TABLE_NAME,
+    SEARCH_TERMS_TABLE_NAME,
+};
+use duckdb::params;
+use std::collections::BTreeSet;
+
+/// Where files written to the original name of a moved file are stored
+pub const STORE_PATH: &str = "./.dkdc/store";
+
+/// SQL condition: `column` is the directory `$1` or below it
+fn under(column: &str) -> String {
+    format!("({0} = $1 OR starts_with({0}, $1 || '/'))", column)
+}
+
+/// `(filepath, filename)` of a full file path like `./files/notes.md`
+fn split_path(path: &str) -> Option<(&str, &str)> {
+    path.rsplit_once('/')
+        .filter(|(dir, name)| !dir.is_empty() && !name.is_empty())
+}
+
+impl Lake {
+    /// The key a file's versions are stored under, or `None` if its name's
+    /// own key belongs to a file moved elsewhere
+    pub(crate) fn stored_name(
+        &self,
+        filepath: &str,
+        filename: &str,
+    ) -> Result<Option<(String, String)>> {
+        let own = Some((filepath.to_string(), filename.to_string()));
+        if self.schema_version(Area::Paths) == 0 {
+            return Ok(own);
+        }
+
+        let sql = format!(
+            "SELECT storepath, storename FROM {names} WHERE filepath = $1 AND filename = $2
+             UNION ALL
+             SELECT NULL, NULL FROM {names} WHERE storepath = $1 AND storename = $2",
+            names = self.table_ref(NAMES_TABLE_NAME)
+        );
+        let lookup = || -> Result<Option<Option<(String, String)>>> {
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![filepath, filename])?;
+
+            let mut moved_away = false;
+            while let Some(row) = rows.next()? {
+                match (row.get(0)?, row.get(1)?) {
+                    (Some(storepath), Some(storename)) => {
+                        return Ok(Some(Some((storepath, storename))))
+                    }
+                    _ => moved_away = true,
+                }
+            }
+            Ok(moved_away.then_some(None))
+        };
+
+        match lookup() {
+            Ok(Some(stored)) => Ok(stored),
+            Ok(None) => Ok(own),
+            // Snapshots from before `names` existed
+            Err(e) if is_missing_table(&e) => Ok(own),
+            Err(e) => Err(e),
+        }
+    }
+
+    /// The key to store a new version of a file under, recording a fresh
+    /// one if its name's own key belongs to a moved file
+    pub(crate) fn stored_name_for_write(
+        &self,
+        filepath: &str,
+        filename: &str,
+    ) -> Result<(String, String)> {
+        if let Some(stored) = self.stored_name(filepath, filename)? {
+            return Ok(stored);
+        }
+
+        let storename =
+            file_hash(format!("{}/{}@{}", filepath, filename, Utc::now().to_rfc3339()).as_bytes());
+        let mut stmt = self.prepare(&format!(
+            "INSERT INTO {} (filepath, filename, storepath, storename) VALUES (?, ?, ?, ?)",
+            NAMES_TABLE_NAME
+        ))?;
+        stmt.execute(params![filepath, filename, STORE_PATH, storename])?;
+
+        Ok((STORE_PATH.to_string(), storename))
+    }
+
+    /// Run a read over `files` with every row under its visible name
+    ///
+    /// `op` gets a relation with the columns of `files` plus `rowid`.
+    pub(crate) fn with_visible_files<T>(&self, op: impl Fn(&str) -> Result<T>) -> Result<T> {
+        let files = self.table_ref(FILES_TABLE_NAME);
+        let stored = format!("(SELECT *, rowid AS rowid FROM {})", files);
+        if self.schema_version(Area::Paths) == 0 {
+            return op(&stored);
+        }
+
+        let visible = format!(
+            "(SELECT f.* REPLACE (
+                    coalesce(n.filepath, f.filepath) AS filepath,
+                    coalesce(n.filename, f.filename) AS filename
+                 ),
+                 f.rowid AS rowid
+              FROM {} AS f
+              LEFT JOIN {} AS n ON n.storepath = f.filepath AND n.storename = f.filename)",
+            files,
+            self.table_ref(NAMES_TABLE_NAME)
+        );
+        match op(&visible) {
+            // Snapshots from before `names` existed
+            Err(e) if is_missing_table(&e) && e.to_string().contains(NAMES_TABLE_NAME) => {
+                op(&stored)
+            }
+            result => result,
+        }
+    }
+
+    /// Add a directory to the index; must run inside the write's transaction
+    pub(crate) fn add_dir(&self, dirpath: &str) -> Result<()> {
+        // Another process may have created the index since this handle read
+        // its schema version, so make sure of it rather than skip
+        self.ensure_schema(Area::Paths)?;
+
+        let mut stmt = self.prepare(&format!(
+            "INSERT INTO {0} (dirpath)
+             SELECT $1 WHERE NOT EXISTS (SELECT 1 FROM {0} WHERE dirpath = $1)",
+            DIRS_TABLE_NAME
+        ))?;
+        stmt.execute(params![dirpath])?;
+        Ok(())
+    }
+
+    /// Add every directory holding a visible file to the index, returning
+    /// how many were missing
+    ///
+    /// Repairs the index after writes that bypass [`Lake::add_dir`], like
+    /// imports, or that came from before the index existed.
+    pub(crate) fn index_dirs(&self) -> Result<usize> {
+        self.ensure_schema(Area::Paths)?;
+        self.with_visible_files(|files| {
+            let sql = format!(
+                "INSERT INTO {dirs} (dirpath)
+                 SELECT DISTINCT filepath FROM {files}
+                 WHERE filepath NOT IN (SELECT dirpath FROM {dirs})",
+                dirs = DIRS_TABLE_NAME,
+                files = files
+            );
+            Ok(self.prepare(&sql)?.execute([])?)
+        })
+    }
+
+    /// Rebuild the directory index from the files in the lake
+    pub(crate) fn reindex_dirs(&self) -> Result<usize> {
+        self.transaction(|lake| {
+            lake.ensure_schema(Area::Files)?;
+            lake.ensure_schema(Area::Paths)?;
+            lake.execute(&format!("DELETE FROM {}", DIRS_TABLE_NAME))?;
+            lake.index_dirs()
+        })
+    }
+
+    /// Drop `dirpath`, then each of its parents, from the index while no
+    /// file is left in or below it; must run inside the removal's
+    /// transaction
+    pub(crate) fn prune_dirs(&self, dirpath: &str) -> Result<()> {
+        let mut dir = dirpath;
+        while self.count_files(dir)? == 0 {
+            self.prepare(&format!(
+                "DELETE FROM {} WHERE {}",
+                DIRS_TABLE_NAME,
+                under("dirpath")
+            ))?
+            .execute(params![dir])?;
+            match dir.rsplit_once('/') {
+                Some((parent, _)) if !parent.is_empty() => dir = parent,
+                _ => break,
+            }
+        }
+        Ok(())
+    }
+
+    /// Directories below `filepath` as full paths, sorted
+    ///
+    /// Read from the directory index, so the cost does not depend on the
+    /// number of files. Directories between `filepath` and an indexed one
+    /// are included; without `recursive`, only direct children are listed.
+    pub fn list_dirs(&self, filepath: &str, recursive: bool) -> Result<Vec<String>> {
+        let _span = trace::span_with("paths.list_dirs", || filepath);
+        let base = filepath.trim_end_matches('/');
+
+        let query = |sql: &str| -> Result<Vec<String>> {
+            let mut stmt = self.prepare(sql)?;
+            let mut rows = stmt.query(params![base])?;
+            let mut dirs = Vec::new();
+            while let Some(row) = rows.next()? {
+                dirs.push(row.get(0)?);
+            }
+            Ok(dirs)
+        };
+        let from_files = || {
+            query(&format!(
+                "SELECT DISTINCT filepath FROM {} WHERE starts_with(filepath, $1 || '/')",
+                self.table_ref(FILES_TABLE_NAME)
+            ))
+        };
+
+        let indexed = read_or_empty(|| {
+            if self.schema_version(Area::Paths) == 0 {
+                return from_files();
+            }
+            let sql = format!(
+                "SELECT dirpath FROM {} WHERE starts_with(dirpath, $1 || '/')",
+                self.table_ref(DIRS_TABLE_NAME)
+            );
+            match query(&sql) {
+                // Snapshots from before the index existed
+                Err(e) if is_missing_table(&e) && e.to_string().contains(DIRS_TABLE_NAME) => {
+                    from_files()
+                }
+                result => result,
+            }
+        })?;
+
+        let mut dirs = BTreeSet::new();
+        for dir in &indexed {
+            let mut path = base.to_string();
+            for component in dir[base.len() + 1..].split('/') {
+                path = format!("{}/{}", path, component);
+                dirs.insert(path.clone());
+                if !recursive {
+                    break;
+                }
+            }
+        }
+
+        Ok(dirs.into_iter().collect())
+    }
+
+    /// Move or rename a file or directory, returning the number of files
+    /// moved
+    ///
+    /// Only names are rewritten, never file contents. A file moved onto an
+    /// existing directory keeps its name, like `mv`; existing files are
+    /// never replaced. Directories left empty are dropped from the index.
+    pub fn move_path(&self, source: &str, destination: &str) -> Result<usize> {
+        let _span = trace::span_with("paths.move", || format!("{} {}", source, destination));
+        let (source, destination) = (
+            source.trim_end_matches('/'),
+            destination.trim_end_matches('/'),
+        );
+        self.ensure_schema(Area::Files)?;
+        self.ensure_schema(Area::Paths)?;
+
+        self.transaction(|lake| {
+            if let Some((filepath, filename)) = split_path(source) {
+                if lake.file_exists(filepath, filename)? {
+                    let target = if lake.dir_exists(destination)? {
+                        (destination, filename)
+                    } else {
+                        split_path(destination).ok_or_else(|| {
+                            anyhow::anyhow!("Invalid destination: {}", destination)
+                        })?
+                    };
+                    lake.move_file((filepath, filename), target)?;
+                    lake.prune_dirs(filepath)?;
+                    return Ok(1);
+                }
+            }
+
+            if !lake.dir_exists(source)? {
+                anyhow::bail!("No such file or directory: {}", source);
+            }
+            let moved = lake.move_dir(source, destination)?;
+            if let Some((parent, _)) = source.rsplit_once('/') {
+                lake.prune_dirs(parent)?;
+            }
+            Ok(moved)
+        })
+    }
+
+    /// Remove a file, or with `recursive` a directory and everything below
+    /// it, returning the number of files removed
+    pub fn remove_path(&self, path: &str, recursive: bool) -> Result<usize> {
+        let _span = trace::span_with("paths.remove", || path);
+        let path = path.trim_end_matches('/');
+        self.ensure_schema(Area::Files)?;
+        self.ensure_schema(Area::Paths)?;
+
+        if let Some((filepath, filename)) = split_path(path) {
+            if self.file_exists(filepath, filename)? {
+                self.delete_file(filepath, filename)?;
+                return Ok(1);
+            }
+        }
+
+        if !self.dir_exists(path)? {
+            anyhow::bail!("No such file or directory: {}", path);
+        }
+        if !recursive {
+            anyhow::bail!("{} is a directory (remove it recursively)", path);
+        }
+
+        self.transaction(|lake| {
+            let removed = lake.remove_dir(path)?;
+            if let Some((parent, _)) = path.rsplit_once('/') {
+                lake.prune_dirs(parent)?;
+            }
+            Ok(removed)
+        })
+    }
+
+    /// Drop a file's `names` row; must run inside its deletion's transaction
+    pub(crate) fn forget_name(&self, filepath: &str, filename: &str) -> Result<()> {
+        if self.schema_version(Area::Paths) == 0 {
+            return Ok(());
+        }
+
+        let mut stmt = self.prepare(&format!(
+            "DELETE FROM {} WHERE filepath = ? AND filename = ?",
+            NAMES_TABLE_NAME
+        ))?;
+        stmt.execute(params![filepath, filename])?;
+        Ok(())
+    }
+
+    fn file_exists(&self, filepath: &str, filename: &str) -> Result<bool> {
+        let Some((storepath, storename)) = self.stored_name(filepath, filename)? else {
+            return Ok(false);
+        };
+        read_or_empty(|| {
+            let mut stmt = self.prepare(&format!(
+                "SELECT 1 FROM {} WHERE filepath = ? AND filename = ? LIMIT 1",
+                self.table_ref(FILES_TABLE_NAME)
+            ))?;
+            let found = stmt.query(params![storepath, storename])?.next()?.is_some();
+            Ok(found)
+        })
+    }
+
+    fn dir_exists(&self, dirpath: &str) -> Result<bool> {
+        read_or_empty(|| {
+            let mut stmt = self.prepare(&format!(
+                "SELECT 1 FROM {} WHERE {} LIMIT 1",
+                self.table_ref(DIRS_TABLE_NAME),
+                under("dirpath")
+            ))?;
+            let found = stmt.query(params![dirpath])?.next()?.is_some();
+            Ok(found)
+        })
+    }
+
+    /// Every visible file with the key its versions are stored under
+    fn stored_names_sql(&self) -> String {
+        format!(
+            "SELECT DISTINCT coalesce(n.filepath, f.filepath) AS filepath,
+                    coalesce(n.filename, f.filename) AS filename,
+                    f.filepath AS storepath,
+                    f.filename AS storename
+             FROM {} AS f
+             LEFT JOIN {} AS n ON n.storepath = f.filepath AND n.storename = f.filename",
+            FILES_TABLE_NAME, NAMES_TABLE_NAME
+        )
+    }
+
+    fn move_file(&self, source: (&str, &str), target: (&str, &str)) -> Result<()> {
+        if self.file_exists(target.0, target.1)? {
+            anyhow::bail!("{}/{} already exists", target.0, target.1);
+        }
+        let Some(stored) = self.stored_name(source.0, source.1)? else {
+            anyhow::bail!("No such file: {}/{}", source.0, source.1);
+        };
+
+        self.forget_name(source.0, source.1)?;
+        self.forget_name(target.0, target.1)?;
+        // Moving a file back to where it is stored needs no name
+        if (stored.0.as_str(), stored.1.as_str()) != target {
+            let mut stmt = self.prepare(&format!(
+                "INSERT INTO {} (filepath, filename, storepath, storename) VALUES (?, ?, ?, ?)",
+                NAMES_TABLE_NAME
+            ))?;
+            stmt.execute(params![target.0, target.1, stored.0, stored.1])?;
+        }
+        self.add_dir(target.0)?;
+
+        if self.schema_version(Area::Search) > 0 {
+            for table in [SEARCH_DOCS_TABLE_NAME, SEARCH_TERMS_TABLE_NAME] {
+                let mut stmt = self.prepare(&format!(
+                    "UPDATE {} SET filepath = ?, filename = ? WHERE filepath = ? AND filename = ?",
+                    table
+                ))?;
+                stmt.execute(params![target.0, target.1, source.0, source.1])?;
+            }
+        }
+
+        Ok(())
+    }
+
+    fn move_dir(&self, source: &str, destination: &str) -> Result<usize> {
+        if destination.starts_with(&format!("{}/", source)) || destination == source {
+            anyhow::bail!("Can't move {} into itself", source);
+        }
+        let Some((filepath, filename)) = split_path(destination) else {
+            anyhow::bail!("Invalid destination: {}", destination);
+        };
+        if self.file_exists(filepath, filename)? || self.count_files(destination)? > 0 {
+            anyhow::bail!("{} already exists", destination);
+        }
+
+        let moved = self.count_files(source)?;
+        let renamed = "$2 || substr(filepath, length($1) + 1)";
+
+        // New names first, then drop the old ones: none of the new ones are
+        // under `source`
+        self.prepare(&format!(
+            "INSERT INTO {names} (filepath, filename, storepath, storename)
+             SELECT * FROM (
+                 SELECT {renamed} AS filepath, filename, storepath, storename
+                 FROM ({stored}) WHERE {under}
+             )
+             WHERE NOT (filepath = storepath AND filename = storename)",
+            names = NAMES_TABLE_NAME,
+            renamed = renamed,
+            stored = self.stored_names_sql(),
+            under = under("filepath")
+        ))?
+        .execute(params![source, destination])?;
+        self.prepare(&format!(
+            "DELETE FROM {} WHERE {}",
+            NAMES_TABLE_NAME,
+            under("filepath")
+        ))?
+        .execute(params![source])?;
+
+        let mut updates = vec![(DIRS_TABLE_NAME, "dirpath")];
+        if self.schema_version(Area::Search) > 0 {
+            updates.push((SEARCH_DOCS_TABLE_NAME, "filepath"));
+            updates.push((SEARCH_TERMS_TABLE_NAME, "filepath"));
+        }
+        for (table, column) in updates {
+            self.prepare(&format!(
+                "UPDATE {table} SET {column} = {renamed} WHERE {under}",
+                table = table,
+                column = column,
+                renamed = renamed.replace("filepath", column),
+                under = under(column)
+            ))?
+            .execute(params![source, destination])?;
+        }
+
+        Ok(moved)
+    }
+
+    fn remove_dir(&self, dirpath: &str) -> Result<usize> {
+        let removed = self.count_files(dirpath)?;
+
+        // Versions stored under the directory and not moved out of it, and
+        // versions of files moved into it
+        self.prepare(&format!(
+            "DELETE FROM {files}
+             WHERE EXISTS (
+                 SELECT 1 FROM {names} AS n
+                 WHERE n.storepath = {files}.filepath AND n.storename = {files}.filename
+                   AND {moved_in}
+             )
+             OR ({stored_here} AND NOT EXISTS (
+                 SELECT 1 FROM {names} AS n
+                 WHERE n.storepath = {files}.filepath AND n.storename = {files}.filename
+             ))",
+            files = FILES_TABLE_NAME,
+            names = NAMES_TABLE_NAME,
+            moved_in = under("n.filepath"),
+            stored_here = under(&format!("{}.filepath", FILES_TABLE_NAME))
+        ))?
+        .execute(params![dirpath])?;
+
+        let mut deletes = vec![(NAMES_TABLE_NAME, "filepath"), (DIRS_TABLE_NAME, "dirpath")];
+        if self.schema_version(Area::Search) > 0 {
+            deletes.push((SEARCH_DOCS_TABLE_NAME, "filepath"));
+            deletes.push((SEARCH_TERMS_TABLE_NAME, "filepath"));
+        }
+        for (table, column) in deletes {
+            self.prepare(&format!("DELETE FROM {} WHERE {}", table, under(column)))?
+                .execute(params![dirpath])?;
+        }
+
+        Ok(removed)
+    }
+
+    /// Number of visible files in or below a directory
+    fn count_files(&self, dirpath: &str) -> Result<usize> {
+        let sql = format!(
+            "SELECT count(*) FROM ({}) WHERE {}",
+            self.stored_names_sql(),
+            under("filepath")
+        );
+        let count: i64 = self
+            .prepare(&sql)?
+            .query_row(params![dirpath], |row| row.get(0))?;
+        Ok(count as usize)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::tests::temp_lake;
+    use dkdc_config::LakeConfig;
+
+    #[test]
+    fn test_split_path() {
+        assert_eq!(
+            split_path("./files/notes.md"),
+            Some(("./files", "notes.md"))
+        );
+        assert_eq!(split_path("./files/sub/"), None);
+        assert_eq!(split_path("notes.md"), None);
+        assert_eq!(
+            under("dirpath"),
+            "(dirpath = $1 OR starts_with(dirpath, $1 || '/'))"
+        );
+    }
+    #[test]
+    fn test_move_file_then_read_under_new_name() {
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        let text = b"the lake stores encrypted blobs";
+        lake.add_file("./files/docs", "notes.md", text).unwrap();
+        lake.add_file("./files", "keep.md", b"unrelated").unwrap();
+
+        let moved = lake
+            .move_path("./files/docs/notes.md", "./files/archive/old.md")
+            .unwrap();
+        assert_eq!(moved, 1);
+        let file = lake.get_file("./files/archive", "old.md").unwrap().unwrap();
+        assert_eq!(file.filedata, text);
+        assert!(lake.get_file("./files/docs", "notes.md").unwrap().is_none());
+        assert_eq!(lake.list_files("./files/archive").unwrap(), ["old.md"]);
+        assert_eq!(
+            lake.list_dirs("./files", true).unwrap(),
+            ["./files/archive"]
+        );
+
+        let hits = lake.search("encrypted", None, 10).unwrap();
+        assert_eq!(hits.len(), 1);
+        assert_eq!(
+            (hits[0].filepath.as_str(), hits[0].filename.as_str()),
+            ("./files/archive", "old.md")
+        );
+        let matches = lake.grep("stores", None, false).unwrap();
+        assert_eq!(matches.len(), 1);
+        assert_eq!(matches[0].filename, "old.md");
+
+        // The old name's key still holds the moved file's versions, so a new
+        // file written there is stored under a fresh key
+        lake.add_file("./files/docs", "notes.md", b"a new file")
+            .unwrap();
+        let new = lake.get_file("./files/docs", "notes.md").unwrap().unwrap();
+        assert_eq!(new.filedata, b"a new file");
+        let file = lake.get_file("./files/archive", "old.md").unwrap().unwrap();
+        assert_eq!(file.filedata, text);
+    }
+
+    #[test]
+    fn test_move_dir() {
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        lake.add_file("./files/a/x", "one.md", b"first").unwrap();
+        lake.add_file("./files/a", "two.md", b"second").unwrap();
+        assert!(lake.move_path("./files/a", "./files/a/b").is_err());
+
+        assert_eq!(lake.move_path("./files/a", "./files/b").unwrap(), 2);
+        assert_eq!(
+            lake.list_dirs("./files", true).unwrap(),
+            ["./files/b", "./files/b/x"]
+        );
+        let one = lake.get_file("./files/b/x", "one.md").unwrap().unwrap();
+        assert_eq!(one.filedata, b"first");
+        assert!(lake.get_file("./files/a", "two.md").unwrap().is_none());
+        assert_eq!(
+            lake.grep("second", None, false).unwrap()[0].filepath,
+            "./files/b"
+        );
+    }
+
+    #[test]
+    fn test_remove_prunes_dirs() {
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        lake.add_file("./files/p/q", "r.md", b"nested note")
+            .unwrap();
+        lake.add_file("./files/s", "t.md", b"sibling note").unwrap();
+        lake.add_file("./files/s/u", "v.md", b"deeper note")
+            .unwrap();
+
+        assert_eq!(lake.remove_path("./files/p/q/r.md", false).unwrap(), 1);
+        assert!(lake.get_file("./files/p/q", "r.md").unwrap().is_none());
+        assert_eq!(
+            lake.list_dirs("./files", true).unwrap(),
+            ["./files/s", "./files/s/u"]
+        );
+        assert!(lake.search("nested", None, 10).unwrap().is_empty());
+
+        assert!(lake.remove_path("./files/s", false).is_err());
+        assert_eq!(lake.remove_path("./files/s", true).unwrap(), 2);
+        assert!(lake.list_dirs("./files", true).unwrap().is_empty());
+        assert!(lake.grep("note", None, false).unwrap().is_empty());
+        assert!(lake.remove_path("./files/s", true).is_err());
+    }
+}
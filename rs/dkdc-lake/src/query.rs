@@ -0,0 +1,298 @@
+//! Query results as streams of Arrow record batches
+
+use crate::schema::with_optional_column;
+use crate::Lake;
+use anyhow::Result;
+use dkdc_common::trace;
+use dkdc_config::{
+    ARCHIVES_TABLE_NAME, CHUNKS_TABLE_NAME, FILES_TABLE_NAME, LAKE_TABLES, SECRETS_TABLE_NAME,
+};
+use duckdb::arrow::array::{Array, AsArray, BinaryArray};
+use duckdb::arrow::datatypes::{Int64Type, SchemaRef};
+use duckdb::arrow::error::ArrowError;
+use duckdb::arrow::record_batch::{RecordBatch, RecordBatchReader};
+use std::sync::mpsc;
+use std::sync::Arc;
+use std::thread;
+
+/// Batches a query reads ahead of its consumer
+const READ_AHEAD: usize = 1;
+
+/// Columns `table_arrow` adds to decode blobs, dropped from its result
+const CODEC_COLUMN: &str = "dkdc_codec";
+const SIZE_COLUMN: &str = "dkdc_size";
+const CHUNKS_COLUMN: &str = "dkdc_chunks";
+
+/// Applied to every batch on the reading thread
+type BatchFn = Box<dyn Fn(&Lake, RecordBatch) -> Result<RecordBatch> + Send>;
+
+/// A query result, read from DuckDB one record batch at a time
+///
+/// The query runs on its own thread, over a second connection to the lake,
+/// and hands batches over through a bounded channel, so only the batches in
+/// flight are held in memory however large the result is. Dropping the
+/// stream ends the query.
+pub struct ArrowBatches {
+    schema: SchemaRef,
+    batches: mpsc::Receiver<Result<RecordBatch>>,
+}
+
+impl Iterator for ArrowBatches {
+    type Item = Result<RecordBatch, ArrowError>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        let batch = self.batches.recv().ok()?;
+        Some(batch.map_err(|e| ArrowError::ExternalError(e.into())))
+    }
+}
+
+impl RecordBatchReader for ArrowBatches {
+    fn schema(&self) -> SchemaRef {
+        self.schema.clone()
+    }
+}
+
+/// Columns holding a table's stored blobs, which are compressed and sealed
+/// (see `codec` and `envelope`)
+struct BlobColumns {
+    data: &'static str,
+    codec: &'static str,
+    size: &'static str,
+    /// Column listing the chunks a blob was split into, if the table has one
+    chunks: Option<&'static str>,
+}
+
+impl BlobColumns {
+    fn of(table: &str) -> Option<Self> {
+        let file = |chunks| BlobColumns {
+            data: "filedata",
+            codec: "filecodec",
+            size: "filesize",
+            chunks,
+        };
+        match table {
+            FILES_TABLE_NAME => Some(file(Some("filechunks"))),
+            SECRETS_TABLE_NAME | ARCHIVES_TABLE_NAME => Some(file(None)),
+            CHUNKS_TABLE_NAME => Some(BlobColumns {
+                data: "chunkdata",
+                codec: "chunkcodec",
+                size: "chunksize",
+                chunks: None,
+            }),
+            _ => None,
+        }
+    }
+}
+
+impl Lake {
+    /// Run a query and stream its result as Arrow record batches
+    ///
+    /// Rows go straight from DuckDB's vectors into Arrow buffers, so large
+    /// results (including BLOB columns) are never converted row by row.
+    /// Errors in the query are returned here, before any batch is read.
+    /// Blob columns are returned as stored; see [`Lake::table_arrow`].
+    pub fn query_arrow(&self, sql: &str) -> Result<ArrowBatches> {
+        let _span = trace::span_with("lake.query_arrow", || sql);
+        self.stream_arrow(sql, None)
+    }
+
+    /// Read one of the lake tables as Arrow, optionally projecting columns
+    ///
+    /// Only the requested columns are scanned, so leaving out `filedata`
+    /// skips reading BLOBs entirely. Blobs are decoded to their contents,
+    /// large files included, unless `raw` is set; with `raw` they are
+    /// returned as stored (compressed, sealed, or `NULL` for chunked files),
+    /// as their codec column describes.
+    pub fn table_arrow(
+        &self,
+        table: &str,
+        columns: Option<&[String]>,
+        raw: bool,
+    ) -> Result<ArrowBatches> {
+        if !LAKE_TABLES.contains(&table) {
+            anyhow::bail!(
+                "Unknown table '{}' (expected one of: {})",
+                table,
+                LAKE_TABLES.join(", ")
+            );
+        }
+
+        let selected: Option<Vec<&str>> = columns
+            .filter(|columns| !columns.is_empty())
+            .map(|columns| columns.iter().map(String::as_str).collect());
+        let projection = match &selected {
+            Some(columns) => columns
+                .iter()
+                .map(|column| quote_identifier(column))
+                .collect::<Vec<_>>()
+                .join(", "),
+            None => "*".to_string(),
+        };
+
+        let blobs = BlobColumns::of(table).filter(|blobs| {
+            !raw && selected
+                .as_ref()
+                .map_or(true, |columns| columns.contains(&blobs.data))
+        });
+        let Some(blobs) = blobs else {
+            return self.query_arrow(&format!(
+                "SELECT {} FROM {}",
+                projection,
+                self.table_ref(table)
+            ));
+        };
+
+        // Select what decoding needs after the requested columns; lakes not
+        // written to since a column was added lack it, and have no rows
+        // that need it
+        let query = |codec: &str, chunks: &str| {
+            let sql = format!(
+                "SELECT {}, {} AS {}, {} AS {}, {} AS {} FROM {}",
+                projection,
+                codec,
+                CODEC_COLUMN,
+                blobs.size,
+                SIZE_COLUMN,
+                chunks,
+                CHUNKS_COLUMN,
+                self.table_ref(table)
+            );
+            let _span = trace::span_with("lake.query_arrow", || &sql);
+            let data = blobs.data;
+            self.stream_arrow(
+                &sql,
+                Some(Box::new(move |lake: &Lake, batch| {
+                    decode_batch(lake, batch, data)
+                })),
+            )
+        };
+        with_optional_column(blobs.codec, blobs.codec, |codec| match blobs.chunks {
+            Some(chunks) => with_optional_column(chunks, chunks, |chunks| query(codec, chunks)),
+            None => query(codec, "NULL::VARCHAR"),
+        })
+    }
+
+    /// Run `sql` on a reading thread, passing each batch through `map` there
+    fn stream_arrow(&self, sql: &str, map: Option<BatchFn>) -> Result<ArrowBatches> {
+        // Statements borrow their connection, so the reading thread gets its
+        // own handle, on the same database
+        let lake = self.clone_for_reads()?;
+        let sql = sql.to_string();
+        let (started, schema) = mpsc::sync_channel::<Result<SchemaRef>>(1);
+        let (sender, batches) = mpsc::sync_channel(READ_AHEAD);
+
+        thread::spawn(move || {
+            let mut stmt = match lake.prepare(&sql) {
+                Ok(stmt) => stmt,
+                Err(e) => {
+                    let _ = started.send(Err(e));
+                    return;
+                }
+            };
+            let arrow = match stmt.query_arrow([]) {
+                Ok(arrow) => arrow,
+                Err(e) => {
+                    let _ = started.send(Err(e.into()));
+                    return;
+                }
+            };
+
+            let schema = arrow.get_schema();
+            let schema = match map {
+                // Decoding drops the columns it added
+                Some(_) => decoded_schema(&schema),
+                None => Ok(schema),
+            };
+            if started.send(schema).is_err() {
+                return;
+            }
+
+            for batch in arrow {
+                let batch = match &map {
+                    Some(map) => map(&lake, batch),
+                    None => Ok(batch),
+                };
+                let failed = batch.is_err();
+                // Fails once the stream is dropped
+                if sender.send(batch).is_err() || failed {
+                    break;
+                }
+            }
+        });
+
+        let schema = schema
+            .recv()
+            .map_err(|_| anyhow::anyhow!("Query thread exited before running the query"))??;
+        Ok(ArrowBatches { schema, batches })
+    }
+}
+
+/// Schema of a batch selected by `table_arrow` once it's decoded
+fn decoded_schema(schema: &SchemaRef) -> Result<SchemaRef> {
+    let keep: Vec<usize> = (0..schema.fields().len() - 3).collect();
+    Ok(Arc::new(schema.project(&keep)?))
+}
+
+/// Replace the stored blobs in `data` with their contents, reassembling
+/// chunked files, and drop the columns selected to decode them
+fn decode_batch(lake: &Lake, batch: RecordBatch, data: &str) -> Result<RecordBatch> {
+    let column = |name: &str| {
+        batch
+            .column_by_name(name)
+            .ok_or_else(|| anyhow::anyhow!("Column {} missing from the result", name))
+    };
+    let mismatch = |name: &str| anyhow::anyhow!("Unexpected type of column {}", name);
+
+    let index = batch.schema().index_of(data)?;
+    let stored = batch
+        .column(index)
+        .as_binary_opt::<i32>()
+        .ok_or_else(|| mismatch(data))?;
+    let codecs = column(CODEC_COLUMN)?
+        .as_string_opt::<i32>()
+        .ok_or_else(|| mismatch(CODEC_COLUMN))?;
+    let sizes = column(SIZE_COLUMN)?
+        .as_primitive_opt::<Int64Type>()
+        .ok_or_else(|| mismatch(SIZE_COLUMN))?;
+    let chunks = column(CHUNKS_COLUMN)?
+        .as_string_opt::<i32>()
+        .ok_or_else(|| mismatch(CHUNKS_COLUMN))?;
+
+    let decoded = (0..batch.num_rows())
+        .map(|row| -> Result<Option<Vec<u8>>> {
+            let size = sizes.value(row);
+            if chunks.is_valid(row) {
+                return Ok(Some(lake.read_chunks(chunks.value(row), size)?));
+            }
+            if stored.is_null(row) {
+                return Ok(None);
+            }
+            let codec = codecs.is_valid(row).then(|| codecs.value(row));
+            Ok(Some(lake.decode_blob(
+                stored.value(row).to_vec(),
+                codec,
+                size,
+            )?))
+        })
+        .collect::<Result<Vec<_>>>()?;
+
+    let mut columns = batch.columns().to_vec();
+    columns[index] = Arc::new(BinaryArray::from_iter(decoded));
+    let keep: Vec<usize> = (0..columns.len() - 3).collect();
+    Ok(RecordBatch::try_new(batch.schema(), columns)?.project(&keep)?)
+}
+
+fn quote_identifier(name: &str) -> String {
+    format!("\"{}\"", name.replace('"', "\"\""))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_quote_identifier() {
+        assert_eq!(quote_identifier("filesize"), "\"filesize\"");
+        assert_eq!(quote_identifier("a\"b"), "\"a\"\"b\"");
+    }
+}
@@ -0,0 +1,358 @@
+//! Versioned, lazily applied table schemas
+//!
+//! Each area of the lake (files, secrets, archives) owns one table and an
+//! ordered list of migrations. The version each area has reached is kept in
+//! a small `dkdc_schema` table in the SQLite catalog, read once when a
+//! [`Lake`] is opened. Migrations run on the first write to an area whose
+//! recorded version is behind, so opening a lake and reading from it never
+//! issues DDL. Reads of an area that was never written treat its table as
+//! empty.
+//!
+//! Migrations must be idempotent: lakes created before versions were
+//! recorded start at version 0 and replay every migration, and two
+//! processes may race to apply the same one.
+
+use crate::Lake;
+use anyhow::Result;
+use dkdc_common::trace;
+use dkdc_config::{
+    ARCHIVES_TABLE_NAME, CHUNKS_TABLE_NAME, DIRS_TABLE_NAME, FILES_TABLE_NAME, NAMES_TABLE_NAME,
+    SEARCH_DOCS_TABLE_NAME, SEARCH_TERMS_TABLE_NAME, SECRETS_TABLE_NAME,
+};
+use std::collections::HashMap;
+use std::path::Path;
+use std::time::Duration;
+
+/// SQLite table holding the schema version of each area
+const SCHEMA_TABLE: &str = "dkdc_schema";
+
+/// Columns shared by every blob table
+const BLOB_COLUMNS: &str = "filepath VARCHAR,
+    filename VARCHAR,
+    filedata BLOB,
+    filesize BIGINT,
+    fileupdated TIMESTAMP";
+
+/// Columns of the chunk store
+const CHUNK_COLUMNS: &str = "chunkhash VARCHAR,
+    chunkdata BLOB,
+    chunksize BIGINT,
+    chunkcodec VARCHAR";
+
+/// Columns of the full-text index (see `search`)
+const SEARCH_DOCS_COLUMNS: &str = "filepath VARCHAR,
+    filename VARCHAR,
+    filehash VARCHAR,
+    doclength INTEGER";
+const SEARCH_TERMS_COLUMNS: &str = "term VARCHAR,
+    filepath VARCHAR,
+    filename VARCHAR,
+    termfreq INTEGER";
+
+/// Columns of the directory index and moved-file names (see `paths`)
+const DIRS_COLUMNS: &str = "dirpath VARCHAR";
+const NAMES_COLUMNS: &str = "filepath VARCHAR,
+    filename VARCHAR,
+    storepath VARCHAR,
+    storename VARCHAR";
+
+/// A group of tables migrated together
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
+pub enum Area {
+    Files,
+    Secrets,
+    Archives,
+    Chunks,
+    Search,
+    Paths,
+}
+
+impl Area {
+    pub const ALL: [Area; 6] = [
+        Area::Files,
+        Area::Secrets,
+        Area::Archives,
+        Area::Chunks,
+        Area::Search,
+        Area::Paths,
+    ];
+
+    pub fn name(self) -> &'static str {
+        match self {
+            Self::Files => FILES_TABLE_NAME,
+            Self::Secrets => SECRETS_TABLE_NAME,
+            Self::Archives => ARCHIVES_TABLE_NAME,
+            Self::Chunks => CHUNKS_TABLE_NAME,
+            // Two tables, migrated together
+            Self::Search => "search",
+            Self::Paths => "paths",
+        }
+    }
+
+    fn from_name(name: &str) -> Option<Self> {
+        Self::ALL.into_iter().find(|area| area.name() == name)
+    }
+
+    /// Migrations in order; the schema version is the number applied
+    pub fn migrations(self) -> Vec<String> {
+        let create =
+            |columns: &str| format!("CREATE TABLE IF NOT EXISTS {} ({})", self.name(), columns);
+        let add_column = |column: &str| {
+            format!(
+                "ALTER TABLE {} ADD COLUMN IF NOT EXISTS {}",
+                self.name(),
+                column
+            )
+        };
+
+        match self {
+            Self::Files => vec![
+                create(BLOB_COLUMNS),
+                add_column("filehash VARCHAR"),
+                add_column("filecodec VARCHAR"),
+                add_column("filechunks VARCHAR"),
+            ],
+            Self::Secrets | Self::Archives => {
+                vec![create(BLOB_COLUMNS), add_column("filecodec VARCHAR")]
+            }
+            Self::Chunks => vec![create(CHUNK_COLUMNS)],
+            Self::Search => vec![
+                format!(
+                    "CREATE TABLE IF NOT EXISTS {} ({})",
+                    SEARCH_DOCS_TABLE_NAME, SEARCH_DOCS_COLUMNS
+                ),
+                format!(
+                    "CREATE TABLE IF NOT EXISTS {} ({})",
+                    SEARCH_TERMS_TABLE_NAME, SEARCH_TERMS_COLUMNS
+                ),
+                format!(
+                    "ALTER TABLE {} ADD COLUMN IF NOT EXISTS droppedterms BOOLEAN",
+                    SEARCH_DOCS_TABLE_NAME
+                ),
+            ],
+            // Needs `files`; the index starts from the directories in use
+            Self::Paths => vec![
+                format!(
+                    "CREATE TABLE IF NOT EXISTS {} ({})",
+                    DIRS_TABLE_NAME, DIRS_COLUMNS
+                ),
+                format!(
+                    "CREATE TABLE IF NOT EXISTS {} ({})",
+                    NAMES_TABLE_NAME, NAMES_COLUMNS
+                ),
+                format!(
+                    "INSERT INTO {dirs} (dirpath)
+                     SELECT DISTINCT filepath FROM {files}
+                     WHERE filepath NOT IN (SELECT dirpath FROM {dirs})",
+                    dirs = DIRS_TABLE_NAME,
+                    files = FILES_TABLE_NAME
+                ),
+            ],
+        }
+    }
+
+    pub fn latest_version(self) -> usize {
+        self.migrations().len()
+    }
+}
+
+impl Lake {
+    /// Bring an area's tables up to date before writing to it
+    ///
+    /// A no-op once the recorded version is current. Inside a transaction the
+    /// migrations join it and the version is recorded after it commits.
+    pub fn ensure_schema(&self, area: Area) -> Result<()> {
+        let current = self.schema_version(area);
+        let migrations = area.migrations();
+        if current >= migrations.len() {
+            return Ok(());
+        }
+
+        let _span = trace::span_with("lake.migrate", || area.name());
+        self.transaction(|lake| {
+            for sql in &migrations[current..] {
+                lake.execute(sql)?;
+            }
+            Ok(())
+        })?;
+
+        self.schema.borrow_mut().insert(area, migrations.len());
+
+        if self.in_transaction.get() {
+            self.pending_schema.borrow_mut().push(area);
+        } else {
+            self.record_schema_version(area);
+        }
+        Ok(())
+    }
+
+    /// Schema version of an area as known to this handle
+    pub fn schema_version(&self, area: Area) -> usize {
+        self.schema.borrow().get(&area).copied().unwrap_or(0)
+    }
+
+    /// Record versions for migrations applied inside a committed transaction
+    pub(crate) fn commit_schema(&self) {
+        let pending = std::mem::take(&mut *self.pending_schema.borrow_mut());
+        for area in pending {
+            self.record_schema_version(area);
+        }
+    }
+
+    /// Forget migrations applied inside a rolled-back transaction
+    pub(crate) fn rollback_schema(&self) {
+        let pending = std::mem::take(&mut *self.pending_schema.borrow_mut());
+        let mut schema = self.schema.borrow_mut();
+        for area in pending {
+            schema.remove(&area);
+        }
+    }
+
+    /// Record an area's version in the catalog
+    ///
+    /// Best effort: migrations are idempotent, so a lost record only means
+    /// they are replayed by the next writer.
+    fn record_schema_version(&self, area: Area) {
+        if let Err(e) = self.try_record_schema_version(area) {
+            eprintln!(
+                "[dkdc] failed to record {} schema version: {}",
+                area.name(),
+                e
+            );
+        }
+    }
+
+    fn try_record_schema_version(&self, area: Area) -> Result<()> {
+        let db = open_catalog(
+            &self.config.metadata_path(),
+            Duration::from_millis(self.settings.busy_timeout_ms),
+        )?;
+
+        db.execute_batch(&format!(
+            "CREATE TABLE IF NOT EXISTS {} (
+                area TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                updated TEXT NOT NULL
+            )",
+            SCHEMA_TABLE
+        ))?;
+        db.execute(
+            &format!(
+                "INSERT INTO {} (area, version, updated) VALUES (?1, ?2, datetime('now'))
+                 ON CONFLICT (area) DO UPDATE SET
+                    version = max(version, excluded.version),
+                    updated = excluded.updated",
+                SCHEMA_TABLE
+            ),
+            rusqlite::params![area.name(), self.schema_version(area) as i64],
+        )?;
+
+        Ok(())
+    }
+}
+
+/// Read recorded schema versions; a catalog without the table has none
+pub(crate) fn load_versions(db: &rusqlite::Connection) -> Result<HashMap<Area, usize>> {
+    let sql = format!("SELECT area, version FROM {}", SCHEMA_TABLE);
+    let mut stmt = match db.prepare(&sql) {
+        Ok(stmt) => stmt,
+        Err(e) if e.to_string().contains("no such table") => return Ok(HashMap::new()),
+        Err(e) => return Err(e.into()),
+    };
+
+    let rows = stmt.query_map([], |row| {
+        Ok((row.get::<_, String>(0)?, row.get::<_, i64>(1)?))
+    })?;
+
+    let mut versions = HashMap::new();
+    for row in rows {
+        let (name, version) = row?;
+        if let Some(area) = Area::from_name(&name) {
+            versions.insert(area, version.max(0) as usize);
+        }
+    }
+
+    Ok(versions)
+}
+
+/// Open the SQLite catalog directly, waiting up to `busy_timeout` for locks
+pub(crate) fn open_catalog(path: &Path, busy_timeout: Duration) -> Result<rusqlite::Connection> {
+    let db = rusqlite::Connection::open(path)?;
+    db.busy_timeout(busy_timeout)?;
+    Ok(db)
+}
+
+/// Open the SQLite catalog for reading only
+pub(crate) fn open_catalog_read_only(
+    path: &Path,
+    busy_timeout: Duration,
+) -> Result<rusqlite::Connection> {
+    let db = rusqlite::Connection::open_with_flags(
+        path,
+        rusqlite::OpenFlags::SQLITE_OPEN_READ_ONLY | rusqlite::OpenFlags::SQLITE_OPEN_NO_MUTEX,
+    )?;
+    db.busy_timeout(busy_timeout)?;
+    Ok(db)
+}
+
+/// Run a read, treating a table that was never created as empty
+pub(crate) fn read_or_empty<T: Default>(op: impl FnOnce() -> Result<T>) -> Result<T> {
+    match op() {
+        Err(e) if is_missing_table(&e) => Ok(T::default()),
+        result => result,
+    }
+}
+
+/// Run a read that selects an optional column, with `NULL` standing in for
+/// it on tables that predate the column
+///
+/// `op` gets the expression to select: `expr` first, then the fallback.
+/// Only DuckDB's error for that missing column falls back; other errors,
+/// even ones mentioning the column, are returned.
+pub(crate) fn with_optional_column<T>(
+    column: &str,
+    expr: &str,
+    op: impl Fn(&str) -> Result<T>,
+) -> Result<T> {
+    match op(expr) {
+        Err(e) if is_missing_column(&e, column) => op("NULL::VARCHAR"),
+        result => result,
+    }
+}
+
+pub(crate) fn is_missing_table(e: &anyhow::Error) -> bool {
+    let message = e.to_string();
+    message.contains("Table with name") && message.contains("does not exist")
+}
+
+/// Whether `e` is DuckDB's binder error for a reference to `column`, which
+/// the table doesn't have
+pub(crate) fn is_missing_column(e: &anyhow::Error, column: &str) -> bool {
+    e.to_string()
+        .contains(&format!("Referenced column \"{}\" not found", column))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_read_or_empty() {
+        let missing: Result<Vec<String>> =
+            read_or_empty(|| anyhow::bail!("Catalog Error: Table with name files does not exist!"));
+        assert!(missing.unwrap().is_empty());
+
+        let other: Result<Vec<String>> = read_or_empty(|| anyhow::bail!("IO Error"));
+        assert!(other.is_err());
+    }
+
+    #[test]
+    fn test_is_missing_column() {
+        let missing = anyhow::anyhow!(
+            "Binder Error: Referenced column \"filehash\" not found in FROM clause!"
+        );
+        assert!(is_missing_column(&missing, "filehash"));
+        let conflict = anyhow::anyhow!("Transaction conflict on filehash");
+        assert!(!is_missing_column(&conflict, "filehash"));
+    }
+}
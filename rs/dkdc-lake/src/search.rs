@@ -0,0 +1,554 @@
+//! Full-text search over text files
+//!
+//! An inverted index is kept in two lake tables, so it is encrypted and
+//! versioned with everything else. `search_docs` has one row per indexed
+//! file (its latest version's hash, length in terms, and whether any terms
+//! were too long to index), and `search_terms`
+//! one row per (term, file) with the term's frequency. Adding a file
+//! replaces its rows in the same transaction, so the index follows the
+//! latest versions without a separate indexing pass; `reindex_files`
+//! rebuilds it from scratch (e.g. for files added before it existed).
+//!
+//! Only text is indexed: valid UTF-8 without NUL bytes, below the chunking
+//! threshold. Terms are lowercased runs of alphanumeric characters. Binary
+//! files get a `search_docs` row without a length and no terms, recording
+//! that there is nothing to find in them; large text files get no row.
+//!
+//! `search` ranks files by BM25 from the index alone and only decrypts the
+//! top results for snippets. `grep` uses the index to narrow candidates to
+//! files containing every term of the pattern, and also scans every file
+//! whose latest version the index doesn't cover: large text files, files
+//! written while indexing was off, before the index existed, or by an
+//! import, and files with terms too long to index, which the pattern may be
+//! part of.
+
+use crate::chunks::CHUNK_THRESHOLD;
+use crate::quote_literal;
+use crate::schema::{is_missing_table, read_or_empty, with_optional_column, Area};
+use crate::Lake;
+use anyhow::Result;
+use dkdc_common::trace;
+use dkdc_config::{SEARCH_DOCS_TABLE_NAME, SEARCH_TERMS_TABLE_NAME};
+use duckdb::params;
+
+/// BM25 term frequency saturation
+const BM25_K1: f64 = 1.2;
+/// BM25 document length normalization
+const BM25_B: f64 = 0.75;
+
+const MIN_TERM_LEN: usize = 2;
+const MAX_TERM_LEN: usize = 64;
+
+/// Characters of context on each side of a snippet's match
+const SNIPPET_CONTEXT: usize = 60;
+
+/// A ranked search result
+#[derive(Debug, Clone)]
+pub struct SearchHit {
+    pub filepath: String,
+    pub filename: String,
+    pub score: f64,
+    /// The first line mentioning a query term, trimmed around it
+    pub snippet: Option<String>,
+}
+
+/// A line matching a `grep` pattern
+#[derive(Debug, Clone)]
+pub struct GrepMatch {
+    pub filepath: String,
+    pub filename: String,
+    /// 1-based
+    pub line_number: usize,
+    pub line: String,
+}
+
+/// Split text into index terms
+pub fn tokenize(text: &str) -> Vec<String> {
+    text.split(|c: char| !c.is_alphanumeric())
+        .filter(|token| (MIN_TERM_LEN..=MAX_TERM_LEN).contains(&token.chars().count()))
+        .map(str::to_lowercase)
+        .collect()
+}
+
+/// Whether `text` has runs too long to be terms (base64, hex, URLs), which
+/// `tokenize` drops
+fn has_long_terms(text: &str) -> bool {
+    text.split(|c: char| !c.is_alphanumeric())
+        .any(|token| token.len() > MAX_TERM_LEN && token.chars().count() > MAX_TERM_LEN)
+}
+
+/// `data` as text, if it is text: valid UTF-8 without NUL bytes
+fn as_text(data: &[u8]) -> Option<&str> {
+    if data.contains(&0) {
+        return None;
+    }
+    std::str::from_utf8(data).ok()
+}
+
+/// The text of `data` if it should be indexed
+fn indexable_text(data: &[u8]) -> Option<&str> {
+    if data.len() >= CHUNK_THRESHOLD {
+        return None;
+    }
+    as_text(data)
+}
+
+impl Lake {
+    /// Replace the index entries of a file with those of its new contents
+    ///
+    /// Must run inside the transaction that writes the file version.
+    pub(crate) fn index_file(&self, filepath: &str, filename: &str, data: &[u8]) -> Result<()> {
+        if !self.settings.search_index {
+            return Ok(());
+        }
+        let _span = trace::span_with("search.index", || format!("{}/{}", filepath, filename));
+        self.ensure_schema(Area::Search)?;
+        self.unindex_file(filepath, filename)?;
+
+        let mut docs = self.prepare(&format!(
+            "INSERT INTO {} (filepath, filename, filehash, doclength, droppedterms)
+             VALUES (?, ?, ?, ?, ?)",
+            SEARCH_DOCS_TABLE_NAME
+        ))?;
+        let Some(text) = indexable_text(data) else {
+            // Binary files are recorded so `grep` can skip them; large text
+            // files aren't, so it scans them
+            if as_text(data).is_none() {
+                let hash = crate::files::file_hash(data);
+                docs.execute(params![filepath, filename, hash, None::<i64>, false])?;
+            }
+            return Ok(());
+        };
+        let terms = tokenize(text);
+        docs.execute(params![
+            filepath,
+            filename,
+            crate::files::file_hash(data),
+            terms.len() as i64,
+            has_long_terms(text)
+        ])?;
+
+        // Terms contain no spaces, so they travel as one string and DuckDB
+        // counts them, instead of one statement per term
+        let mut stmt = self.prepare(&format!(
+            "INSERT INTO {} (term, filepath, filename, termfreq)
+             SELECT term, ?, ?, count(*)
+             FROM (SELECT unnest(string_split(?, ' ')) AS term)
+             WHERE term <> ''
+             GROUP BY term",
+            SEARCH_TERMS_TABLE_NAME
+        ))?;
+        stmt.execute(params![filepath, filename, terms.join(" ")])?;
+
+        Ok(())
+    }
+
+    /// Remove a file from the index
+    ///
+    /// Runs inside write transactions, where a failed statement would abort
+    /// the transaction, so lakes without the index are skipped up front.
+    pub(crate) fn unindex_file(&self, filepath: &str, filename: &str) -> Result<()> {
+        if self.schema_version(Area::Search) == 0 {
+            return Ok(());
+        }
+        for table in [SEARCH_DOCS_TABLE_NAME, SEARCH_TERMS_TABLE_NAME] {
+            let sql = format!("DELETE FROM {} WHERE filepath = ? AND filename = ?", table);
+            self.prepare(&sql)?.execute(params![filepath, filename])?;
+        }
+        Ok(())
+    }
+
+    /// Rebuild the index from the latest version of every file, returning
+    /// the number of files indexed; the directory index is rebuilt too
+    ///
+    /// Large files are read too, to record the binary ones `grep` can skip.
+    pub fn reindex_files(&self) -> Result<usize> {
+        let _span = trace::span("search.reindex");
+        self.ensure_schema(Area::Search)?;
+        self.reindex_dirs()?;
+
+        let names: Vec<(String, String)> = read_or_empty(|| {
+            self.with_visible_files(|files| {
+                let mut stmt = self.prepare(&format!(
+                    "SELECT DISTINCT filepath, filename FROM {}",
+                    files
+                ))?;
+                let mut rows = stmt.query([])?;
+                let mut names = Vec::new();
+                while let Some(row) = rows.next()? {
+                    names.push((row.get(0)?, row.get(1)?));
+                }
+                Ok(names)
+            })
+        })?;
+
+        self.transaction(|lake| {
+            lake.execute(&format!(
+                "DELETE FROM {}; DELETE FROM {};",
+                SEARCH_DOCS_TABLE_NAME, SEARCH_TERMS_TABLE_NAME
+            ))?;
+
+            let mut indexed = 0;
+            for (filepath, filename) in &names {
+                if let Some(file) = lake.get_file(filepath, filename)? {
+                    lake.index_file(filepath, filename, &file.filedata)?;
+                    if indexable_text(&file.filedata).is_some() {
+                        indexed += 1;
+                    }
+                }
+            }
+            Ok(indexed)
+        })
+    }
+
+    /// Files best matching `query`, ranked by BM25, optionally only under
+    /// `filepath`
+    pub fn search(
+        &self,
+        query: &str,
+        filepath: Option<&str>,
+        limit: usize,
+    ) -> Result<Vec<SearchHit>> {
+        let _span = trace::span_with("search.query", || query);
+        let terms = tokenize(query);
+        if terms.is_empty() {
+            return Ok(Vec::new());
+        }
+
+        let sql = format!(
+            "WITH query AS (SELECT DISTINCT unnest(string_split(?, ' ')) AS term),
+             stats AS (SELECT count(doclength) AS n, avg(doclength) AS avgdl FROM {docs}),
+             postings AS (
+                 SELECT * FROM {terms}
+                 WHERE term IN (SELECT term FROM query) {path_filter}
+             ),
+             df AS (SELECT term, count(*) AS df FROM postings GROUP BY term)
+             SELECT p.filepath, p.filename,
+                    sum(
+                        ln(1 + (stats.n - df.df + 0.5) / (df.df + 0.5))
+                        * p.termfreq * ({k1} + 1)
+                        / (p.termfreq + {k1} * (1 - {b} + {b} * d.doclength / stats.avgdl))
+                    ) AS score
+             FROM postings p
+             JOIN df USING (term)
+             JOIN {docs} d ON d.filepath = p.filepath AND d.filename = p.filename
+             CROSS JOIN stats
+             GROUP BY p.filepath, p.filename
+             ORDER BY score DESC, p.filepath, p.filename
+             LIMIT {limit}",
+            docs = self.table_ref(SEARCH_DOCS_TABLE_NAME),
+            terms = self.table_ref(SEARCH_TERMS_TABLE_NAME),
+            path_filter = path_filter(filepath),
+            k1 = BM25_K1,
+            b = BM25_B,
+            limit = limit
+        );
+
+        let mut hits = read_or_empty(|| {
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![terms.join(" ")])?;
+            let mut hits = Vec::new();
+            while let Some(row) = rows.next()? {
+                hits.push(SearchHit {
+                    filepath: row.get(0)?,
+                    filename: row.get(1)?,
+                    score: row.get(2)?,
+                    snippet: None,
+                });
+            }
+            Ok(hits)
+        })?;
+
+        // Only the results are decrypted, for their snippets
+        for hit in &mut hits {
+            if let Some(file) = self.get_file(&hit.filepath, &hit.filename)? {
+                hit.snippet = indexable_text(&file.filedata).and_then(|text| snippet(text, &terms));
+            }
+        }
+
+        Ok(hits)
+    }
+
+    /// Lines of text files containing `pattern`, optionally only under
+    /// `filepath`
+    ///
+    /// The index narrows the search to files containing every term of the
+    /// pattern (the first and last may be partial words), and only those,
+    /// plus the files the index doesn't cover, are read and scanned.
+    pub fn grep(
+        &self,
+        pattern: &str,
+        filepath: Option<&str>,
+        ignore_case: bool,
+    ) -> Result<Vec<GrepMatch>> {
+        let _span = trace::span_with("search.grep", || pattern);
+        let terms = tokenize(pattern);
+        let mut candidates = self.grep_candidates(pattern, &terms, filepath)?;
+        candidates.extend(self.unindexed_files(filepath)?);
+        candidates.sort();
+        candidates.dedup();
+
+        let needle = if ignore_case {
+            pattern.to_lowercase()
+        } else {
+            pattern.to_string()
+        };
+        let mut matches = Vec::new();
+        for (filepath, filename) in candidates {
+            let Some(file) = self.get_file(&filepath, &filename)? else {
+                continue;
+            };
+            let Some(text) = as_text(&file.filedata) else {
+                continue;
+            };
+
+            for (i, line) in text.lines().enumerate() {
+                let found = if ignore_case {
+                    line.to_lowercase().contains(&needle)
+                } else {
+                    line.contains(&needle)
+                };
+                if found {
+                    matches.push(GrepMatch {
+                        filepath: filepath.clone(),
+                        filename: filename.clone(),
+                        line_number: i + 1,
+                        line: line.to_string(),
+                    });
+                }
+            }
+        }
+
+        Ok(matches)
+    }
+
+    /// Indexed files that may contain `pattern`
+    ///
+    /// Files with terms too long to index are always candidates, as the
+    /// pattern may be inside one of them.
+    fn grep_candidates(
+        &self,
+        pattern: &str,
+        terms: &[String],
+        filepath: Option<&str>,
+    ) -> Result<Vec<(String, String)>> {
+        let query = |dropped: &str| -> Result<Vec<(String, String)>> {
+            let sql = self.grep_candidates_sql(pattern, terms, filepath, dropped);
+            let mut stmt = self.prepare(&format!("{} ORDER BY ALL", sql))?;
+            let mut rows = stmt.query([])?;
+            let mut candidates = Vec::new();
+            while let Some(row) = rows.next()? {
+                candidates.push((row.get(0)?, row.get(1)?));
+            }
+            Ok(candidates)
+        };
+
+        read_or_empty(|| {
+            with_optional_column("droppedterms", "droppedterms", |column| {
+                // Files indexed before this was recorded may have dropped terms
+                if column == "droppedterms" {
+                    query("droppedterms IS NOT false")
+                } else {
+                    query("true")
+                }
+            })
+        })
+    }
+
+    /// SQL selecting the indexed files that may contain `pattern`, where
+    /// `dropped` is the condition for files with terms too long to index
+    fn grep_candidates_sql(
+        &self,
+        pattern: &str,
+        terms: &[String],
+        filepath: Option<&str>,
+        dropped: &str,
+    ) -> String {
+        if terms.is_empty() {
+            format!(
+                "SELECT filepath, filename FROM {} WHERE doclength IS NOT NULL {}",
+                self.table_ref(SEARCH_DOCS_TABLE_NAME),
+                path_filter(filepath)
+            )
+        } else {
+            // Terms at the pattern's edges may be cut mid-word
+            let starts_mid_word = pattern.starts_with(|c: char| c.is_alphanumeric());
+            let ends_mid_word = pattern.ends_with(|c: char| c.is_alphanumeric());
+            let last = terms.len() - 1;
+
+            let with_terms = terms
+                .iter()
+                .enumerate()
+                .map(|(i, term)| {
+                    let prefix = if i == 0 && starts_mid_word { "%" } else { "" };
+                    let suffix = if i == last && ends_mid_word { "%" } else { "" };
+                    format!(
+                        "SELECT DISTINCT filepath, filename FROM {} WHERE term LIKE {} {}",
+                        self.table_ref(SEARCH_TERMS_TABLE_NAME),
+                        quote_literal(&format!("{}{}{}", prefix, term, suffix)),
+                        path_filter(filepath)
+                    )
+                })
+                .collect::<Vec<_>>()
+                .join(" INTERSECT ");
+
+            format!(
+                "SELECT filepath, filename FROM ({})
+                 UNION
+                 SELECT filepath, filename FROM {} WHERE doclength IS NOT NULL AND {} {}",
+                with_terms,
+                self.table_ref(SEARCH_DOCS_TABLE_NAME),
+                dropped,
+                path_filter(filepath)
+            )
+        }
+    }
+
+    /// Files whose latest version has no index entry, which `grep` scans
+    /// whatever the pattern
+    fn unindexed_files(&self, filepath: Option<&str>) -> Result<Vec<(String, String)>> {
+        let query = |hash: &str, uncovered: &str| -> Result<Vec<(String, String)>> {
+            self.with_visible_files(|files| {
+                let sql = format!(
+                    "SELECT filepath, filename
+                     FROM (
+                         SELECT filepath, filename, {} AS filehash
+                         FROM {}
+                         WHERE true {}
+                         GROUP BY filepath, filename
+                     ) AS f
+                     WHERE {}
+                     ORDER BY ALL",
+                    hash,
+                    files,
+                    path_filter(filepath),
+                    uncovered
+                );
+                let mut stmt = self.prepare(&sql)?;
+                let mut rows = stmt.query([])?;
+                let mut names = Vec::new();
+                while let Some(row) = rows.next()? {
+                    names.push((row.get(0)?, row.get(1)?));
+                }
+                Ok(names)
+            })
+        };
+
+        // Versions written before hashing match any entry for their name
+        let uncovered = format!(
+            "NOT EXISTS (
+                 SELECT 1 FROM {} AS d
+                 WHERE d.filepath = f.filepath AND d.filename = f.filename
+                   AND (f.filehash IS NULL OR d.filehash = f.filehash)
+             )",
+            self.table_ref(SEARCH_DOCS_TABLE_NAME)
+        );
+        read_or_empty(|| {
+            with_optional_column("filehash", "arg_max(filehash, rowid)", |hash| {
+                match query(hash, &uncovered) {
+                    // No index (yet, or at this snapshot) covers nothing
+                    Err(e)
+                        if is_missing_table(&e)
+                            && e.to_string().contains(SEARCH_DOCS_TABLE_NAME) =>
+                    {
+                        query(hash, "true")
+                    }
+                    result => result,
+                }
+            })
+        })
+    }
+}
+
+fn path_filter(filepath: Option<&str>) -> String {
+    match filepath {
+        Some(path) => format!(
+            "AND (filepath = {0} OR starts_with(filepath, {0} || '/'))",
+            quote_literal(path)
+        ),
+        None => String::new(),
+    }
+}
+
+/// The first line containing one of `terms`, trimmed to some context
+/// around the match
+fn snippet(text: &str, terms: &[String]) -> Option<String> {
+    text.lines().find_map(|line| {
+        // Lowercasing can change a character's length (e.g. 'İ' becomes two
+        // characters), so note which character of the line each byte of the
+        // lowercased line came from
+        let mut lower = String::with_capacity(line.len());
+        let mut origin = Vec::with_capacity(line.len());
+        for (i, c) in line.chars().enumerate() {
+            lower.extend(c.to_lowercase());
+            origin.resize(lower.len(), i);
+        }
+        let at = terms
+            .iter()
+            .filter_map(|term| lower.find(term.as_str()))
+            .min()?;
+        let at = origin[at];
+        let chars: Vec<char> = line.chars().collect();
+        let start = at.saturating_sub(SNIPPET_CONTEXT);
+        let end = (at + SNIPPET_CONTEXT).min(chars.len());
+
+        let mut snippet: String = chars[start..end].iter().collect();
+        if start > 0 {
+            snippet.insert_str(0, "...");
+        }
+        if end < chars.len() {
+            snippet.push_str("...");
+        }
+        Some(snippet.trim().to_string())
+    })
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::tests::temp_lake;
+    use dkdc_config::LakeConfig;
+
+    #[test]
+    fn test_tokenize_and_snippet() {
+        assert_eq!(
+            tokenize("Hello, DuckDB-lake! a über_größe"),
+            ["hello", "duckdb", "lake", "über", "größe"]
+        );
+        assert!(indexable_text(b"binary\0data").is_none());
+
+        let text = "intro line\nthe Lake stores encrypted blobs\n";
+        assert_eq!(
+            snippet(text, &["lake".to_string()]).as_deref(),
+            Some("the Lake stores encrypted blobs")
+        );
+        assert_eq!(path_filter(None), "");
+
+        // Lowercasing 'İ' adds a character before the match
+        let text = format!("{}lake", "İ".repeat(100));
+        let trimmed = snippet(&text, &["lake".to_string()]).unwrap();
+        assert!(trimmed.ends_with("lake"));
+        assert!(indexable_text(&vec![b'a'; CHUNK_THRESHOLD]).is_none());
+        assert!(as_text(&vec![b'a'; CHUNK_THRESHOLD]).is_some());
+    }
+
+    #[test]
+    fn test_grep_inside_long_terms() {
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        let long = format!("{}abc123{}", "x".repeat(50), "y".repeat(50));
+        assert!(has_long_terms(&long) && !has_long_terms("short words only"));
+        lake.add_file(
+            "./files",
+            "token.txt",
+            format!("key: {}\n", long).as_bytes(),
+        )
+        .unwrap();
+        lake.add_file("./files", "other.txt", b"nothing here\n")
+            .unwrap();
+
+        let matches = lake.grep("abc123", None, false).unwrap();
+        assert_eq!(matches.len(), 1);
+        assert_eq!(matches[0].filename, "token.txt");
+        assert_eq!(matches[0].line_number, 1);
+    }
+}
@@ -1,93 +1,158 @@
+use crate::schema::{read_or_empty, with_optional_column, Area};
 use crate::Lake;
 use anyhow::Result;
+use dkdc_common::trace;
 use dkdc_config::SECRETS_TABLE_NAME;
 use duckdb::params;
 
 impl Lake {
-    pub fn create_secrets_table(&self) -> Result<()> {
-        let sql = format!(
-            "CREATE TABLE IF NOT EXISTS {} (
-                filepath VARCHAR,
-                filename VARCHAR,
-                filedata BLOB,
-                filesize BIGINT,
-                fileupdated TIMESTAMP
-            )",
-            SECRETS_TABLE_NAME
-        );
-        self.execute(&sql)?;
-        Ok(())
-    }
-
     pub fn set_secret(&self, name: &str, value: &[u8]) -> Result<()> {
+        let _span = trace::span("secrets.set");
+        self.ensure_schema(Area::Secrets)?;
         let sql = format!(
-            "INSERT INTO {} (filepath, filename, filedata, filesize, fileupdated)
-             VALUES (?, ?, ?, ?, ?)",
+            "INSERT INTO {} (filepath, filename, filedata, filesize, fileupdated, filecodec)
+             VALUES (?, ?, ?, ?, ?, ?)",
             SECRETS_TABLE_NAME
         );
 
-        let mut stmt = self.prepare(&sql)?;
         use chrono::Utc;
-        stmt.execute(params![
-            "./secrets",
-            name,
-            value,
-            value.len() as i64,
-            Utc::now().to_rfc3339(),
-        ])?;
-
-        Ok(())
+        let (stored, codec) = self.encode_blob(name, value)?;
+        self.with_retry(|lake| {
+            let mut stmt = lake.prepare(&sql)?;
+            stmt.execute(params![
+                "./secrets",
+                name,
+                stored.as_ref(),
+                value.len() as i64,
+                Utc::now().to_rfc3339(),
+                codec,
+            ])?;
+            Ok(())
+        })
     }
 
     pub fn get_secret(&self, name: &str) -> Result<Option<Vec<u8>>> {
-        let sql = format!(
-            "SELECT filedata
-             FROM {}
-             WHERE filepath = './secrets' AND filename = ?
-             ORDER BY fileupdated DESC
-             LIMIT 1",
-            SECRETS_TABLE_NAME
-        );
+        let _span = trace::span("secrets.get");
+        let query = |codec_column: &str| -> Result<Option<Vec<u8>>> {
+            let sql = format!(
+                "SELECT filedata, filesize, {} AS filecodec
+                 FROM {}
+                 WHERE filepath = './secrets' AND filename = ?
+                 ORDER BY rowid DESC
+                 LIMIT 1",
+                codec_column,
+                self.table_ref(SECRETS_TABLE_NAME)
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![name])?;
 
-        let mut stmt = self.prepare(&sql)?;
-        let mut rows = stmt.query(params![name])?;
+            if let Some(row) = rows.next()? {
+                let (data, size) = (row.get(0)?, row.get(1)?);
+                let codec: Option<String> = row.get(2)?;
+                Ok(Some(self.decode_blob(data, codec.as_deref(), size)?))
+            } else {
+                Ok(None)
+            }
+        };
 
-        if let Some(row) = rows.next()? {
-            Ok(Some(row.get(0)?))
-        } else {
-            Ok(None)
-        }
+        read_or_empty(|| with_optional_column("filecodec", "filecodec", query))
     }
 
     pub fn list_secrets(&self) -> Result<Vec<String>> {
-        let sql = format!(
-            "SELECT DISTINCT filename
-             FROM {}
-             WHERE filepath = './secrets'
-             ORDER BY filename",
-            SECRETS_TABLE_NAME
-        );
+        let _span = trace::span("secrets.list");
+        read_or_empty(|| {
+            let sql = format!(
+                "SELECT DISTINCT filename
+                 FROM {}
+                 WHERE filepath = './secrets'
+                 ORDER BY filename",
+                self.table_ref(SECRETS_TABLE_NAME)
+            );
 
-        let mut stmt = self.prepare(&sql)?;
-        let mut rows = stmt.query([])?;
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query([])?;
 
-        let mut secrets = Vec::new();
-        while let Some(row) = rows.next()? {
-            secrets.push(row.get(0)?);
-        }
+            let mut secrets = Vec::new();
+            while let Some(row) = rows.next()? {
+                secrets.push(row.get(0)?);
+            }
 
-        Ok(secrets)
+            Ok(secrets)
+        })
+    }
+
+    /// Latest values of all secrets whose names start with `prefix`, by name
+    ///
+    /// One query for every secret, instead of a `get_secret` per name. The
+    /// latest row is taken whole: its codec is `NULL` for raw bytes, which a
+    /// per-column `arg_max` would skip in favour of an older row's codec.
+    pub fn secrets_with_prefix(&self, prefix: Option<&str>) -> Result<Vec<(String, Vec<u8>)>> {
+        let _span = trace::span("secrets.with_prefix");
+        let query = |codec_column: &str| -> Result<Vec<(String, Vec<u8>)>> {
+            let sql = format!(
+                "SELECT filename, filedata, filesize, {} AS filecodec
+                 FROM {}
+                 WHERE filepath = './secrets' AND starts_with(filename, ?)
+                 QUALIFY row_number() OVER (PARTITION BY filename ORDER BY rowid DESC) = 1
+                 ORDER BY filename",
+                codec_column,
+                self.table_ref(SECRETS_TABLE_NAME)
+            );
+
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![prefix.unwrap_or("")])?;
+
+            let mut secrets = Vec::new();
+            while let Some(row) = rows.next()? {
+                let (data, size) = (row.get(1)?, row.get(2)?);
+                let codec: Option<String> = row.get(3)?;
+                secrets.push((row.get(0)?, self.decode_blob(data, codec.as_deref(), size)?));
+            }
+
+            Ok(secrets)
+        };
+
+        read_or_empty(|| with_optional_column("filecodec", "filecodec", query))
     }
 
     pub fn delete_secret(&self, name: &str) -> Result<bool> {
+        let _span = trace::span("secrets.delete");
         let sql = format!(
             "DELETE FROM {} WHERE filepath = './secrets' AND filename = ?",
             SECRETS_TABLE_NAME
         );
 
-        let mut stmt = self.prepare(&sql)?;
-        let count = stmt.execute(params![name])?;
+        let count = read_or_empty(|| {
+            self.with_retry(|lake| {
+                let mut stmt = lake.prepare(&sql)?;
+                Ok(stmt.execute(params![name])?)
+            })
+        })?;
 
         Ok(count > 0)
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use crate::tests::temp_lake;
+    use dkdc_config::LakeConfig;
+
+    #[test]
+    fn test_latest_raw_secret_after_compressed() {
+        let settings = LakeConfig {
+            compression: true,
+            ..LakeConfig::default()
+        };
+        let (_home, lake) = temp_lake(settings);
+
+        // Stored with zstd, then small enough to be stored raw
+        lake.set_secret("token", &[b'a'; 4096]).unwrap();
+        lake.set_secret("token", b"short").unwrap();
+
+        let secrets = lake.secrets_with_prefix(None).unwrap();
+        assert_eq!(secrets, [("token".to_string(), b"short".to_vec())]);
+        assert_eq!(lake.get_secret("token").unwrap().unwrap(), b"short");
+    }
+}
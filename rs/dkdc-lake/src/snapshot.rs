@@ -0,0 +1,253 @@
+//! Snapshot-pinned reads and time travel
+//!
+//! Every commit to the lake creates a DuckLake snapshot. A [`Lake`] pinned
+//! with [`Lake::at`] reads every table as of one snapshot, so a sequence of
+//! reads sees a single consistent state while other processes keep writing,
+//! and older states can be read back without restoring anything.
+//!
+//! Within a snapshot, the latest version of a file is the one inserted last
+//! (the highest DuckLake `rowid`), not the one with the newest
+//! `fileupdated`, which comes from the writer's wall clock.
+
+use crate::Lake;
+use anyhow::Result;
+use chrono::{DateTime, NaiveDate, NaiveDateTime, Utc};
+use dkdc_common::trace;
+use duckdb::params;
+use std::str::FromStr;
+
+/// A point in the lake's history to read from
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq)]
+pub enum AsOf {
+    /// The latest snapshot at the time of pinning
+    #[default]
+    Latest,
+    /// A DuckLake snapshot id
+    Snapshot(i64),
+    /// The latest snapshot committed at or before a time
+    Timestamp(DateTime<Utc>),
+}
+
+impl FromStr for AsOf {
+    type Err = anyhow::Error;
+
+    /// Parse `latest`, a snapshot id, or a timestamp (RFC 3339, or a UTC
+    /// `YYYY-MM-DD[ HH:MM:SS]`)
+    fn from_str(s: &str) -> Result<Self> {
+        let s = s.trim();
+        if s.eq_ignore_ascii_case("latest") {
+            return Ok(Self::Latest);
+        }
+        if let Ok(id) = s.parse::<i64>() {
+            return Ok(Self::Snapshot(id));
+        }
+        if let Some(time) = try_parse_time(s) {
+            return Ok(Self::Timestamp(time));
+        }
+
+        anyhow::bail!(
+            "Invalid point in time '{}': expected a snapshot id, 'latest', or a timestamp like 2025-01-31T12:00:00Z",
+            s
+        )
+    }
+}
+
+/// Parse a timestamp: RFC 3339, or a UTC `YYYY-MM-DD[ HH:MM:SS]`
+pub fn parse_time(s: &str) -> Result<DateTime<Utc>> {
+    try_parse_time(s.trim()).ok_or_else(|| {
+        anyhow::anyhow!(
+            "Invalid timestamp '{}': expected e.g. 2025-01-31T12:00:00Z or 2025-01-31",
+            s
+        )
+    })
+}
+
+fn try_parse_time(s: &str) -> Option<DateTime<Utc>> {
+    if let Ok(time) = DateTime::parse_from_rfc3339(s) {
+        return Some(time.with_timezone(&Utc));
+    }
+    for format in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"] {
+        if let Ok(time) = NaiveDateTime::parse_from_str(s, format) {
+            return Some(time.and_utc());
+        }
+    }
+    NaiveDate::parse_from_str(s, "%Y-%m-%d")
+        .ok()
+        .map(|date| date.and_hms_opt(0, 0, 0).unwrap().and_utc())
+}
+
+/// A committed DuckLake snapshot
+#[derive(Debug, Clone)]
+pub struct Snapshot {
+    pub id: i64,
+    pub time: DateTime<Utc>,
+}
+
+impl Lake {
+    /// Pin all reads through this handle to a point in the lake's history
+    ///
+    /// Pinning to [`AsOf::Latest`] freezes the current state, which is what
+    /// multi-file reads such as dumps and exports use to stay consistent.
+    /// Writes through a pinned handle fail.
+    pub fn at(mut self, as_of: AsOf) -> Result<Self> {
+        self.pin(as_of)?;
+        Ok(self)
+    }
+
+    /// Re-pin a handle in place, e.g. a long-lived reader moving to the
+    /// latest snapshot before each request
+    pub fn pin(&mut self, as_of: AsOf) -> Result<()> {
+        self.snapshot = self.resolve_snapshot(as_of)?;
+        Ok(())
+    }
+
+    /// Read the live state again, as a handle that was never pinned
+    pub fn unpin(&mut self) {
+        self.snapshot = None;
+    }
+
+    /// Snapshot this handle is pinned to, if any
+    pub fn snapshot(&self) -> Option<i64> {
+        self.snapshot
+    }
+
+    /// Resolve a point in time to a snapshot id
+    ///
+    /// Returns `None` for a lake that has never been written to.
+    pub fn resolve_snapshot(&self, as_of: AsOf) -> Result<Option<i64>> {
+        let _span = trace::span_with("lake.resolve_snapshot", || format!("{:?}", as_of));
+        if self.empty {
+            return match as_of {
+                AsOf::Latest => Ok(None),
+                _ => anyhow::bail!("Lake at {} has no snapshots", self.dir()),
+            };
+        }
+
+        match as_of {
+            AsOf::Latest => Ok(Some(self.current_snapshot()?)),
+            AsOf::Snapshot(id) => {
+                let exists = self.connection.query_row(
+                    "SELECT count(*) FROM ducklake_snapshots('data') WHERE snapshot_id = ?",
+                    params![id],
+                    |row| row.get::<_, i64>(0),
+                )?;
+                if exists == 0 {
+                    anyhow::bail!(
+                        "Snapshot {} does not exist in the lake at {}",
+                        id,
+                        self.dir()
+                    );
+                }
+                Ok(Some(id))
+            }
+            AsOf::Timestamp(time) => {
+                let id = self.connection.query_row(
+                    "SELECT max(snapshot_id) FROM ducklake_snapshots('data')
+                     WHERE epoch_us(snapshot_time) <= ?",
+                    params![time.timestamp_micros()],
+                    |row| row.get::<_, Option<i64>>(0),
+                )?;
+                match id {
+                    Some(id) => Ok(Some(id)),
+                    None => anyhow::bail!(
+                        "No snapshot at or before {} in the lake at {}",
+                        time.to_rfc3339(),
+                        self.dir()
+                    ),
+                }
+            }
+        }
+    }
+
+    /// All committed snapshots, oldest first
+    pub fn snapshots(&self) -> Result<Vec<Snapshot>> {
+        if self.empty {
+            return Ok(Vec::new());
+        }
+
+        let mut stmt = self.prepare(
+            "SELECT snapshot_id, epoch_us(snapshot_time)
+             FROM ducklake_snapshots('data')
+             ORDER BY snapshot_id",
+        )?;
+        let mut rows = stmt.query([])?;
+
+        let mut snapshots = Vec::new();
+        while let Some(row) = rows.next()? {
+            let micros: i64 = row.get(1)?;
+            snapshots.push(Snapshot {
+                id: row.get(0)?,
+                time: DateTime::from_timestamp_micros(micros).unwrap_or_default(),
+            });
+        }
+
+        Ok(snapshots)
+    }
+
+    /// A table reference for reads, pinned to this handle's snapshot
+    pub(crate) fn table_ref(&self, table: &str) -> String {
+        match self.snapshot {
+            Some(id) => format!("{} AT (VERSION => {})", table, id),
+            None => table.to_string(),
+        }
+    }
+
+    fn dir(&self) -> String {
+        self.config.dkdc_dir().display().to_string()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::tests::temp_lake;
+    use dkdc_config::LakeConfig;
+
+    #[test]
+    fn test_parse_as_of() {
+        assert_eq!("latest".parse::<AsOf>().unwrap(), AsOf::Latest);
+        assert_eq!("42".parse::<AsOf>().unwrap(), AsOf::Snapshot(42));
+
+        let noon = DateTime::parse_from_rfc3339("2025-01-31T12:00:00Z")
+            .unwrap()
+            .with_timezone(&Utc);
+        assert_eq!(
+            "2025-01-31T12:00:00Z".parse::<AsOf>().unwrap(),
+            AsOf::Timestamp(noon)
+        );
+        assert_eq!(
+            "2025-01-31 12:00:00".parse::<AsOf>().unwrap(),
+            AsOf::Timestamp(noon)
+        );
+        assert!("yesterday".parse::<AsOf>().is_err());
+    }
+    #[test]
+    fn test_read_as_of() {
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        lake.add_file("./files", "notes.md", b"first").unwrap();
+        let first = lake.current_snapshot().unwrap();
+        std::thread::sleep(std::time::Duration::from_millis(10));
+        let between = Utc::now();
+        std::thread::sleep(std::time::Duration::from_millis(10));
+        lake.add_file("./files", "notes.md", b"second").unwrap();
+        lake.add_file("./files", "later.md", b"added later")
+            .unwrap();
+
+        let open = || Lake::open_read_only(lake.config().clone()).unwrap();
+        for as_of in [AsOf::Snapshot(first), AsOf::Timestamp(between)] {
+            let old = open().at(as_of).unwrap();
+            let notes = old.get_file("./files", "notes.md").unwrap().unwrap();
+            assert_eq!(notes.filedata, b"first");
+            assert!(old.get_file("./files", "later.md").unwrap().is_none());
+            assert!(old.add_file("./files", "pinned.md", b"no").is_err());
+        }
+
+        let latest = open().at(AsOf::Latest).unwrap();
+        let notes = latest.get_file("./files", "notes.md").unwrap().unwrap();
+        assert_eq!(notes.filedata, b"second");
+        assert_eq!(
+            latest.list_files("./files").unwrap(),
+            ["later.md", "notes.md"]
+        );
+    }
+}
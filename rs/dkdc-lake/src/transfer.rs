@@ -0,0 +1,547 @@
+//! Bulk export and import of lake tables as Parquet
+//!
+//! `export_table` writes a table with DuckDB's parallel `COPY` to
+//! `<dir>/<table>/month=YYYY-MM/*.parquet`, partitioned by the month of
+//! `fileupdated`, and `import_table` reads such a directory back with one
+//! `INSERT ... SELECT` over `read_parquet`. Both scan columns, never rows,
+//! and both filter by `filepath` prefix and `fileupdated` range.
+//!
+//! Rows are exported as stored: compressed blobs keep their `filecodec`, and
+//! chunked files keep their `filechunks`, with the chunks they reference
+//! exported alongside to `<dir>/chunks`. Imports skip rows (and chunks)
+//! the lake already has, so an interrupted import can simply be rerun, and
+//! versions no newer than the lake's own latest of the same name, so an
+//! older export never rolls back a local edit.
+//!
+//! Sealed blobs (see `envelope`) stay sealed with the exporting lake's
+//! envelope key, so importing them needs that key; imports check they can
+//! open them before adding any rows.
+//!
+//! Parquet files can be encrypted with a key derived from a secret, using
+//! DuckDB's Parquet modular encryption. The key is derived with PBKDF2 and
+//! a random salt stored in the export directory, shared by every table
+//! exported to it. Secrets are only exported without a key when plaintext
+//! is asked for explicitly.
+
+use crate::envelope::{self, ENVELOPE, ZSTD_ENVELOPE};
+use crate::quote_literal;
+use crate::schema::{read_or_empty, with_optional_column, Area};
+use crate::Lake;
+use anyhow::Result;
+use chrono::{DateTime, Utc};
+use dkdc_common::trace;
+use dkdc_config::{ARCHIVES_TABLE_NAME, CHUNKS_TABLE_NAME, FILES_TABLE_NAME, SECRETS_TABLE_NAME};
+use duckdb::params;
+use ring::pbkdf2;
+use std::fs;
+use std::num::NonZeroU32;
+use std::path::Path;
+
+/// Tables that can be exported; chunks travel with `files`
+pub const TRANSFER_TABLES: &[&str] = &[FILES_TABLE_NAME, SECRETS_TABLE_NAME, ARCHIVES_TABLE_NAME];
+
+/// Name the Parquet key is registered under for a transfer
+const PARQUET_KEY_NAME: &str = "dkdc_transfer";
+
+/// File in an export directory holding the salt of its Parquet key, in hex
+const KEY_SALT_FILE: &str = "parquet-key.salt";
+const KEY_SALT_LEN: usize = 16;
+/// PBKDF2 rounds; a key is derived once per transfer
+const KEY_ITERATIONS: u32 = 100_000;
+
+/// Which rows to transfer, and how the Parquet files are encrypted
+#[derive(Debug, Clone, Default)]
+pub struct TransferOptions {
+    /// Only rows whose `filepath` starts with this
+    pub prefix: Option<String>,
+    /// Only rows updated at or after this time
+    pub since: Option<DateTime<Utc>>,
+    /// Only rows updated before this time
+    pub until: Option<DateTime<Utc>>,
+    /// Secret to derive the Parquet encryption key from
+    pub key: Option<Vec<u8>>,
+    /// Allow exporting secrets without `key`, as plaintext Parquet
+    pub plaintext: bool,
+}
+
+impl TransferOptions {
+    /// SQL condition selecting the rows to transfer
+    fn filter(&self) -> String {
+        let mut conditions = vec!["true".to_string()];
+        if let Some(prefix) = &self.prefix {
+            conditions.push(format!("starts_with(filepath, {})", quote_literal(prefix)));
+        }
+        if let Some(since) = self.since {
+            conditions.push(format!("fileupdated >= {}", timestamp(since)));
+        }
+        if let Some(until) = self.until {
+            conditions.push(format!("fileupdated < {}", timestamp(until)));
+        }
+        conditions.join(" AND ")
+    }
+
+    /// `COPY` option and `read_parquet` argument for the encryption key
+    fn encryption(&self) -> (String, String) {
+        match self.key {
+            Some(_) => (
+                format!(", ENCRYPTION_CONFIG {{footer_key: '{}'}}", PARQUET_KEY_NAME),
+                format!(
+                    ", encryption_config = {{footer_key: '{}'}}",
+                    PARQUET_KEY_NAME
+                ),
+            ),
+            None => (String::new(), String::new()),
+        }
+    }
+}
+
+impl Lake {
+    /// Export a table's rows to partitioned Parquet under `dir/<table>`,
+    /// returning the number of rows written per table
+    ///
+    /// Sealed blobs are exported sealed: importing them needs this lake's
+    /// envelope key. Secrets need a key, or `plaintext` set.
+    pub fn export_table(
+        &self,
+        table: &str,
+        dir: &Path,
+        options: &TransferOptions,
+    ) -> Result<Vec<(String, usize)>> {
+        check_table(table)?;
+        if table == SECRETS_TABLE_NAME && options.key.is_none() && !options.plaintext {
+            anyhow::bail!(
+                "Refusing to export secrets as plaintext Parquet; give a key secret to \
+                 encrypt them, or allow plaintext explicitly"
+            );
+        }
+        let _span = trace::span_with("transfer.export", || table);
+        self.register_key(options, dir, true)?;
+        let (encryption, _) = options.encryption();
+        let filter = options.filter();
+
+        let copy = |source: &str| -> Result<usize> {
+            let sql = format!(
+                "COPY (
+                    SELECT * EXCLUDE (rowid), strftime(fileupdated, '%Y-%m') AS month
+                    FROM {}
+                    WHERE {}
+                 ) TO {} (FORMAT PARQUET, COMPRESSION ZSTD, PARTITION_BY (month), OVERWRITE_OR_IGNORE{})",
+                source,
+                filter,
+                quote_literal(&dir.join(table).display().to_string()),
+                encryption
+            );
+            Ok(self.prepare(&sql)?.execute([])?)
+        };
+        let rows = read_or_empty(|| {
+            if table == FILES_TABLE_NAME {
+                // Moved files are exported under their current names
+                self.with_visible_files(copy)
+            } else {
+                copy(&format!(
+                    "(SELECT *, rowid AS rowid FROM {})",
+                    self.table_ref(table)
+                ))
+            }
+        })?;
+        let mut counts = vec![(table.to_string(), rows)];
+
+        if table == FILES_TABLE_NAME {
+            // The chunks of the exported files, once each
+            let chunks = read_or_empty(|| {
+                self.with_visible_files(|files| {
+                    with_optional_column("filechunks", "filechunks", |chunks_column| {
+                        if chunks_column != "filechunks" {
+                            return Ok(0);
+                        }
+                        let sql = format!(
+                            "COPY (
+                                SELECT * FROM {}
+                                WHERE chunkhash IN (
+                                    SELECT unnest(string_split(filechunks, ','))
+                                    FROM {}
+                                    WHERE filechunks IS NOT NULL AND {}
+                                )
+                             ) TO {} (FORMAT PARQUET, COMPRESSION ZSTD, PER_THREAD_OUTPUT, OVERWRITE_OR_IGNORE{})",
+                            self.table_ref(CHUNKS_TABLE_NAME),
+                            files,
+                            filter,
+                            quote_literal(&dir.join(CHUNKS_TABLE_NAME).display().to_string()),
+                            encryption
+                        );
+                        Ok(self.prepare(&sql)?.execute([])?)
+                    })
+                })
+            })?;
+            counts.push((CHUNKS_TABLE_NAME.to_string(), chunks));
+        }
+
+        Ok(counts)
+    }
+
+    /// Import rows exported by [`Lake::export_table`] from `dir/<table>` as
+    /// one snapshot, returning the number of rows added per table
+    ///
+    /// Versions no newer than the lake's latest of the same name are
+    /// skipped (including rows it already has), as are chunks it already
+    /// stores. Imported files are added to the directory and search indexes
+    /// in the same snapshot. Fails before importing anything if the export
+    /// holds sealed blobs this lake's envelope key can't open.
+    pub fn import_table(
+        &self,
+        table: &str,
+        dir: &Path,
+        options: &TransferOptions,
+    ) -> Result<Vec<(String, usize)>> {
+        check_table(table)?;
+        let _span = trace::span_with("transfer.import", || table);
+        let source = dir.join(table);
+        if !source.exists() {
+            anyhow::bail!("No export of '{}' in {}", table, dir.display());
+        }
+
+        let area = match table {
+            FILES_TABLE_NAME => Area::Files,
+            SECRETS_TABLE_NAME => Area::Secrets,
+            _ => Area::Archives,
+        };
+        self.ensure_schema(area)?;
+        let chunks = dir.join(CHUNKS_TABLE_NAME);
+        let with_chunks = table == FILES_TABLE_NAME && chunks.exists();
+        if with_chunks {
+            self.ensure_schema(Area::Chunks)?;
+        }
+        if table == FILES_TABLE_NAME {
+            self.ensure_schema(Area::Paths)?;
+        }
+        self.register_key(options, dir, false)?;
+        let (_, encryption) = options.encryption();
+
+        self.check_envelope_key(
+            &parquet_glob(&source),
+            &encryption,
+            ("filedata", "filecodec", "filesize"),
+        )?;
+        if with_chunks {
+            self.check_envelope_key(
+                &parquet_glob(&chunks),
+                &encryption,
+                ("chunkdata", "chunkcodec", "chunksize"),
+            )?;
+        }
+
+        self.transaction(|lake| {
+            let mut counts = Vec::new();
+
+            // Chunks first, so no imported file refers to a missing chunk
+            if with_chunks {
+                let sql = format!(
+                    "INSERT INTO {table} BY NAME
+                     SELECT DISTINCT ON (chunkhash) *
+                     FROM read_parquet({files}{encryption})
+                     WHERE chunkhash NOT IN (SELECT chunkhash FROM {table})",
+                    table = CHUNKS_TABLE_NAME,
+                    files = parquet_glob(&chunks),
+                    encryption = encryption
+                );
+                let rows = lake.prepare(&sql)?.execute([])?;
+                counts.push((CHUNKS_TABLE_NAME.to_string(), rows));
+            }
+
+            // Latest means highest rowid, and imported rows get new ones: a
+            // version is only imported if it's newer than every local one
+            let new_rows = |existing: &str| -> Result<String> {
+                Ok(format!(
+                    "FROM read_parquet({files}, hive_partitioning = true{encryption}) AS import
+                     WHERE {filter} AND NOT EXISTS (
+                         SELECT 1 FROM {existing} AS existing
+                         WHERE existing.filepath = import.filepath
+                           AND existing.filename = import.filename
+                           AND existing.fileupdated >= import.fileupdated
+                     )",
+                    existing = existing,
+                    files = parquet_glob(&source),
+                    encryption = encryption,
+                    filter = options.filter()
+                ))
+            };
+            let new_rows = if table == FILES_TABLE_NAME {
+                // Moved files are compared under their current names
+                lake.with_visible_files(new_rows)?
+            } else {
+                new_rows(table)?
+            };
+            let names = if table == FILES_TABLE_NAME {
+                lake.imported_names(&new_rows)?
+            } else {
+                Vec::new()
+            };
+
+            // Oldest first, so the latest version of each file is inserted last
+            let sql = format!(
+                "INSERT INTO {} BY NAME SELECT * EXCLUDE (month) {} ORDER BY fileupdated",
+                table, new_rows
+            );
+            let rows = lake.prepare(&sql)?.execute([])?;
+            counts.insert(0, (table.to_string(), rows));
+
+            // Index the new latest versions and their directories, as
+            // writing them would have
+            if table == FILES_TABLE_NAME {
+                lake.index_dirs()?;
+            }
+            for (filepath, filename) in &names {
+                if let Some(file) = lake.get_file(filepath, filename)? {
+                    lake.index_file(filepath, filename, &file.filedata)?;
+                }
+            }
+
+            Ok(counts)
+        })
+    }
+
+    /// Names of the files an import adds versions of
+    fn imported_names(&self, new_rows: &str) -> Result<Vec<(String, String)>> {
+        let sql = format!("SELECT DISTINCT filepath, filename {}", new_rows);
+        let mut stmt = self.prepare(&sql)?;
+        let mut rows = stmt.query([])?;
+        let mut names = Vec::new();
+        while let Some(row) = rows.next()? {
+            names.push((row.get(0)?, row.get(1)?));
+        }
+        Ok(names)
+    }
+
+    /// Register the Parquet encryption key for this connection, with the
+    /// salt stored in `dir` (created for exports that don't have one yet)
+    fn register_key(&self, options: &TransferOptions, dir: &Path, create: bool) -> Result<()> {
+        if let Some(key) = &options.key {
+            let salt = key_salt(dir, create)?;
+            // Not through `execute`, whose span would record the key
+            self.connection.execute_batch(&format!(
+                "PRAGMA add_parquet_key('{}', '{}')",
+                PARQUET_KEY_NAME,
+                parquet_key(key, &salt)
+            ))?;
+        }
+        Ok(())
+    }
+
+    /// Fail unless this lake can open the sealed blobs among exported rows
+    ///
+    /// Exports keep blobs as stored, so sealed ones can only be opened with
+    /// the envelope key of the lake they were exported from. The smallest
+    /// sealed blob is opened as a check.
+    fn check_envelope_key(
+        &self,
+        files: &str,
+        encryption: &str,
+        (data, codec, size): (&str, &str, &str),
+    ) -> Result<()> {
+        let query = |codec_column: &str| -> Result<Option<(Vec<u8>, String, i64)>> {
+            let sql = format!(
+                "SELECT {data}, {codec}, {size}
+                 FROM read_parquet({files}{encryption})
+                 WHERE {codec} IN (?, ?) AND {data} IS NOT NULL
+                 ORDER BY {size}
+                 LIMIT 1",
+                data = data,
+                codec = codec_column,
+                size = size,
+                files = files,
+                encryption = encryption
+            );
+            let mut stmt = self.prepare(&sql)?;
+            let mut rows = stmt.query(params![ENVELOPE, ZSTD_ENVELOPE])?;
+            match rows.next()? {
+                Some(row) => Ok(Some((row.get(0)?, row.get(1)?, row.get(2)?))),
+                None => Ok(None),
+            }
+        };
+
+        let Some((blob, blob_codec, blob_size)) = with_optional_column(codec, codec, query)? else {
+            return Ok(());
+        };
+        self.decode_blob(blob, Some(&blob_codec), blob_size)
+            .map_err(|e| {
+                e.context(format!(
+                    "The export holds blobs sealed with its lake's envelope key, which this \
+                     lake can't open; copy that key to {} to import it",
+                    self.config.envelope_key_path().display()
+                ))
+            })?;
+        Ok(())
+    }
+}
+
+fn check_table(table: &str) -> Result<()> {
+    if !TRANSFER_TABLES.contains(&table) {
+        anyhow::bail!(
+            "Unknown table '{}' (expected one of: {})",
+            table,
+            TRANSFER_TABLES.join(", ")
+        );
+    }
+    Ok(())
+}
+
+/// A Parquet key derived from a secret with PBKDF2-HMAC-SHA256
+///
+/// DuckDB takes the key as a string of 16, 24 or 32 bytes and uses its
+/// bytes as an AES key. It is 32 hex characters, to stay printable, so the
+/// AES-256 key carries 128 bits of derived key material.
+fn parquet_key(secret: &[u8], salt: &[u8]) -> String {
+    let mut key = [0u8; 16];
+    pbkdf2::derive(
+        pbkdf2::PBKDF2_HMAC_SHA256,
+        NonZeroU32::new(KEY_ITERATIONS).expect("iterations are non-zero"),
+        salt,
+        secret,
+        &mut key,
+    );
+    key.iter().map(|b| format!("{:02x}", b)).collect()
+}
+
+/// The salt of an export's Parquet key, read from `dir`, or created there
+/// with `create` if it has none yet
+fn key_salt(dir: &Path, create: bool) -> Result<Vec<u8>> {
+    let path = dir.join(KEY_SALT_FILE);
+    if !path.exists() {
+        if !create {
+            anyhow::bail!(
+                "No Parquet key salt ({}) in {}; was it exported with a key?",
+                KEY_SALT_FILE,
+                dir.display()
+            );
+        }
+        let mut salt = [0u8; KEY_SALT_LEN];
+        envelope::random(&mut salt)?;
+        fs::create_dir_all(dir)?;
+        let hex: String = salt.iter().map(|b| format!("{:02x}", b)).collect();
+        fs::write(&path, hex)?;
+    }
+
+    let hex = fs::read_to_string(&path)?;
+    let hex = hex.trim();
+    let salt = (0..hex.len())
+        .step_by(2)
+        .map(|i| {
+            hex.get(i..i + 2)
+                .and_then(|b| u8::from_str_radix(b, 16).ok())
+        })
+        .collect::<Option<Vec<u8>>>();
+    match salt {
+        Some(salt) if salt.len() == KEY_SALT_LEN => Ok(salt),
+        _ => anyhow::bail!("Invalid Parquet key salt in {}", path.display()),
+    }
+}
+
+fn parquet_glob(dir: &Path) -> String {
+    quote_literal(&dir.join("**").join("*.parquet").display().to_string())
+}
+
+fn timestamp(time: DateTime<Utc>) -> String {
+    format!("TIMESTAMP '{}'", time.format("%Y-%m-%d %H:%M:%S%.6f"))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::tests::temp_lake;
+    use chrono::TimeZone;
+    use dkdc_config::LakeConfig;
+    use std::time::Duration;
+
+    #[test]
+    fn test_transfer_filter() {
+        let options = TransferOptions {
+            prefix: Some("./files/o'brien".to_string()),
+            since: Some(Utc.with_ymd_and_hms(2025, 1, 31, 12, 0, 0).unwrap()),
+            ..Default::default()
+        };
+        assert_eq!(
+            options.filter(),
+            "true AND starts_with(filepath, './files/o''brien') \
+             AND fileupdated >= TIMESTAMP '2025-01-31 12:00:00.000000'"
+        );
+        assert!(check_table("chunks").is_err());
+    }
+
+    #[test]
+    fn test_parquet_key_salt() {
+        let dir = tempfile::tempdir().unwrap();
+        assert!(key_salt(dir.path(), false).is_err());
+        let salt = key_salt(dir.path(), true).unwrap();
+        assert_eq!(key_salt(dir.path(), false).unwrap(), salt);
+
+        let key = parquet_key(b"hunter2", &salt);
+        assert_eq!(key.len(), 32);
+        assert_eq!(key, parquet_key(b"hunter2", &salt));
+        assert_ne!(key, parquet_key(b"hunter2", &[0; KEY_SALT_LEN]));
+    }
+
+    #[test]
+    fn test_import_keeps_newer_local_versions() {
+        let export = tempfile::tempdir().unwrap();
+        let options = TransferOptions {
+            plaintext: true,
+            ..Default::default()
+        };
+
+        let (_home, source) = temp_lake(LakeConfig::default());
+        source.add_file("./files", "notes.md", b"exported").unwrap();
+        source
+            .add_file("./files/imported", "new.md", b"only exported")
+            .unwrap();
+        source.set_secret("token", b"exported").unwrap();
+        source
+            .export_table(FILES_TABLE_NAME, export.path(), &options)
+            .unwrap();
+        source
+            .export_table(SECRETS_TABLE_NAME, export.path(), &options)
+            .unwrap();
+        std::thread::sleep(Duration::from_millis(10));
+
+        // Edited after the export was taken
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        lake.add_file("./files", "notes.md", b"edited").unwrap();
+        lake.set_secret("token", b"edited").unwrap();
+        lake.import_table(FILES_TABLE_NAME, export.path(), &options)
+            .unwrap();
+        lake.import_table(SECRETS_TABLE_NAME, export.path(), &options)
+            .unwrap();
+
+        let notes = lake.get_file("./files", "notes.md").unwrap().unwrap();
+        assert_eq!(notes.filedata, b"edited");
+        assert_eq!(lake.get_secret("token").unwrap().unwrap(), b"edited");
+        let new = lake.get_file("./files/imported", "new.md").unwrap();
+        assert_eq!(new.unwrap().filedata, b"only exported");
+
+        // Imported files are in the directory and search indexes, and a
+        // rerun adds nothing
+        assert_eq!(
+            lake.list_dirs("./files", true).unwrap(),
+            ["./files/imported"]
+        );
+        let hits = lake.search("only", None, 10).unwrap();
+        assert_eq!(hits.len(), 1);
+        assert_eq!(hits[0].filename, "new.md");
+        let counts = lake
+            .import_table(FILES_TABLE_NAME, export.path(), &options)
+            .unwrap();
+        assert!(counts.iter().all(|(_, rows)| *rows == 0));
+    }
+
+    #[test]
+    fn test_secrets_export_needs_key_or_plaintext() {
+        let export = tempfile::tempdir().unwrap();
+        let (_home, lake) = temp_lake(LakeConfig::default());
+        lake.set_secret("token", b"value").unwrap();
+
+        let options = TransferOptions::default();
+        assert!(lake
+            .export_table(SECRETS_TABLE_NAME, export.path(), &options)
+            .is_err());
+        assert!(!export.path().join(SECRETS_TABLE_NAME).exists());
+    }
+}
@@ -2,7 +2,7 @@ use anyhow::Result;
 use clap::Parser;
 
 use dkdc_links::config::{config_it, init_config, load_config, print_config};
-use dkdc_links::open::open_links;
+use dkdc_links::open::{open_links, OpenMode, DEFAULT_JOBS};
 
 #[derive(Parser, Debug)]
 #[command(name = "dkdc-links")]
@@ -13,6 +13,18 @@ struct Args {
     #[arg(short, long)]
     config: bool,
 
+    /// Maximum number of links to open at once
+    #[arg(short, long, default_value_t = DEFAULT_JOBS)]
+    jobs: usize,
+
+    /// Open all links in a single browser invocation ($BROWSER)
+    #[arg(short, long, conflicts_with = "print")]
+    batch: bool,
+
+    /// Print resolved links instead of opening them
+    #[arg(short, long)]
+    print: bool,
+
     /// Things to open
     links: Vec<String>,
 }
@@ -36,8 +48,16 @@ fn main() -> Result<()> {
     if args.links.is_empty() {
         print_config(&config)?;
     } else {
+        let mode = if args.print {
+            OpenMode::Print
+        } else if args.batch {
+            OpenMode::Batch
+        } else {
+            OpenMode::Parallel { jobs: args.jobs }
+        };
+
         // Open the links
-        open_links(args.links, &config)?;
+        open_links(args.links, &config, mode)?;
     }
 
     Ok(())
@@ -1,7 +1,30 @@
 use anyhow::{Context, Result};
+use std::process::Command;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::thread;
 
 use crate::config::Config;
 
+/// Default number of links dispatched at once
+pub const DEFAULT_JOBS: usize = 4;
+
+/// How resolved links are handled
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum OpenMode {
+    /// Open each link with the system launcher, up to `jobs` at a time
+    Parallel { jobs: usize },
+    /// Open all links with a single browser invocation
+    Batch,
+    /// Print the resolved links without opening them
+    Print,
+}
+
+impl Default for OpenMode {
+    fn default() -> Self {
+        Self::Parallel { jobs: DEFAULT_JOBS }
+    }
+}
+
 pub fn alias_or_link_to_uri(link: &str, config: &Config) -> Result<String> {
     // Check if it's an alias first
     if let Some(alias_target) = config.aliases.get(link) {
@@ -19,25 +42,136 @@ pub fn alias_or_link_to_uri(link: &str, config: &Config) -> Result<String> {
     anyhow::bail!("'{}' not found in [links] or [aliases]", link)
 }
 
+/// Resolve links to URIs, reporting and skipping unknown ones
+fn resolve_links(links: Vec<String>, config: &Config) -> Vec<(String, String)> {
+    let mut resolved = Vec::with_capacity(links.len());
+
+    for link in links {
+        match alias_or_link_to_uri(&link, config) {
+            Ok(uri) => resolved.push((link, uri)),
+            Err(e) => {
+                eprintln!("[dkdc] skipping {}: {}", link, e);
+            }
+        }
+    }
+
+    resolved
+}
+
 fn open_it(link: &str) -> Result<()> {
     open::that(link).with_context(|| format!("failed to open {}", link))?;
     println!("opening {}...", link);
     Ok(())
 }
 
-pub fn open_links(links: Vec<String>, config: &Config) -> Result<()> {
-    for link in links {
-        match alias_or_link_to_uri(&link, config) {
-            Ok(uri) => {
-                if let Err(e) = open_it(&uri) {
+/// Open links on a bounded pool of threads so slow launchers don't serialize
+fn open_parallel(resolved: &[(String, String)], jobs: usize) {
+    let next = AtomicUsize::new(0);
+    let workers = jobs.clamp(1, resolved.len().max(1));
+
+    thread::scope(|s| {
+        for _ in 0..workers {
+            s.spawn(|| loop {
+                let index = next.fetch_add(1, Ordering::Relaxed);
+                let Some((link, uri)) = resolved.get(index) else {
+                    break;
+                };
+                if let Err(e) = open_it(uri) {
                     eprintln!("[dkdc] failed to open {}: {}", link, e);
                 }
-            }
-            Err(e) => {
-                eprintln!("[dkdc] skipping {}: {}", link, e);
+            });
+        }
+    });
+}
+
+/// Build the browser command used for batched opening
+///
+/// Uses the first entry of `$BROWSER` if set, otherwise `open` on macOS,
+/// which accepts multiple URLs.
+fn browser_command() -> Result<Command> {
+    if let Ok(browser) = std::env::var("BROWSER") {
+        let mut parts = browser.split(':').next().unwrap_or("").split_whitespace();
+        if let Some(program) = parts.next() {
+            let mut command = Command::new(program);
+            command.args(parts);
+            return Ok(command);
+        }
+    }
+
+    if cfg!(target_os = "macos") {
+        return Ok(Command::new("open"));
+    }
+
+    anyhow::bail!("set $BROWSER to open multiple links in a single invocation")
+}
+
+/// Open all links with one browser process
+fn open_batch(resolved: &[(String, String)]) -> Result<()> {
+    let mut command = browser_command()?;
+    let program = command.get_program().to_string_lossy().to_string();
+
+    let status = command
+        .args(resolved.iter().map(|(_, uri)| uri))
+        .status()
+        .with_context(|| format!("Browser {} not found in PATH", program))?;
+
+    if !status.success() {
+        anyhow::bail!("Browser {} exited with non-zero status", program);
+    }
+
+    for (_, uri) in resolved {
+        println!("opening {}...", uri);
+    }
+
+    Ok(())
+}
+
+pub fn open_links(links: Vec<String>, config: &Config, mode: OpenMode) -> Result<()> {
+    let resolved = resolve_links(links, config);
+
+    if resolved.is_empty() {
+        return Ok(());
+    }
+
+    match mode {
+        OpenMode::Parallel { jobs } => open_parallel(&resolved, jobs),
+        OpenMode::Batch => open_batch(&resolved)?,
+        OpenMode::Print => {
+            for (_, uri) in &resolved {
+                println!("{}", uri);
             }
         }
     }
 
     Ok(())
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn test_config() -> Config {
+        let mut config = Config::default();
+        config
+            .links
+            .insert("link1".to_string(), "https://example.com/1".to_string());
+        config.aliases.insert("a1".to_string(), "link1".to_string());
+        config
+    }
+
+    #[test]
+    fn test_resolve_links() {
+        let config = test_config();
+        let resolved = resolve_links(
+            vec!["a1".to_string(), "missing".to_string(), "link1".to_string()],
+            &config,
+        );
+        assert_eq!(
+            resolved,
+            vec![
+                ("a1".to_string(), "https://example.com/1".to_string()),
+                ("link1".to_string(), "https://example.com/1".to_string()),
+            ]
+        );
+    }
+}
@@ -1,11 +1,824 @@
 use pyo3::prelude::*;
-use pyo3::exceptions::PyRuntimeError;
+use pyo3::exceptions::{PyBufferError, PyRuntimeError, PyTypeError, PyValueError};
+use pyo3::types::{IntoPyDict, PyBytes, PyCapsule, PyDict};
+use dkdc_lake::arrow::datatypes::SchemaRef;
+use dkdc_lake::arrow::ffi_stream::FFI_ArrowArrayStream;
+use dkdc_lake::arrow::record_batch::RecordBatchReader;
+use dkdc_lake::files::{FileEntry, FileSort, ListOptions};
+use dkdc_lake::query::ArrowBatches;
+use dkdc_lake::transfer::TransferOptions;
+use dkdc_lake::AsOf;
+use std::collections::HashMap;
+use std::ffi::CString;
+use std::path::PathBuf;
+use std::time::Duration;
+
+fn to_py_err(e: anyhow::Error) -> PyErr {
+    PyRuntimeError::new_err(e.to_string())
+}
+
+/// A point in the lake's history from a snapshot id, datetime or string
+fn as_of_from_py(when: &Bound<'_, PyAny>) -> PyResult<AsOf> {
+    if let Ok(id) = when.extract::<i64>() {
+        return Ok(AsOf::Snapshot(id));
+    }
+    if let Ok(time) = when.extract::<chrono::DateTime<chrono::FixedOffset>>() {
+        return Ok(AsOf::Timestamp(time.with_timezone(&chrono::Utc)));
+    }
+    // Naive datetimes are taken as UTC, like the CLI's `--at`
+    if let Ok(time) = when.extract::<chrono::NaiveDateTime>() {
+        return Ok(AsOf::Timestamp(time.and_utc()));
+    }
+    if let Ok(text) = when.extract::<String>() {
+        return text
+            .parse()
+            .map_err(|e: anyhow::Error| PyValueError::new_err(e.to_string()));
+    }
+
+    Err(PyTypeError::new_err(
+        "expected a snapshot id, a datetime, or a string",
+    ))
+}
+
+/// Parse a transfer time bound: a datetime or a timestamp string
+fn time_from_py(
+    when: Option<&Bound<'_, PyAny>>,
+) -> PyResult<Option<chrono::DateTime<chrono::Utc>>> {
+    match when.map(as_of_from_py).transpose()? {
+        None => Ok(None),
+        Some(AsOf::Timestamp(time)) => Ok(Some(time)),
+        Some(_) => Err(PyValueError::new_err(
+            "expected a datetime or a timestamp string",
+        )),
+    }
+}
+
+/// Filters and key for `Lake.export_table` / `Lake.import_table`
+fn transfer_options(
+    lake: &dkdc_lake::Lake,
+    prefix: Option<String>,
+    since: Option<&Bound<'_, PyAny>>,
+    until: Option<&Bound<'_, PyAny>>,
+    key_secret: Option<&str>,
+) -> PyResult<TransferOptions> {
+    let key = match key_secret {
+        Some(name) => Some(
+            lake.get_secret(name)
+                .map_err(to_py_err)?
+                .ok_or_else(|| PyValueError::new_err(format!("Secret '{}' not found", name)))?,
+        ),
+        None => None,
+    };
+
+    Ok(TransferOptions {
+        prefix,
+        since: time_from_py(since)?,
+        until: time_from_py(until)?,
+        key,
+        plaintext: false,
+    })
+}
+
+/// Resolve a lake from a dkdc home directory, a named profile, or the defaults
+fn resolve_config(path: Option<PathBuf>, profile: Option<&str>) -> PyResult<dkdc_config::Config> {
+    let config = match (path, profile) {
+        (Some(_), Some(_)) => {
+            return Err(PyValueError::new_err(
+                "pass either path or profile, not both",
+            ))
+        }
+        (Some(path), None) => dkdc_config::Config::from_path(path),
+        (None, Some(profile)) => dkdc_config::Config::for_profile(profile).map_err(to_py_err)?,
+        (None, None) => dkdc_config::Config::new().map_err(to_py_err)?,
+    };
+
+    Ok(config)
+}
+
+fn open_lake(config: dkdc_config::Config, read_only: bool) -> PyResult<dkdc_lake::Lake> {
+    if read_only {
+        dkdc_lake::Lake::open_read_only(config).map_err(to_py_err)
+    } else {
+        dkdc_lake::Lake::with_config(config).map_err(to_py_err)
+    }
+}
+
+/// A file's metadata as the dict `ls` and `entry` return
+fn entry_dict(py: Python<'_>, entry: FileEntry) -> PyResult<Bound<'_, PyDict>> {
+    let dict = PyDict::new_bound(py);
+    dict.set_item("filepath", entry.filepath)?;
+    dict.set_item("filename", entry.filename)?;
+    dict.set_item("filesize", entry.filesize)?;
+    dict.set_item("fileupdated", entry.fileupdated)?;
+    dict.set_item("versions", entry.versions)?;
+    dict.set_item("filehash", entry.filehash)?;
+    Ok(dict)
+}
+
+/// Owned C stream handed to consumers through a PyCapsule
+///
+/// The consumer moves the stream out and marks it released; dropping the
+/// capsule then only releases streams that were never consumed.
+#[repr(transparent)]
+struct StreamCapsule(FFI_ArrowArrayStream);
+
+// The stream is only touched by whoever holds the capsule, under the GIL.
+unsafe impl Send for StreamCapsule {}
+
+/// Arrow query result exported through the Arrow C stream interface
+///
+/// Implements `__arrow_c_stream__`, so it can be passed directly to
+/// `pyarrow.table`, `polars.from_arrow`, `duckdb` or `ibis`. Batches are
+/// read from the lake as the consumer pulls them, so the whole result is
+/// never held in memory. The stream can be consumed once.
+#[pyclass(name = "ArrowStream", module = "dkdc")]
+struct PyArrowStream {
+    schema: SchemaRef,
+    batches: Option<ArrowBatches>,
+}
+
+impl PyArrowStream {
+    fn new(batches: ArrowBatches) -> Self {
+        Self {
+            schema: batches.schema(),
+            batches: Some(batches),
+        }
+    }
+}
+
+#[pymethods]
+impl PyArrowStream {
+    /// Export the result as an `ArrowArrayStream` PyCapsule
+    #[pyo3(signature = (requested_schema=None))]
+    fn __arrow_c_stream__<'py>(
+        &mut self,
+        py: Python<'py>,
+        requested_schema: Option<Bound<'py, PyAny>>,
+    ) -> PyResult<Bound<'py, PyCapsule>> {
+        // Schema negotiation is optional; the result is always exported as-is.
+        let _ = requested_schema;
+        let batches = self
+            .batches
+            .take()
+            .ok_or_else(|| PyRuntimeError::new_err("Arrow stream already consumed"))?;
+        let stream = StreamCapsule(FFI_ArrowArrayStream::new(Box::new(batches)));
+        let name = CString::new("arrow_array_stream").expect("valid capsule name");
+        PyCapsule::new_bound(py, stream, Some(name))
+    }
+
+    /// Column names of the result
+    #[getter]
+    fn columns(&self) -> Vec<String> {
+        self.schema
+            .fields()
+            .iter()
+            .map(|field| field.name().to_string())
+            .collect()
+    }
+
+    /// Consume the stream as a `pyarrow.RecordBatchReader`
+    fn to_pyarrow<'py>(slf: Bound<'py, Self>) -> PyResult<Bound<'py, PyAny>> {
+        let pyarrow = slf.py().import_bound("pyarrow")?;
+        pyarrow
+            .getattr("RecordBatchReader")?
+            .call_method1("from_stream", (slf,))
+    }
+
+    fn __repr__(&self) -> String {
+        format!("ArrowStream(columns={:?})", self.columns())
+    }
+}
+
+/// A read-only memory map of a file from the local file cache
+///
+/// Supports the buffer protocol, so `memoryview(f)` or
+/// `numpy.frombuffer(f, ...)` read the cached copy without copying it;
+/// `bytes(f)` makes a copy.
+#[pyclass(name = "MappedFile", module = "dkdc", frozen)]
+struct PyMappedFile {
+    file: dkdc_lake::file_cache::MappedFile,
+}
+
+#[pymethods]
+impl PyMappedFile {
+    unsafe fn __getbuffer__(
+        slf: Bound<'_, Self>,
+        view: *mut pyo3::ffi::Py_buffer,
+        flags: std::os::raw::c_int,
+    ) -> PyResult<()> {
+        if view.is_null() {
+            return Err(PyBufferError::new_err("view is null"));
+        }
+
+        let data = slf.get().file.as_bytes();
+        // The view holds a reference to `slf`, which keeps the mapping alive;
+        // readonly=1 makes requests for a writable buffer fail
+        let result = pyo3::ffi::PyBuffer_FillInfo(
+            view,
+            slf.as_ptr(),
+            data.as_ptr() as *mut std::os::raw::c_void,
+            data.len() as pyo3::ffi::Py_ssize_t,
+            1,
+            flags,
+        );
+        if result == -1 {
+            return Err(PyErr::fetch(slf.py()));
+        }
+        Ok(())
+    }
+
+    fn __len__(&self) -> usize {
+        self.file.len()
+    }
+
+    #[getter]
+    fn path(&self) -> &str {
+        &self.file.filepath
+    }
+
+    #[getter]
+    fn name(&self) -> &str {
+        &self.file.filename
+    }
+
+    /// SHA-256 of the contents
+    #[getter]
+    fn filehash(&self) -> &str {
+        &self.file.filehash
+    }
+
+    fn __repr__(&self) -> String {
+        format!(
+            "MappedFile(path={:?}, name={:?}, size={})",
+            self.file.filepath,
+            self.file.filename,
+            self.file.len()
+        )
+    }
+}
+
+/// A handle to a single lake
+///
+/// With no arguments the lake is resolved like the CLI does: `DKDC_HOME`,
+/// then the `DKDC_LAKE` profile, then `~/.dkdc`. `path` is a dkdc home
+/// directory; `profile` names an entry in the `[lakes]` config section.
+/// With `read_only=True` the catalog is attached read-only: no directories
+/// or tables are created, writes fail, and any number of readers can run
+/// next to a writer.
+///
+/// `threads`, `memory_limit`, `temp_directory`, `object_cache` and
+/// `prefetch` override the DuckDB settings from the `[lake]` config section.
+#[pyclass(name = "Lake", module = "dkdc")]
+struct PyLake {
+    lake: dkdc_lake::Lake,
+}
+
+#[pymethods]
+impl PyLake {
+    #[new]
+    #[allow(clippy::too_many_arguments)]
+    #[pyo3(signature = (path=None, profile=None, read_only=false, threads=None, memory_limit=None, temp_directory=None, object_cache=None, prefetch=None))]
+    fn new(
+        path: Option<PathBuf>,
+        profile: Option<&str>,
+        read_only: bool,
+        threads: Option<usize>,
+        memory_limit: Option<String>,
+        temp_directory: Option<String>,
+        object_cache: Option<bool>,
+        prefetch: Option<bool>,
+    ) -> PyResult<Self> {
+        let config = resolve_config(path, profile)?;
+
+        let mut settings = config.file().lake;
+        if threads.is_some() {
+            settings.threads = threads;
+        }
+        if memory_limit.is_some() {
+            settings.memory_limit = memory_limit;
+        }
+        if temp_directory.is_some() {
+            settings.temp_directory = temp_directory;
+        }
+        settings.object_cache = object_cache.unwrap_or(settings.object_cache);
+        settings.prefetch = prefetch.unwrap_or(settings.prefetch);
+
+        Ok(Self {
+            lake: open_lake(config.with_lake_settings(settings), read_only)?,
+        })
+    }
+
+    /// Whether this handle was opened read-only
+    #[getter]
+    fn read_only(&self) -> bool {
+        self.lake.is_read_only()
+    }
+
+    /// The dkdc home directory of this lake
+    #[getter]
+    fn path(&self) -> PathBuf {
+        self.lake.config().dkdc_dir().to_path_buf()
+    }
+
+    /// Snapshot id reads are pinned to, or `None` for the latest
+    #[getter]
+    fn snapshot(&self) -> Option<i64> {
+        self.lake.snapshot()
+    }
+
+    /// A read-only handle pinned to a point in the lake's history
+    ///
+    /// `when` is a snapshot id, a `datetime` (naive values are UTC), or a
+    /// string such as `"latest"` or `"2025-01-31T12:00:00Z"`. Every read
+    /// through the returned lake sees that one snapshot.
+    fn at(&self, when: &Bound<'_, PyAny>) -> PyResult<Self> {
+        let as_of = as_of_from_py(when)?;
+        let lake = dkdc_lake::Lake::open_read_only(self.lake.config().clone())
+            .and_then(|lake| lake.at(as_of))
+            .map_err(to_py_err)?;
+        Ok(Self { lake })
+    }
+
+    /// Id of the latest committed snapshot
+    fn current_snapshot(&self) -> PyResult<i64> {
+        self.lake.current_snapshot().map_err(to_py_err)
+    }
+
+    /// All snapshots, oldest first, as dicts with `id` and `time`
+    fn snapshots<'py>(&self, py: Python<'py>) -> PyResult<Vec<Bound<'py, PyDict>>> {
+        let snapshots = self.lake.snapshots().map_err(to_py_err)?;
+
+        snapshots
+            .into_iter()
+            .map(|snapshot| {
+                let dict = PyDict::new_bound(py);
+                dict.set_item("id", snapshot.id)?;
+                dict.set_item("time", snapshot.time)?;
+                Ok(dict)
+            })
+            .collect()
+    }
+
+    /// List files in the virtual filesystem
+    #[pyo3(signature = (path="./files"))]
+    fn list_files(&self, path: &str) -> PyResult<Vec<String>> {
+        self.lake.list_files(path).map_err(to_py_err)
+    }
+
+    /// List files with metadata, without reading their contents
+    ///
+    /// Returns one dict per file with `filepath`, `filename`, `filesize`,
+    /// `fileupdated`, `versions` and `filehash`. `sort` is one of `name`,
+    /// `size`, `updated` or `versions`.
+    #[allow(clippy::too_many_arguments)]
+    #[pyo3(signature = (path="./files", recursive=false, sort="name", reverse=false, limit=None, offset=0))]
+    fn ls<'py>(
+        &self,
+        py: Python<'py>,
+        path: &str,
+        recursive: bool,
+        sort: &str,
+        reverse: bool,
+        limit: Option<usize>,
+        offset: usize,
+    ) -> PyResult<Vec<Bound<'py, PyDict>>> {
+        let sort = match sort {
+            "name" => FileSort::Name,
+            "size" => FileSort::Size,
+            "updated" => FileSort::Updated,
+            "versions" => FileSort::Versions,
+            other => {
+                return Err(PyValueError::new_err(format!(
+                    "Unknown sort '{}' (expected name, size, updated or versions)",
+                    other
+                )))
+            }
+        };
+        let options = ListOptions {
+            recursive,
+            sort,
+            reverse,
+            limit,
+            offset,
+        };
+
+        let entries = self
+            .lake
+            .list_file_entries(path, &options)
+            .map_err(to_py_err)?;
+
+        entries
+            .into_iter()
+            .map(|entry| entry_dict(py, entry))
+            .collect()
+    }
+
+    /// Metadata of one file, as `ls` returns it, or None if it doesn't exist
+    #[pyo3(signature = (name, path="./files"))]
+    fn entry<'py>(
+        &self,
+        py: Python<'py>,
+        name: &str,
+        path: &str,
+    ) -> PyResult<Option<Bound<'py, PyDict>>> {
+        self.lake
+            .file_entry(path, name)
+            .map_err(to_py_err)?
+            .map(|entry| entry_dict(py, entry))
+            .transpose()
+    }
+
+    /// Directories below `path` as full paths, from the directory index
+    #[pyo3(signature = (path="./files", recursive=false))]
+    fn dirs(&self, path: &str, recursive: bool) -> PyResult<Vec<String>> {
+        self.lake.list_dirs(path, recursive).map_err(to_py_err)
+    }
+
+    /// Move or rename a file or directory, returning the number of files moved
+    ///
+    /// Only names are rewritten, never file contents.
+    fn mv(&self, source: &str, destination: &str) -> PyResult<usize> {
+        self.lake.move_path(source, destination).map_err(to_py_err)
+    }
+
+    /// Remove a file, or with `recursive` a directory and everything below it,
+    /// returning the number of files removed
+    #[pyo3(signature = (path, recursive=false))]
+    fn rm(&self, path: &str, recursive: bool) -> PyResult<usize> {
+        self.lake.remove_path(path, recursive).map_err(to_py_err)
+    }
+
+    /// Add a local file to the virtual filesystem, returning its name
+    #[pyo3(signature = (file, path=None))]
+    fn add_file(&self, file: PathBuf, path: Option<&str>) -> PyResult<String> {
+        let filename = file
+            .file_name()
+            .and_then(|n| n.to_str())
+            .ok_or_else(|| PyValueError::new_err(format!("Invalid filename: {}", file.display())))?
+            .to_string();
+        let data = std::fs::read(&file)?;
+
+        self.lake
+            .add_file(path.unwrap_or("./files"), &filename, &data)
+            .map_err(to_py_err)?;
+        Ok(filename)
+    }
+
+    /// Write bytes as a new version of a file
+    #[pyo3(signature = (name, data, path="./files"))]
+    fn write_file(&self, name: &str, data: &[u8], path: &str) -> PyResult<()> {
+        self.lake.add_file(path, name, data).map_err(to_py_err)
+    }
+
+    /// Add several local files as a single snapshot, returning their names
+    #[pyo3(signature = (files, path=None))]
+    fn add_files(&self, files: Vec<PathBuf>, path: Option<&str>) -> PyResult<Vec<String>> {
+        let mut entries = Vec::with_capacity(files.len());
+        for file in &files {
+            let filename = file
+                .file_name()
+                .and_then(|n| n.to_str())
+                .ok_or_else(|| {
+                    PyValueError::new_err(format!("Invalid filename: {}", file.display()))
+                })?
+                .to_string();
+            entries.push((filename, std::fs::read(file)?));
+        }
+
+        let filepath = path.unwrap_or("./files");
+        let batch: Vec<(&str, &str, &[u8])> = entries
+            .iter()
+            .map(|(filename, data)| (filepath, filename.as_str(), data.as_slice()))
+            .collect();
+        self.lake.add_files(&batch).map_err(to_py_err)?;
+
+        Ok(entries.into_iter().map(|(filename, _)| filename).collect())
+    }
+
+    /// Get the latest content of a file
+    #[pyo3(signature = (name, path="./files"))]
+    fn get_file<'py>(
+        &self,
+        py: Python<'py>,
+        name: &str,
+        path: &str,
+    ) -> PyResult<Option<Bound<'py, PyBytes>>> {
+        let file = self.lake.get_file(path, name).map_err(to_py_err)?;
+        Ok(file.map(|f| PyBytes::new_bound(py, &f.filedata)))
+    }
+
+    /// Read bytes `start` to `end` of a file's latest version
+    ///
+    /// Large (chunked) files only fetch the chunks overlapping the range.
+    #[pyo3(signature = (name, start, end, path="./files"))]
+    fn read_range<'py>(
+        &self,
+        py: Python<'py>,
+        name: &str,
+        start: u64,
+        end: u64,
+        path: &str,
+    ) -> PyResult<Option<Bound<'py, PyBytes>>> {
+        let data = self
+            .lake
+            .read_file_range(path, name, start, end)
+            .map_err(to_py_err)?;
+        Ok(data.map(|d| PyBytes::new_bound(py, &d)))
+    }
+
+    /// Get the latest content of a file as a read-only memory map
+    ///
+    /// The first read of each version decrypts it into the local file cache
+    /// (`[lake] file_cache_dir`, plaintext on disk); later reads map the
+    /// cached copy without decrypting or copying it.
+    #[pyo3(signature = (name, path="./files"))]
+    fn get_file_mapped(&self, name: &str, path: &str) -> PyResult<Option<PyMappedFile>> {
+        let file = self.lake.get_file_mapped(path, name).map_err(to_py_err)?;
+        Ok(file.map(|file| PyMappedFile { file }))
+    }
+
+    /// Text files best matching `query`, ranked by BM25
+    ///
+    /// Returns dicts with `filepath`, `filename`, `score` and `snippet`.
+    #[pyo3(signature = (query, path=None, limit=10))]
+    fn search<'py>(
+        &self,
+        py: Python<'py>,
+        query: &str,
+        path: Option<&str>,
+        limit: usize,
+    ) -> PyResult<Vec<Bound<'py, PyDict>>> {
+        let hits = self.lake.search(query, path, limit).map_err(to_py_err)?;
+
+        hits.into_iter()
+            .map(|hit| {
+                let dict = PyDict::new_bound(py);
+                dict.set_item("filepath", hit.filepath)?;
+                dict.set_item("filename", hit.filename)?;
+                dict.set_item("score", hit.score)?;
+                dict.set_item("snippet", hit.snippet)?;
+                Ok(dict)
+            })
+            .collect()
+    }
+
+    /// Lines of text files containing `pattern`
+    ///
+    /// Returns dicts with `filepath`, `filename`, `line_number` and `line`.
+    #[pyo3(signature = (pattern, path=None, ignore_case=false))]
+    fn grep<'py>(
+        &self,
+        py: Python<'py>,
+        pattern: &str,
+        path: Option<&str>,
+        ignore_case: bool,
+    ) -> PyResult<Vec<Bound<'py, PyDict>>> {
+        let matches = self
+            .lake
+            .grep(pattern, path, ignore_case)
+            .map_err(to_py_err)?;
+
+        matches
+            .into_iter()
+            .map(|found| {
+                let dict = PyDict::new_bound(py);
+                dict.set_item("filepath", found.filepath)?;
+                dict.set_item("filename", found.filename)?;
+                dict.set_item("line_number", found.line_number)?;
+                dict.set_item("line", found.line)?;
+                Ok(dict)
+            })
+            .collect()
+    }
+
+    /// Rebuild the search and directory indexes, returning the number of
+    /// files indexed for search
+    fn reindex(&self) -> PyResult<usize> {
+        self.lake.reindex_files().map_err(to_py_err)
+    }
+
+    /// Delete chunks no file references any more, returning how many
+    ///
+    /// Run it while nothing else writes to the lake.
+    fn gc(&self) -> PyResult<usize> {
+        self.lake.gc_chunks().map_err(to_py_err)
+    }
+
+    /// Run SQL against the lake and return the result as Arrow
+    ///
+    /// Tables are addressed by name (`files`, `secrets`, `archives`). Raw
+    /// SQL is not pinned by `at`; write `files AT (VERSION => n)` instead.
+    fn query(&self, sql: &str) -> PyResult<PyArrowStream> {
+        self.lake
+            .query_arrow(sql)
+            .map(PyArrowStream::new)
+            .map_err(to_py_err)
+    }
+
+    /// Read a lake table as Arrow, optionally selecting columns
+    ///
+    /// Leave out `filedata` to read metadata without touching any blobs.
+    /// `filedata` holds each file's contents, decompressed, unsealed, and
+    /// reassembled from `chunks`. With `raw=True` it's returned as stored,
+    /// as `query` returns it: rows with a `filecodec` of `zstd` are
+    /// compressed, `envelope` ones are sealed with the envelope key, and
+    /// large files are NULL with their contents in `chunks`.
+    #[pyo3(signature = (name, columns=None, raw=false))]
+    fn table(
+        &self,
+        name: &str,
+        columns: Option<Vec<String>>,
+        raw: bool,
+    ) -> PyResult<PyArrowStream> {
+        self.lake
+            .table_arrow(name, columns.as_deref(), raw)
+            .map(PyArrowStream::new)
+            .map_err(to_py_err)
+    }
+
+    /// Export a table to partitioned Parquet under `to/<table>`
+    ///
+    /// Returns rows written per table (`files` exports include `chunks`).
+    /// `prefix` filters by path, `since`/`until` by update time, and
+    /// `key_secret` names a secret to derive a Parquet encryption key from;
+    /// secrets are only exported without one if `plaintext` is set.
+    #[allow(clippy::too_many_arguments)]
+    #[pyo3(signature = (table, to, prefix=None, since=None, until=None, key_secret=None, plaintext=false))]
+    fn export_table<'py>(
+        &self,
+        py: Python<'py>,
+        table: &str,
+        to: PathBuf,
+        prefix: Option<String>,
+        since: Option<&Bound<'py, PyAny>>,
+        until: Option<&Bound<'py, PyAny>>,
+        key_secret: Option<&str>,
+        plaintext: bool,
+    ) -> PyResult<Bound<'py, PyDict>> {
+        let options = TransferOptions {
+            plaintext,
+            ..transfer_options(&self.lake, prefix, since, until, key_secret)?
+        };
+        let counts = self
+            .lake
+            .export_table(table, &to, &options)
+            .map_err(to_py_err)?;
+        Ok(counts.into_py_dict_bound(py))
+    }
+
+    /// Import a table exported with `export_table`, as one snapshot
+    ///
+    /// Versions no newer than the lake's own latest of the same name are
+    /// skipped. Returns rows added per table.
+    #[allow(clippy::too_many_arguments)]
+    #[pyo3(signature = (table, source, prefix=None, since=None, until=None, key_secret=None))]
+    fn import_table<'py>(
+        &self,
+        py: Python<'py>,
+        table: &str,
+        source: PathBuf,
+        prefix: Option<String>,
+        since: Option<&Bound<'py, PyAny>>,
+        until: Option<&Bound<'py, PyAny>>,
+        key_secret: Option<&str>,
+    ) -> PyResult<Bound<'py, PyDict>> {
+        let options = transfer_options(&self.lake, prefix, since, until, key_secret)?;
+        let counts = self
+            .lake
+            .import_table(table, &source, &options)
+            .map_err(to_py_err)?;
+        Ok(counts.into_py_dict_bound(py))
+    }
+
+    /// Get a secret value
+    fn get_secret(&self, name: &str) -> PyResult<Option<String>> {
+        let data = self.lake.get_secret(name).map_err(to_py_err)?;
+        Ok(data.map(|d| String::from_utf8_lossy(&d).to_string()))
+    }
+
+    /// Set a secret value
+    fn set_secret(&self, name: &str, value: &str) -> PyResult<()> {
+        self.lake
+            .set_secret(name, value.as_bytes())
+            .map_err(to_py_err)
+    }
+
+    /// List all secrets
+    fn list_secrets(&self) -> PyResult<Vec<String>> {
+        self.lake.list_secrets().map_err(to_py_err)
+    }
+
+    /// Delete a secret
+    fn delete_secret(&self, name: &str) -> PyResult<bool> {
+        self.lake.delete_secret(name).map_err(to_py_err)
+    }
+
+    /// SQL that attaches this lake in another DuckDB session
+    fn connection_string(&self) -> String {
+        self.lake.get_sql_commands()
+    }
+
+    fn __repr__(&self) -> String {
+        match self.lake.snapshot() {
+            Some(snapshot) => format!(
+                "Lake(path={:?}, snapshot={})",
+                self.path().display().to_string(),
+                snapshot
+            ),
+            None => format!("Lake(path={:?})", self.path().display().to_string()),
+        }
+    }
+}
+
+/// In-process LRU cache of secrets from one lake
+///
+/// Entries expire after `ttl` seconds and the whole cache is dropped when the
+/// lake's latest snapshot changes, which is checked at most every
+/// `check_interval` seconds. Cached bytes are zeroed on eviction and, with
+/// `lock_memory`, kept out of swap; the `str` returned to Python is an
+/// ordinary Python object.
+#[pyclass(name = "SecretCache", module = "dkdc")]
+struct PySecretCache {
+    cache: dkdc_secrets::SecretCache,
+}
+
+#[pymethods]
+impl PySecretCache {
+    #[new]
+    #[pyo3(signature = (path=None, profile=None, capacity=128, ttl=300.0, check_interval=1.0, lock_memory=true))]
+    fn new(
+        path: Option<PathBuf>,
+        profile: Option<&str>,
+        capacity: usize,
+        ttl: f64,
+        check_interval: f64,
+        lock_memory: bool,
+    ) -> PyResult<Self> {
+        if capacity == 0 {
+            return Err(PyValueError::new_err("capacity must be at least 1"));
+        }
+        let seconds = |value: f64, name: &str| {
+            Duration::try_from_secs_f64(value)
+                .map_err(|_| PyValueError::new_err(format!("invalid {}: {}", name, value)))
+        };
+
+        let options = dkdc_secrets::CacheOptions {
+            capacity,
+            ttl: seconds(ttl, "ttl")?,
+            check_interval: seconds(check_interval, "check_interval")?,
+            lock_memory,
+        };
+
+        Ok(Self {
+            cache: dkdc_secrets::SecretCache::new(
+                open_lake(resolve_config(path, profile)?, true)?,
+                options,
+            ),
+        })
+    }
+
+    /// Get a secret value, or None if it doesn't exist
+    fn get(&mut self, name: &str) -> PyResult<Option<String>> {
+        let value = self.cache.get(name).map_err(to_py_err)?;
+        Ok(value.map(|bytes| String::from_utf8_lossy(bytes).into_owned()))
+    }
+
+    /// Drop one cached secret, or all of them
+    #[pyo3(signature = (name=None))]
+    fn invalidate(&mut self, name: Option<&str>) {
+        self.cache.invalidate(name);
+    }
+
+    /// Hit, miss, eviction and invalidation counters
+    #[getter]
+    fn stats<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyDict>> {
+        let stats = self.cache.stats();
+        let dict = PyDict::new_bound(py);
+        dict.set_item("hits", stats.hits)?;
+        dict.set_item("misses", stats.misses)?;
+        dict.set_item("evictions", stats.evictions)?;
+        dict.set_item("invalidations", stats.invalidations)?;
+        Ok(dict)
+    }
+
+    fn __len__(&self) -> usize {
+        self.cache.len()
+    }
+
+    fn __repr__(&self) -> String {
+        format!(
+            "SecretCache(path={:?}, size={})",
+            self.cache.lake().config().dkdc_dir().display().to_string(),
+            self.cache.len()
+        )
+    }
+}
 
 /// List files in the virtual filesystem
 #[pyfunction]
 #[pyo3(signature = (path="./files"))]
 fn list_files(path: &str) -> PyResult<Vec<String>> {
-    let lake = dkdc_lake::Lake::new()
+    let lake = dkdc_lake::Lake::read_only()
         .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
     
     lake.list_files(path)
@@ -24,7 +837,7 @@ fn add_file(file: &str, path: Option<&str>) -> PyResult<String> {
 /// Get a secret value
 #[pyfunction]
 fn get_secret(name: &str) -> PyResult<Option<String>> {
-    let lake = dkdc_lake::Lake::new()
+    let lake = dkdc_lake::Lake::read_only()
         .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
     
     match lake.get_secret(name) {
@@ -47,13 +860,29 @@ fn set_secret(name: &str, value: &str) -> PyResult<()> {
 /// List all secrets
 #[pyfunction]
 fn list_secrets() -> PyResult<Vec<String>> {
-    let lake = dkdc_lake::Lake::new()
+    let lake = dkdc_lake::Lake::read_only()
         .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
     
     lake.list_secrets()
         .map_err(|e| PyRuntimeError::new_err(e.to_string()))
 }
 
+/// Secrets whose names start with `prefix`, as a dict ready to use as an
+/// environment (e.g. `subprocess.run(cmd, env={**os.environ, **env})`)
+///
+/// All values are read with one query.
+#[pyfunction]
+#[pyo3(signature = (prefix=None))]
+fn secrets_env(prefix: Option<&str>) -> PyResult<HashMap<String, String>> {
+    let lake = dkdc_lake::Lake::read_only().map_err(to_py_err)?;
+    let secrets = lake.secrets_with_prefix(prefix).map_err(to_py_err)?;
+
+    Ok(secrets
+        .into_iter()
+        .map(|(name, data)| (name, String::from_utf8_lossy(&data).to_string()))
+        .collect())
+}
+
 /// Delete a secret
 #[pyfunction]
 fn delete_secret(name: &str) -> PyResult<bool> {
@@ -99,6 +928,65 @@ fn get_connection_string() -> PyResult<String> {
     Ok(lake.get_sql_commands())
 }
 
+/// Start recording timing spans for lake, file and archive operations
+///
+/// At most `max_events` spans are kept (100,000 by default); the oldest are
+/// dropped first.
+#[pyfunction]
+#[pyo3(signature = (max_events=None))]
+fn enable_tracing(max_events: Option<usize>) {
+    if let Some(max_events) = max_events {
+        dkdc_common::trace::set_max_events(max_events);
+    }
+    dkdc_common::trace::enable();
+}
+
+/// Stop recording timing spans (recorded spans are kept)
+#[pyfunction]
+fn disable_tracing() {
+    dkdc_common::trace::disable();
+}
+
+/// Write recorded spans to a file
+///
+/// `format` is `"jsonl"` or `"chrome"`; by default `.json` files get the
+/// Chrome trace format and anything else JSON lines.
+#[pyfunction]
+#[pyo3(signature = (path, format=None))]
+fn write_trace(path: PathBuf, format: Option<&str>) -> PyResult<()> {
+    use dkdc_common::trace::TraceFormat;
+
+    let format = match format {
+        None => TraceFormat::from_path(&path),
+        Some("jsonl") => TraceFormat::JsonLines,
+        Some("chrome") => TraceFormat::Chrome,
+        Some(other) => {
+            return Err(PyValueError::new_err(format!(
+                "Unknown trace format '{}' (expected jsonl or chrome)",
+                other
+            )))
+        }
+    };
+
+    dkdc_common::trace::write(&path, format).map_err(to_py_err)
+}
+
+/// Count, total and max duration (microseconds) per span name
+#[pyfunction]
+fn trace_summary(py: Python<'_>) -> PyResult<Vec<Bound<'_, PyDict>>> {
+    dkdc_common::trace::counters()
+        .into_iter()
+        .map(|counter| {
+            let dict = PyDict::new_bound(py);
+            dict.set_item("name", counter.name)?;
+            dict.set_item("count", counter.count)?;
+            dict.set_item("total_us", counter.total_us)?;
+            dict.set_item("max_us", counter.max_us)?;
+            Ok(dict)
+        })
+        .collect()
+}
+
 /// Run the CLI with given arguments
 #[pyfunction]
 fn run_cli(args: Vec<String>) -> PyResult<i32> {
@@ -125,9 +1013,18 @@ fn _dkdc(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(set_secret, m)?)?;
     m.add_function(wrap_pyfunction!(list_secrets, m)?)?;
     m.add_function(wrap_pyfunction!(delete_secret, m)?)?;
+    m.add_function(wrap_pyfunction!(secrets_env, m)?)?;
     m.add_function(wrap_pyfunction!(launch_dev, m)?)?;
     m.add_function(wrap_pyfunction!(get_connection_string, m)?)?;
     m.add_function(wrap_pyfunction!(run_cli, m)?)?;
+    m.add_function(wrap_pyfunction!(enable_tracing, m)?)?;
+    m.add_function(wrap_pyfunction!(disable_tracing, m)?)?;
+    m.add_function(wrap_pyfunction!(write_trace, m)?)?;
+    m.add_function(wrap_pyfunction!(trace_summary, m)?)?;
+    m.add_class::<PyLake>()?;
+    m.add_class::<PyArrowStream>()?;
+    m.add_class::<PySecretCache>()?;
+    m.add_class::<PyMappedFile>()?;
     m.add("__version__", dkdc_common::version::PKG_VERSION)?;
     Ok(())
 }
\ No newline at end of file
@@ -0,0 +1,303 @@
+//! In-process cache of decrypted secrets
+//!
+//! Entries are bounded by an LRU capacity and a per-entry TTL, and the whole
+//! cache is dropped whenever the lake's latest snapshot id changes. The
+//! snapshot id is checked at most once per `check_interval`, so hot reads
+//! are a hash map lookup while writes from any process are seen within
+//! that interval.
+
+use anyhow::Result;
+use dkdc_lake::Lake;
+use std::collections::HashMap;
+use std::sync::atomic::{compiler_fence, Ordering};
+use std::time::{Duration, Instant};
+
+#[cfg(unix)]
+use std::collections::BTreeMap;
+#[cfg(unix)]
+use std::sync::{Mutex, PoisonError};
+
+/// Tuning for a [`SecretCache`]
+#[derive(Debug, Clone)]
+pub struct CacheOptions {
+    /// Maximum number of cached secrets
+    pub capacity: usize,
+    /// How long an entry is served before it is re-read
+    pub ttl: Duration,
+    /// How often the lake snapshot id is checked for changes
+    pub check_interval: Duration,
+    /// Lock cached values into RAM so they are never swapped out
+    pub lock_memory: bool,
+}
+
+impl Default for CacheOptions {
+    fn default() -> Self {
+        Self {
+            capacity: 128,
+            ttl: Duration::from_secs(300),
+            check_interval: Duration::from_secs(1),
+            lock_memory: true,
+        }
+    }
+}
+
+/// Cache counters
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq)]
+pub struct CacheStats {
+    pub hits: u64,
+    pub misses: u64,
+    /// Entries dropped for capacity
+    pub evictions: u64,
+    /// Times the cache was cleared because the lake changed
+    pub invalidations: u64,
+}
+
+/// Secret bytes that are zeroed on drop and optionally `mlock`ed
+pub struct SecretBytes {
+    data: Vec<u8>,
+    locked: bool,
+}
+
+impl SecretBytes {
+    fn new(data: Vec<u8>, lock: bool) -> Self {
+        let locked = lock && lock_memory(&data);
+        Self { data, locked }
+    }
+
+    pub fn as_bytes(&self) -> &[u8] {
+        &self.data
+    }
+}
+
+impl Drop for SecretBytes {
+    fn drop(&mut self) {
+        for byte in self.data.iter_mut() {
+            // Volatile so the writes aren't optimized away before the free
+            unsafe { std::ptr::write_volatile(byte, 0) };
+        }
+        compiler_fence(Ordering::SeqCst);
+
+        if self.locked {
+            unlock_memory(&self.data);
+        }
+    }
+}
+
+/// Number of locked values on each locked page, by page number
+///
+/// `mlock` works on whole pages and doesn't nest: unlocking one value's
+/// range would unlock every other value on its pages. A page is only
+/// unlocked once no locked value is left on it.
+#[cfg(unix)]
+static LOCKED_PAGES: Mutex<BTreeMap<usize, usize>> = Mutex::new(BTreeMap::new());
+
+#[cfg(unix)]
+fn page_size() -> usize {
+    unsafe { libc::sysconf(libc::_SC_PAGESIZE) as usize }
+}
+
+/// Numbers of the pages `data` lies on; it must not be empty
+#[cfg(unix)]
+fn pages(data: &[u8]) -> std::ops::Range<usize> {
+    let (start, size) = (data.as_ptr() as usize, page_size());
+    start / size..(start + data.len() - 1) / size + 1
+}
+
+#[cfg(unix)]
+fn lock_memory(data: &[u8]) -> bool {
+    if data.is_empty() {
+        return false;
+    }
+    let mut locked = LOCKED_PAGES.lock().unwrap_or_else(PoisonError::into_inner);
+    // mlock can fail under RLIMIT_MEMLOCK; the value is then only zeroed
+    if unsafe { libc::mlock(data.as_ptr().cast(), data.len()) } != 0 {
+        return false;
+    }
+    for page in pages(data) {
+        *locked.entry(page).or_default() += 1;
+    }
+    true
+}
+
+#[cfg(unix)]
+fn unlock_memory(data: &[u8]) {
+    let size = page_size();
+    let mut locked = LOCKED_PAGES.lock().unwrap_or_else(PoisonError::into_inner);
+    for page in pages(data) {
+        let Some(count) = locked.get_mut(&page) else {
+            continue;
+        };
+        *count -= 1;
+        if *count == 0 {
+            locked.remove(&page);
+            unsafe { libc::munlock((page * size) as *const libc::c_void, size) };
+        }
+    }
+}
+
+#[cfg(not(unix))]
+fn lock_memory(_data: &[u8]) -> bool {
+    false
+}
+
+#[cfg(not(unix))]
+fn unlock_memory(_data: &[u8]) {}
+
+struct Entry {
+    /// `None` caches a lookup of a secret that doesn't exist
+    value: Option<SecretBytes>,
+    fetched: Instant,
+    last_used: u64,
+}
+
+/// Size-bounded LRU cache of secrets read from one lake
+pub struct SecretCache {
+    lake: Lake,
+    options: CacheOptions,
+    entries: HashMap<String, Entry>,
+    snapshot: Option<i64>,
+    last_check: Option<Instant>,
+    tick: u64,
+    stats: CacheStats,
+}
+
+impl SecretCache {
+    pub fn new(lake: Lake, options: CacheOptions) -> Self {
+        Self {
+            lake,
+            options,
+            entries: HashMap::new(),
+            snapshot: None,
+            last_check: None,
+            tick: 0,
+            stats: CacheStats::default(),
+        }
+    }
+
+    /// Get a secret, reading through to the lake on a miss
+    pub fn get(&mut self, name: &str) -> Result<Option<&[u8]>> {
+        self.check_snapshot()?;
+        self.tick += 1;
+
+        let fresh = self
+            .entries
+            .get(name)
+            .is_some_and(|entry| entry.fetched.elapsed() < self.options.ttl);
+
+        if fresh {
+            self.stats.hits += 1;
+        } else {
+            self.stats.misses += 1;
+            let value = self.lake.get_secret(name)?;
+            self.insert(name, value);
+        }
+
+        let entry = self
+            .entries
+            .get_mut(name)
+            .expect("entry was just looked up or inserted");
+        entry.last_used = self.tick;
+        Ok(entry.value.as_ref().map(SecretBytes::as_bytes))
+    }
+
+    /// Drop one cached secret, or all of them
+    pub fn invalidate(&mut self, name: Option<&str>) {
+        match name {
+            Some(name) => {
+                self.entries.remove(name);
+            }
+            None => self.entries.clear(),
+        }
+    }
+
+    pub fn stats(&self) -> CacheStats {
+        self.stats
+    }
+
+    pub fn len(&self) -> usize {
+        self.entries.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.entries.is_empty()
+    }
+
+    pub fn lake(&self) -> &Lake {
+        &self.lake
+    }
+
+    fn insert(&mut self, name: &str, value: Option<Vec<u8>>) {
+        if !self.entries.contains_key(name) && self.entries.len() >= self.options.capacity {
+            self.evict_lru();
+        }
+
+        let value = value.map(|data| SecretBytes::new(data, self.options.lock_memory));
+        self.entries.insert(
+            name.to_string(),
+            Entry {
+                value,
+                fetched: Instant::now(),
+                last_used: self.tick,
+            },
+        );
+    }
+
+    fn evict_lru(&mut self) {
+        let oldest = self
+            .entries
+            .iter()
+            .min_by_key(|(_, entry)| entry.last_used)
+            .map(|(name, _)| name.clone());
+
+        if let Some(name) = oldest {
+            self.entries.remove(&name);
+            self.stats.evictions += 1;
+        }
+    }
+
+    /// Clear the cache if the lake has a new snapshot since the last check
+    fn check_snapshot(&mut self) -> Result<()> {
+        if self
+            .last_check
+            .is_some_and(|checked| checked.elapsed() < self.options.check_interval)
+        {
+            return Ok(());
+        }
+
+        let snapshot = self.lake.current_snapshot()?;
+        if self.snapshot.is_some_and(|previous| previous != snapshot) && !self.entries.is_empty() {
+            self.entries.clear();
+            self.stats.invalidations += 1;
+        }
+
+        self.snapshot = Some(snapshot);
+        self.last_check = Some(Instant::now());
+        Ok(())
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_secret_bytes_round_trip() {
+        let secret = SecretBytes::new(b"hunter2".to_vec(), true);
+        assert_eq!(secret.as_bytes(), b"hunter2");
+    }
+
+    #[cfg(unix)]
+    #[test]
+    fn test_shared_pages_stay_locked() {
+        let first = SecretBytes::new(b"first".to_vec(), true);
+        let second = SecretBytes::new(b"second".to_vec(), true);
+        if !(first.locked && second.locked) {
+            // mlock isn't allowed here (RLIMIT_MEMLOCK)
+            return;
+        }
+
+        let page = pages(second.as_bytes()).start;
+        drop(first);
+        assert!(LOCKED_PAGES.lock().unwrap().contains_key(&page));
+    }
+}
@@ -6,9 +6,13 @@
 use anyhow::Result;
 use dkdc_lake::Lake;
 
+pub mod cache;
+
+pub use cache::{CacheOptions, CacheStats, SecretCache};
+
 /// List all secret names
 pub fn list_secrets() -> Result<Vec<String>> {
-    let lake = Lake::new()?;
+    let lake = Lake::read_only()?;
     lake.list_secrets()
 }
 
@@ -20,7 +24,7 @@ pub fn set_secret(name: &str, value: &[u8]) -> Result<()> {
 
 /// Get a secret value
 pub fn get_secret(name: &str) -> Result<Option<Vec<u8>>> {
-    let lake = Lake::new()?;
+    let lake = Lake::read_only()?;
     lake.get_secret(name)
 }
 
@@ -0,0 +1,482 @@
+//! Local HTTP server over the lake's virtual filesystem
+//!
+//! `GET /files/notes.md` returns the latest version of `./files/notes.md`,
+//! and a directory returns an HTML index of its files and subdirectories.
+//! File responses carry the contents' SHA-256 as a strong `ETag` and the
+//! update time as `Last-Modified`, so conditional requests (`If-None-Match`,
+//! `If-Modified-Since`, `If-Range`) work, and a single `Range` is answered
+//! with `206 Partial Content` from only the chunks it overlaps.
+//!
+//! Each worker thread holds its own read-only lake, pinned to the latest
+//! snapshot for every request, so the headers and body of a response always
+//! describe the same version while writers keep writing. Bodies are streamed
+//! a window at a time; with `[lake] file_cache` they are sent straight from
+//! the cached copy's memory map instead, without decrypting them again.
+//!
+//! `SIGINT` or `SIGTERM` stops the server cleanly: workers finish the
+//! request in hand and [`serve`] returns, so callers still run their
+//! shutdown work (such as writing a trace). A second signal exits at once.
+
+use anyhow::Result;
+use chrono::{DateTime, Utc};
+use dkdc_common::trace;
+use dkdc_config::Config;
+use dkdc_lake::files::{FileEntry, ListOptions};
+use dkdc_lake::{AsOf, Lake};
+use percent_encoding::{percent_decode_str, utf8_percent_encode, AsciiSet, NON_ALPHANUMERIC};
+use std::io::{self, Cursor, Read};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::Arc;
+use std::thread;
+use std::time::Duration;
+use tiny_http::{Header, Method, Request, Response, Server, StatusCode};
+
+/// Bytes read from the lake per step of a streamed body
+const STREAM_WINDOW: u64 = 4 * 1024 * 1024;
+
+/// How often idle workers check whether the server is stopping
+const STOP_POLL: Duration = Duration::from_millis(200);
+
+static STOPPING: AtomicBool = AtomicBool::new(false);
+
+/// `Last-Modified` format (RFC 9110 IMF-fixdate)
+const HTTP_DATE: &str = "%a, %d %b %Y %H:%M:%S GMT";
+
+/// Characters escaped in a URL path segment
+const SEGMENT: &AsciiSet = &NON_ALPHANUMERIC
+    .remove(b'-')
+    .remove(b'.')
+    .remove(b'_')
+    .remove(b'~');
+
+type Reply<'a> = Response<Box<dyn Read + 'a>>;
+
+/// Serve the lake at `addr` with `workers` threads until interrupted
+pub fn serve(addr: &str, workers: usize) -> Result<()> {
+    let config = Config::new()?;
+    let server =
+        Server::http(addr).map_err(|e| anyhow::anyhow!("Failed to listen on {}: {}", addr, e))?;
+    let server = Arc::new(server);
+    STOPPING.store(false, Ordering::SeqCst);
+    stop_on_signal();
+    println!("Serving the lake on http://{}", addr);
+
+    let workers: Vec<_> = (0..workers.max(1))
+        .map(|_| {
+            let server = Arc::clone(&server);
+            let config = config.clone();
+            thread::spawn(move || worker(&server, config))
+        })
+        .collect();
+    for worker in workers {
+        worker
+            .join()
+            .map_err(|_| anyhow::anyhow!("Server worker panicked"))??;
+    }
+
+    println!("Stopped serving the lake");
+    Ok(())
+}
+
+#[cfg(unix)]
+fn stop_on_signal() {
+    extern "C" fn on_signal(signal: libc::c_int) {
+        STOPPING.store(true, Ordering::SeqCst);
+        // Let a second signal terminate the process as usual
+        unsafe { libc::signal(signal, libc::SIG_DFL) };
+    }
+
+    let handler = on_signal as extern "C" fn(libc::c_int) as libc::sighandler_t;
+    unsafe {
+        libc::signal(libc::SIGINT, handler);
+        libc::signal(libc::SIGTERM, handler);
+    }
+}
+
+#[cfg(not(unix))]
+fn stop_on_signal() {}
+
+fn worker(server: &Server, config: Config) -> Result<()> {
+    let mut lake = Lake::open_read_only(config)?;
+    let use_cache = lake.config().file().lake.file_cache;
+
+    while !STOPPING.load(Ordering::SeqCst) {
+        let Some(request) = server.recv_timeout(STOP_POLL)? else {
+            continue;
+        };
+        let _span = trace::span_with("serve.request", || request.url().to_string());
+
+        let reply = match route(&mut lake, &request, use_cache) {
+            Ok(reply) => reply,
+            Err(e) => {
+                eprintln!("[dkdc] {} {}: {}", request.method(), request.url(), e);
+                text(500, "Internal server error")
+            }
+        };
+        // Clients hanging up mid-body only end their own response
+        let _ = request.respond(reply);
+    }
+
+    Ok(())
+}
+
+fn route<'a>(lake: &'a mut Lake, request: &Request, use_cache: bool) -> Result<Reply<'a>> {
+    if !matches!(request.method(), Method::Get | Method::Head) {
+        return Ok(text(405, "Method not allowed").with_header(header("Allow", "GET, HEAD")));
+    }
+    let Some(path) = lake_path(request.url()) else {
+        return Ok(text(400, "Bad path"));
+    };
+
+    lake.pin(AsOf::Latest)?;
+    let lake: &Lake = lake;
+
+    if let Some((filepath, filename)) = path.rsplit_once('/') {
+        if let Some(entry) = lake.file_entry(filepath, filename)? {
+            return serve_file(lake, request, entry, use_cache);
+        }
+    }
+
+    let dirs = lake.list_dirs(&path, false)?;
+    let files = lake.list_file_entries(&path, &ListOptions::default())?;
+    if dirs.is_empty() && files.is_empty() && path != "." {
+        return Ok(text(404, "Not found"));
+    }
+    Ok(index(&path, &dirs, &files))
+}
+
+fn serve_file<'a>(
+    lake: &'a Lake,
+    request: &Request,
+    entry: FileEntry,
+    use_cache: bool,
+) -> Result<Reply<'a>> {
+    let size = entry.filesize.max(0) as u64;
+    let etag = entity_tag(&entry);
+    let modified = entry.fileupdated.format(HTTP_DATE).to_string();
+    let mut headers = vec![
+        header("ETag", &etag),
+        header("Last-Modified", &modified),
+        header("Cache-Control", "no-cache"),
+        header("Accept-Ranges", "bytes"),
+    ];
+
+    if not_modified(request, &etag, entry.fileupdated) {
+        return Ok(reply(304, headers, io::empty(), 0));
+    }
+
+    // A range of an older version than the client holds would corrupt it
+    let range = match request_header(request, "If-Range") {
+        Some(validator) if !range_is_current(validator, &etag, &modified) => ByteRange::Full,
+        _ => parse_range(request_header(request, "Range"), size),
+    };
+    let (status, start, end) = match range {
+        ByteRange::Full => (200, 0, size),
+        ByteRange::Partial(start, end) => {
+            let content_range = format!("bytes {}-{}/{}", start, end - 1, size);
+            headers.push(header("Content-Range", &content_range));
+            (206, start, end)
+        }
+        ByteRange::Unsatisfiable => {
+            headers.push(header("Content-Range", &format!("bytes */{}", size)));
+            return Ok(reply(416, headers, io::empty(), 0));
+        }
+    };
+    headers.push(header("Content-Type", content_type(&entry.filename)));
+
+    let len = end - start;
+    if *request.method() == Method::Head || len == 0 {
+        // No body is sent for HEAD, but its length is still reported
+        return Ok(reply(status, headers, io::empty(), len));
+    }
+
+    if use_cache {
+        if let Some(mapped) = lake.get_file_mapped(&entry.filepath, &entry.filename)? {
+            if mapped.len() as u64 == size {
+                let mut body = Cursor::new(mapped);
+                body.set_position(start);
+                return Ok(reply(status, headers, body.take(len), len));
+            }
+        }
+    }
+
+    let body = LakeReader {
+        lake,
+        filepath: entry.filepath,
+        filename: entry.filename,
+        next: start,
+        end,
+        window: Cursor::new(Vec::new()),
+    };
+    Ok(reply(status, headers, body, len))
+}
+
+/// Streams bytes `next..end` of a file from the lake, a window at a time
+///
+/// Only the chunks overlapping the current window are read and decrypted,
+/// so memory use does not depend on the file or range size.
+struct LakeReader<'a> {
+    lake: &'a Lake,
+    filepath: String,
+    filename: String,
+    next: u64,
+    end: u64,
+    window: Cursor<Vec<u8>>,
+}
+
+impl Read for LakeReader<'_> {
+    fn read(&mut self, buf: &mut [u8]) -> io::Result<usize> {
+        loop {
+            let read = self.window.read(buf)?;
+            if read > 0 || buf.is_empty() || self.next >= self.end {
+                return Ok(read);
+            }
+
+            let stop = (self.next + STREAM_WINDOW).min(self.end);
+            let data = self
+                .lake
+                .read_file_range(&self.filepath, &self.filename, self.next, stop)
+                .map_err(io::Error::other)?
+                .filter(|data| !data.is_empty())
+                .ok_or_else(|| io::Error::new(io::ErrorKind::UnexpectedEof, "File truncated"))?;
+            self.next += data.len() as u64;
+            self.window = Cursor::new(data);
+        }
+    }
+}
+
+/// Outcome of a `Range` header against a file's size
+#[derive(Debug, PartialEq, Eq)]
+enum ByteRange {
+    /// The whole file: no range, or one that isn't a single byte range
+    Full,
+    /// Bytes `start..end`
+    Partial(u64, u64),
+    /// No requested byte is in the file
+    Unsatisfiable,
+}
+
+/// Parse a single `bytes=` range; others are ignored, as RFC 9110 allows
+fn parse_range(header: Option<&str>, size: u64) -> ByteRange {
+    let Some(spec) = header.and_then(|h| h.trim().strip_prefix("bytes=")) else {
+        return ByteRange::Full;
+    };
+    let Some((first, last)) = spec.trim().split_once('-') else {
+        return ByteRange::Full;
+    };
+    if spec.contains(',') {
+        return ByteRange::Full;
+    }
+
+    match (first.trim().parse::<u64>(), last.trim()) {
+        // `bytes=-500`: the last 500 bytes
+        (Err(_), last) if first.trim().is_empty() => match last.parse::<u64>() {
+            Ok(0) => ByteRange::Unsatisfiable,
+            Ok(_) if size == 0 => ByteRange::Unsatisfiable,
+            Ok(suffix) => ByteRange::Partial(size.saturating_sub(suffix), size),
+            Err(_) => ByteRange::Full,
+        },
+        (Ok(start), _) if start >= size => ByteRange::Unsatisfiable,
+        // `bytes=500-`: from byte 500 to the end
+        (Ok(start), "") => ByteRange::Partial(start, size),
+        (Ok(start), last) => match last.parse::<u64>() {
+            Ok(last) if last >= start => ByteRange::Partial(start, (last + 1).min(size)),
+            _ => ByteRange::Full,
+        },
+        (Err(_), _) => ByteRange::Full,
+    }
+}
+
+/// Strong tag from the contents' hash; files written before hashing get a
+/// weak one from their size and update time
+fn entity_tag(entry: &FileEntry) -> String {
+    match &entry.filehash {
+        Some(hash) => format!("\"{}\"", hash),
+        None => format!(
+            "W/\"{}-{}\"",
+            entry.filesize,
+            entry.fileupdated.timestamp_micros()
+        ),
+    }
+}
+
+/// Whether the client's copy is current, so `304 Not Modified` can be sent
+fn not_modified(request: &Request, etag: &str, updated: DateTime<Utc>) -> bool {
+    // `If-None-Match` takes precedence, with weak comparison
+    if let Some(tags) = request_header(request, "If-None-Match") {
+        let etag = etag.trim_start_matches("W/");
+        return tags
+            .split(',')
+            .map(str::trim)
+            .any(|tag| tag == "*" || tag.trim_start_matches("W/") == etag);
+    }
+
+    request_header(request, "If-Modified-Since")
+        .and_then(|since| DateTime::parse_from_rfc2822(since).ok())
+        .is_some_and(|since| updated.timestamp() <= since.timestamp())
+}
+
+/// `If-Range` matches only a strong tag or the exact modification date
+fn range_is_current(validator: &str, etag: &str, modified: &str) -> bool {
+    let validator = validator.trim();
+    (validator == etag && !etag.starts_with("W/")) || validator == modified
+}
+
+/// HTML index of a directory's subdirectories and files
+fn index<'a>(path: &str, dirs: &[String], files: &[FileEntry]) -> Reply<'a> {
+    let mut html = format!(
+        "<!DOCTYPE html>\n<meta charset=\"utf-8\">\n<title>{0}</title>\n<h1>{0}</h1>\n<ul>\n",
+        escape_html(path)
+    );
+    for dir in dirs {
+        let name = dir.rsplit('/').next().unwrap_or(dir);
+        html.push_str(&format!(
+            "<li><a href=\"{}/\">{}/</a></li>\n",
+            url_path(dir),
+            escape_html(name)
+        ));
+    }
+    for entry in files {
+        html.push_str(&format!(
+            "<li><a href=\"{}\">{}</a> {}</li>\n",
+            url_path(&format!("{}/{}", entry.filepath, entry.filename)),
+            escape_html(&entry.filename),
+            entry.filesize
+        ));
+    }
+    html.push_str("</ul>\n");
+
+    let len = html.len() as u64;
+    let headers = vec![header("Content-Type", "text/html; charset=utf-8")];
+    reply(200, headers, Cursor::new(html.into_bytes()), len)
+}
+
+/// Lake path of a request URL, e.g. `./files/a b.md` for `/files/a%20b.md`
+///
+/// `None` for paths that aren't UTF-8 or try to leave the lake with `..`.
+fn lake_path(url: &str) -> Option<String> {
+    let path = url.split(['?', '#']).next().unwrap_or_default();
+
+    let mut lake_path = String::from(".");
+    for segment in path.split('/').filter(|s| !s.is_empty()) {
+        let segment = percent_decode_str(segment).decode_utf8().ok()?;
+        if segment == "." || segment == ".." || segment.contains('/') {
+            return None;
+        }
+        lake_path.push('/');
+        lake_path.push_str(&segment);
+    }
+
+    Some(lake_path)
+}
+
+/// URL path of a lake path, the inverse of [`lake_path`]
+fn url_path(lake_path: &str) -> String {
+    lake_path
+        .trim_start_matches('.')
+        .split('/')
+        .map(|segment| utf8_percent_encode(segment, SEGMENT).to_string())
+        .collect::<Vec<_>>()
+        .join("/")
+}
+
+fn escape_html(s: &str) -> String {
+    s.replace('&', "&amp;")
+        .replace('<', "&lt;")
+        .replace('>', "&gt;")
+        .replace('"', "&quot;")
+}
+
+/// `Content-Type` by extension, so browsers and players can preview files
+fn content_type(filename: &str) -> &'static str {
+    let extension = filename
+        .rsplit_once('.')
+        .map(|(_, ext)| ext.to_ascii_lowercase())
+        .unwrap_or_default();
+
+    match extension.as_str() {
+        "txt" | "md" | "toml" | "yaml" | "yml" | "rs" | "py" | "sh" | "sql" => {
+            "text/plain; charset=utf-8"
+        }
+        "html" | "htm" => "text/html; charset=utf-8",
+        "css" => "text/css; charset=utf-8",
+        "csv" => "text/csv; charset=utf-8",
+        "js" => "text/javascript; charset=utf-8",
+        "json" => "application/json",
+        "pdf" => "application/pdf",
+        "zip" => "application/zip",
+        "png" => "image/png",
+        "jpg" | "jpeg" => "image/jpeg",
+        "gif" => "image/gif",
+        "webp" => "image/webp",
+        "svg" => "image/svg+xml",
+        "mp3" => "audio/mpeg",
+        "wav" => "audio/wav",
+        "ogg" => "audio/ogg",
+        "mp4" | "m4v" => "video/mp4",
+        "webm" => "video/webm",
+        "mov" => "video/quicktime",
+        _ => "application/octet-stream",
+    }
+}
+
+fn request_header<'r>(request: &'r Request, name: &'static str) -> Option<&'r str> {
+    request
+        .headers()
+        .iter()
+        .find(|h| h.field.equiv(name))
+        .map(|h| h.value.as_str())
+}
+
+fn header(name: &str, value: &str) -> Header {
+    Header::from_bytes(name, value).expect("header names and values are ASCII")
+}
+
+fn reply<'a>(status: u16, headers: Vec<Header>, body: impl Read + 'a, len: u64) -> Reply<'a> {
+    Response::new(
+        StatusCode(status),
+        headers,
+        Box::new(body),
+        Some(len as usize),
+        None,
+    )
+}
+
+fn text<'a>(status: u16, message: &str) -> Reply<'a> {
+    let headers = vec![header("Content-Type", "text/plain; charset=utf-8")];
+    let body = format!("{}\n", message).into_bytes();
+    let len = body.len() as u64;
+    reply(status, headers, Cursor::new(body), len)
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_parse_range() {
+        let range = |header: &str| parse_range(Some(header), 1000);
+        assert_eq!(parse_range(None, 1000), ByteRange::Full);
+        assert_eq!(range("bytes=0-499"), ByteRange::Partial(0, 500));
+        assert_eq!(range("bytes=500-"), ByteRange::Partial(500, 1000));
+        assert_eq!(range("bytes=-100"), ByteRange::Partial(900, 1000));
+        assert_eq!(range("bytes=900-2000"), ByteRange::Partial(900, 1000));
+        assert_eq!(range("bytes=1000-"), ByteRange::Unsatisfiable);
+        assert_eq!(range("bytes=-0"), ByteRange::Unsatisfiable);
+        assert_eq!(range("bytes=0-1,5-6"), ByteRange::Full);
+        assert_eq!(range("bytes=5-1"), ByteRange::Full);
+        assert_eq!(range("items=0-1"), ByteRange::Full);
+    }
+
+    #[test]
+    fn test_lake_path() {
+        assert_eq!(lake_path("/").as_deref(), Some("."));
+        assert_eq!(
+            lake_path("/files/a%20b.md?download").as_deref(),
+            Some("./files/a b.md")
+        );
+        assert_eq!(lake_path("/files/../secrets"), None);
+        assert_eq!(lake_path("/files/%2e%2e/secrets"), None);
+        assert_eq!(url_path("./files/a b.md"), "/files/a%20b.md");
+    }
+}
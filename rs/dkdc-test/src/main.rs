@@ -1,9 +1,28 @@
 use anyhow::{Context, Result};
 use clap::{Parser, Subcommand};
 use colored::*;
+use serde::{Deserialize, Serialize};
+use std::collections::HashMap;
+use std::path::{Path, PathBuf};
 use std::process::{Command, Stdio};
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
+use std::time::{Duration, Instant};
 use tempfile::TempDir;
 
+/// Where input fingerprints of passing suites are recorded
+const CACHE_PATH: &str = "rs/target/dkdc-test/cache.json";
+
+/// Directories never included in suite fingerprints
+const FINGERPRINT_SKIP_DIRS: &[&str] = &[
+    "target",
+    ".git",
+    ".venv",
+    "__pycache__",
+    ".pytest_cache",
+    ".ruff_cache",
+];
+
 #[derive(Parser)]
 #[command(name = "dkdc-test")]
 #[command(about = "Test runner for dkdc")]
@@ -14,6 +33,22 @@ struct Cli {
     /// Verbose output
     #[arg(short, long)]
     verbose: bool,
+
+    /// Maximum number of suites (and e2e cases) to run at once
+    #[arg(short, long, default_value_t = default_jobs())]
+    jobs: usize,
+
+    /// Run suites even if their inputs are unchanged since the last pass
+    #[arg(long)]
+    no_cache: bool,
+
+    /// Write a JSON timing report to this file
+    #[arg(long)]
+    report: Option<PathBuf>,
+
+    /// Write a JUnit XML report to this file
+    #[arg(long)]
+    junit: Option<PathBuf>,
 }
 
 #[derive(Subcommand)]
@@ -30,68 +65,349 @@ enum Commands {
     E2e,
 }
 
+fn default_jobs() -> usize {
+    std::thread::available_parallelism()
+        .map(|n| n.get())
+        .unwrap_or(4)
+}
+
+#[derive(Clone, Copy, PartialEq, Eq)]
+enum Suite {
+    Rust,
+    Python,
+    Go,
+    E2e,
+}
+
+impl Suite {
+    const ALL: [Suite; 4] = [Suite::Rust, Suite::Python, Suite::Go, Suite::E2e];
+
+    fn key(self) -> &'static str {
+        match self {
+            Suite::Rust => "rust",
+            Suite::Python => "python",
+            Suite::Go => "go",
+            Suite::E2e => "e2e",
+        }
+    }
+
+    fn title(self) -> &'static str {
+        match self {
+            Suite::Rust => "Rust tests",
+            Suite::Python => "Python tests",
+            Suite::Go => "Go tests",
+            Suite::E2e => "End-to-end tests",
+        }
+    }
+
+    fn icon(self) -> &'static str {
+        match self {
+            Suite::Rust => "🦀",
+            Suite::Python => "🐍",
+            Suite::Go => "🐹",
+            Suite::E2e => "🔄",
+        }
+    }
+
+    /// Files and directories whose contents decide whether a suite must re-run
+    fn inputs(self) -> &'static [&'static str] {
+        match self {
+            Suite::Rust => &["rs"],
+            Suite::Python | Suite::E2e => &["rs", "py", "pyproject.toml"],
+            Suite::Go => &["go"],
+        }
+    }
+
+    fn run(self, jobs: usize) -> Result<Vec<TestResult>> {
+        match self {
+            Suite::Rust => run_rust_tests(),
+            Suite::Python => run_python_tests(),
+            Suite::Go => run_go_tests(),
+            Suite::E2e => run_e2e_tests(jobs),
+        }
+    }
+}
+
+/// A build shared by several suites, run once before any of them start
+///
+/// `cargo test` and `uv` (through maturin) both build the workspace into
+/// `rs/target`. Run side by side they wait on each other's target-dir lock
+/// and rebuild the same crates, so the builds run first, one at a time, and
+/// the suites only reuse them.
+struct BuildStep {
+    name: &'static str,
+    dir: &'static str,
+    program: &'static str,
+    args: &'static [&'static str],
+    suites: &'static [Suite],
+}
+
+const BUILD_STEPS: &[BuildStep] = &[
+    BuildStep {
+        name: "Rust test build",
+        dir: "rs",
+        program: "cargo",
+        args: &["test", "--workspace", "--no-run", "--quiet"],
+        suites: &[Suite::Rust],
+    },
+    BuildStep {
+        name: "Python environment",
+        dir: ".",
+        program: "uv",
+        args: &["sync", "--quiet"],
+        suites: &[Suite::Python, Suite::E2e],
+    },
+];
+
+/// Run the build steps the given suites need, returning the output of the
+/// failed ones by the suites that depend on them
+///
+/// A missing tool isn't a failure here: the suites report it themselves.
+fn run_builds(suites: &[Suite]) -> HashMap<&'static str, String> {
+    let mut failures = HashMap::new();
+
+    for step in BUILD_STEPS {
+        if !step.suites.iter().any(|suite| suites.contains(suite)) {
+            continue;
+        }
+
+        println!("{} {}", "🔨".bold(), step.name.dimmed());
+        let failure = match Command::new(step.program)
+            .current_dir(step.dir)
+            .args(step.args)
+            .output()
+        {
+            Ok(output) if output.status.success() => continue,
+            Ok(output) => format!(
+                "{} failed ({}):\n{}",
+                step.name,
+                output.status,
+                String::from_utf8_lossy(&output.stderr).trim()
+            ),
+            Err(e) if e.kind() == std::io::ErrorKind::NotFound => continue,
+            Err(e) => format!("Failed to run {}: {}", step.program, e),
+        };
+
+        for suite in step.suites {
+            failures.insert(suite.key(), failure.clone());
+        }
+    }
+
+    failures
+}
+
 struct TestResult {
     name: String,
     passed: bool,
     output: Option<String>,
     skipped: bool,
+    cached: bool,
+    duration: Duration,
+}
+
+impl TestResult {
+    fn skipped(name: &str, reason: &str) -> Self {
+        Self {
+            name: name.to_string(),
+            passed: true,
+            output: Some(reason.to_string()),
+            skipped: true,
+            cached: false,
+            duration: Duration::ZERO,
+        }
+    }
+
+    fn cached(name: &str) -> Self {
+        Self {
+            name: name.to_string(),
+            passed: true,
+            output: None,
+            skipped: false,
+            cached: true,
+            duration: Duration::ZERO,
+        }
+    }
+
+    fn status(&self) -> &'static str {
+        if self.cached {
+            "cached"
+        } else if self.skipped {
+            "skipped"
+        } else if self.passed {
+            "passed"
+        } else {
+            "failed"
+        }
+    }
+}
+
+struct SuiteRun {
+    suite: Suite,
+    results: Vec<TestResult>,
+    fingerprint: String,
+    duration: Duration,
+}
+
+/// Fingerprints of suite inputs from the last passing run
+#[derive(Default, Serialize, Deserialize)]
+struct Cache {
+    #[serde(default)]
+    suites: HashMap<String, String>,
+}
+
+impl Cache {
+    fn load() -> Self {
+        std::fs::read_to_string(CACHE_PATH)
+            .ok()
+            .and_then(|content| serde_json::from_str(&content).ok())
+            .unwrap_or_default()
+    }
+
+    fn save(&self) -> Result<()> {
+        let path = Path::new(CACHE_PATH);
+        if let Some(parent) = path.parent() {
+            std::fs::create_dir_all(parent)?;
+        }
+        std::fs::write(path, serde_json::to_string_pretty(self)?)?;
+        Ok(())
+    }
+
+    fn is_fresh(&self, suite: Suite, fingerprint: &str) -> bool {
+        self.suites.get(suite.key()).map(String::as_str) == Some(fingerprint)
+    }
 }
 
 fn main() -> Result<()> {
     let cli = Cli::parse();
 
     let command = cli.command.unwrap_or(Commands::All);
+    let suites: Vec<Suite> = match command {
+        Commands::All => Suite::ALL.to_vec(),
+        Commands::Rust => vec![Suite::Rust],
+        Commands::Python => vec![Suite::Python],
+        Commands::Go => vec![Suite::Go],
+        Commands::E2e => vec![Suite::E2e],
+    };
 
     println!("{}", "🧪 Running tests...".bold());
     println!();
 
-    let mut results = Vec::new();
     let verbose = cli.verbose;
+    let jobs = cli.jobs.max(1);
+    let mut cache = Cache::load();
+    let print_lock = Mutex::new(());
+    let started = Instant::now();
+
+    let fingerprints: Vec<String> = suites.iter().map(|s| fingerprint(s.inputs())).collect();
+    let stale: Vec<Suite> = suites
+        .iter()
+        .zip(&fingerprints)
+        .filter(|(suite, fingerprint)| cli.no_cache || !cache.is_fresh(**suite, fingerprint))
+        .map(|(suite, _)| *suite)
+        .collect();
+    let build_failures = run_builds(&stale);
+
+    // Independent suites run concurrently; each prints its block when done
+    let planned: Vec<(Suite, String)> = suites.into_iter().zip(fingerprints).collect();
+    let runs = run_parallel(&planned, jobs, |(suite, fingerprint)| {
+        let suite = *suite;
+        let suite_started = Instant::now();
+        let failed = |output: String| TestResult {
+            name: suite.title().to_string(),
+            passed: false,
+            output: Some(output),
+            skipped: false,
+            cached: false,
+            duration: suite_started.elapsed(),
+        };
+
+        let results = if !stale.contains(&suite) {
+            vec![TestResult::cached(suite.title())]
+        } else if let Some(failure) = build_failures.get(suite.key()) {
+            vec![failed(failure.clone())]
+        } else {
+            suite
+                .run(jobs)
+                .unwrap_or_else(|e| vec![failed(format!("{:#}", e))])
+        };
+
+        let run = SuiteRun {
+            suite,
+            results,
+            fingerprint: fingerprint.clone(),
+            duration: suite_started.elapsed(),
+        };
+
+        let _guard = print_lock.lock().unwrap();
+        print_suite(&run, verbose);
+        run
+    });
 
-    match command {
-        Commands::All => {
-            results.extend(run_rust_tests(verbose)?);
-            results.extend(run_python_tests(verbose)?);
-            results.extend(run_go_tests(verbose)?);
-            results.extend(run_e2e_tests(verbose)?);
+    let elapsed = started.elapsed();
+
+    // Remember fingerprints of suites that fully passed
+    for run in &runs {
+        let ran = run.results.iter().any(|r| !r.skipped && !r.cached);
+        if run.results.iter().all(|r| r.passed) {
+            if ran {
+                cache
+                    .suites
+                    .insert(run.suite.key().to_string(), run.fingerprint.clone());
+            }
+        } else {
+            cache.suites.remove(run.suite.key());
         }
-        Commands::Rust => results.extend(run_rust_tests(verbose)?),
-        Commands::Python => results.extend(run_python_tests(verbose)?),
-        Commands::Go => results.extend(run_go_tests(verbose)?),
-        Commands::E2e => results.extend(run_e2e_tests(verbose)?),
     }
+    if let Err(e) = cache.save() {
+        eprintln!("{} failed to save test cache: {}", "⚠️".yellow(), e);
+    }
+
+    if let Some(path) = &cli.report {
+        write_json_report(path, &runs, elapsed)?;
+    }
+    if let Some(path) = &cli.junit {
+        write_junit_report(path, &runs, elapsed)?;
+    }
+
+    let results: Vec<&TestResult> = runs.iter().flat_map(|run| &run.results).collect();
 
     // Print summary
     println!();
     println!("{}", "━".repeat(50).dimmed());
 
     let total = results.len();
-    let passed = results.iter().filter(|r| r.passed).count();
+    let passed = results.iter().filter(|r| r.passed && !r.skipped).count();
     let failed = results.iter().filter(|r| !r.passed && !r.skipped).count();
     let skipped = results.iter().filter(|r| r.skipped).count();
+    let cached = results.iter().filter(|r| r.cached).count();
+    let timing = format!("in {:.1}s", elapsed.as_secs_f64()).dimmed();
 
     if failed == 0 {
-        if skipped > 0 {
+        if skipped > 0 || cached > 0 {
             println!(
-                "{} {} tests passed, {} skipped",
+                "{} {} tests passed ({} cached), {} skipped {}",
                 "✅".bold(),
                 passed.to_string().green().bold(),
-                skipped.to_string().yellow()
+                cached,
+                skipped.to_string().yellow(),
+                timing
             );
         } else {
             println!(
-                "{} All {} tests passed!",
+                "{} All {} tests passed {}",
                 "🎉".bold(),
-                total.to_string().green().bold()
+                total.to_string().green().bold(),
+                timing
             );
         }
     } else {
         println!(
-            "{} {} passed, {} failed, {} skipped",
+            "{} {} passed, {} failed, {} skipped {}",
             "❌".bold(),
             passed.to_string().green(),
             failed.to_string().red().bold(),
-            skipped.to_string().yellow()
+            skipped.to_string().yellow(),
+            timing
         );
         println!();
         println!("{}", "Failed tests:".red().bold());
@@ -116,10 +432,237 @@ fn main() -> Result<()> {
     Ok(())
 }
 
-fn run_rust_tests(verbose: bool) -> Result<Vec<TestResult>> {
-    println!("{} {}", "🦀".bold(), "Running Rust tests...".cyan());
+/// Run `f` over `items` on at most `jobs` threads, returning results in order
+fn run_parallel<T, R, F>(items: &[T], jobs: usize, f: F) -> Vec<R>
+where
+    T: Sync,
+    R: Send,
+    F: Fn(&T) -> R + Sync,
+{
+    let next = AtomicUsize::new(0);
+    let slots: Mutex<Vec<Option<R>>> = Mutex::new(items.iter().map(|_| None).collect());
+    let workers = jobs.clamp(1, items.len().max(1));
+
+    std::thread::scope(|s| {
+        for _ in 0..workers {
+            s.spawn(|| loop {
+                let index = next.fetch_add(1, Ordering::Relaxed);
+                let Some(item) = items.get(index) else {
+                    break;
+                };
+                let result = f(item);
+                slots.lock().unwrap()[index] = Some(result);
+            });
+        }
+    });
+
+    slots
+        .into_inner()
+        .unwrap()
+        .into_iter()
+        .map(|slot| slot.expect("every item is run exactly once"))
+        .collect()
+}
+
+/// Content hash (FNV-1a) over every file under the given inputs
+fn fingerprint(inputs: &[&str]) -> String {
+    let mut files = Vec::new();
+    for input in inputs {
+        collect_files(Path::new(input), &mut files);
+    }
+    files.sort();
+    files.dedup();
+
+    let mut hash: u64 = 0xcbf29ce484222325;
+    let mut update = |bytes: &[u8]| {
+        for byte in bytes {
+            hash ^= *byte as u64;
+            hash = hash.wrapping_mul(0x100000001b3);
+        }
+    };
+
+    for file in &files {
+        update(file.to_string_lossy().as_bytes());
+        update(&[0]);
+        if let Ok(data) = std::fs::read(file) {
+            update(&data);
+        }
+        update(&[0]);
+    }
+
+    format!("{:016x}", hash)
+}
 
-    let mut results = Vec::new();
+fn collect_files(path: &Path, files: &mut Vec<PathBuf>) {
+    if path.is_file() {
+        files.push(path.to_path_buf());
+        return;
+    }
+
+    let Ok(entries) = std::fs::read_dir(path) else {
+        return;
+    };
+
+    for entry in entries.flatten() {
+        let entry_path = entry.path();
+        let name = entry.file_name();
+        let name = name.to_string_lossy();
+
+        if entry_path.is_dir() {
+            if !FINGERPRINT_SKIP_DIRS.contains(&name.as_ref()) {
+                collect_files(&entry_path, files);
+            }
+        } else if !(name.ends_with(".so") || name.ends_with(".pyd")) {
+            // Built extension modules are derived from rs/, not inputs
+            files.push(entry_path);
+        }
+    }
+}
+
+fn print_suite(run: &SuiteRun, verbose: bool) {
+    println!(
+        "{} {} {}",
+        run.suite.icon().bold(),
+        run.suite.title().cyan(),
+        format!("({:.1}s)", run.duration.as_secs_f64()).dimmed()
+    );
+
+    for result in &run.results {
+        if result.cached {
+            println!("  {} {} {}", "✓".green(), result.name, "(cached)".dimmed());
+        } else if result.skipped {
+            let reason = result.output.as_deref().unwrap_or("skipped");
+            println!("  {} {} ({})", "⚠️".yellow(), result.name.yellow(), reason);
+        } else if result.passed {
+            println!(
+                "  {} {} {}",
+                "✓".green(),
+                result.name,
+                format!("({:.1}s)", result.duration.as_secs_f64()).dimmed()
+            );
+        } else {
+            println!("  {} {}", "✗".red(), result.name);
+            if verbose {
+                if let Some(output) = &result.output {
+                    for line in output.lines().take(5) {
+                        println!("    {}", line.dimmed());
+                    }
+                }
+            }
+        }
+    }
+}
+
+#[derive(Serialize)]
+struct JsonReport<'a> {
+    seconds: f64,
+    suites: Vec<JsonSuite<'a>>,
+}
+
+#[derive(Serialize)]
+struct JsonSuite<'a> {
+    suite: &'static str,
+    seconds: f64,
+    tests: Vec<JsonTest<'a>>,
+}
+
+#[derive(Serialize)]
+struct JsonTest<'a> {
+    name: &'a str,
+    status: &'static str,
+    seconds: f64,
+}
+
+fn write_json_report(path: &Path, runs: &[SuiteRun], elapsed: Duration) -> Result<()> {
+    let report = JsonReport {
+        seconds: elapsed.as_secs_f64(),
+        suites: runs
+            .iter()
+            .map(|run| JsonSuite {
+                suite: run.suite.key(),
+                seconds: run.duration.as_secs_f64(),
+                tests: run
+                    .results
+                    .iter()
+                    .map(|result| JsonTest {
+                        name: &result.name,
+                        status: result.status(),
+                        seconds: result.duration.as_secs_f64(),
+                    })
+                    .collect(),
+            })
+            .collect(),
+    };
+
+    std::fs::write(path, serde_json::to_string_pretty(&report)?)
+        .with_context(|| format!("Failed to write report to {}", path.display()))
+}
+
+fn xml_escape(text: &str) -> String {
+    text.replace('&', "&amp;")
+        .replace('<', "&lt;")
+        .replace('>', "&gt;")
+        .replace('"', "&quot;")
+}
+
+fn write_junit_report(path: &Path, runs: &[SuiteRun], elapsed: Duration) -> Result<()> {
+    let mut xml = String::from("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n");
+    xml.push_str(&format!(
+        "<testsuites name=\"dkdc\" time=\"{:.3}\">\n",
+        elapsed.as_secs_f64()
+    ));
+
+    for run in runs {
+        let failures = run
+            .results
+            .iter()
+            .filter(|r| !r.passed && !r.skipped)
+            .count();
+        let skipped = run.results.iter().filter(|r| r.skipped || r.cached).count();
+
+        xml.push_str(&format!(
+            "  <testsuite name=\"{}\" tests=\"{}\" failures=\"{}\" skipped=\"{}\" time=\"{:.3}\">\n",
+            run.suite.key(),
+            run.results.len(),
+            failures,
+            skipped,
+            run.duration.as_secs_f64()
+        ));
+
+        for result in &run.results {
+            xml.push_str(&format!(
+                "    <testcase classname=\"{}\" name=\"{}\" time=\"{:.3}\"",
+                run.suite.key(),
+                xml_escape(&result.name),
+                result.duration.as_secs_f64()
+            ));
+
+            if result.skipped || result.cached {
+                xml.push_str(&format!(
+                    "><skipped message=\"{}\"/></testcase>\n",
+                    result.status()
+                ));
+            } else if !result.passed {
+                xml.push_str(&format!(
+                    "><failure message=\"failed\">{}</failure></testcase>\n",
+                    xml_escape(result.output.as_deref().unwrap_or(""))
+                ));
+            } else {
+                xml.push_str("/>\n");
+            }
+        }
+
+        xml.push_str("  </testsuite>\n");
+    }
+
+    xml.push_str("</testsuites>\n");
+
+    std::fs::write(path, xml)
+        .with_context(|| format!("Failed to write JUnit report to {}", path.display()))
+}
+
+fn run_rust_tests() -> Result<Vec<TestResult>> {
+    let started = Instant::now();
 
     // Run cargo test
     let output = Command::new("cargo")
@@ -128,57 +671,43 @@ fn run_rust_tests(verbose: bool) -> Result<Vec<TestResult>> {
         .output()
         .context("Failed to run cargo test")?;
 
-    let passed = output.status.success();
-
-    if passed {
-        println!("  {} Rust tests", "✓".green());
-    } else {
-        println!("  {} Rust tests", "✗".red());
-        if verbose {
-            let stderr = String::from_utf8_lossy(&output.stderr);
-            println!("{}", stderr.dimmed());
-        }
-    }
-
-    results.push(TestResult {
+    Ok(vec![TestResult {
         name: "Rust tests".to_string(),
-        passed,
+        passed: output.status.success(),
         output: Some(String::from_utf8_lossy(&output.stderr).to_string()),
         skipped: false,
-    });
-
-    Ok(results)
+        cached: false,
+        duration: started.elapsed(),
+    }])
 }
 
-fn run_python_tests(verbose: bool) -> Result<Vec<TestResult>> {
-    println!("{} {}", "🐍".bold(), "Running Python tests...".cyan());
-
-    let mut results = Vec::new();
+fn run_python_tests() -> Result<Vec<TestResult>> {
+    let started = Instant::now();
 
     // Check if Python files exist
-    let py_files = std::fs::read_dir("py");
-    if py_files.is_err() {
-        println!("  {} No py/ directory", "⚠️".yellow());
-        return Ok(results);
+    if std::fs::read_dir("py").is_err() {
+        return Ok(vec![TestResult::skipped(
+            "Python tests",
+            "no py/ directory",
+        )]);
     }
 
     // Check if pytest exists
     let pytest_check = Command::new("uv")
-        .args(["run", "pytest", "--version"])
+        .args(["run", "--no-sync", "pytest", "--version"])
         .stderr(Stdio::null())
         .output();
 
     if pytest_check.is_err() || !pytest_check.unwrap().status.success() {
-        println!(
-            "  {} pytest not available (install with: uv add --dev pytest)",
-            "⚠️".yellow()
-        );
-        return Ok(results);
+        return Ok(vec![TestResult::skipped(
+            "Python tests",
+            "pytest not available, install with: uv add --dev pytest",
+        )]);
     }
 
     // Run pytest
     let output = Command::new("uv")
-        .args(["run", "pytest", "py/", "-v", "--tb=short"])
+        .args(["run", "--no-sync", "pytest", "py/", "-v", "--tb=short"])
         .output()
         .context("Failed to run pytest")?;
 
@@ -186,66 +715,35 @@ fn run_python_tests(verbose: bool) -> Result<Vec<TestResult>> {
 
     // Check if no tests were collected
     if stdout.contains("collected 0 items") {
-        println!("  {} No Python tests found", "⚠️".yellow());
-        results.push(TestResult {
-            name: "Python tests".to_string(),
-            passed: true,
-            output: None,
-            skipped: true,
-        });
-        return Ok(results);
-    }
-
-    let passed = output.status.success();
-
-    if passed {
-        println!("  {} Python tests", "✓".green());
-    } else {
-        println!("  {} Python tests", "✗".red());
-        if verbose {
-            println!("{}", stdout.dimmed());
-        }
+        return Ok(vec![TestResult::skipped(
+            "Python tests",
+            "no Python tests found",
+        )]);
     }
 
-    results.push(TestResult {
+    Ok(vec![TestResult {
         name: "Python tests".to_string(),
-        passed,
+        passed: output.status.success(),
         output: Some(stdout.to_string()),
         skipped: false,
-    });
-
-    Ok(results)
+        cached: false,
+        duration: started.elapsed(),
+    }])
 }
 
-fn run_go_tests(verbose: bool) -> Result<Vec<TestResult>> {
-    println!("{} {}", "🐹".bold(), "Running Go tests...".cyan());
-
-    let mut results = Vec::new();
+fn run_go_tests() -> Result<Vec<TestResult>> {
+    let started = Instant::now();
 
     // Check if go exists
     let go_check = Command::new("which").arg("go").output();
 
     if go_check.is_err() || !go_check.unwrap().status.success() {
-        println!("  {} Go not installed", "⚠️".yellow());
-        results.push(TestResult {
-            name: "Go tests".to_string(),
-            passed: true,
-            output: None,
-            skipped: true,
-        });
-        return Ok(results);
+        return Ok(vec![TestResult::skipped("Go tests", "Go not installed")]);
     }
 
     // Check if go directory exists
-    if !std::path::Path::new("go").exists() {
-        println!("  {} No go/ directory", "⚠️".yellow());
-        results.push(TestResult {
-            name: "Go tests".to_string(),
-            passed: true,
-            output: None,
-            skipped: true,
-        });
-        return Ok(results);
+    if !Path::new("go").exists() {
+        return Ok(vec![TestResult::skipped("Go tests", "no go/ directory")]);
     }
 
     // Check if we have Go files
@@ -262,14 +760,7 @@ fn run_go_tests(verbose: bool) -> Result<Vec<TestResult>> {
         .unwrap_or(false);
 
     if !has_go_files {
-        println!("  {} No Go files found", "⚠️".yellow());
-        results.push(TestResult {
-            name: "Go tests".to_string(),
-            passed: true,
-            output: None,
-            skipped: true,
-        });
-        return Ok(results);
+        return Ok(vec![TestResult::skipped("Go tests", "no Go files found")]);
     }
 
     // Run go test
@@ -278,297 +769,258 @@ fn run_go_tests(verbose: bool) -> Result<Vec<TestResult>> {
         .output()
         .context("Failed to run go test")?;
 
-    let passed = output.status.success();
-
-    if passed {
-        println!("  {} Go tests", "✓".green());
-    } else {
-        println!("  {} Go tests", "✗".red());
-        if verbose {
-            println!("{}", String::from_utf8_lossy(&output.stdout).dimmed());
-        }
-    }
-
-    results.push(TestResult {
+    Ok(vec![TestResult {
         name: "Go tests".to_string(),
-        passed,
+        passed: output.status.success(),
         output: Some(String::from_utf8_lossy(&output.stdout).to_string()),
         skipped: false,
-    });
-
-    Ok(results)
+        cached: false,
+        duration: started.elapsed(),
+    }])
 }
 
-fn run_e2e_tests(verbose: bool) -> Result<Vec<TestResult>> {
-    println!("{} {}", "🔄".bold(), "Running end-to-end tests...".cyan());
+/// Resolved Python environment shared by all e2e cases
+///
+/// The project is synced by the shared build step, and `uv run` only
+/// locates its scripts; cases then call the installed `dkdc` and `python`
+/// directly, each with its own `HOME` so
+/// they get an isolated `~/.dkdc` and can run in parallel.
+struct E2eEnv {
+    scripts: PathBuf,
+    passthrough: Vec<(&'static str, String)>,
+}
 
-    let mut results = Vec::new();
+impl E2eEnv {
+    fn resolve() -> Result<Self> {
+        let output = Command::new("uv")
+            .args([
+                "run",
+                "--no-sync",
+                "python",
+                "-c",
+                "import sysconfig; print(sysconfig.get_path('scripts'))",
+            ])
+            .output()
+            .context("Failed to run uv")?;
 
-    // Create temp directory for testing
-    let temp_dir = TempDir::new()?;
+        if !output.status.success() {
+            anyhow::bail!(
+                "Failed to set up Python environment: {}",
+                String::from_utf8_lossy(&output.stderr)
+            );
+        }
 
-    // Test 1: Version check
-    results.push(run_test(
-        "Version check",
-        || {
-            Command::new("uv")
-                .args(["run", "dkdc", "--version"])
-                .output()
-                .map(|o| o.status.success())
-                .unwrap_or(false)
-        },
-        verbose,
-    ));
+        let scripts = PathBuf::from(String::from_utf8_lossy(&output.stdout).trim());
+
+        // Keep uv's cache and managed Pythons when HOME is swapped out
+        let mut passthrough = Vec::new();
+        for (var, args) in [
+            ("UV_CACHE_DIR", ["cache", "dir"]),
+            ("UV_PYTHON_INSTALL_DIR", ["python", "dir"]),
+        ] {
+            let value = std::env::var(var).ok().or_else(|| {
+                Command::new("uv")
+                    .args(args)
+                    .output()
+                    .ok()
+                    .filter(|o| o.status.success())
+                    .map(|o| String::from_utf8_lossy(&o.stdout).trim().to_string())
+            });
+            if let Some(value) = value {
+                passthrough.push((var, value));
+            }
+        }
 
-    // Test 2: Help output
-    results.push(run_test(
-        "Help output",
-        || {
-            Command::new("uv")
-                .args(["run", "dkdc", "--help"])
-                .output()
-                .map(|o| o.status.success())
-                .unwrap_or(false)
-        },
-        verbose,
-    ));
+        Ok(Self {
+            scripts,
+            passthrough,
+        })
+    }
 
-    // Test 3: Dev environment setup
-    results.push(run_test(
-        "Dev environment setup",
-        || match Command::new("uv")
-            .args(["run", "dkdc", "dev", "--exit"])
-            .output()
-        {
-            Ok(output) => {
-                let stdout = String::from_utf8_lossy(&output.stdout);
-                stdout.contains("Setup complete")
-            }
-            Err(_) => false,
-        },
-        verbose,
-    ));
+    fn command(&self, program: &str, home: &Path) -> Command {
+        let program = if cfg!(windows) {
+            self.scripts.join(format!("{}.exe", program))
+        } else {
+            self.scripts.join(program)
+        };
+
+        let mut command = Command::new(program);
+        command
+            .env("HOME", home)
+            .env("USERPROFILE", home)
+            .env("XDG_CONFIG_HOME", home.join(".config"))
+            .env("DKDC_HOME", home.join(".dkdc"))
+            .env_remove("DKDC_LAKE");
+        for (var, value) in &self.passthrough {
+            command.env(var, value);
+        }
+        command
+    }
 
-    // Test 4: Secrets workflow - Fixed version
-    results.push(run_test(
-        "Secrets workflow",
-        || -> bool {
-            // Use a unique test secret name to avoid conflicts
-            let secret_name = format!("TEST_E2E_SECRET_{}", std::process::id());
-
-            // Set secret
-            let set_output = match Command::new("uv")
-                .args([
-                    "run",
-                    "dkdc",
-                    "secrets",
-                    "set",
-                    &secret_name,
-                    "--value",
-                    "test-value",
-                ])
-                .output()
-            {
-                Ok(output) => output,
-                Err(_) => return false,
-            };
-
-            if !set_output.status.success() {
-                if verbose {
-                    eprintln!(
-                        "Failed to set secret: {}",
-                        String::from_utf8_lossy(&set_output.stderr)
-                    );
-                }
-                return false;
-            }
+    fn dkdc(&self, home: &Path) -> Command {
+        self.command("dkdc", home)
+    }
+}
 
-            // Get secret
-            let get_output = match Command::new("uv")
-                .args(["run", "dkdc", "secrets", "get", &secret_name])
-                .output()
-            {
-                Ok(output) => output,
-                Err(_) => return false,
-            };
-
-            if !get_output.status.success() {
-                return false;
-            }
+type E2eCase = (&'static str, fn(&E2eEnv, &Path) -> Result<()>);
+
+const E2E_CASES: &[E2eCase] = &[
+    ("Version check", e2e_version),
+    ("Help output", e2e_help),
+    ("Dev environment setup", e2e_dev_setup),
+    ("Secrets workflow", e2e_secrets),
+    ("Files workflow", e2e_files),
+    ("Archive workflow", e2e_archive),
+    ("Python-Rust integration", e2e_python_integration),
+    ("CLI error handling", e2e_error_handling),
+];
+
+fn run_e2e_tests(jobs: usize) -> Result<Vec<TestResult>> {
+    let env = E2eEnv::resolve()?;
+
+    Ok(run_parallel(E2E_CASES, jobs, |&(name, case)| {
+        let started = Instant::now();
+
+        // Each case gets a fresh HOME, and with it a fresh ~/.dkdc
+        let result = TempDir::new()
+            .context("Failed to create a temporary HOME")
+            .and_then(|home| case(&env, home.path()));
+
+        TestResult {
+            name: name.to_string(),
+            passed: result.is_ok(),
+            output: result.err().map(|e| format!("{:#}", e)),
+            skipped: false,
+            cached: false,
+            duration: started.elapsed(),
+        }
+    }))
+}
 
-            let value = String::from_utf8_lossy(&get_output.stdout);
-            if value.trim() != "test-value" {
-                // Try without trim in case there's no newline
-                if value != "test-value" {
-                    eprintln!(
-                        "Secret value mismatch: got '{}', expected 'test-value'",
-                        value
-                    );
-                    return false;
-                }
-            }
+/// Run a case's command, failing with its stderr unless it exits cleanly
+fn run_ok(command: &mut Command, what: &str) -> Result<std::process::Output> {
+    let output = command
+        .output()
+        .with_context(|| format!("Failed to run {}", what))?;
+    if !output.status.success() {
+        anyhow::bail!(
+            "{} failed ({}): {}",
+            what,
+            output.status,
+            String::from_utf8_lossy(&output.stderr).trim()
+        );
+    }
+    Ok(output)
+}
 
-            // Delete secret
-            match Command::new("uv")
-                .args(["run", "dkdc", "secrets", "delete", &secret_name])
-                .output()
-            {
-                Ok(output) => output.status.success(),
-                Err(_) => false,
-            }
-        },
-        verbose,
-    ));
+fn e2e_version(env: &E2eEnv, home: &Path) -> Result<()> {
+    run_ok(env.dkdc(home).arg("--version"), "dkdc --version").map(|_| ())
+}
 
-    // Test 5: Files workflow
-    results.push(run_test(
-        "Files workflow",
-        || -> bool {
-            let test_file = temp_dir.path().join("test.txt");
-            if std::fs::write(&test_file, "test content").is_err() {
-                return false;
-            }
+fn e2e_help(env: &E2eEnv, home: &Path) -> Result<()> {
+    run_ok(env.dkdc(home).arg("--help"), "dkdc --help").map(|_| ())
+}
 
-            let test_file_str = match test_file.to_str() {
-                Some(s) => s,
-                None => return false,
-            };
-
-            // Add file
-            let add_output = match Command::new("uv")
-                .args(["run", "dkdc", "files", "add", test_file_str])
-                .output()
-            {
-                Ok(output) => output,
-                Err(_) => return false,
-            };
-
-            if !add_output.status.success() {
-                if verbose {
-                    eprintln!(
-                        "Failed to add file: {}",
-                        String::from_utf8_lossy(&add_output.stderr)
-                    );
-                }
-                return false;
-            }
+fn e2e_dev_setup(env: &E2eEnv, home: &Path) -> Result<()> {
+    let output = env
+        .dkdc(home)
+        .args(["dev", "--exit"])
+        .output()
+        .context("Failed to run dkdc dev --exit")?;
 
-            // List files
-            let list_output = match Command::new("uv")
-                .args(["run", "dkdc", "files", "list"])
-                .output()
-            {
-                Ok(output) => output,
-                Err(_) => return false,
-            };
-
-            let stdout = String::from_utf8_lossy(&list_output.stdout);
-            stdout.contains("test.txt")
-        },
-        verbose,
-    ));
+    let stdout = String::from_utf8_lossy(&output.stdout);
+    if !stdout.contains("Setup complete") {
+        anyhow::bail!(
+            "dkdc dev --exit didn't complete setup ({}): {}",
+            output.status,
+            String::from_utf8_lossy(&output.stderr).trim()
+        );
+    }
+    Ok(())
+}
 
-    // Test 6: Archive workflow
-    results.push(run_test(
-        "Archive workflow",
-        || -> bool {
-            let test_dir = temp_dir.path().join("test-project");
-            if std::fs::create_dir(&test_dir).is_err() {
-                return false;
-            }
-            if std::fs::write(test_dir.join("file.txt"), "test file").is_err() {
-                return false;
-            }
+fn e2e_secrets(env: &E2eEnv, home: &Path) -> Result<()> {
+    let secret_name = "TEST_E2E_SECRET";
+
+    run_ok(
+        env.dkdc(home)
+            .args(["secrets", "set", secret_name, "--value", "test-value"]),
+        "dkdc secrets set",
+    )?;
+
+    let get_output = run_ok(
+        env.dkdc(home).args(["secrets", "get", secret_name]),
+        "dkdc secrets get",
+    )?;
+    let value = String::from_utf8_lossy(&get_output.stdout);
+    if value.trim() != "test-value" {
+        anyhow::bail!(
+            "Secret value mismatch: got '{}', expected 'test-value'",
+            value.trim()
+        );
+    }
 
-            let test_dir_str = match test_dir.to_str() {
-                Some(s) => s,
-                None => return false,
-            };
-
-            match Command::new("uv")
-                .args([
-                    "run",
-                    "dkdc",
-                    "archive",
-                    test_dir_str,
-                    "--name",
-                    "test-archive.zip",
-                ])
-                .output()
-            {
-                Ok(output) => output.status.success(),
-                Err(_) => false,
-            }
-        },
-        verbose,
-    ));
+    run_ok(
+        env.dkdc(home).args(["secrets", "delete", secret_name]),
+        "dkdc secrets delete",
+    )
+    .map(|_| ())
+}
 
-    // Test 7: Python-Rust integration
-    results.push(run_test(
-        "Python-Rust integration",
-        || {
-            Command::new("uv")
-                .args([
-                    "run",
-                    "python",
-                    "-c",
-                    "from dkdc import _dkdc; print(_dkdc.__version__)",
-                ])
-                .output()
-                .map(|o| o.status.success())
-                .unwrap_or(false)
-        },
-        verbose,
-    ));
+fn e2e_files(env: &E2eEnv, home: &Path) -> Result<()> {
+    let test_file = home.join("test.txt");
+    std::fs::write(&test_file, "test content")?;
 
-    // Test 8: CLI error handling
-    results.push(run_test(
-        "CLI error handling",
-        || match Command::new("uv")
-            .args(["run", "dkdc", "nonexistent-command"])
-            .output()
-        {
-            Ok(output) => {
-                let stderr = String::from_utf8_lossy(&output.stderr);
-                stderr.contains("unrecognized subcommand")
-            }
-            Err(_) => false,
-        },
-        verbose,
-    ));
+    run_ok(
+        env.dkdc(home).args(["files", "add"]).arg(&test_file),
+        "dkdc files add",
+    )?;
 
-    // Print results
-    for result in &results {
-        if result.skipped {
-            println!("  {} {} (skipped)", "⚠️".yellow(), result.name.yellow());
-        } else if result.passed {
-            println!("  {} {}", "✓".green(), result.name);
-        } else {
-            println!("  {} {}", "✗".red(), result.name);
-            if verbose {
-                if let Some(output) = &result.output {
-                    for line in output.lines().take(5) {
-                        println!("    {}", line.dimmed());
-                    }
-                }
-            }
-        }
+    let list_output = run_ok(env.dkdc(home).args(["files", "list"]), "dkdc files list")?;
+    let stdout = String::from_utf8_lossy(&list_output.stdout);
+    if !stdout.contains("test.txt") {
+        anyhow::bail!("test.txt missing from dkdc files list: {}", stdout.trim());
     }
+    Ok(())
+}
 
-    Ok(results)
+fn e2e_archive(env: &E2eEnv, home: &Path) -> Result<()> {
+    let test_dir = home.join("test-project");
+    std::fs::create_dir(&test_dir)?;
+    std::fs::write(test_dir.join("file.txt"), "test file")?;
+
+    run_ok(
+        env.dkdc(home)
+            .arg("archive")
+            .arg(&test_dir)
+            .args(["--name", "test-archive.zip"]),
+        "dkdc archive",
+    )
+    .map(|_| ())
 }
 
-fn run_test(name: &str, test_fn: impl FnOnce() -> bool, verbose: bool) -> TestResult {
-    let passed = test_fn();
+fn e2e_python_integration(env: &E2eEnv, home: &Path) -> Result<()> {
+    run_ok(
+        env.command("python", home)
+            .args(["-c", "from dkdc import _dkdc; print(_dkdc.__version__)"]),
+        "python -c 'from dkdc import _dkdc'",
+    )
+    .map(|_| ())
+}
 
-    TestResult {
-        name: name.to_string(),
-        passed,
-        output: if !passed && verbose {
-            Some(format!("Test '{}' failed", name))
-        } else {
-            None
-        },
-        skipped: false,
+fn e2e_error_handling(env: &E2eEnv, home: &Path) -> Result<()> {
+    let output = env
+        .dkdc(home)
+        .arg("nonexistent-command")
+        .output()
+        .context("Failed to run dkdc")?;
+
+    let stderr = String::from_utf8_lossy(&output.stderr);
+    if !stderr.contains("unrecognized subcommand") {
+        anyhow::bail!(
+            "Expected an unrecognized subcommand error, got: {}",
+            stderr.trim()
+        );
     }
+    Ok(())
 }